@@ -9,6 +9,7 @@ from nacl.signing import SigningKey
 import time
 import json
 from eth_account import Account
+from eth_account.messages import encode_defunct
 from eth_account._utils.legacy_transactions import serializable_unsigned_transaction_from_dict
 from eth_utils import keccak, to_bytes, to_hex
 from eth_keys import keys
@@ -102,18 +103,16 @@ def create_transaction(sender : dict , receiver: dict, sender_idx : int, nonce:
         trans_body = {
             "sender" : sender["pub_key"],
             "receiver" : receiver["pub_key"],
-            "amount" : str(AMOUNT),
+            "amount" : AMOUNT,
             "nonce": nonce,
         }
-        private_key = keys.PrivateKey(hex_to_bytes(sender["priv_key"]))
-        public_key = private_key.public_key
-        message = json.dumps(trans_body, separators=(",", ":"), sort_keys=True)
-        message_bytes = message.encode("utf-8")
-        signature = private_key.sign_msg(message_bytes)
+        # personal_sign of the message the sequencer and the guest rebuild, the signer is the sender
+        message = f'{{"sender":"{sender["pub_key"].lower()}","receiver":"{receiver["pub_key"].lower()}","amount":"{AMOUNT}","nonce":"{nonce}"}}'
+        signature = Account.sign_message(encode_defunct(text=message), sender["priv_key"]).signature
 
         trans_body["signature"] ={
-           "pubKey": public_key.to_hex(),
-            "signature": signature.to_hex()
+           "pubKey": sender["pub_key"],
+            "signature": to_hex(signature)
         }
         logger.info(trans_body)
         return trans_body
@@ -147,3 +146,30 @@ class StefanJorisRollUpUser(HttpUser):
         transaction = create_transaction_to_submit(nonce, a, b)
         self.client.post("/api/submit", json=transaction)
 
+
+
+BATCH_SIZE = 100
+
+
+class BatchRelayerUser(HttpUser):
+    """
+        A relayer that signs BATCH_SIZE transfers of one sender with consecutive nonces
+        and submits them with one request, one get-nonce per batch
+    """
+    host = SEQUENCER_URL
+    wait_time = between(1, 1.5)
+
+    @task
+    def submit_transaction_batch(self):
+        a = int(np.random.randint(len(LAYER_2_ACCOUNTS)))
+        res = self.client.post("/api/get-nonce", json={"account": LAYER_2_ACCOUNTS[a]["pub_key"]})
+        if res.status_code != 200:
+            print(f"Failed to get nonce: {res.text}")
+            return
+        nonce = res.json().get("nonce")
+
+        transactions = []
+        for i in range(BATCH_SIZE):
+            b = int(np.random.choice([j for j in range(len(LAYER_2_ACCOUNTS)) if j != a]))
+            transactions.append(create_transaction_to_submit(nonce + i, a, b))
+        self.client.post("/api/submit-batch", json={"transactions": transactions})
@@ -4,7 +4,8 @@ use alloy::{
     signers::local::PrivateKeySigner,
 };
 use alloy_primitives::{Address, FixedBytes};
-use anyhow::Result;
+use anyhow::{bail, Context, Result};
+use calldata::{calldata_gas, encode_compact, encode_legacy, CalldataTx};
 use clap::Parser;
 use methods::GUEST_ELF;
 use risc0_ethereum_contracts::encode_seal;
@@ -30,22 +31,67 @@ pub mod rollup_abi {
 
 use rollup_abi::IRollup;
 
+#[derive(clap::ValueEnum, Clone, Debug, PartialEq)]
+enum Mode {
+    /// prove the batch and submit it right away
+    All,
+    /// prove the batch and write the proof to --proof-path
+    Prove,
+    /// submit a proof written by --mode prove
+    Submit,
+}
+
+#[derive(clap::ValueEnum, Clone, Debug, PartialEq)]
+enum CalldataEncoding {
+    /// 141 bytes per transfer
+    Legacy,
+    /// address table, varints, no pubKey (lib/calldata)
+    Compact,
+}
+
 #[derive(Parser, Debug)]
 struct Args {
+    #[clap(long, value_enum, default_value = "all")]
+    mode: Mode,
+
     #[clap(long)]
-    chain_id: u64,
+    chain_id: Option<u64>,
 
     #[clap(long, env)]
-    eth_wallet_private_key: PrivateKeySigner,
+    eth_wallet_private_key: Option<PrivateKeySigner>,
+
+    #[clap(long)]
+    rpc_url: Option<Url>,
 
     #[clap(long)]
-    rpc_url: Url,
+    contract: Option<Address>,
 
+    /// pass it several times to prove consecutive badges as one L1 batch
     #[clap(long)]
-    contract: Address,
+    batch_path: Vec<PathBuf>,
 
+    /// L1 batch id of an aggregated proof, defaults to the badge_id of the first batch
     #[clap(long)]
-    batch_path: PathBuf,
+    batch_id: Option<u32>,
+
+    #[clap(long)]
+    proof_path: Option<PathBuf>,
+
+    /// txData encoding of the proven batch
+    #[clap(long, value_enum, default_value = "compact")]
+    calldata: CalldataEncoding,
+}
+
+/// Everything submitBatch needs, so proving and publishing can run in separate processes
+#[derive(Deserialize, Serialize, Clone)]
+struct ProofArtifact {
+    badge_id: u32,
+    old_root: String,
+    new_root: String,
+    tx_calldata: String,
+    journal_hash: String,
+    seal: String,
+    processed_deposit_ids: Vec<u64>,
 }
 
 #[derive(Deserialize, Serialize, Clone)]
@@ -86,6 +132,24 @@ struct Batch {
     deposits: Vec<DepositInfo>, 
     badge_id: u32,
     addresses: Vec<String>,
+    #[serde(default)]
+    proof_nodes: Vec<String>,
+    #[serde(default)]
+    proofs: Vec<LeafProof>,
+}
+
+/// Proof of addresses[i] against old_merkle_root, as exported by the sequencer
+#[derive(Deserialize, Serialize, Clone)]
+struct LeafProof {
+    sidenodes: Vec<u32>,
+    non_membership_leafdata: Option<String>,
+}
+
+/// Guest input: consecutive badges that are proven and published as one L1 batch
+#[derive(Deserialize, Serialize, Clone)]
+struct AggregatedBatch {
+    batch_id: u32,
+    batches: Vec<Batch>,
 }
 
 fn hex_to_bytes(hex_str: &str) -> Vec<u8> {
@@ -93,53 +157,62 @@ fn hex_to_bytes(hex_str: &str) -> Vec<u8> {
     hex::decode(clean).expect("Invalid hex string")
 }
 
-fn create_transaction_calldata(transactions: &[Transaction]) -> Vec<u8> {
-    let mut calldata = Vec::new();
-    
-    // Encode number of transactions
-    calldata.extend_from_slice(&(transactions.len() as u32).to_be_bytes());
-    
-    for tx in transactions {
-        // From address (20 bytes)
-        let from_bytes = hex_to_bytes(&tx.from);
-        calldata.extend_from_slice(&from_bytes[..20]);
-        
-        // To address (20 bytes)
-        let to_bytes = hex_to_bytes(&tx.to);
-        calldata.extend_from_slice(&to_bytes[..20]);
-        
-        // Amount (8 bytes - big endian u64)
-        calldata.extend_from_slice(&tx.amount.to_be_bytes());
-        
-        // Nonce (8 bytes - big endian u64)
-        calldata.extend_from_slice(&tx.nonce.to_be_bytes());
-        
-        // Signature (65 bytes)
-        let sig_bytes = hex_to_bytes(&tx.signature.signature);
-        calldata.extend_from_slice(&sig_bytes);
-        
-        // PubKey (20 bytes - address format)
-        let pubkey_bytes = hex_to_bytes(&tx.signature.pub_key);
-        calldata.extend_from_slice(&pubkey_bytes[..20]);
+fn to_calldata_tx(tx: &Transaction) -> Result<CalldataTx> {
+    Ok(CalldataTx {
+        from: hex_to_bytes(&tx.from).try_into().ok().context("from is not a 20 byte address")?,
+        to: hex_to_bytes(&tx.to).try_into().ok().context("to is not a 20 byte address")?,
+        amount: tx.amount,
+        nonce: tx.nonce,
+        signature: hex_to_bytes(&tx.signature.signature).try_into().ok().context("signature is not 65 bytes")?,
+    })
+}
+
+fn create_transaction_calldata(transactions: &[Transaction], encoding: &CalldataEncoding) -> Result<Vec<u8>> {
+    let transactions = transactions.iter().map(to_calldata_tx).collect::<Result<Vec<_>>>()?;
+    let legacy = encode_legacy(&transactions);
+    let calldata = match encoding {
+        CalldataEncoding::Legacy => legacy.clone(),
+        CalldataEncoding::Compact => encode_compact(&transactions),
+    };
+    println!("txData: {} bytes ({} gas), legacy encoding {} bytes ({} gas)",
+             calldata.len(), calldata_gas(&calldata), legacy.len(), calldata_gas(&legacy));
+    Ok(calldata)
+}
+
+// The sequencer exports every batch as JSON and as bincode (.bin)
+fn load_batch(path: &PathBuf) -> Result<Batch> {
+    if path.extension().map_or(false, |ext| ext == "bin") {
+        let batch_bytes = fs::read(path)?;
+        Ok(bincode::deserialize(&batch_bytes)?)
+    } else {
+        let batch_json = fs::read_to_string(path)?;
+        Ok(serde_json::from_str(&batch_json)?)
     }
-    
-    calldata
 }
 
-#[tokio::main]
-async fn main() -> Result<()> {
-    env_logger::init();
-    let args = Args::parse();
+async fn prove_batches(batch_id: u32, batches: Vec<Batch>, encoding: &CalldataEncoding) -> Result<ProofArtifact> {
+    if batches.is_empty() {
+        bail!("❌ No batch to prove!");
+    }
+
+    // Fail before proving when the badges do not form one state transition
+    for pair in batches.windows(2) {
+        if pair[1].old_merkle_root != pair[0].new_merkle_root {
+            bail!("❌ Batch {} does not start at the root batch {} ends at: expected {}, got {}",
+                   pair[1].badge_id, pair[0].badge_id, pair[0].new_merkle_root, pair[1].old_merkle_root);
+        }
+    }
 
-    println!("Loading batch from: {:?}", args.batch_path);
-    let batch_json = fs::read_to_string(&args.batch_path)?;
-    let batch: Batch = serde_json::from_str(&batch_json)?;
+    let first_old_root = batches[0].old_merkle_root.clone();
+    let last_new_root = batches[batches.len() - 1].new_merkle_root.clone();
+    let transactions: Vec<Transaction> = batches.iter().flat_map(|batch| batch.transactions.clone()).collect();
+    let deposit_count: usize = batches.iter().map(|batch| batch.deposits.len()).sum();
 
     // Generate the proof in a blocking task to avoid Tokio runtime issues
-    let batch_clone = batch.clone();
+    let aggregated = AggregatedBatch { batch_id, batches };
     let receipt = tokio::task::spawn_blocking(move || {
         let env = ExecutorEnv::builder()
-            .write(&batch_clone)?
+            .write(&aggregated)?
             .build()?;
 
         default_prover()
@@ -165,25 +238,25 @@ async fn main() -> Result<()> {
 
     // Validate the proof
     if !success {
-        panic!("❌ Proof verification failed!");
+        bail!("❌ Proof verification failed!");
     }
 
-    if transactions_processed != batch.transactions.len() as u32 {
-        panic!("❌ Not all transactions were processed!");
+    if transactions_processed != transactions.len() as u32 {
+        bail!("❌ Not all transactions were processed!");
     }
 
-    if processed_deposit_ids.len() != batch.deposits.len() {
-        panic!("❌ Not all deposits were processed!");
+    if processed_deposit_ids.len() != deposit_count {
+        bail!("❌ Not all deposits were processed!");
     }
 
-    if computed_old_root != batch.old_merkle_root {
-        panic!("❌ Computed old root doesn't match batch: expected {}, got {}", 
-               batch.old_merkle_root, computed_old_root);
+    if computed_old_root != first_old_root {
+        bail!("❌ Computed old root doesn't match batch: expected {}, got {}", 
+               first_old_root, computed_old_root);
     }
 
-    if computed_new_root != batch.new_merkle_root {
-        panic!("❌ Computed new root doesn't match batch: expected {}, got {}", 
-               batch.new_merkle_root, computed_new_root);
+    if computed_new_root != last_new_root {
+        bail!("❌ Computed new root doesn't match batch: expected {}, got {}", 
+               last_new_root, computed_new_root);
     }
 
     // Encode the seal for on-chain verification
@@ -192,24 +265,40 @@ async fn main() -> Result<()> {
     // Compute the journal hash from the raw journal bytes
     let journal_bytes = &receipt.journal.bytes;
     let journal_hash = Sha256::digest(journal_bytes);
-    let journal_hash_bytes32: FixedBytes<32> = FixedBytes::from_slice(&journal_hash);
-    
-    let tx_calldata = create_transaction_calldata(&batch.transactions);
     
+    // One txData covering the transfers of every badge, the contract only checks count and length
+    let tx_calldata = create_transaction_calldata(&transactions, encoding)?;
+
+    Ok(ProofArtifact {
+        badge_id,
+        old_root: computed_old_root,
+        new_root: computed_new_root,
+        tx_calldata: format!("0x{}", hex::encode(tx_calldata)),
+        journal_hash: format!("0x{}", hex::encode(journal_hash)),
+        seal: format!("0x{}", hex::encode(seal)),
+        processed_deposit_ids,
+    })
+}
+
+async fn submit_proof(args: &Args, proof: &ProofArtifact) -> Result<()> {
+    let private_key = args.eth_wallet_private_key.clone().context("--eth-wallet-private-key is required to submit")?;
+    let rpc_url = args.rpc_url.clone().context("--rpc-url is required to submit")?;
+    let contract_address = args.contract.context("--contract is required to submit")?;
+
     // Set up Ethereum connection
-    let wallet = EthereumWallet::from(args.eth_wallet_private_key);
+    let wallet = EthereumWallet::from(private_key);
     let provider = ProviderBuilder::new()
         .wallet(wallet)
-        .connect_http(args.rpc_url);
+        .connect_http(rpc_url);
 
-    let contract = IRollup::new(args.contract, provider);
+    let contract = IRollup::new(contract_address, provider);
 
     // Submit the batch on-chain 
     let call = contract.submitBatch(
-        badge_id,                  
-        tx_calldata.into(),        
-        journal_hash_bytes32,      
-        seal.into(),        
+        proof.badge_id,                  
+        hex_to_bytes(&proof.tx_calldata).into(),        
+        FixedBytes::from_slice(&hex_to_bytes(&proof.journal_hash)),      
+        hex_to_bytes(&proof.seal).into(),        
     );
 
     let pending_tx = call.send().await?;
@@ -223,11 +312,43 @@ async fn main() -> Result<()> {
     
     if receipt.status() {
         println!("✅ Transaction succeeded!");
-        println!("{} deposits settled", processed_deposit_ids.len());
-        println!("State transition settled: {} -> {}", computed_old_root, computed_new_root);
+        println!("{} deposits settled", proof.processed_deposit_ids.len());
+        println!("State transition settled: {} -> {}", proof.old_root, proof.new_root);
     } else {
-        println!("❌ Transaction failed!");
+        bail!("❌ Transaction failed!");
     }
 
     Ok(())
-}
\ No newline at end of file
+}
+
+#[tokio::main]
+async fn main() -> Result<()> {
+    env_logger::init();
+    let args = Args::parse();
+
+    let proof = if args.mode == Mode::Submit {
+        let proof_path = args.proof_path.as_ref().context("--proof-path is required to submit")?;
+        serde_json::from_str(&fs::read_to_string(proof_path)?)?
+    } else {
+        if args.batch_path.is_empty() {
+            bail!("--batch-path is required to prove");
+        }
+        let mut batches = Vec::new();
+        for batch_path in &args.batch_path {
+            println!("Loading batch from: {:?}", batch_path);
+            batches.push(load_batch(batch_path)?);
+        }
+        let batch_id = args.batch_id.unwrap_or(batches[0].badge_id);
+        println!("Proving {} badges as batch {}", batches.len(), batch_id);
+        prove_batches(batch_id, batches, &args.calldata).await?
+    };
+
+    if args.mode == Mode::Prove {
+        let proof_path = args.proof_path.as_ref().context("--proof-path is required for --mode prove")?;
+        fs::write(proof_path, serde_json::to_string(&proof)?)?;
+        println!("✅ Proof for batch {} written to {:?}", proof.badge_id, proof_path);
+        return Ok(());
+    }
+
+    submit_proof(&args, &proof).await
+}
@@ -0,0 +1,168 @@
+#![no_std]
+//! txData of `Rollup.submitBatch`, see README.md for the layout.
+//! sequencer/src/CalldataCodec.py implements the same encoding,
+//! vectors.json holds the golden vectors both are checked against.
+extern crate alloc;
+use alloc::vec::Vec;
+use hashbrown::HashMap;
+
+pub const COMPACT_VERSION: u8 = 1;
+pub const LEGACY_TX_SIZE: usize = 141;
+pub const SIGNATURE_SIZE: usize = 65;
+pub const ADDRESS_SIZE: usize = 20;
+
+/// One transfer as it goes on chain, the signer is always `from`
+#[derive(Clone, Debug, PartialEq, Eq)]
+pub struct CalldataTx {
+    pub from: [u8; ADDRESS_SIZE],
+    pub to: [u8; ADDRESS_SIZE],
+    pub amount: u64,
+    pub nonce: u64,
+    pub signature: [u8; SIGNATURE_SIZE],
+}
+
+#[derive(Debug, PartialEq, Eq)]
+pub enum DecodeError {
+    NotCompact,
+    Truncated,
+    VarintOverflow,
+    IndexOutOfRange,
+    TrailingBytes,
+}
+
+/// unsigned LEB128: 7 bits per byte, least significant group first
+pub fn encode_varint(mut value: u64, out: &mut Vec<u8>) {
+    loop {
+        let byte = (value & 0x7f) as u8;
+        value >>= 7;
+        if value != 0 {
+            out.push(byte | 0x80);
+        } else {
+            out.push(byte);
+            return;
+        }
+    }
+}
+
+pub fn decode_varint(data: &[u8], offset: &mut usize) -> Result<u64, DecodeError> {
+    let mut value: u64 = 0;
+    let mut shift = 0;
+    loop {
+        let byte = *data.get(*offset).ok_or(DecodeError::Truncated)?;
+        *offset += 1;
+        if shift > 63 || (shift == 63 && byte & 0x7f > 1) {
+            return Err(DecodeError::VarintOverflow);
+        }
+        value |= ((byte & 0x7f) as u64) << shift;
+        if byte & 0x80 == 0 {
+            return Ok(value);
+        }
+        shift += 7;
+    }
+}
+
+/// u32 count, then from, to, amount, nonce, signature and the sender again as pubKey, big endian
+pub fn encode_legacy(transactions: &[CalldataTx]) -> Vec<u8> {
+    let mut out = Vec::with_capacity(4 + transactions.len() * LEGACY_TX_SIZE);
+    out.extend_from_slice(&(transactions.len() as u32).to_be_bytes());
+    for tx in transactions {
+        out.extend_from_slice(&tx.from);
+        out.extend_from_slice(&tx.to);
+        out.extend_from_slice(&tx.amount.to_be_bytes());
+        out.extend_from_slice(&tx.nonce.to_be_bytes());
+        out.extend_from_slice(&tx.signature);
+        out.extend_from_slice(&tx.from);
+    }
+    out
+}
+
+/// Every sender and receiver once, in order of first appearance, with its position in the table
+fn indexed_address_table(transactions: &[CalldataTx]) -> (Vec<[u8; ADDRESS_SIZE]>, HashMap<[u8; ADDRESS_SIZE], u64>) {
+    let mut addresses: Vec<[u8; ADDRESS_SIZE]> = Vec::new();
+    let mut indices: HashMap<[u8; ADDRESS_SIZE], u64> = HashMap::new();
+    for tx in transactions {
+        for address in [&tx.from, &tx.to] {
+            if !indices.contains_key(address) {
+                indices.insert(*address, addresses.len() as u64);
+                addresses.push(*address);
+            }
+        }
+    }
+    (addresses, indices)
+}
+
+/// Every sender and receiver once, in order of first appearance
+pub fn address_table(transactions: &[CalldataTx]) -> Vec<[u8; ADDRESS_SIZE]> {
+    indexed_address_table(transactions).0
+}
+
+pub fn encode_compact(transactions: &[CalldataTx]) -> Vec<u8> {
+    let (addresses, indices) = indexed_address_table(transactions);
+    let mut out = Vec::new();
+    out.push(COMPACT_VERSION);
+    out.extend_from_slice(&(transactions.len() as u32).to_be_bytes());
+    encode_varint(addresses.len() as u64, &mut out);
+    for address in &addresses {
+        out.extend_from_slice(address);
+    }
+    for tx in transactions {
+        encode_varint(indices[&tx.from], &mut out);
+        encode_varint(indices[&tx.to], &mut out);
+        encode_varint(tx.amount, &mut out);
+        encode_varint(tx.nonce, &mut out);
+        out.extend_from_slice(&tx.signature);
+    }
+    out
+}
+
+pub fn decode_compact(data: &[u8]) -> Result<Vec<CalldataTx>, DecodeError> {
+    if data.len() < 5 || data[0] != COMPACT_VERSION {
+        return Err(DecodeError::NotCompact);
+    }
+    let count = u32::from_be_bytes([data[1], data[2], data[3], data[4]]) as usize;
+    let mut offset = 5;
+    let address_count = decode_varint(data, &mut offset)? as usize;
+    let table_end = address_count
+        .checked_mul(ADDRESS_SIZE)
+        .and_then(|size| size.checked_add(offset))
+        .filter(|end| *end <= data.len())
+        .ok_or(DecodeError::Truncated)?;
+    let addresses: Vec<[u8; ADDRESS_SIZE]> = data[offset..table_end]
+        .chunks_exact(ADDRESS_SIZE)
+        .map(|chunk| chunk.try_into().unwrap())
+        .collect();
+    offset = table_end;
+
+    let mut transactions = Vec::new();
+    for _ in 0..count {
+        let from_index = decode_varint(data, &mut offset)? as usize;
+        let to_index = decode_varint(data, &mut offset)? as usize;
+        let amount = decode_varint(data, &mut offset)?;
+        let nonce = decode_varint(data, &mut offset)?;
+        if from_index >= addresses.len() || to_index >= addresses.len() {
+            return Err(DecodeError::IndexOutOfRange);
+        }
+        let signature: [u8; SIGNATURE_SIZE] = data
+            .get(offset..offset + SIGNATURE_SIZE)
+            .ok_or(DecodeError::Truncated)?
+            .try_into()
+            .unwrap();
+        offset += SIGNATURE_SIZE;
+        transactions.push(CalldataTx {
+            from: addresses[from_index],
+            to: addresses[to_index],
+            amount,
+            nonce,
+            signature,
+        });
+    }
+    if offset != data.len() {
+        return Err(DecodeError::TrailingBytes);
+    }
+    Ok(transactions)
+}
+
+/// EIP-2028: 16 gas per non-zero byte, 4 per zero byte
+pub fn calldata_gas(data: &[u8]) -> u64 {
+    data.iter().map(|byte| if *byte == 0 { 4 } else { 16 }).sum()
+}
@@ -0,0 +1,61 @@
+//! The rust codec against the golden vectors written by the sequencer,
+//! sequencer/tests/test_calldata_codec.py checks src/CalldataCodec.py against the same file
+use calldata::{address_table, decode_compact, encode_compact, encode_legacy, CalldataTx, DecodeError};
+use serde_json::Value;
+
+fn bytes_of(value: &Value) -> Vec<u8> {
+    let text = value.as_str().expect("hex string");
+    hex::decode(text.strip_prefix("0x").unwrap_or(text)).expect("valid hex")
+}
+
+fn transaction(value: &Value) -> CalldataTx {
+    CalldataTx {
+        from: bytes_of(&value["from"]).try_into().expect("20 byte address"),
+        to: bytes_of(&value["to"]).try_into().expect("20 byte address"),
+        amount: value["amount"].as_u64().expect("u64 amount"),
+        nonce: value["nonce"].as_u64().expect("u64 nonce"),
+        signature: bytes_of(&value["signature"]["signature"]).try_into().expect("65 byte signature"),
+    }
+}
+
+fn vectors() -> Vec<Value> {
+    let vectors: Value = serde_json::from_str(include_str!("../vectors.json")).expect("valid vectors.json");
+    vectors["vectors"].as_array().expect("vector list").clone()
+}
+
+#[test]
+fn golden_vectors() {
+    for vector in vectors() {
+        let name = vector["name"].as_str().unwrap();
+        let transactions: Vec<CalldataTx> = vector["transactions"].as_array().unwrap().iter().map(transaction).collect();
+        let legacy = bytes_of(&vector["legacy"]);
+        let compact = bytes_of(&vector["compact"]);
+
+        assert_eq!(encode_legacy(&transactions), legacy, "{name}: legacy encoding");
+        assert_eq!(encode_compact(&transactions), compact, "{name}: compact encoding");
+        assert_eq!(decode_compact(&compact).expect("decodes"), transactions, "{name}: round trip");
+    }
+}
+
+#[test]
+fn address_table_keeps_first_appearance_order() {
+    let address = |byte: u8| [byte; 20];
+    let tx = |from: u8, to: u8| CalldataTx { from: address(from), to: address(to), amount: 1, nonce: 0, signature: [0; 65] };
+    let transactions = [tx(3, 1), tx(1, 3), tx(2, 3), tx(1, 4)];
+    assert_eq!(address_table(&transactions), vec![address(3), address(1), address(2), address(4)]);
+    assert_eq!(decode_compact(&encode_compact(&transactions)).unwrap(), transactions);
+}
+
+#[test]
+fn truncated_and_trailing_data_is_rejected() {
+    for vector in vectors() {
+        let compact = bytes_of(&vector["compact"]);
+        if vector["transactions"].as_array().unwrap().is_empty() {
+            continue;
+        }
+        assert_eq!(decode_compact(&compact[..compact.len() - 1]), Err(DecodeError::Truncated));
+        let mut trailing = compact.clone();
+        trailing.push(0);
+        assert_eq!(decode_compact(&trailing), Err(DecodeError::TrailingBytes));
+    }
+}
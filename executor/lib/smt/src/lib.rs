@@ -1,73 +1,235 @@
-#![cfg_attr(not(feature = "std"), no_std)]
+#![cfg_attr(not(any(feature = "std", test)), no_std)]
+//! The state tree of the sequencer (sequencer/src/StateTree.py, the layout of the python
+//! smt package): a compacted sparse merkle tree over sha256.
+//!
+//! ```text
+//! path:           sha256(address)
+//! leaf value:     balance (u64 le) || nonce (u64 le) || address
+//! leaf node:      sha256(0x00 || path || sha256(value))
+//! internal node:  sha256(0x01 || left || right)
+//! empty subtree:  32 zero bytes, at every height
+//! ```
+//!
+//! A leaf sits at the shallowest depth at which it is alone in its subtree.
+//! A batch carries the proofs of the accounts it touches against its old root. They are
+//! merged into a PartialTree, which holds the touched paths and the hashes of the
+//! untouched subtrees next to them, the batch is applied to it and the new root is
+//! hashed from it.
 extern crate alloc;
+use alloc::boxed::Box;
+use alloc::format;
+use alloc::string::String;
 use alloc::vec::Vec;
-use core::convert::TryInto;
-use sha2::{Sha256, Digest};
-use sha3::{Keccak256, Digest as Keccak256Digest};
-use sparse_merkle_tree::{
-    blake2b::Blake2bHasher,
-    default_store::DefaultStore,
-    SparseMerkleTree,
-    traits::Value,
-    H256,
-};
-
-/// Shared account data type for your SMT
+use sha2::{Digest, Sha256};
+
+pub type H256 = [u8; 32];
+
+/// Hash of an empty subtree
+pub const PLACEHOLDER: H256 = [0u8; 32];
+
+const LEAF: u8 = 0;
+const NODE: u8 = 1;
+
+/// Shared account data type of the tree
 #[derive(Clone, Default)]
 pub struct AccountData {
     pub balance: u64,
     pub nonce: u64,
 }
 
-impl Value for AccountData {
-    fn to_h256(&self) -> H256 {
-        // empty leaf optimization
-        if self.balance == 0 && self.nonce == 0 {
-            return H256::zero();
-        }
-        // pack LE bytes: balance||nonce
-        let mut data = [0u8; 16];
-        data[0..8].copy_from_slice(&self.balance.to_le_bytes());
-        data[8..16].copy_from_slice(&self.nonce.to_le_bytes());
-        // R0-optimized SHA256 precompile
-        let mut hasher = Sha256::new();
-        hasher.update(&data);
-        let hash = hasher.finalize();
-        let mut buf = [0u8; 32];
-        buf.copy_from_slice(&hash);
-        H256::from(buf)
-    }
-    
-    fn zero() -> Self {
-        Default::default()
+pub fn sha256(data: &[u8]) -> H256 {
+    let mut hasher = Sha256::new();
+    hasher.update(data);
+    hasher.finalize().into()
+}
+
+/// The 256-bit path of an account, sha256(address_bytes)
+pub fn address_to_tree_key(address: &[u8; 20]) -> H256 {
+    sha256(address)
+}
+
+/// The value stored in the leaf of an account
+pub fn leaf_value(address: &[u8; 20], account: &AccountData) -> [u8; 36] {
+    let mut value = [0u8; 36];
+    value[0..8].copy_from_slice(&account.balance.to_le_bytes());
+    value[8..16].copy_from_slice(&account.nonce.to_le_bytes());
+    value[16..36].copy_from_slice(address);
+    value
+}
+
+fn leaf_hash(path: &H256, value_hash: &H256) -> H256 {
+    let mut data = [0u8; 65];
+    data[0] = LEAF;
+    data[1..33].copy_from_slice(path);
+    data[33..65].copy_from_slice(value_hash);
+    sha256(&data)
+}
+
+fn node_hash(left: &H256, right: &H256) -> H256 {
+    let mut data = [0u8; 65];
+    data[0] = NODE;
+    data[1..33].copy_from_slice(left);
+    data[33..65].copy_from_slice(right);
+    sha256(&data)
+}
+
+/// Bit of the path at `depth`, most significant first, true goes right
+fn bit(path: &H256, depth: usize) -> bool {
+    (path[depth / 8] >> (7 - depth % 8)) & 1 == 1
+}
+
+/// (path, value hash) of a leaf node, 0x00 || path || value hash
+pub fn parse_leaf(data: &[u8]) -> Result<(H256, H256), &'static str> {
+    if data.len() != 65 || data[0] != LEAF {
+        return Err("leaf data has to be 0x00 || path || value hash");
     }
+    let mut path = [0u8; 32];
+    let mut value_hash = [0u8; 32];
+    path.copy_from_slice(&data[1..33]);
+    value_hash.copy_from_slice(&data[33..65]);
+    Ok((path, value_hash))
 }
 
-/// A 2^256-ary sparse Merkle tree over your AccountData
-pub type SMT = SparseMerkleTree<Blake2bHasher, AccountData, DefaultStore<AccountData>>;
+/// Proof of one account in the smt.proof layout: the side nodes from the leaf up and,
+/// for an account that is not in the tree, the other leaf its path ends in (if any)
+pub struct AccountProof {
+    pub side_nodes: Vec<H256>,
+    pub non_membership_leaf: Option<(H256, H256)>,
+}
 
-/// Instantiate a fresh empty tree (all-zero leaves)
-pub fn new_smt() -> SMT {
-    SMT::default()
+enum Node {
+    Empty,
+    Leaf { path: H256, value_hash: H256 },
+    Inner(Box<Node>, Box<Node>),
+    /// A subtree no proof went into, only its hash is known
+    Pruned(H256),
 }
 
-/// Read the current root
-pub fn root(tree: &SMT) -> H256 {
-    *tree.root()
+impl Node {
+    fn hash(&self) -> H256 {
+        match self {
+            Node::Empty => PLACEHOLDER,
+            Node::Leaf { path, value_hash } => leaf_hash(path, value_hash),
+            Node::Inner(left, right) => node_hash(&left.hash(), &right.hash()),
+            Node::Pruned(hash) => *hash,
+        }
+    }
+
+    fn pruned(hash: H256) -> Node {
+        if hash == PLACEHOLDER { Node::Empty } else { Node::Pruned(hash) }
+    }
 }
 
-/// Update one leaf at `key` to `value`
-pub fn update(tree: &mut SMT, key: H256, value: AccountData) {
-    tree.update(key, value).expect("SMT update failed");
+/// Subtree at `depth` that holds nothing but the leaves a and b
+fn split(depth: usize, a: (H256, H256), b: (H256, H256)) -> Node {
+    let a_right = bit(&a.0, depth);
+    if a_right == bit(&b.0, depth) {
+        let child = Box::new(split(depth + 1, a, b));
+        return if a_right { Node::Inner(Box::new(Node::Empty), child) } else { Node::Inner(child, Box::new(Node::Empty)) };
+    }
+    let a = Box::new(Node::Leaf { path: a.0, value_hash: a.1 });
+    let b = Box::new(Node::Leaf { path: b.0, value_hash: b.1 });
+    if a_right { Node::Inner(b, a) } else { Node::Inner(a, b) }
 }
 
-/// Compute the 256-bit path key by Keccak256(address_bytes)
-pub fn address_to_tree_key(address: &[u8; 20]) -> H256 {
-    let mut hasher = Keccak256::new();
-    hasher.update(address);
-    let hash = hasher.finalize();
-    let bytes: [u8; 32] = hash.as_slice().try_into().unwrap();
-    H256::from(bytes)
+/// The paths of the proven accounts, everything next to them pruned to its hash.
+/// All proofs are added before the first update.
+pub struct PartialTree {
+    root: Node,
+    proven_root: H256,
+    updated: bool,
+}
+
+impl PartialTree {
+    /// A tree the proofs are checked against, nothing proven yet
+    pub fn new(root: H256) -> Self {
+        PartialTree { root: Node::pruned(root), proven_root: root, updated: false }
+    }
+
+    pub fn root(&self) -> H256 {
+        self.root.hash()
+    }
+
+    /// Checks that the account at `path` holds `value` (None: it is not in the tree)
+    /// against the root and adds its path. A proof that does not match the root changes nothing.
+    pub fn add_proof(&mut self, path: &H256, value: Option<&[u8]>, proof: &AccountProof) -> Result<(), &'static str> {
+        if self.updated {
+            return Err("proofs have to be added before the first update");
+        }
+        let depth = proof.side_nodes.len();
+        if depth > 256 {
+            return Err("proof is deeper than the tree");
+        }
+        let terminal = match (value, proof.non_membership_leaf) {
+            (Some(value), _) => Node::Leaf { path: *path, value_hash: sha256(value) },
+            (None, Some((other_path, value_hash))) => {
+                if other_path == *path {
+                    return Err("non-membership proof ends in the leaf of the account");
+                }
+                Node::Leaf { path: other_path, value_hash }
+            }
+            (None, None) => Node::Empty,
+        };
+
+        // hashes of the nodes on the path, hashes[d] at depth d
+        let mut hashes = alloc::vec![PLACEHOLDER; depth + 1];
+        hashes[depth] = terminal.hash();
+        for d in (0..depth).rev() {
+            let side = &proof.side_nodes[depth - 1 - d];
+            hashes[d] = if bit(path, d) { node_hash(side, &hashes[d + 1]) } else { node_hash(&hashes[d + 1], side) };
+        }
+        if hashes[0] != self.proven_root {
+            return Err("proof does not match the root");
+        }
+
+        let mut node = &mut self.root;
+        for d in 0..depth {
+            if let Node::Pruned(_) = node {
+                let path_child = Box::new(Node::pruned(hashes[d + 1]));
+                let side_child = Box::new(Node::pruned(proof.side_nodes[depth - 1 - d]));
+                *node = if bit(path, d) { Node::Inner(side_child, path_child) } else { Node::Inner(path_child, side_child) };
+            }
+            node = match node {
+                Node::Inner(left, right) => if bit(path, d) { right } else { left },
+                _ => return Err("proofs disagree on the shape of the tree"),
+            };
+        }
+        match node {
+            Node::Pruned(_) => *node = terminal,
+            Node::Leaf { .. } | Node::Empty => {}
+            Node::Inner(..) => return Err("proofs disagree on the shape of the tree"),
+        }
+        Ok(())
+    }
+
+    /// Sets the value of the account at `path`, it has to be proven first
+    pub fn update(&mut self, path: &H256, value: &[u8]) -> Result<(), &'static str> {
+        self.updated = true;
+        let value_hash = sha256(value);
+        let mut node = &mut self.root;
+        let mut depth = 0;
+        loop {
+            match node {
+                Node::Inner(left, right) => {
+                    node = if bit(path, depth) { right } else { left };
+                    depth += 1;
+                }
+                Node::Empty => {
+                    *node = Node::Leaf { path: *path, value_hash };
+                    return Ok(());
+                }
+                Node::Leaf { path: leaf_path, value_hash: leaf_value_hash } => {
+                    if leaf_path == path {
+                        *leaf_value_hash = value_hash;
+                    } else {
+                        *node = split(depth, (*leaf_path, *leaf_value_hash), (*path, value_hash));
+                    }
+                    return Ok(());
+                }
+                Node::Pruned(_) => return Err("account was not proven"),
+            }
+        }
+    }
 }
 
 /// Helper functions for converting between different formats
@@ -77,7 +239,7 @@ pub fn hex_to_address(hex_str: &str) -> Result<[u8; 20], &'static str> {
     if clean.len() != 40 {
         return Err("Address must be 40 hex characters");
     }
-    
+
     let mut result = [0u8; 20];
     for i in 0..20 {
         let byte_str = &clean[i*2..i*2+2];
@@ -86,18 +248,28 @@ pub fn hex_to_address(hex_str: &str) -> Result<[u8; 20], &'static str> {
     Ok(result)
 }
 
+/// Convert a 0x prefixed hex string of 32 bytes to H256
+pub fn hex_to_h256(hex_str: &str) -> Result<H256, &'static str> {
+    let clean = hex_str.strip_prefix("0x").unwrap_or(hex_str);
+    if clean.len() != 64 {
+        return Err("Hash must be 64 hex characters");
+    }
+
+    let mut result = [0u8; 32];
+    for i in 0..32 {
+        let byte_str = &clean[i*2..i*2+2];
+        result[i] = u8::from_str_radix(byte_str, 16).map_err(|_| "Invalid hex character")?;
+    }
+    Ok(result)
+}
+
 /// Convert 32-byte array to hex string
-pub fn h256_to_hex(hash: &H256) -> alloc::string::String {
-    use alloc::string::String;
-    use alloc::format;
-    format!("0x{}", hex_encode(hash.as_slice()))
+pub fn h256_to_hex(hash: &H256) -> String {
+    format!("0x{}", hex_encode(hash))
 }
 
 /// Convert bytes to hex string (no_std compatible)
-fn hex_encode(bytes: &[u8]) -> alloc::string::String {
-    use alloc::string::String;
-    use alloc::format;
-    
+fn hex_encode(bytes: &[u8]) -> String {
     let mut result = String::new();
     for byte in bytes {
         result.push_str(&format!("{:02x}", byte));
@@ -105,16 +277,5 @@ fn hex_encode(bytes: &[u8]) -> alloc::string::String {
     result
 }
 
-// Optional: Simple merkle proof functions (simplified for now)
-/// Get a simple inclusion proof for debugging
-pub fn get_simple_proof(tree: &SMT, key: H256) -> Option<AccountData> {
-    tree.get(&key).ok()
-}
-
-/// Verify that a key-value pair exists in the tree
-pub fn verify_inclusion(tree: &SMT, key: H256, expected_value: &AccountData) -> bool {
-    match tree.get(&key) {
-        Ok(value) => value.balance == expected_value.balance && value.nonce == expected_value.nonce,
-        Err(_) => false,
-    }
-}
\ No newline at end of file
+#[cfg(test)]
+mod tests;
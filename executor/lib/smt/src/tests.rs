@@ -0,0 +1,88 @@
+use super::*;
+use serde_json::Value;
+
+/// Three consecutive blocks exported by the sequencer (see sequencer/tests/test_witness.py):
+/// deposits into an empty tree, transfers, a deposit that creates an account next to a
+/// transfer. post_leaf_data[i] is the state of addresses[i] after the block.
+const BATCHES: &str = include_str!("testdata/batches.json");
+
+fn proof_of(batch: &Value, i: usize) -> AccountProof {
+    let nodes = batch["proof_nodes"].as_array().unwrap();
+    let proof = &batch["proofs"][i];
+    AccountProof {
+        side_nodes: proof["sidenodes"].as_array().unwrap().iter()
+            .map(|index| hex_to_h256(nodes[index.as_u64().unwrap() as usize].as_str().unwrap()).unwrap())
+            .collect(),
+        non_membership_leaf: proof["non_membership_leafdata"].as_str()
+            .map(|leaf| parse_leaf(&hex::decode(leaf.strip_prefix("0x").unwrap()).unwrap()).unwrap()),
+    }
+}
+
+fn account(leaf: &Value) -> AccountData {
+    AccountData { balance: leaf["balance"].as_u64().unwrap(), nonce: leaf["nonce"].as_u64().unwrap() }
+}
+
+/// Proves the pre-state of every account of the batch, the way the guest does
+fn proven_tree(batch: &Value) -> Result<PartialTree, &'static str> {
+    let mut tree = PartialTree::new(hex_to_h256(batch["old_merkle_root"].as_str().unwrap())?);
+    for (i, address) in batch["addresses"].as_array().unwrap().iter().enumerate() {
+        let address = hex_to_address(address.as_str().unwrap())?;
+        let path = address_to_tree_key(&address);
+        let proof = proof_of(batch, i);
+        let pre = account(&batch["leaf_data"][i]);
+        if tree.add_proof(&path, Some(&leaf_value(&address, &pre)), &proof).is_err() {
+            if pre.balance != 0 || pre.nonce != 0 {
+                return Err("pre-state is not in the tree");
+            }
+            tree.add_proof(&path, None, &proof)?;
+        }
+    }
+    Ok(tree)
+}
+
+#[test]
+fn sequencer_batches_end_at_their_new_root() {
+    let cases: Value = serde_json::from_str(BATCHES).unwrap();
+    let mut previous_root: Option<String> = None;
+    for case in cases.as_array().unwrap() {
+        let batch = &case["batch"];
+        if let Some(root) = &previous_root {
+            assert_eq!(root, batch["old_merkle_root"].as_str().unwrap());
+        }
+        let mut tree = proven_tree(batch).unwrap();
+        assert_eq!(h256_to_hex(&tree.root()), batch["old_merkle_root"].as_str().unwrap());
+        for (i, address) in batch["addresses"].as_array().unwrap().iter().enumerate() {
+            let address = hex_to_address(address.as_str().unwrap()).unwrap();
+            let post = account(&case["post_leaf_data"][i]);
+            tree.update(&address_to_tree_key(&address), &leaf_value(&address, &post)).unwrap();
+        }
+        assert_eq!(h256_to_hex(&tree.root()), batch["new_merkle_root"].as_str().unwrap());
+        previous_root = Some(batch["new_merkle_root"].as_str().unwrap().into());
+    }
+}
+
+#[test]
+fn a_wrong_pre_state_is_rejected() {
+    let cases: Value = serde_json::from_str(BATCHES).unwrap();
+    let mut batch = cases[1]["batch"].clone();
+    let balance = batch["leaf_data"][0]["balance"].as_u64().unwrap();
+    batch["leaf_data"][0]["balance"] = (balance + 1).into();
+    assert!(proven_tree(&batch).is_err());
+}
+
+#[test]
+fn a_proof_against_another_root_is_rejected() {
+    let cases: Value = serde_json::from_str(BATCHES).unwrap();
+    let mut batch = cases[2]["batch"].clone();
+    batch["old_merkle_root"] = cases[1]["batch"]["old_merkle_root"].clone();
+    assert!(proven_tree(&batch).is_err());
+}
+
+#[test]
+fn an_unproven_account_cannot_be_updated() {
+    let cases: Value = serde_json::from_str(BATCHES).unwrap();
+    let mut tree = PartialTree::new(hex_to_h256(cases[1]["batch"]["old_merkle_root"].as_str().unwrap()).unwrap());
+    let address = [0x42u8; 20];
+    let value = leaf_value(&address, &AccountData { balance: 1, nonce: 0 });
+    assert!(tree.update(&address_to_tree_key(&address), &value).is_err());
+}
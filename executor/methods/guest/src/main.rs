@@ -3,7 +3,7 @@
 extern crate alloc;
 use risc0_zkvm::guest::env;
 use serde::{Deserialize, Serialize};
-use smt::{AccountData, new_smt, root, update, address_to_tree_key, h256_to_hex, hex_to_address};
+use smt::{AccountData, AccountProof, PartialTree, address_to_tree_key, h256_to_hex, hex_to_address, hex_to_h256, leaf_value, parse_leaf};
 
 use alloc::{
     string::String,
@@ -52,6 +52,33 @@ struct Batch {
     deposits: Vec<DepositInfo>, 
     badge_id: u32,
     addresses: Vec<String>,
+    proof_nodes: Vec<String>,
+    proofs: Vec<LeafProof>,
+}
+
+/// Proof of addresses[i] against old_merkle_root, side nodes from the leaf up as
+/// indices into proof_nodes, see sequencer/src/WitnessExporter.py
+#[derive(Serialize, Deserialize, Clone)]
+struct LeafProof {
+    sidenodes: Vec<u32>,
+    non_membership_leafdata: Option<String>,
+}
+
+/// K consecutive badges proven in one run and published as L1 batch batch_id,
+/// batches[i + 1] has to start at the root batches[i] ends at
+#[derive(Serialize, Deserialize)]
+struct AggregatedBatch {
+    batch_id: u32,
+    batches: Vec<Batch>,
+}
+
+/// Outcome of one badge of an aggregated batch
+struct BatchResult {
+    success: bool,
+    old_root: String,
+    new_root: String,
+    transactions_processed: usize,
+    processed_deposit_ids: Vec<u64>,
 }
 
 fn hex_to_bytes(hex_str: &str) -> Result<Vec<u8>, &'static str> {
@@ -208,31 +235,53 @@ fn hex_to_bytes32_array(hex_str: &str) -> [u8; 32] {
     result
 }
 
-risc0_zkvm::guest::entry!(main);
+fn account_proof(batch: &Batch, i: usize) -> Result<AccountProof, &'static str> {
+    let proof = batch.proofs.get(i).ok_or("Missing account proof")?;
+    let mut side_nodes = Vec::new();
+    for index in &proof.sidenodes {
+        let node = batch.proof_nodes.get(*index as usize).ok_or("Invalid proof node index")?;
+        side_nodes.push(hex_to_h256(node)?);
+    }
+    let non_membership_leaf = match &proof.non_membership_leafdata {
+        Some(leaf) => Some(parse_leaf(&hex_to_bytes(leaf)?)?),
+        None => None,
+    };
+    Ok(AccountProof { side_nodes, non_membership_leaf })
+}
 
-fn main() {
-    let batch: Batch = env::read();
-    let mut tree = new_smt();
-    
-    // Initialize tree with all accounts from the batch
-    let mut account_keys = Vec::new();
-    
-    for (i, address) in batch.addresses.iter().enumerate() {
-        let address_bytes = hex_to_address(address).expect("Invalid address");
-        let key = address_to_tree_key(&address_bytes);
-        account_keys.push(key);
-        
+// Checks the pre-state of every account of the badge against its old root
+fn prove_pre_state(batch: &Batch, addresses: &[[u8; 20]]) -> Result<PartialTree, &'static str> {
+    if batch.leaf_data.len() != addresses.len() {
+        return Err("Every address needs its leaf data");
+    }
+    let mut tree = PartialTree::new(hex_to_h256(&batch.old_merkle_root)?);
+    for (i, address) in addresses.iter().enumerate() {
+        let proof = account_proof(batch, i)?;
+        let key = address_to_tree_key(address);
         let account_data = AccountData {
             balance: batch.leaf_data[i].balance,
             nonce: batch.leaf_data[i].nonce,
         };
-        
-        update(&mut tree, key, account_data);
+        if tree.add_proof(&key, Some(&leaf_value(address, &account_data)), &proof).is_err() {
+            // Accounts created by a deposit of this badge are not in the tree yet
+            if account_data.balance != 0 || account_data.nonce != 0 {
+                return Err("Leaf data does not match the old root");
+            }
+            tree.add_proof(&key, None, &proof)?;
+        }
     }
+    Ok(tree)
+}
+
+// Replays one badge on the accounts proven against its old root
+fn execute_batch(batch: &Batch) -> BatchResult {
+    let addresses: Vec<[u8; 20]> = batch.addresses.iter()
+        .map(|address| hex_to_address(address).expect("Invalid address"))
+        .collect();
     
     // Verify old root
-    let computed_old_root = h256_to_hex(&root(&tree));
-    let old_root_verified = computed_old_root == batch.old_merkle_root;
+    let proven_tree = prove_pre_state(batch, &addresses);
+    let old_root_verified = proven_tree.is_ok();
     
     // Verify signatures for all transactions
     let mut signatures_verified = true;
@@ -267,13 +316,6 @@ fn main() {
             // Add deposit amount to the account balance
             working_accounts[idx].balance += deposit.amount;
             
-            // Update the tree with the new balance
-            let account_data = AccountData {
-                balance: working_accounts[idx].balance,
-                nonce: working_accounts[idx].nonce,
-            };
-            update(&mut tree, account_keys[idx], account_data);
-            
             // Track processed deposit ID
             processed_deposit_ids.push(deposit.deposit_id);
         } else {
@@ -300,12 +342,6 @@ fn main() {
                     if account.balance >= tx.amount && account.nonce == tx.nonce {
                         // Self-transfer: only update nonce (balance stays same)
                         account.nonce += 1;
-                        
-                        let account_data = AccountData {
-                            balance: account.balance,
-                            nonce: account.nonce,
-                        };
-                        update(&mut tree, account_keys[from_idx], account_data);
                         transactions_processed += 1;
                     } else {
                         // Invalid transaction
@@ -330,20 +366,6 @@ fn main() {
                         from_account.balance -= tx.amount;
                         from_account.nonce += 1;
                         to_account.balance += tx.amount;
-                        
-                        // Update tree with new state
-                        let from_account_data = AccountData {
-                            balance: from_account.balance,
-                            nonce: from_account.nonce,
-                        };
-                        let to_account_data = AccountData {
-                            balance: to_account.balance,
-                            nonce: to_account.nonce,
-                        };
-                        
-                        update(&mut tree, account_keys[from_idx], from_account_data);
-                        update(&mut tree, account_keys[to_idx], to_account_data);
-                        
                         transactions_processed += 1;
                     } else {
                         // Invalid transaction - insufficient balance or wrong nonce
@@ -357,31 +379,86 @@ fn main() {
         }
     }
     
-    // Compute final root after all changes
-    let computed_new_root = h256_to_hex(&root(&tree));
+    // Write the final state of every account into the proven tree and compute the new root
+    let mut tree_updated = false;
+    let mut computed_new_root = String::new();
+    if let Ok(mut tree) = proven_tree {
+        tree_updated = true;
+        for (i, address) in addresses.iter().enumerate() {
+            let account_data = AccountData {
+                balance: working_accounts[i].balance,
+                nonce: working_accounts[i].nonce,
+            };
+            if tree.update(&address_to_tree_key(address), &leaf_value(address, &account_data)).is_err() {
+                tree_updated = false;
+            }
+        }
+        computed_new_root = h256_to_hex(&tree.root());
+    }
     
     // Verify new root matches expected
     let new_root_verified = computed_new_root == batch.new_merkle_root;
     
     // Overall success flag
     let success = old_root_verified && 
+                  tree_updated &&
                   new_root_verified && 
                   signatures_verified && 
                   deposits_processed &&
                   transactions_processed == batch.transactions.len();
     
+    BatchResult {
+        success,
+        old_root: batch.old_merkle_root.clone(),
+        new_root: computed_new_root,
+        transactions_processed,
+        processed_deposit_ids,
+    }
+}
+
+risc0_zkvm::guest::entry!(main);
+
+fn main() {
+    let aggregated: AggregatedBatch = env::read();
+    
+    let mut success = !aggregated.batches.is_empty();
+    let mut transactions_processed = 0;
+    let mut processed_deposit_ids = Vec::new();
+    let mut first_old_root: Option<String> = None;
+    let mut last_new_root: Option<String> = None;
+    
+    for batch in &aggregated.batches {
+        let result = execute_batch(batch);
+        
+        // The badges have to form one chained state transition
+        if let Some(previous_new_root) = &last_new_root {
+            if *previous_new_root != result.old_root {
+                success = false;
+            }
+        }
+        
+        success = success && result.success;
+        transactions_processed += result.transactions_processed;
+        processed_deposit_ids.extend(result.processed_deposit_ids);
+        if first_old_root.is_none() {
+            first_old_root = Some(result.old_root);
+        }
+        last_new_root = Some(result.new_root);
+    }
+    
     // Convert hex strings to bytes32 for proper encoding
-    let old_root_bytes = hex_to_bytes32_array(&computed_old_root);
-    let new_root_bytes = hex_to_bytes32_array(&computed_new_root);
+    let old_root_bytes = first_old_root.map_or([0u8; 32], |root| hex_to_bytes32_array(&root));
+    let new_root_bytes = last_new_root.map_or([0u8; 32], |root| hex_to_bytes32_array(&root));
     
+    // Same journal layout as for a single badge, the roots span the whole chain
     let verification_data = (
         success,                         
         old_root_bytes,                   
         new_root_bytes,                   
-        batch.badge_id,                   
+        aggregated.batch_id,                   
         transactions_processed as u32,    
         processed_deposit_ids,            
     );
 
     env::commit(&verification_data);
-}
\ No newline at end of file
+}
@@ -0,0 +1,128 @@
+"""
+    Compares forming a 50 transaction block with the per-transaction mongo
+    round-trips (legacy) against the in-memory account state with one
+    write-behind flush.
+
+    needs a running mongo (MONGO_URI), run from the sequencer directory:
+        python3 benchmarks/bench_account_state.py
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+import json
+import random
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+os.environ["DB_NAME"] = os.environ["DB_NAME"] + "_bench"
+os.environ["STATE_DB_PATH"] = ":memory:"
+
+from src.AsyncMongoClient import get_mongo_client
+from src.MerkleTreeController import MerkleTreeController
+from src.Types import TransactionStatus
+from src.TxRecord import TxRecord
+from src.utils import generate_random_id, get_current_timestamp, hex_to_bytes
+
+BLOCK_SIZE = 50
+ROUNDS = 5
+
+
+def create_block(accounts : list[dict], nonces : dict) -> list[TxRecord]:
+    transactions = []
+    for _ in range(BLOCK_SIZE):
+        a, b = random.sample(range(len(accounts)), 2)
+        sender = accounts[a]["pub_key"]
+        transactions.append(TxRecord(
+            transaction_id=generate_random_id(),
+            submission_id=generate_random_id(),
+            received_at=get_current_timestamp(),
+            sender=sender,
+            receiver=accounts[b]["pub_key"],
+            amount=1,
+            nonce=nonces[sender],
+            status=TransactionStatus.PENDING.value
+        ))
+        nonces[sender] += 1
+    return transactions
+
+
+async def reset_users(users_col, accounts : list[dict]) -> None:
+    """
+        USERS documents as the legacy controller kept them, with the account_updates array
+    """
+    await users_col.delete_many({})
+    await users_col.insert_many([
+        {"address": acc["pub_key"], "balance": acc["balance"], "nonce": 0, "account_updates": []}
+        for acc in accounts
+    ])
+
+
+async def legacy_block(tree_controller : MerkleTreeController, users_col, badge_id : str, transactions : list[TxRecord]) -> None:
+    """
+        Access pattern of the mongo backed controller: two reads for the invariants,
+        then a read and a write for each of the two leaves.
+    """
+    for t in transactions:
+        sender = await users_col.find_one({"address": t.sender})
+        await users_col.find_one({"address": t.receiver})
+        updates = sender["account_updates"]
+        balance, nonce = (updates[-1]["balance_after"], updates[-1]["nonce_after"]) if updates else (sender["balance"], sender["nonce"])
+        if balance < t.amount or nonce != t.nonce:
+            continue
+        for address, delta, nonce_delta in ((t.sender, -int(t.amount), 1), (t.receiver, int(t.amount), 0)):
+            doc = await users_col.find_one({"address": address})
+            updates = doc["account_updates"]
+            balance, nonce = (updates[-1]["balance_after"], updates[-1]["nonce_after"]) if updates else (doc["balance"], doc["nonce"])
+            await users_col.update_one({"address": address}, {"$push": {"account_updates": {
+                "balance_before": balance, "balance_after": balance + delta,
+                "nonce_before": nonce, "nonce_after": nonce + nonce_delta,
+                "transactions": [t.transaction_id], "badgeId": badge_id
+            }}})
+            leaf = (balance + delta).to_bytes(8, 'little') + (nonce + nonce_delta).to_bytes(8, 'little') + hex_to_bytes(address)
+            tree_controller.sparse_merkle_tree.update(hex_to_bytes(address), leaf)
+
+
+async def in_memory_block(tree_controller : MerkleTreeController, users_col, history_col, badge_id : str, blocknumber : int, transactions : list[TxRecord]) -> None:
+    for t in transactions:
+        try:
+            await tree_controller.make_rollup_transaction_between_existing_users(badge_id=badge_id, transaction=t)
+        except Exception:
+            pass
+    tree_controller.apply_pending_leaves()
+    account_updates, history_updates = tree_controller.drain_account_updates(badge_id=badge_id, blocknumber=blocknumber, timestamp=get_current_timestamp())
+    await users_col.bulk_write(account_updates, ordered=False)
+    await history_col.bulk_write(history_updates, ordered=False)
+
+
+async def main():
+    with open("funded_accounts.json", "r") as file:
+        accounts = json.load(file)
+    db = get_mongo_client()[os.environ["DB_NAME"]]
+    users_col = db[os.environ["USERS"]]
+    history_col = db[os.environ.get("ACCOUNT_HISTORY", "account_history")]
+    results = {}
+    for name in ("legacy", "in_memory"):
+        await reset_users(users_col, accounts)
+        tree_controller = MerkleTreeController(with_account_setup=True)
+        nonces = {acc["pub_key"]: 0 for acc in accounts}
+        timings = []
+        for blocknumber in range(1, ROUNDS + 1):
+            badge_id = generate_random_id()
+            transactions = create_block(accounts, nonces)
+            start = time.perf_counter()
+            if name == "legacy":
+                await legacy_block(tree_controller, users_col, badge_id, transactions)
+            else:
+                await in_memory_block(tree_controller, users_col, history_col, badge_id, blocknumber, transactions)
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        results[name] = {"best_block_seconds": best, "tx_per_second": BLOCK_SIZE / best}
+    await db.client.drop_database(os.environ["DB_NAME"])
+    results["speedup"] = results["legacy"]["best_block_seconds"] / results["in_memory"]["best_block_seconds"]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
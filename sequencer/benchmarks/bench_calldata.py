@@ -0,0 +1,56 @@
+"""
+    Reports the bytes and calldata gas per transfer of the legacy and the compact txData
+    for blocks of random transfers between random accounts. The golden vectors of
+    executor/lib/calldata are checked by tests/test_calldata_codec.py and cargo test.
+
+        python3 benchmarks/bench_calldata.py --block-size 10 50 200 --accounts 10 100
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import random
+from src.CalldataCodec import encode_legacy, encode_compact, decode_compact, calldata_gas
+
+
+def create_block(rng : random.Random, block_size : int, accounts : int) -> list[dict]:
+    addresses = ["0x" + rng.randbytes(20).hex() for _ in range(accounts)]
+    nonces = {address: rng.randrange(0, 500) for address in addresses}
+    transactions = []
+    for _ in range(block_size):
+        sender, receiver = rng.sample(addresses, 2)
+        transactions.append({
+            "from": sender,
+            "to": receiver,
+            # amounts in wei of 0.001 to 10 eth
+            "amount": rng.randrange(10**15, 10**19),
+            "nonce": nonces[sender],
+            "signature": {"pubKey": sender, "signature": "0x" + rng.randbytes(64).hex() + rng.choice(["00", "01"])}
+        })
+        nonces[sender] += 1
+    return transactions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--block-size", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--accounts", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'txs':>5} {'accounts':>8} {'legacy B/tx':>12} {'compact B/tx':>13} {'legacy gas/tx':>14} {'compact gas/tx':>15} {'saved':>6}")
+    for block_size in args.block_size:
+        for accounts in args.accounts:
+            transactions = create_block(rng, block_size, accounts)
+            legacy = encode_legacy(transactions)
+            compact = encode_compact(transactions)
+            assert decode_compact(compact) == transactions
+            legacy_gas = calldata_gas(legacy) / block_size
+            compact_gas = calldata_gas(compact) / block_size
+            print(f"{block_size:>5} {accounts:>8} {len(legacy) / block_size:>12.1f} {len(compact) / block_size:>13.1f} "
+                  f"{legacy_gas:>14.0f} {compact_gas:>15.0f} {1 - compact_gas / legacy_gas:>6.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+    Deposit catch up against a local anvil node (anvil/anvil.sh, deploy_anvil.sh) and
+    the mongo of .env: sends --deposits deposits from the anvil dev accounts to
+    DEPOSIT_CONTRACT while the sequencer is down, then times how long the ChainListener
+    needs to ingest them. Run it against an empty database.
+
+        python3 benchmarks/bench_deposit_ingestion.py --deposits 2000 --chunk 500
+
+    With --reorg the last blocks are reverted (evm_snapshot / evm_revert) and mined
+    again with other deposits, the listener has to drop and re-read them.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import asyncio
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from web3 import AsyncWeb3, AsyncHTTPProvider, Web3
+from src.ChainListener import ChainListener
+from src.MemPool import MemPool
+from src.AccountStateStore import AccountStateStore
+from src.AsyncMongoClient import get_mongo_client
+
+DEPOSIT_ABI = [{"type": "function", "name": "deposit", "inputs": [], "outputs": [], "stateMutability": "payable"}]
+
+
+async def send_deposits(w3 : AsyncWeb3, contract_address : str, count : int) -> None:
+    accounts = await w3.eth.accounts
+    contract = w3.eth.contract(address=contract_address, abi=DEPOSIT_ABI)
+    # anvil auto-mines, one deposit per block
+    for i in range(count):
+        await contract.functions.deposit().transact({"from": accounts[i % len(accounts)], "value": Web3.to_wei(1, "ether")})
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rpc-url", default="http://127.0.0.1:8545")
+    parser.add_argument("--deposits", type=int, default=1000)
+    parser.add_argument("--chunk", type=int, default=2000)
+    parser.add_argument("--reorg", type=int, default=0, help="blocks to revert and mine again after the catch up")
+    args = parser.parse_args()
+
+    contract_address = Web3.to_checksum_address(os.environ["DEPOSIT_CONTRACT"])
+    w3 = AsyncWeb3(AsyncHTTPProvider(args.rpc_url))
+    start = time.perf_counter()
+    await send_deposits(w3, contract_address, args.deposits)
+    print(f"sent {args.deposits} deposits in {time.perf_counter() - start:.1f}s, L1 head {await w3.eth.block_number}")
+
+    snapshot = None
+    if args.reorg > 0:
+        snapshot = await w3.provider.make_request("evm_snapshot", [])
+        await send_deposits(w3, contract_address, args.reorg)
+
+    mempool = MemPool(account_state=AccountStateStore())
+    listener = ChainListener(polling_interval=1, mempool=mempool, node_addres=args.rpc_url, contract_address=contract_address,
+                             confirmations=0, chunk_size=args.chunk, start_block=0)
+    start = time.perf_counter()
+    ingested = await listener.catch_up()
+    elapsed = time.perf_counter() - start
+    print(f"ingested {ingested} deposits up to block {listener.cursor['blocknumber']} in {elapsed:.2f}s ({ingested / elapsed:.0f} deposits/s)")
+
+    if snapshot is not None:
+        await w3.provider.make_request("evm_revert", [snapshot["result"]])
+        await send_deposits(w3, contract_address, args.reorg + 1)
+        ingested = await listener.catch_up()
+        db = get_mongo_client()[os.environ["DB_NAME"]]
+        stored = await db[os.environ["TRANSACTIONS"]].count_documents({"receiver": None})
+        print(f"after the reorg : {ingested} deposits read again, {stored} deposits stored, pool holds {len(mempool.pending_pool)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,121 @@
+"""
+    Replays the same submission stream through the legacy block selection
+    (newest PENDING first, like the old mongo query) and through the PendingPool,
+    executing every block against the in-memory account state.
+    Reports how many transfers were included, how many were wasted as FAILED
+    and the selection + execution throughput.
+
+        python3 benchmarks/bench_mempool.py --senders 200 --per-sender 20 --block-size 50
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import json
+import random
+import time
+from src.TxRecord import TxRecord
+from src.AccountStateStore import AccountStateStore
+from src.PendingPool import PendingPool
+
+
+def create_accounts(count : int) -> AccountStateStore:
+    rng = random.Random(1)
+    account_state = AccountStateStore()
+    for _ in range(count):
+        account_state.put(address="0x" + rng.randbytes(20).hex(), balance=10**9, nonce=0)
+    return account_state
+
+
+def create_stream(addresses : list[str], per_sender : int) -> list[TxRecord]:
+    """
+        every sender sends its nonces in order, the senders are interleaved randomly
+    """
+    rng = random.Random(2)
+    order = [a for a in addresses for _ in range(per_sender)]
+    rng.shuffle(order)
+    nonces = {a: 0 for a in addresses}
+    stream = []
+    for i, sender in enumerate(order):
+        stream.append(TxRecord(
+            transaction_id=str(i), submission_id=None, received_at=i, sender=sender, receiver=rng.choice(addresses),
+            amount=1, nonce=nonces[sender]
+        ))
+        nonces[sender] += 1
+    return stream
+
+
+def execute(account_state : AccountStateStore, badge_id : str, transactions : list[TxRecord]) -> list[TxRecord]:
+    failed = []
+    for t in transactions:
+        if account_state.check_transfer(t):
+            account_state.apply_transfer(badge_id=badge_id, transaction=t)
+        else:
+            failed.append(t)
+    account_state.touched = {}
+    return failed
+
+
+def run_legacy(account_count : int, stream : list[TxRecord], block_size : int, arrivals_per_block : int) -> dict:
+    account_state = create_accounts(account_count)
+    pending = []
+    included = failed = blocks = 0
+    busy = 0.0
+    position = 0
+    while position < len(stream) or len(pending) > 0:
+        pending.extend(stream[position:position + arrivals_per_block])
+        position += arrivals_per_block
+        start = time.perf_counter()
+        pending.sort(key=lambda t: t.received_at, reverse=True)
+        block, pending = pending[:block_size], pending[block_size:]
+        block_failed = execute(account_state, str(blocks), block)
+        busy += time.perf_counter() - start
+        blocks += 1
+        included += len(block) - len(block_failed)
+        failed += len(block_failed)
+    return {"blocks": blocks, "included": included, "failed": failed, "failed_rate": round(failed / len(stream), 4), "tx_per_s": round(included / busy, 1)}
+
+
+def run_pool(account_count : int, stream : list[TxRecord], block_size : int, arrivals_per_block : int) -> dict:
+    account_state = create_accounts(account_count)
+    pool = PendingPool(account_state=account_state)
+    included = failed = blocks = 0
+    busy = 0.0
+    position = 0
+    while position < len(stream) or len(pool) > 0:
+        start = time.perf_counter()
+        for t in stream[position:position + arrivals_per_block]:
+            if not pool.insert(t):
+                failed += 1
+        position += arrivals_per_block
+        block = pool.select(block_size)
+        block_failed = execute(account_state, str(blocks), block)
+        dropped = pool.after_block(senders={t.sender_key for t in block}, failed_senders={t.sender_key for t in block_failed})
+        busy += time.perf_counter() - start
+        blocks += 1
+        included += len(block) - len(block_failed)
+        failed += len(block_failed) + len(dropped)
+        if len(block) == 0 and position >= len(stream):
+            break
+    return {"blocks": blocks, "included": included, "failed": failed, "held": pool.held(), "failed_rate": round(failed / len(stream), 4), "tx_per_s": round(included / busy, 1)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--senders", type=int, default=200)
+    parser.add_argument("--per-sender", type=int, default=20)
+    parser.add_argument("--block-size", type=int, default=50)
+    parser.add_argument("--arrivals-per-block", type=int, default=60)
+    args = parser.parse_args()
+
+    account_state = create_accounts(args.senders)
+    stream = create_stream([a.address for a in account_state.accounts.values()], args.per_sender)
+    print(json.dumps({
+        "transactions": len(stream),
+        "legacy_newest_first": run_legacy(args.senders, stream, args.block_size, args.arrivals_per_block),
+        "pending_pool": run_pool(args.senders, stream, args.block_size, args.arrivals_per_block),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+    Forms the same stream of blocks one after another (execute, then persist)
+    and through the BlockPipeline, where block N+1 is executed while block N is
+    persisted. The mongo commit is replaced by a fixed delay (--persist-ms) so the
+    script runs without a database; the tree checkpoint goes to a real SQLite file.
+
+        python3 benchmarks/bench_pipeline.py --blocks 40 --block-size 50 --persist-ms 20
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from src.BlockController import BlockController
+from src.Types import BadgeExecutionCause, SchedulerSettingsUpdate
+from src.TxRecord import TxRecord
+from src.utils import generate_random_id
+
+
+def create_transfers(block_controller : BlockController, count : int) -> list[TxRecord]:
+    accounts = list(block_controller.tree_controller.account_state.accounts.values())
+    nonces = {a.address: a.nonce for a in accounts}
+    transfers = []
+    for i in range(count):
+        sender = accounts[i % len(accounts)]
+        receiver = accounts[(i + 1) % len(accounts)]
+        transfers.append(TxRecord(
+            transaction_id=generate_random_id(), submission_id=generate_random_id(), received_at=i, sender=sender.address,
+            receiver=receiver.address, amount=1, nonce=nonces[sender.address]
+        ))
+        nonces[sender.address] += 1
+    return transfers
+
+
+def create_block_controller(directory : str, name : str, persist_ms : float) -> BlockController:
+    os.environ["STATE_DB_PATH"] = os.path.join(directory, name + ".sqlite")
+    os.environ["WITNESS_DIR"] = os.path.join(directory, name + "_witness")
+    os.environ["PROVER"] = "fake"
+    block_controller = BlockController(with_account_setup=True)
+    block_controller.header_builder.tip = ("0x" + "0" * 64, 0, "genesis")
+
+    async def commit(block_commit) -> None:
+        await asyncio.sleep(persist_ms / 1000)
+    block_controller.block_committer.commit = commit
+    return block_controller
+
+
+async def run_sequential(block_controller : BlockController, blocks : int, block_size : int) -> float:
+    for t in create_transfers(block_controller, blocks * block_size):
+        block_controller.mempool.pending_pool.insert(t)
+    start = time.perf_counter()
+    for _ in range(blocks):
+        await block_controller.form_new_L2_block(BadgeExecutionCause.FILLEDUP, block_size, 15_000_000)
+    return time.perf_counter() - start
+
+
+async def run_pipelined(block_controller : BlockController, blocks : int, block_size : int) -> float:
+    block_controller.scheduler.update_settings(SchedulerSettingsUpdate(max_block_size=block_size, min_block_size=block_size, adaptive=False))
+    transfers = create_transfers(block_controller, blocks * block_size)
+    start = time.perf_counter()
+    pipeline = asyncio.create_task(block_controller.block_production_loop())
+    for t in transfers:
+        block_controller.mempool.pending_pool.insert(t)
+    while block_controller.header_builder.tip[1] < blocks:
+        await asyncio.sleep(0.001)
+    await block_controller.pipeline.drain()
+    elapsed = time.perf_counter() - start
+    pipeline.cancel()
+    return elapsed
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blocks", type=int, default=40)
+    parser.add_argument("--block-size", type=int, default=50)
+    parser.add_argument("--persist-ms", type=float, default=20)
+    args = parser.parse_args()
+    logging_level = os.environ.get("LOG_LEVEL", "WARNING")
+    import logging
+    logging.basicConfig(level=logging_level)
+
+    with tempfile.TemporaryDirectory() as directory:
+        sequential = await run_sequential(create_block_controller(directory, "sequential", args.persist_ms), args.blocks, args.block_size)
+        pipelined = await run_pipelined(create_block_controller(directory, "pipelined", args.persist_ms), args.blocks, args.block_size)
+    transactions = args.blocks * args.block_size
+    print(json.dumps({
+        "blocks": args.blocks,
+        "block_size": args.block_size,
+        "persist_ms": args.persist_ms,
+        "sequential_tx_s": round(transactions / sequential, 1),
+        "pipelined_tx_s": round(transactions / pipelined, 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
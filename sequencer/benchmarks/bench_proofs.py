@@ -0,0 +1,91 @@
+"""
+    Proof latency of the ProofService against proving every request from scratch, on an
+    in-memory tree with --leaves accounts. Cached proofs are requested again after one
+    block of --block-size transfers, and a multiproof of --batch accounts reports how
+    many side nodes the deduplication saves.
+
+        python3 benchmarks/bench_proofs.py --leaves 1048576 --requests 20000 --block-size 1000
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import random
+import time
+from smt.proof import SparseMerkleProof, verify_proof
+from src.StateTree import StateTree
+from src.ProofService import ProofService
+from src.utils import hex_to_bytes, bytes_to_hex
+
+
+class TreeHolder:
+
+    def __init__(self, tree : StateTree):
+        self.sparse_merkle_tree = tree
+        self.state_blocknumber = 0
+
+
+def leaf(address : str, balance : int, nonce : int) -> bytes:
+    return balance.to_bytes(8, 'little') + nonce.to_bytes(8, 'little') + hex_to_bytes(address)
+
+
+def scratch_proof(tree : StateTree, address : str) -> dict:
+    # what the service would do without a cache: prove and encode every request
+    key = hex_to_bytes(address)
+    proof = tree.prove(key)
+    value = tree.get(key)
+    return {"address": address, "leaf": bytes_to_hex(value), "balance": int.from_bytes(value[0:8], 'little'),
+            "nonce": int.from_bytes(value[8:16], 'little'), "root": tree.root_as_hex(), "sidenodes": [bytes_to_hex(s) for s in proof.sidenodes]}
+
+
+def timed(call, addresses : list[str]) -> float:
+    start = time.perf_counter()
+    for address in addresses:
+        call(address)
+    return (time.perf_counter() - start) / len(addresses) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--leaves", type=int, default=1 << 20)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--block-size", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args()
+
+    rnd = random.Random(1)
+    addresses = ["0x" + rnd.randbytes(20).hex() for _ in range(args.leaves)]
+    tree = StateTree()
+    tree.update_many([hex_to_bytes(a) for a in addresses], [leaf(a, 100, 0) for a in addresses])
+    holder = TreeHolder(tree)
+    service = ProofService(tree_controller=holder)
+    requested = rnd.sample(addresses, args.requests)
+
+    results = {}
+    results["scratch"] = timed(lambda a: scratch_proof(tree, a), requested)
+    results["cold"] = timed(service.get_proof, requested)
+    results["cached"] = timed(service.get_proof, requested)
+    # one block: the transfers touch two accounts each
+    touched = rnd.sample(addresses, 2 * args.block_size)
+    tree.update_many([hex_to_bytes(a) for a in touched], [leaf(a, 99, 1) for a in touched])
+    holder.state_blocknumber = 1
+    results["scratch after block"] = timed(lambda a: scratch_proof(tree, a), requested)
+    results["after block"] = timed(service.get_proof, requested)
+
+    for address in requested[:100]:
+        response = service.get_proof(address)
+        proof = SparseMerkleProof([hex_to_bytes(s) for s in response["sidenodes"]], None, None)
+        assert verify_proof(proof, tree.root, hex_to_bytes(address), hex_to_bytes(response["leaf"]))
+
+    multiproof = service.get_multiproof(requested[:args.batch])
+    side_nodes = sum(len(p["sidenodes"]) for p in multiproof["proofs"])
+
+    print(f"{'':<22} {'us/proof':>9}")
+    for name, result in results.items():
+        print(f"{name:<22} {result:>9.2f}")
+    print(f"multiproof of {args.batch} accounts : {len(multiproof['nodes'])} side nodes instead of {side_nodes}")
+    print(service.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+    Cost per L2 transaction when K badges are proven and published as one L1 batch
+    (PROVER_AGGREGATE). Every submitBatch pays the transaction base cost, one Groth16
+    verification and the state writes of the contract once, the calldata grows with
+    the transfers. Every guest run pays the proving setup and the STARK to SNARK wrap
+    once, the execution grows with the badges.
+
+    The defaults are estimates, pass what you measure on anvil (gas used is printed
+    by the host) and for your prover:
+
+        python3 benchmarks/bench_prover_aggregation.py --block-size 50 --verify-gas 280000 --wrap-s 20 --badge-s 6
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+from src.utils import TRANSFER_GAS
+
+TX_BASE_GAS = 21000
+# batchCount, currentRoot, roots[batchId] and the deposit id array of a new batch
+STATE_WRITE_GAS = 4 * 22100
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--block-size", type=int, default=50, help="transfers per badge")
+    parser.add_argument("--verify-gas", type=int, default=280000, help="gas of one Groth16 verification")
+    parser.add_argument("--wrap-s", type=float, default=20.0, help="fixed seconds per guest run (setup, groth16 wrap)")
+    parser.add_argument("--badge-s", type=float, default=6.0, help="seconds of proving per badge")
+    parser.add_argument("--aggregate", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    fixed_gas = TX_BASE_GAS + args.verify_gas + STATE_WRITE_GAS
+    print(f"{'K':>4} {'L1 gas / batch':>15} {'L1 gas / tx':>12} {'prove s / batch':>16} {'prove ms / tx':>14}")
+    for k in args.aggregate:
+        transactions = k * args.block_size
+        batch_gas = fixed_gas + 4 * 16 + transactions * TRANSFER_GAS
+        prove_s = args.wrap_s + k * args.badge_s
+        print(f"{k:>4} {batch_gas:>15} {batch_gas / transactions:>12.0f} {prove_s:>16.1f} {prove_s / transactions * 1000:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
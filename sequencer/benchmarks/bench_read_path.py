@@ -0,0 +1,125 @@
+"""
+    Latency and throughput of get-nonce and get-status under concurrent load, against
+    the mongo of .env (database <DB_NAME>_bench, dropped afterwards).
+
+        python3 benchmarks/bench_read_path.py --concurrency 64 --requests 20000 --history 500
+
+    legacy   : the previous path, find_one of the whole document (USERS documents with
+               --history account updates in the layout before the history buckets), no indexes
+    indexed  : mongo fallback of the new path, projections and the SetupService indexes
+    memory   : the new path, account state + pending pool / status cache
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import asyncio
+import json
+import logging
+import random
+import tempfile
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+logging.disable(logging.CRITICAL)
+os.environ["DB_NAME"] = os.environ["DB_NAME"] + "_bench"
+os.environ["PROVER"] = "fake"
+
+from src.AsyncMongoClient import get_mongo_client
+from src.BlockController import BlockController
+from src.SetupService import SetupService
+from src.Types import AccountUpdates, TransactionStatus
+from src.utils import generate_random_id
+
+
+async def seed(db, accounts : list[dict], history : int, transactions : int) -> list[str]:
+    await db[os.environ["USERS"]].insert_many([{
+        "address": acc["pub_key"], "balance": acc["balance"], "nonce": 0,
+        "account_updates": [{"balance_before": 0, "balance_after": 0, "nonce_before": i, "nonce_after": i + 1, "transactions": [generate_random_id()],
+                             "badgeId": generate_random_id(), "blocknumber": i + 1, "timestamp": i} for i in range(history)]
+    } for acc in accounts])
+    submission_ids = [generate_random_id() for _ in range(transactions)]
+    await db[os.environ["TRANSACTIONS"]].insert_many([{
+        "receivedAt": i, "submissionId": submission_id, "transactionId": generate_random_id(), "sender": accounts[0]["pub_key"],
+        "receiver": accounts[1]["pub_key"], "nonce": i, "signature": None, "amount": 1, "status": TransactionStatus.INCLUDED.value,
+        "badgeId": None, "pubKey": None, "depositId": None, "l1Block": None
+    } for i, submission_id in enumerate(submission_ids)])
+    return submission_ids
+
+
+async def legacy_nonce(db, account : str) -> int:
+    doc = await db[os.environ["USERS"]].find_one({"address": account})
+    account_updates = [AccountUpdates(**u) for u in doc["account_updates"]]
+    return account_updates[-1].nonce_after if len(account_updates) > 0 else doc["nonce"]
+
+
+async def legacy_status(db, submission_id : str) -> str:
+    doc = await db[os.environ["TRANSACTIONS"]].find_one({"submissionId": submission_id})
+    return doc["status"]
+
+
+async def load(call, keys : list[str], concurrency : int, requests : int) -> dict:
+    latencies = []
+
+    async def worker(offset : int) -> None:
+        for i in range(offset, requests, concurrency):
+            start = time.perf_counter()
+            await call(keys[i % len(keys)])
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(i) for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "req_per_s": round(requests / elapsed),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 3)
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--history", type=int, default=500, help="account updates per account")
+    parser.add_argument("--transactions", type=int, default=50000)
+    args = parser.parse_args()
+
+    with open("funded_accounts.json", "r") as file:
+        accounts = json.load(file)
+    db = get_mongo_client()[os.environ["DB_NAME"]]
+    await db.client.drop_database(os.environ["DB_NAME"])
+    submission_ids = await seed(db, accounts, args.history, args.transactions)
+    addresses = [acc["pub_key"] for acc in accounts]
+    random.Random(1).shuffle(submission_ids)
+
+    results = {}
+    results["get-nonce legacy"] = await load(lambda a: legacy_nonce(db, a), addresses, args.concurrency, args.requests)
+    results["get-status legacy"] = await load(lambda s: legacy_status(db, s), submission_ids, args.concurrency, args.requests)
+
+    await SetupService(start_users_needed=False).create_indexes()
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["STATE_DB_PATH"] = os.path.join(directory, "state.sqlite")
+        os.environ["WITNESS_DIR"] = os.path.join(directory, "witness")
+        block_controller = BlockController(with_account_setup=False)
+        results["get-nonce indexed"] = await load(block_controller._stored_nonce, addresses, args.concurrency, args.requests)
+        results["get-status indexed"] = await load(block_controller.get_status_for_transaction, submission_ids, args.concurrency, args.requests)
+
+        # the seeded accounts were never part of a block, they are only in USERS
+        await block_controller.tree_controller.account_state.load_from_collection(db[os.environ["USERS"]])
+        for submission_id in submission_ids:
+            block_controller.status_cache.put(submission_id, generate_random_id(), TransactionStatus.INCLUDED.value)
+        results["get-nonce memory"] = await load(block_controller.get_nonce_for_account, addresses, args.concurrency, args.requests)
+        results["get-status memory"] = await load(block_controller.get_status_for_transaction, submission_ids, args.concurrency, args.requests)
+        block_controller.tree_controller.node_store.close()
+
+    await db.client.drop_database(os.environ["DB_NAME"])
+    print(f"{'':<20} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, result in results.items():
+        print(f"{name:<20} {result['req_per_s']:>9} {result['p50_ms']:>8} {result['p99_ms']:>8}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
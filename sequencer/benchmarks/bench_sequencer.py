@@ -0,0 +1,272 @@
+"""
+    End-to-end run of the sequencer components (Transaction_Validator, MemPool,
+    MerkleTreeController, BlockController) on synthetic workloads, without the API.
+    Every combination of the comma separated lists runs in its own process, so peak RSS
+    is per run, and the results are written as JSON.
+
+        python3 benchmarks/bench_sequencer.py --backend memory --accounts 1024,1048576 \
+            --distribution uniform,zipf --block-size 50,500,5000 --blocks 10 --output results.json
+
+    --backend memory runs on the in-process stand-in (MONGO_BACKEND=memory, --latency-ms per
+    call), --backend mongo on the mongo of .env (database <DB_NAME>_bench, dropped afterwards).
+    The transfers come from benchmarks/workload.py (shared with generate_workload.py): senders
+    drawn uniformly or with Zipf weights 1/rank^s, receivers uniformly. They are signed by their
+    sender before the clock starts; only accounts that send get the address of their key,
+    the others keep a random address. They are submitted in batches of
+    SUBMIT_BATCH_MAX_SIZE (ingest, includes the signature checks), then --blocks blocks are
+    formed one after another with form_new_L2_block (execute, persist, export).
+
+    stages, summed over the blocks:
+        verify       Transaction_Validator.check_transactions_validity (ingest)
+        select       MemPool.get_transaction_for_badge
+        invariants   MerkleTreeController._check_tree_invariants_for_update
+        tree_update  MerkleTreeController.apply_pending_leaves
+        block_hash   BlockHeaderBuilder.add / seal
+        persist      BlockController.persist_block (mongo commit + tree checkpoint)
+        export       BlockPipeline.export_block (witness files, proof job)
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import asyncio
+import functools
+import inspect
+import itertools
+import json
+import logging
+import random
+import resource
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from dotenv import load_dotenv
+from workload import create_pairs, assign_nonces, derive_addresses, sign_chunk
+
+load_dotenv()
+
+BALANCE = 10 ** 12
+MAX_GAS = 10 ** 12
+
+
+def sign_workload(seed : int, accounts : list[str], senders : list[int], receivers : list[int], nonces : list[int], workers : int) -> list[dict]:
+    """
+        /api/submit bodies of the transfers, signed in a process pool with the keys of workload.py.
+        The accounts that send are replaced with the addresses of their keys.
+    """
+    chunk_size = max(1, -(-len(senders) // (workers * 4)))
+    chunks = [(start, min(start + chunk_size, len(senders))) for start in range(0, len(senders), chunk_size)]
+    requests = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        signers = sorted(set(senders))
+        signer_chunks = [signers[start:start + chunk_size] for start in range(0, len(signers), chunk_size)]
+        for indices, addresses in zip(signer_chunks, executor.map(derive_addresses, [seed] * len(signer_chunks), signer_chunks)):
+            for index, address in zip(indices, addresses):
+                accounts[index] = address
+        futures = [executor.submit(sign_chunk, seed, senders[start:end], [accounts[i] for i in senders[start:end]],
+                                   [accounts[i] for i in receivers[start:end]], [1] * (end - start), nonces[start:end])
+                   for start, end in chunks]
+        for (start, end), future in zip(chunks, futures):
+            signatures, pub_keys = future.result()
+            for i in range(start, end):
+                offset = (i - start) * 65
+                requests.append({"sender": accounts[senders[i]], "receiver": accounts[receivers[i]], "amount": 1, "nonce": nonces[i],
+                                 "signature": {"pubKey": pub_keys[senders[i]], "signature": "0x" + signatures[offset:offset + 65].hex()}})
+    return requests
+
+
+class StageTimer:
+
+    def __init__(self):
+        self.totals : dict[str, float] = {}
+        self.calls : dict[str, int] = {}
+
+    def wrap(self, owner, method : str, stage : str) -> None:
+        """
+            Replaces the method on the instance with one that adds its time to the stage
+        """
+        function = getattr(owner, method)
+        totals = self.totals
+        calls = self.calls
+        totals.setdefault(stage, 0.0)
+        calls.setdefault(stage, 0)
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    totals[stage] += time.perf_counter() - start
+                    calls[stage] += 1
+        else:
+            @functools.wraps(function)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    totals[stage] += time.perf_counter() - start
+                    calls[stage] += 1
+        setattr(owner, method, timed)
+
+
+async def setup_accounts(block_controller, accounts : list[str]) -> None:
+    tree_controller = block_controller.tree_controller
+    for address in accounts:
+        tree_controller.account_state.put(address=address, balance=BALANCE, nonce=0)
+    states = list(tree_controller.account_state.accounts.values())
+    tree = tree_controller.sparse_merkle_tree
+    tree.update_many([s.key for s in states], [s.leaf_bytes() for s in states])
+    tree_controller.node_store.commit(tree_controller.take_changeset(), root=tree.root, blocknumber=0, badge_id=None)
+
+    users_col = block_controller.mongo_client[os.environ["DB_NAME"]][os.environ["USERS"]]
+    for i in range(0, len(accounts), 10000):
+        await users_col.insert_many([{"address": a, "balance": BALANCE, "nonce": 0} for a in accounts[i:i + 10000]])
+    block_controller.header_builder.tip = ("0x" + "0" * 64, 0, "genesis")
+
+
+async def run_single(config : dict) -> dict:
+    from src.AsyncMongoClient import get_mongo_client
+    from src.BlockController import BlockController
+    from src.SetupService import SetupService
+    from src.Types import BadgeExecutionCause, TransactionRequest
+
+    rnd = random.Random(config["seed"])
+    accounts = ["0x" + rnd.randbytes(20).hex() for _ in range(config["accounts"])]
+    total = config["block_size"] * config["blocks"]
+    senders, receivers = create_pairs(np.random.default_rng(config["seed"]), len(accounts), total, config["distribution"], config["zipf_s"])
+    nonces = assign_nonces(senders)
+    requests = [TransactionRequest(**r) for r in sign_workload(config["seed"], accounts, senders.tolist(), receivers.tolist(), nonces.tolist(), config["sign_workers"])]
+
+    client = get_mongo_client()
+    await client.drop_database(os.environ["DB_NAME"])
+    await SetupService(start_users_needed=False).create_indexes()
+    block_controller = BlockController(with_account_setup=False)
+    setup_start = time.perf_counter()
+    await setup_accounts(block_controller, accounts)
+    setup_seconds = time.perf_counter() - setup_start
+
+    timer = StageTimer()
+    tree_controller = block_controller.tree_controller
+    timer.wrap(block_controller.mempool.validator, "check_transactions_validity", "verify")
+    timer.wrap(block_controller.mempool, "get_transaction_for_badge", "select")
+    timer.wrap(tree_controller, "_check_tree_invariants_for_update", "invariants")
+    timer.wrap(tree_controller, "apply_pending_leaves", "tree_update")
+    timer.wrap(block_controller.header_builder, "add", "block_hash")
+    timer.wrap(block_controller.header_builder, "seal", "block_hash")
+    timer.wrap(block_controller, "persist_block", "persist")
+    timer.wrap(block_controller.pipeline, "export_block", "export")
+
+    batch_size = int(os.environ.get("SUBMIT_BATCH_MAX_SIZE", 1000))
+    block_controller.mempool.validator.start()
+    ingest_start = time.perf_counter()
+    accepted = 0
+    for i in range(0, len(requests), batch_size):
+        response = await block_controller.handle_batch_submission(requests[i:i + batch_size])
+        accepted += sum(1 for s in response.submissions if s.valid)
+    ingest_seconds = time.perf_counter() - ingest_start
+
+    round_trips = getattr(client, "round_trips", None)
+    included = 0
+    block_seconds = []
+    for _ in range(config["blocks"]):
+        start = time.perf_counter()
+        taken = await block_controller.form_new_L2_block(BadgeExecutionCause.FILLEDUP, config["block_size"], MAX_GAS)
+        block_seconds.append(time.perf_counter() - start)
+        included += len(taken)
+    blocks_seconds = sum(block_seconds)
+    block_controller.mempool.validator.shutdown()
+    if block_controller.prover_coordinator.group_timer is not None:
+        block_controller.prover_coordinator.group_timer.cancel()
+    tree_controller.node_store.close()
+    await client.drop_database(os.environ["DB_NAME"])
+
+    block_seconds.sort()
+    result = {
+        "config": config,
+        "setup_s": round(setup_seconds, 3),
+        "ingest": {
+            "transactions": len(requests),
+            "accepted": accepted,
+            "seconds": round(ingest_seconds, 3),
+            "tx_per_s": round(len(requests) / ingest_seconds, 1)
+        },
+        "blocks": {
+            "blocks": config["blocks"],
+            "transactions": included,
+            "seconds": round(blocks_seconds, 3),
+            "tx_per_s": round(included / blocks_seconds, 1) if blocks_seconds > 0 else None,
+            "block_ms_p50": round(block_seconds[len(block_seconds) // 2] * 1000, 3),
+            "block_ms_max": round(block_seconds[-1] * 1000, 3)
+        },
+        "stages": {stage: {"seconds": round(seconds, 4), "calls": timer.calls[stage], "ms_per_block": round(seconds * 1000 / config["blocks"], 3)}
+                   for stage, seconds in timer.totals.items() if stage != "verify"},
+        "verify": {"seconds": round(timer.totals["verify"], 4), "us_per_tx": round(timer.totals["verify"] * 1e6 / len(requests), 1)},
+        # ru_maxrss is in KB on linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+    if round_trips is not None:
+        result["mongo_round_trips_per_block"] = round((client.round_trips - round_trips) / config["blocks"], 1)
+    return result
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["memory", "mongo"], default="memory")
+    parser.add_argument("--latency-ms", type=float, default=0, help="added to every call of the memory backend")
+    parser.add_argument("--accounts", default="1024", help="comma separated, 10 .. 1048576")
+    parser.add_argument("--distribution", default="uniform", help="comma separated, uniform | zipf")
+    parser.add_argument("--zipf-s", type=float, default=1.1)
+    parser.add_argument("--block-size", default="500", help="comma separated, 50 .. 5000")
+    parser.add_argument("--blocks", type=int, default=10)
+    parser.add_argument("--sign-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="bench_sequencer.json")
+    parser.add_argument("--single", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        config = json.loads(args.single)
+        os.environ["MONGO_BACKEND"] = config["backend"]
+        os.environ["MEMORY_MONGO_LATENCY_MS"] = str(config["latency_ms"])
+        os.environ["DB_NAME"] = os.environ["DB_NAME"] + "_bench"
+        os.environ["PROVER"] = "fake"
+        logging.disable(logging.CRITICAL)
+        with tempfile.TemporaryDirectory() as directory:
+            os.environ["STATE_DB_PATH"] = os.path.join(directory, "state.sqlite")
+            os.environ["WITNESS_DIR"] = os.path.join(directory, "witness")
+            result = asyncio.run(run_single(config))
+        print(json.dumps(result))
+        return
+
+    results = []
+    for accounts, distribution, block_size in itertools.product(
+            [int(a) for a in args.accounts.split(",")], args.distribution.split(","), [int(b) for b in args.block_size.split(",")]):
+        config = {"backend": args.backend, "latency_ms": args.latency_ms, "accounts": accounts, "distribution": distribution,
+                  "zipf_s": args.zipf_s, "block_size": block_size, "blocks": args.blocks, "sign_workers": args.sign_workers, "seed": args.seed}
+        run = subprocess.run([sys.executable, os.path.abspath(__file__), "--single", json.dumps(config)], capture_output=True, text=True)
+        if run.returncode != 0:
+            print(f"{accounts} accounts, {distribution}, {block_size} per block failed :\n{run.stderr}")
+            continue
+        result = json.loads(run.stdout.strip().splitlines()[-1])
+        results.append(result)
+        print(f"{accounts:>8} accounts {distribution:<8} {block_size:>5} per block : ingest {result['ingest']['tx_per_s']:>9} tx/s, "
+              f"blocks {result['blocks']['tx_per_s']:>9} tx/s, peak rss {result['peak_rss_mb']} MB")
+
+    with open(args.output, "w") as file:
+        json.dump({"commit": git_commit(), "backend": args.backend, "results": results}, file, indent=2)
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
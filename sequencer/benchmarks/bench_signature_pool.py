@@ -0,0 +1,100 @@
+"""
+    Submits bursts of concurrent signed transfers to the validator and reports
+    the per-submission latency and how long the event loop was blocked,
+    verifying inline on the loop (what MemPool did before) against the pool.
+
+        python3 benchmarks/bench_signature_pool.py --concurrency 200 --pool process
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import asyncio
+import json
+import time
+from eth_keys import keys
+from src.TxRecord import TxRecord
+from src.utils import transfer_message_hash
+import src.TransactionValidator as validator_module
+from src.TransactionValidator import Transaction_Validator, verify_signature
+
+
+def create_transactions(count : int) -> list[TxRecord]:
+    with open("funded_accounts.json", "r") as file:
+        accounts = json.load(file)
+    transactions = []
+    for i in range(count):
+        sender = accounts[i % len(accounts)]
+        receiver = accounts[(i + 1) % len(accounts)]
+        private_key = keys.PrivateKey(bytes.fromhex(sender["priv_key"][2:]))
+        signature = private_key.sign_msg_hash(transfer_message_hash(sender["pub_key"], receiver["pub_key"], 1, i))
+        transactions.append(TxRecord(
+            transaction_id=str(i), submission_id=None, received_at=0, sender=sender["pub_key"], receiver=receiver["pub_key"],
+            amount=1, nonce=i, signature=signature.to_hex(), pub_key=sender["pub_key"]
+        ))
+    return transactions
+
+
+async def inline_check(transaction : TxRecord, submission_id : str) -> bool:
+    return verify_signature((transaction.sender, transaction.receiver, transaction.amount, transaction.nonce, transaction.signature))
+
+
+async def loop_lag_probe(stop : asyncio.Event, lags : list[float]) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - start - 0.001)
+
+
+async def run(check, transactions : list[TxRecord], concurrency : int) -> dict:
+    latencies = []
+    lags = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(loop_lag_probe(stop, lags))
+
+    async def submit(transaction : TxRecord) -> None:
+        start = time.perf_counter()
+        valid = await check(transaction, "bench")
+        assert valid
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(0, len(transactions), concurrency):
+        await asyncio.gather(*[submit(t) for t in transactions[i:i + concurrency]])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe
+    latencies.sort()
+    lags.sort()
+    return {
+        "throughput_tx_s": round(len(transactions) / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+        "max_loop_lag_ms": round(lags[-1] * 1000, 2) if lags else None,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transactions", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--pool", choices=["process", "thread"], default="process")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    validator_module.VERIFIER_POOL = args.pool
+    validator_module.VERIFIER_WORKERS = args.workers
+    transactions = create_transactions(args.transactions)
+    validator = Transaction_Validator()
+    validator.start()
+    results = {
+        "inline": await run(inline_check, transactions, args.concurrency),
+        args.pool + "_pool": await run(validator.check_transaction_validity, transactions, args.concurrency),
+        "queue_delay": validator.queue_delay.summary(),
+    }
+    validator.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+"""
+    Compares the batched StateTree against smt.tree.SparseMerkleTree on the
+    workload of anvil/2^20_leaves_5k_tx_state.json: 2^20 funded leaves and
+    5000 transfers (two leaf updates each) sealed as one block.
+
+    All trees share the nodes of one store that never drops orphans, so they
+    start from the same root without building the large tree twice.
+
+        python3 benchmarks/bench_state_tree.py --leaves 1048576 --transactions 5000
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import json
+import random
+import time
+from smt.tree import SparseMerkleTree
+from src.StateTree import StateTree, MemoryNodeStore
+
+
+class KeepAllNodeStore(MemoryNodeStore):
+
+    def delete_node(self, key : bytes) -> bool:
+        return True
+
+    def delete_nodes(self, keys : list[bytes]) -> None:
+        pass
+
+    def fork(self) -> "KeepAllNodeStore":
+        """
+            shares the nodes, but every tree gets its own leaf values
+        """
+        store = KeepAllNodeStore()
+        store.nodes = self.nodes
+        store.get_node = self.nodes.get
+        store.set_node = self.nodes.__setitem__
+        store.values = dict(self.values)
+        return store
+
+
+def leaf(balance : int, nonce : int, address : bytes) -> bytes:
+    return balance.to_bytes(8, 'little') + nonce.to_bytes(8, 'little') + address
+
+
+def create_workload(leaves : int, transactions : int) -> tuple[list, list]:
+    rng = random.Random(42)
+    accounts = [[rng.randbytes(20), 1000, 0] for _ in range(leaves)]
+    transfers = []
+    for _ in range(transactions):
+        a, b = rng.sample(range(leaves), 2)
+        transfers.append((a, b))
+    return accounts, transfers
+
+
+def apply_transfers(accounts : list, transfers : list) -> list[tuple[bytes, bytes]]:
+    updates = []
+    for a, b in transfers:
+        accounts[a][1] -= 1
+        accounts[a][2] += 1
+        accounts[b][1] += 1
+        updates.append((accounts[a][0], leaf(accounts[a][1], accounts[a][2], accounts[a][0])))
+        updates.append((accounts[b][0], leaf(accounts[b][1], accounts[b][2], accounts[b][0])))
+    return updates
+
+
+def main(leaves : int, transactions : int):
+    accounts, transfers = create_workload(leaves, transactions)
+    store = KeepAllNodeStore()
+    start = time.perf_counter()
+    genesis = StateTree(store=store)
+    genesis.update_many([acc[0] for acc in accounts], [leaf(acc[1], acc[2], acc[0]) for acc in accounts])
+    build_seconds = time.perf_counter() - start
+    updates = apply_transfers(accounts, transfers)
+
+    library_tree = SparseMerkleTree(store=store.fork(), root=genesis.root)
+    start = time.perf_counter()
+    for key, value in updates:
+        library_tree.update(key, value)
+    library_seconds = time.perf_counter() - start
+
+    single_tree = StateTree(store=store.fork(), root=genesis.root)
+    start = time.perf_counter()
+    for key, value in updates:
+        single_tree.update(key, value)
+    single_seconds = time.perf_counter() - start
+
+    batched_tree = StateTree(store=store.fork(), root=genesis.root)
+    start = time.perf_counter()
+    batched_tree.update_many([u[0] for u in updates], [u[1] for u in updates])
+    batched_seconds = time.perf_counter() - start
+
+    assert library_tree.root == single_tree.root == batched_tree.root, "state roots diverged"
+    print(json.dumps({
+        "leaves": leaves,
+        "transactions": transactions,
+        "genesis_build_seconds": build_seconds,
+        "smt_library_seconds": library_seconds,
+        "state_tree_update_seconds": single_seconds,
+        "state_tree_update_many_seconds": batched_seconds,
+        "speedup_update": library_seconds / single_seconds,
+        "speedup_update_many": library_seconds / batched_seconds,
+        "root": batched_tree.root_as_hex()
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--leaves", type=int, default=2**20)
+    parser.add_argument("--transactions", type=int, default=5000)
+    args = parser.parse_args()
+    main(leaves=args.leaves, transactions=args.transactions)
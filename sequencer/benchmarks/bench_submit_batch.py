@@ -0,0 +1,100 @@
+"""
+    Ingest over one connection against a running sequencer (python3 main.py): every transfer
+    with its own get-nonce + /api/submit round trips (what client/chain_client.py does)
+    against /api/submit-batch with one get-nonce per batch. The transfers are signed before
+    the clock starts.
+
+        python3 benchmarks/bench_submit_batch.py --transactions 2000 --batch-size 100
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import asyncio
+import json
+import time
+import aiohttp
+from eth_keys import keys
+from src.utils import transfer_message_hash
+
+SEQUENCER_URL = os.environ.get("SEQUENCER_URL", "http://127.0.0.1:8000")
+
+
+def sign_transfers(sender : dict, receiver : dict, first_nonce : int, count : int) -> list[dict]:
+    private_key = keys.PrivateKey(bytes.fromhex(sender["priv_key"][2:]))
+    transfers = []
+    for nonce in range(first_nonce, first_nonce + count):
+        body = {"sender": sender["pub_key"], "receiver": receiver["pub_key"], "amount": 1, "nonce": nonce}
+        signature = private_key.sign_msg_hash(transfer_message_hash(sender["pub_key"], receiver["pub_key"], 1, nonce))
+        body["signature"] = {"pubKey": sender["pub_key"], "signature": signature.to_hex()}
+        transfers.append(body)
+    return transfers
+
+
+async def get_nonce(session : aiohttp.ClientSession, account : str) -> int:
+    async with session.post(f"{SEQUENCER_URL}/api/get-nonce", json={"account": account}) as res:
+        return (await res.json())["nonce"]
+
+
+async def run_single(session : aiohttp.ClientSession, transfers : list[dict]) -> int:
+    accepted = 0
+    for transfer in transfers:
+        await get_nonce(session, transfer["sender"])
+        async with session.post(f"{SEQUENCER_URL}/api/submit", json=transfer) as res:
+            accepted += (await res.json())["valid"]
+    return accepted
+
+
+async def run_batch(session : aiohttp.ClientSession, transfers : list[dict], batch_size : int) -> int:
+    accepted = 0
+    for i in range(0, len(transfers), batch_size):
+        batch = transfers[i:i + batch_size]
+        await get_nonce(session, batch[0]["sender"])
+        async with session.post(f"{SEQUENCER_URL}/api/submit-batch", json={"transactions": batch}) as res:
+            accepted += sum(s["valid"] for s in (await res.json())["submissions"])
+    return accepted
+
+
+async def prepare(session : aiohttp.ClientSession, accounts : list[dict], count : int, batch_size : int) -> list[dict]:
+    # one sender per batch, the nonces continue after what the sequencer already holds
+    transfers = []
+    next_nonce = {}
+    for k, i in enumerate(range(0, count, batch_size)):
+        sender, receiver = accounts[k % len(accounts)], accounts[(k + 1) % len(accounts)]
+        if sender["pub_key"] not in next_nonce:
+            next_nonce[sender["pub_key"]] = await get_nonce(session, sender["pub_key"])
+        size = min(batch_size, count - i)
+        transfers.extend(sign_transfers(sender, receiver, next_nonce[sender["pub_key"]], size))
+        next_nonce[sender["pub_key"]] += size
+    return transfers
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transactions", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    with open("funded_accounts.json", "r") as file:
+        accounts = json.load(file)
+    connector = aiohttp.TCPConnector(limit=1)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        results = {}
+        for name in ["single", "batch"]:
+            transfers = await prepare(session, accounts, args.transactions, args.batch_size)
+            start = time.perf_counter()
+            if name == "single":
+                accepted = await run_single(session, transfers)
+            else:
+                accepted = await run_batch(session, transfers, args.batch_size)
+            elapsed = time.perf_counter() - start
+            results[name] = {"tx_per_s": round(len(transfers) / elapsed), "accepted": accepted, "transactions": len(transfers)}
+
+    print(f"{'':<8} {'tx/s':>8} {'accepted':>10}")
+    for name, result in results.items():
+        print(f"{name:<8} {result['tx_per_s']:>8} {result['accepted']:>6}/{result['transactions']}")
+    print(f"speedup {results['batch']['tx_per_s'] / max(1, results['single']['tx_per_s']):.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+"""
+    Compares the time to get back to a usable state tree after a restart:
+    rebuilding it from all leaves (what the sequencer did before) against
+    reopening the PersistentNodeStore at its last checkpoint.
+    Afterwards one block of transfers is applied to the reopened tree, which
+    has to fault its nodes in from the mapped file.
+
+        python3 benchmarks/bench_tree_restart.py --leaves 1048576 --transactions 5000
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import json
+import random
+import tempfile
+import time
+from src.StateTree import StateTree
+from src.PersistentNodeStore import PersistentNodeStore
+
+
+def leaf(balance : int, nonce : int, address : bytes) -> bytes:
+    return balance.to_bytes(8, 'little') + nonce.to_bytes(8, 'little') + address
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--leaves", type=int, default=2**20)
+    parser.add_argument("--transactions", type=int, default=5000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    addresses = [rng.randbytes(20) for _ in range(args.leaves)]
+    genesis = [leaf(1000, 0, address) for address in addresses]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "state_tree.sqlite")
+
+        start = time.perf_counter()
+        store = PersistentNodeStore(path)
+        tree = StateTree(store=store)
+        tree.update_many(addresses, genesis)
+        rebuild = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store.commit(store.take_changeset(), root=tree.root, blocknumber=0, badge_id=None)
+        checkpoint = time.perf_counter() - start
+        root = tree.root
+        store.close()
+
+        start = time.perf_counter()
+        store = PersistentNodeStore(path)
+        restored_root, blocknumber, badge_id = store.last_checkpoint()
+        restored = StateTree(store=store, root=restored_root)
+        restart = time.perf_counter() - start
+        assert restored.root == root
+
+        keys, values = [], []
+        for _ in range(args.transactions):
+            a, b = rng.sample(range(args.leaves), 2)
+            keys += [addresses[a], addresses[b]]
+            values += [leaf(999, 1, addresses[a]), leaf(1001, 0, addresses[b])]
+        start = time.perf_counter()
+        restored.update_many(keys, values)
+        first_block = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store.commit(store.take_changeset(), root=restored.root, blocknumber=1, badge_id=None)
+        block_checkpoint = time.perf_counter() - start
+        store.close()
+
+        print(json.dumps({
+            "leaves": args.leaves,
+            "transactions": args.transactions,
+            "rebuild_from_leaves_s": round(rebuild, 3),
+            "genesis_checkpoint_s": round(checkpoint, 3),
+            "restart_from_checkpoint_s": round(restart, 6),
+            "first_block_after_restart_s": round(first_block, 3),
+            "block_checkpoint_s": round(block_checkpoint, 3),
+            "file_size_mb": round(os.path.getsize(path) / 2**20, 1) if os.path.exists(path) else None,
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
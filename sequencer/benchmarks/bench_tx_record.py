@@ -0,0 +1,129 @@
+"""
+    Per transaction CPU time and allocations of the internal transaction representation.
+
+    convert : request -> internal transaction -> mongo document -> internal transaction
+              (submission, mirror to mongo, reload on start), for the pydantic
+              Transaction model and for TxRecord
+    execute : block formation with execute_block (selection, account state, tree,
+              block hash, witness, calldata) over TxRecords, nothing is written to mongo
+
+        python3 benchmarks/bench_tx_record.py --transactions 3000 --block-size 100
+
+    Allocations are counted with tracemalloc in a second run, it slows the code down
+    so the CPU times come from a run without it.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import asyncio
+import logging
+import tempfile
+import time
+import tracemalloc
+from dotenv import load_dotenv
+
+load_dotenv()
+logging.disable(logging.CRITICAL)
+
+from src.BlockController import BlockController
+from src.Types import BadgeExecutionCause, Transaction, TransactionRequest, TransactionStatus, SignatureData
+from src.TxRecord import TxRecord
+from src.utils import generate_random_id, get_current_timestamp
+
+
+def create_requests(block_controller : BlockController, count : int) -> list[TransactionRequest]:
+    accounts = list(block_controller.tree_controller.account_state.accounts.values())
+    nonces = {a.address: a.nonce for a in accounts}
+    requests = []
+    for i in range(count):
+        sender = accounts[i % len(accounts)]
+        receiver = accounts[(i + 1) % len(accounts)]
+        requests.append(TransactionRequest(sender=sender.address, receiver=receiver.address, amount=1, nonce=nonces[sender.address],
+            signature=SignatureData(pubKey="0x" + "11" * 64, signature="0x" + "22" * 65)))
+        nonces[sender.address] += 1
+    return requests
+
+
+def convert_pydantic(requests : list[TransactionRequest]) -> list[Transaction]:
+    transactions = []
+    for request in requests:
+        transaction = Transaction(
+            receivedAt=get_current_timestamp(), submissionId="bench", transactionId=generate_random_id(), sender=request.sender,
+            receiver=request.receiver, nonce=request.nonce, signature=request.signature.signature, amount=request.amount,
+            status=TransactionStatus.PENDING, badgeId=None, pubKey=request.signature.pubKey
+        )
+        transactions.append(Transaction(**transaction.model_dump()))
+    return transactions
+
+
+def convert_record(requests : list[TransactionRequest]) -> list[TxRecord]:
+    transactions = []
+    for request in requests:
+        record = TxRecord.from_request(request, transaction_id=generate_random_id(), submission_id="bench", received_at=get_current_timestamp())
+        transactions.append(TxRecord.from_document(record.to_document()))
+    return transactions
+
+
+def measure(fn, traced : bool):
+    """
+        Returns the result and either the process time or (allocated blocks, retained bytes, peak bytes)
+    """
+    if not traced:
+        start = time.process_time()
+        result = fn()
+        return result, time.process_time() - start
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = fn()
+    after = tracemalloc.take_snapshot()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    return result, (sum(s.count_diff for s in stats), sum(s.size_diff for s in stats), peak)
+
+
+def create_block_controller(directory : str) -> BlockController:
+    os.environ["STATE_DB_PATH"] = os.path.join(directory, "state.sqlite")
+    os.environ["WITNESS_DIR"] = os.path.join(directory, "witness")
+    os.environ["PROVER"] = "fake"
+    block_controller = BlockController(with_account_setup=True)
+    block_controller.header_builder.tip = ("0x" + "0" * 64, 0, "genesis")
+    return block_controller
+
+
+def run(count : int, block_size : int, traced : bool) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        block_controller = create_block_controller(directory)
+        requests = create_requests(block_controller, count)
+        _, results["convert pydantic"] = measure(lambda: convert_pydantic(requests), traced)
+        records, results["convert TxRecord"] = measure(lambda: convert_record(requests), traced)
+        for record in records:
+            block_controller.mempool.pending_pool.insert(record)
+
+        async def form_blocks() -> None:
+            while len(block_controller.mempool.pending_pool) > 0:
+                await block_controller.execute_block(BadgeExecutionCause.FILLEDUP, block_size, 10**12)
+        _, results["execute TxRecord"] = measure(lambda: asyncio.run(form_blocks()), traced)
+        block_controller.tree_controller.node_store.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transactions", type=int, default=3000)
+    parser.add_argument("--block-size", type=int, default=100)
+    args = parser.parse_args()
+
+    cpu = run(args.transactions, args.block_size, traced=False)
+    allocations = run(args.transactions, args.block_size, traced=True)
+    print(f"{'':<18} {'us/tx':>7} {'blocks/tx':>10} {'retained B/tx':>14} {'peak B/tx':>10}")
+    for name, seconds in cpu.items():
+        blocks, retained, peak = allocations[name]
+        n = args.transactions
+        print(f"{name:<18} {seconds / n * 1e6:>7.1f} {blocks / n:>10.1f} {retained / n:>14.0f} {peak / n:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+    Synthetic workload of real keypairs and signed transfers at benchmark and prover test
+    sizes (millions of accounts / transfers), the large scale counterpart of
+    scripts/create_test_badge.py.
+
+        python3 benchmarks/generate_workload.py --accounts 1048576 --transactions 5000000 \
+            --distribution zipf --block-size 500 --format bin --batches --output workload
+
+    The pairs, nonces and signatures come from benchmarks/workload.py (shared with
+    bench_sequencer.py). Private key i is sha256(seed || i), so a workload is reproducible
+    from its seed and a worker derives the key of any account from its index. Keypairs are
+    derived and the transfers signed in a process pool (--workers), chunk by chunk, and the
+    files are written as the chunks come back in order. Every account starts with --balance,
+    which has to cover everything an account sends, so every transfer is valid in order.
+
+    Written to --output:
+        manifest.json       config, counts, genesis root, record layouts, timings
+        accounts.jsonl      {"pub_key", "priv_key", "balance"} per account, the layout of funded_accounts.json
+        transactions.jsonl  /api/submit bodies, in submission order
+    or with --format bin, little endian records without a header:
+        accounts.bin        <32s64s20sQ   private key, public key, address, balance
+        transactions.bin    <IIQQ65s      sender index, receiver index, amount, nonce, signature
+    and with --batches, the transfers cut into blocks of --block-size, applied to a
+    StateTree from the genesis accounts:
+        batches/batch_<blocknumber>.json / .bin   executor Batch witnesses, as WitnessExporter writes them
+        roots.jsonl         {"blocknumber", "old_root", "new_root", "transactions"} per block
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import json
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+import numpy as np
+from src.AccountStateStore import AccountState
+from src.StateTree import StateTree
+from src.TxRecord import TxRecord
+from src.ProofService import multiproof_for_root
+from src.WitnessExporter import WitnessExporter, build_batch_witness
+from workload import derive_keys, create_pairs, assign_nonces, sign_chunk
+
+KEY_SIZE = 32 + 64 + 20
+# void fields, numpy strips trailing zero bytes of S fields
+ACCOUNT_RECORD = np.dtype([("keys", f"V{KEY_SIZE}"), ("balance", "<u8")])
+TRANSACTION_RECORD = np.dtype([("sender", "<u4"), ("receiver", "<u4"), ("amount", "<u8"), ("nonce", "<u8"), ("signature", "V65")])
+
+
+def ordered_map(executor : ProcessPoolExecutor, fn, jobs, window : int):
+    """
+        executor.map that keeps at most window jobs in flight, so the results are
+        written as they come back instead of being held until all are submitted
+    """
+    pending = deque()
+    for job in jobs:
+        pending.append(executor.submit(fn, *job))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while len(pending) > 0:
+        yield pending.popleft().result()
+
+
+def chunks(count : int, size : int):
+    for start in range(0, count, size):
+        yield start, min(start + size, count)
+
+
+class BatchWriter:
+    """
+        Applies the transfers block by block to a StateTree and writes the Batch witness
+        of every block, with the pre-state of the touched accounts, their multiproof against
+        the old root and both roots.
+    """
+
+    def __init__(self, directory : str, addresses : list[str], balance : int):
+        self.exporter = WitnessExporter(os.path.join(directory, "batches"))
+        self.roots = open(os.path.join(directory, "roots.jsonl"), "w")
+        self.addresses = addresses
+        self.balances = np.full(len(addresses), balance, dtype=np.int64)
+        self.nonces = np.zeros(len(addresses), dtype=np.int64)
+        self.tree = StateTree()
+        genesis = [AccountState(address, balance, 0) for address in addresses]
+        self.tree.update_many([acc.key for acc in genesis], [acc.leaf_bytes() for acc in genesis])
+        self.genesis_root = self.tree.root_as_hex()
+        self.blocknumber = 0
+
+    def write_block(self, senders : np.ndarray, receivers : np.ndarray, amounts : np.ndarray, nonces : np.ndarray, signatures : list[str]) -> None:
+        self.blocknumber += 1
+        touched = np.unique(np.concatenate((senders, receivers)))
+        accounts = {}
+        for index, balance, nonce in zip(touched.tolist(), self.balances[touched].tolist(), self.nonces[touched].tolist()):
+            accounts[index] = AccountState(self.addresses[index], balance, nonce)
+        np.subtract.at(self.balances, senders, amounts)
+        np.add.at(self.balances, receivers, amounts)
+        np.add.at(self.nonces, senders, 1)
+        for index, balance, nonce in zip(touched.tolist(), self.balances[touched].tolist(), self.nonces[touched].tolist()):
+            accounts[index].balance = balance
+            accounts[index].nonce = nonce
+
+        old_root = self.tree.root_as_hex()
+        multiproof = multiproof_for_root(self.tree, [acc.address for acc in accounts.values()], self.tree.root)
+        self.tree.update_many([acc.key for acc in accounts.values()], [acc.leaf_bytes() for acc in accounts.values()])
+        new_root = self.tree.root_as_hex()
+        transactions = [
+            TxRecord(transaction_id=str(i), submission_id=None, received_at=0, sender=self.addresses[sender],
+                     receiver=self.addresses[receiver], amount=amount, nonce=nonce, signature=signature)
+            for i, (sender, receiver, amount, nonce, signature) in enumerate(zip(senders.tolist(), receivers.tolist(), amounts.tolist(), nonces.tolist(), signatures))
+        ]
+        self.exporter.write_batch(build_batch_witness(self.blocknumber, old_root, new_root, list(accounts.values()), transactions, multiproof))
+        self.roots.write(json.dumps({"blocknumber": self.blocknumber, "old_root": old_root, "new_root": new_root, "transactions": len(transactions)}) + "\n")
+
+    def close(self) -> None:
+        self.roots.close()
+
+
+def write_accounts(executor : ProcessPoolExecutor, args, directory : str) -> list[str]:
+    addresses = []
+    jobs = ((args.seed, start, end) for start, end in chunks(args.accounts, args.chunk_size))
+    with open(os.path.join(directory, f"accounts.{args.format}"), "wb" if args.format == "bin" else "w") as file:
+        for data in ordered_map(executor, derive_keys, jobs, 2 * args.workers):
+            offsets = range(0, len(data), KEY_SIZE)
+            chunk_addresses = ["0x" + data[offset + 96:offset + KEY_SIZE].hex() for offset in offsets]
+            addresses += chunk_addresses
+            if args.format == "bin":
+                records = np.empty(len(chunk_addresses), dtype=ACCOUNT_RECORD)
+                records["keys"] = np.frombuffer(data, dtype=f"V{KEY_SIZE}")
+                records["balance"] = args.balance
+                records.tofile(file)
+            else:
+                file.writelines(
+                    json.dumps({"pub_key": address, "priv_key": "0x" + data[offset:offset + 32].hex(), "balance": args.balance}) + "\n"
+                    for address, offset in zip(chunk_addresses, offsets)
+                )
+    return addresses
+
+
+def write_transactions(executor : ProcessPoolExecutor, args, directory : str, addresses : list[str],
+                       senders : np.ndarray, receivers : np.ndarray, amounts : np.ndarray, nonces : np.ndarray,
+                       batch_writer : Optional[BatchWriter] = None) -> None:
+    def jobs():
+        for start, end in chunks(len(senders), args.chunk_size):
+            chunk_senders = senders[start:end].tolist()
+            chunk_receivers = receivers[start:end].tolist()
+            yield (args.seed, chunk_senders, [addresses[i] for i in chunk_senders], [addresses[i] for i in chunk_receivers],
+                   amounts[start:end].tolist(), nonces[start:end].tolist())
+
+    with open(os.path.join(directory, f"transactions.{args.format}"), "wb" if args.format == "bin" else "w") as file:
+        for (start, end), (signatures, pub_keys) in zip(chunks(len(senders), args.chunk_size), ordered_map(executor, sign_chunk, jobs(), 2 * args.workers)):
+            if args.format == "bin":
+                records = np.empty(end - start, dtype=TRANSACTION_RECORD)
+                records["sender"] = senders[start:end]
+                records["receiver"] = receivers[start:end]
+                records["amount"] = amounts[start:end]
+                records["nonce"] = nonces[start:end]
+                records["signature"] = np.frombuffer(signatures, dtype="V65")
+                records.tofile(file)
+            signatures_hex = ["0x" + signatures[offset:offset + 65].hex() for offset in range(0, len(signatures), 65)]
+            if args.format == "jsonl":
+                file.writelines(
+                    json.dumps({"sender": addresses[sender], "receiver": addresses[receiver], "amount": amount, "nonce": nonce,
+                                "signature": {"pubKey": pub_keys[sender], "signature": signature}}) + "\n"
+                    for sender, receiver, amount, nonce, signature in zip(senders[start:end].tolist(), receivers[start:end].tolist(),
+                                                                          amounts[start:end].tolist(), nonces[start:end].tolist(), signatures_hex)
+                )
+            if batch_writer is not None:
+                # chunks are a multiple of the block size
+                for block_start, block_end in chunks(end - start, args.block_size):
+                    batch_writer.write_block(senders[start + block_start:start + block_end], receivers[start + block_start:start + block_end],
+                                             amounts[start + block_start:start + block_end], nonces[start + block_start:start + block_end],
+                                             signatures_hex[block_start:block_end])
+            print(f"signed {end} / {len(senders)} transfers", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=1024)
+    parser.add_argument("--transactions", type=int, default=10000)
+    parser.add_argument("--distribution", choices=["uniform", "zipf"], default="uniform")
+    parser.add_argument("--zipf-s", type=float, default=1.1)
+    parser.add_argument("--amount", type=int, default=1)
+    parser.add_argument("--balance", type=int, default=10 ** 9, help="of every account, has to cover all its transfers")
+    parser.add_argument("--block-size", type=int, default=500)
+    parser.add_argument("--batches", action="store_true", help="write the Batch witness and the roots of every block")
+    parser.add_argument("--format", choices=["jsonl", "bin"], default="jsonl")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=5000, help="accounts / transfers per pool job")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="workload")
+    args = parser.parse_args()
+    if args.accounts < 2 or args.accounts > 2 ** 32:
+        parser.error("--accounts has to be between 2 and 2^32")
+    if args.batches:
+        args.chunk_size = max(1, args.chunk_size // args.block_size) * args.block_size
+
+    rng = np.random.default_rng(args.seed)
+    senders, receivers = create_pairs(rng, args.accounts, args.transactions, args.distribution, args.zipf_s)
+    nonces = assign_nonces(senders)
+    amounts = np.full(args.transactions, args.amount, dtype=np.int64)
+    most_sent = int(np.bincount(senders, weights=amounts, minlength=args.accounts).max()) if args.transactions > 0 else 0
+    if most_sent > args.balance:
+        parser.error(f"--balance {args.balance} does not cover the {most_sent} sent by the busiest account")
+
+    os.makedirs(args.output, exist_ok=True)
+    timings = {}
+    started_at = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        addresses = write_accounts(executor, args, args.output)
+        timings["accounts_s"] = time.perf_counter() - started_at
+
+        batch_writer = None
+        if args.batches:
+            started_at = time.perf_counter()
+            batch_writer = BatchWriter(args.output, addresses, args.balance)
+            timings["genesis_tree_s"] = time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        write_transactions(executor, args, args.output, addresses, senders, receivers, amounts, nonces, batch_writer)
+        timings["transactions_s"] = time.perf_counter() - started_at
+        if batch_writer is not None:
+            batch_writer.close()
+
+    manifest = {
+        "config": vars(args),
+        "accounts": args.accounts,
+        "transactions": args.transactions,
+        "senders": int(len(np.unique(senders))),
+        "genesis_root": batch_writer.genesis_root if batch_writer is not None else None,
+        "blocks": batch_writer.blocknumber if batch_writer is not None else 0,
+        "records": {
+            "accounts.bin": "<32s64s20sQ private key, public key, address, balance",
+            "transactions.bin": "<IIQQ65s sender index, receiver index, amount, nonce, signature"
+        } if args.format == "bin" else {},
+        "timings": timings
+    }
+    with open(os.path.join(args.output, "manifest.json"), "w") as file:
+        json.dump(manifest, file, indent=2)
+    print(json.dumps(manifest, indent=2))
+
+
+if __name__ == "__main__":
+    main()
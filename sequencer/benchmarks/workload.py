@@ -0,0 +1,79 @@
+"""
+    Synthetic transfers shared by generate_workload.py and bench_sequencer.py.
+
+    Sender / receiver pairs are drawn for the whole workload at once with numpy, uniform or
+    with Zipf weights 1/rank^s, receiver != sender. The nonce of a transfer is its rank among
+    those of its sender. Account i is the address of private key i = sha256(seed || i), transfers
+    are signed by their sender the way /api/submit and the guest check them
+    (Transaction_Validator.verify_signature, personal_sign of utils.transfer_message).
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hashlib
+import numpy as np
+from src.utils import transfer_message_hash
+
+
+def private_key_bytes(seed : int, index : int) -> bytes:
+    return hashlib.sha256(seed.to_bytes(8, "little") + index.to_bytes(8, "little")).digest()
+
+
+def derive_keys(seed : int, start : int, end : int) -> bytes:
+    """
+        Accounts start .. end-1, as private key (32) + public key (64) + address (20) per account
+    """
+    from eth_keys import keys
+    parts = []
+    for index in range(start, end):
+        private_key = keys.PrivateKey(private_key_bytes(seed, index))
+        parts += [private_key.to_bytes(), private_key.public_key.to_bytes(), private_key.public_key.to_canonical_address()]
+    return b"".join(parts)
+
+
+def derive_addresses(seed : int, indices : list[int]) -> list[str]:
+    from eth_keys import keys
+    return ["0x" + keys.PrivateKey(private_key_bytes(seed, index)).public_key.to_canonical_address().hex() for index in indices]
+
+
+def create_pairs(rng : np.random.Generator, accounts : int, count : int, distribution : str, zipf_s : float) -> tuple[np.ndarray, np.ndarray]:
+    if distribution == "zipf":
+        cum_weights = np.cumsum(1 / np.arange(1, accounts + 1, dtype=np.float64) ** zipf_s)
+        senders = np.searchsorted(cum_weights, rng.random(count) * cum_weights[-1], side="right")
+        senders = np.minimum(senders, accounts - 1)
+    else:
+        senders = rng.integers(0, accounts, count)
+    receivers = rng.integers(0, accounts - 1, count)
+    receivers += receivers >= senders
+    return senders.astype(np.int64), receivers.astype(np.int64)
+
+
+def assign_nonces(senders : np.ndarray) -> np.ndarray:
+    """
+        The n-th transfer of a sender gets nonce n: the position inside its run after a stable sort by sender
+    """
+    order = np.argsort(senders, kind="stable")
+    ordered = senders[order]
+    positions = np.arange(len(senders))
+    run_starts = np.ones(len(senders), dtype=bool)
+    run_starts[1:] = ordered[1:] != ordered[:-1]
+    nonces = np.empty(len(senders), dtype=np.int64)
+    nonces[order] = positions - np.maximum.accumulate(np.where(run_starts, positions, 0))
+    return nonces
+
+
+def sign_chunk(seed : int, senders : list[int], sender_addresses : list[str], receiver_addresses : list[str],
+               amounts : list[int], nonces : list[int]) -> tuple[bytes, dict[int, str]]:
+    """
+        65 byte signatures of the chunk, concatenated, and the public key of every sender
+    """
+    from eth_keys import keys
+    private_keys = {}
+    signatures = []
+    for sender, sender_address, receiver_address, amount, nonce in zip(senders, sender_addresses, receiver_addresses, amounts, nonces):
+        private_key = private_keys.get(sender)
+        if private_key is None:
+            private_key = keys.PrivateKey(private_key_bytes(seed, sender))
+            private_keys[sender] = private_key
+        signatures.append(private_key.sign_msg_hash(transfer_message_hash(sender_address, receiver_address, amount, nonce)).to_bytes())
+    return b"".join(signatures), {sender: private_key.public_key.to_hex() for sender, private_key in private_keys.items()}
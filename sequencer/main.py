@@ -1,16 +1,21 @@
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Depends, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse, PlainTextResponse
 from contextlib import asynccontextmanager
 import logging
 import json
 from dotenv import load_dotenv
 from src.BlockController import BlockController
-from src.Types import TransactionRequest, SubmissionResponse, NonceResponse, SubmissionStatus, NonceRequest, SubmissionStatusRequest
+from src.Types import TransactionRequest, SubmissionResponse, NonceResponse, SubmissionStatus, NonceRequest, SubmissionStatusRequest, SchedulerSettings, SchedulerSettingsUpdate, SchedulerStatus, AccountHistoryPage, TransactionBatchRequest, BatchSubmissionResponse, ProofBatchRequest, ProfileRequest
 from src.SetupService import SetupService
 import asyncio
+import hmac
+from typing import Optional
 from src.ChainListener import ChainListener
+from src.BlockPipeline import PipelineStopped
+from src.Metrics import REGISTRY
 
 logging.basicConfig(
     level=logging.INFO,
@@ -26,31 +31,75 @@ load_dotenv()
 NODE_ADDRESS = 'http://127.0.0.1:8545'
 CONTRACT_ADDRESS = "0xe7f1725E7734CE288F8367e1Bb143E90bb3F0512"
 
-queue = asyncio.Queue()
 setup_service = SetupService(start_users_needed=True)
-badge_controller = BlockController(queue=queue, with_account_setup=True)
-chain_listener = ChainListener(polling_interval=2, mempool=badge_controller.mempool, node_addres=NODE_ADDRESS, contract_address=CONTRACT_ADDRESS)
+badge_controller = BlockController(with_account_setup=True)
+chain_listener = ChainListener(polling_interval=2, mempool=badge_controller.mempool, node_addres=NODE_ADDRESS, contract_address=os.environ.get("DEPOSIT_CONTRACT", CONTRACT_ADDRESS))
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    badge_controller.mempool.validator.start()
     await setup_service.on_start()
+    await badge_controller.tree_controller.load_account_state()
+    await badge_controller.mempool.load_pending_transactions()
+    await badge_controller.prover_coordinator.load_jobs()
     loop = asyncio.get_running_loop()
-    loop.create_task(badge_controller.batch_queue_producer())
-    loop.create_task(badge_controller.batch_queue_consumer())
+    loop.create_task(badge_controller.prover_coordinator.run())
+    loop.create_task(badge_controller.block_production_loop())
     loop.create_task(chain_listener.deposit_chain_loop())
     logger.info("setup complete")
     yield
+    badge_controller.mempool.validator.shutdown()
 
-app = FastAPI(lifespan=lifespan)
+SUBMIT_BATCH_MAX_SIZE = int(os.environ.get("SUBMIT_BATCH_MAX_SIZE", 1000))
+EVENT_KEEPALIVE_S = float(os.environ.get("EVENT_KEEPALIVE_S", 15))
+PROOF_BATCH_MAX_SIZE = int(os.environ.get("PROOF_BATCH_MAX_SIZE", 1000))
+
+# responses are serialized with orjson
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+def require_admin(x_admin_token : str = Header(default=None)) -> None:
+    """
+        Admin endpoints are disabled unless ADMIN_TOKEN is set
+    """
+    admin_token = os.environ.get("ADMIN_TOKEN")
+    if not admin_token or x_admin_token is None or not hmac.compare_digest(x_admin_token, admin_token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+@app.get("/health")
+async def health() -> dict:
+    """
+        503 once block production stopped, the sequencer has to be restarted
+    """
+    if badge_controller.pipeline.failure is not None:
+        raise HTTPException(status_code=503, detail=f"block production stopped : {badge_controller.pipeline.failure}")
+    return {"status": "ok"}
 
 @app.post("/api/submit")
 async def submit_transaction(transaction: TransactionRequest) -> SubmissionResponse:
     try:
         return await badge_controller.handel_transaction_submission(transaction_request=transaction)
+    except PipelineStopped as e:
+        raise HTTPException(status_code=503, detail=f"{e}")
+    except Exception as e :
+        logger.error(e)
+        raise HTTPException(status_code=500, detail=f"{e}")
+
+@app.post("/api/submit-batch")
+async def submit_transaction_batch(batch : TransactionBatchRequest) -> BatchSubmissionResponse:
+    if len(batch.transactions) > SUBMIT_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"at most {SUBMIT_BATCH_MAX_SIZE} transactions per batch")
+    try:
+        return await badge_controller.handle_batch_submission(transaction_requests=batch.transactions)
+    except PipelineStopped as e:
+        raise HTTPException(status_code=503, detail=f"{e}")
     except Exception as e :
         logger.error(e)
         raise HTTPException(status_code=500, detail=f"{e}")
 
+# the submission path is profiled together with block formation (POST /api/admin/profile)
+badge_controller.profiler.add_scope(submit_transaction)
+badge_controller.profiler.add_scope(submit_transaction_batch)
+
 @app.post("/api/get-nonce")
 async def get_nonce_for_account(req : NonceRequest) -> NonceResponse:
     try:
@@ -65,6 +114,139 @@ async def get_status_from_transaction(req : SubmissionStatusRequest) -> Submissi
         return await badge_controller.get_status_for_transaction(submission_id=req.submission_id)
     except Exception as e :
         raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@app.get("/api/account-history/{address}")
+async def get_account_history(address : str, before : Optional[int] = None, limit : int = 50) -> AccountHistoryPage:
+    try:
+        return await badge_controller.account_history.get_history(address=address, before=before, limit=limit)
+    except Exception as e :
+        logger.error(e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@app.get("/api/events")
+async def stream_events(address : list[str] = Query(default=[]), submission_id : list[str] = Query(default=[]), badges : bool = False) -> StreamingResponse:
+    """
+        Server-Sent Events of the transactions of the given addresses / submission ids
+        and, with badges=true, of the badges
+    """
+    try:
+        subscription = badge_controller.event_bus.subscribe(addresses=address, submission_ids=submission_id, badges=badges)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"{e}")
+
+    async def stream():
+        try:
+            yield b": subscribed\n\n"
+            while True:
+                data = await subscription.next(timeout=EVENT_KEEPALIVE_S)
+                if data is None:
+                    break
+                yield b"data: " + data + b"\n\n" if data else b": keepalive\n\n"
+        finally:
+            badge_controller.event_bus.unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "Access-Control-Allow-Origin": os.environ.get("EVENTS_ALLOW_ORIGIN", "*")})
+
+
+@app.get("/api/event-stats")
+async def get_event_stats() -> dict:
+    return badge_controller.event_bus.stats()
+
+
+@app.get("/api/proof/{address}")
+async def get_account_proof(address : str) -> dict:
+    try:
+        return badge_controller.proof_service.get_proof(address=address)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"{e}")
+    except Exception as e :
+        logger.error(e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@app.post("/api/proofs")
+async def get_account_multiproof(req : ProofBatchRequest) -> dict:
+    if len(req.addresses) > PROOF_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"at most {PROOF_BATCH_MAX_SIZE} addresses per request")
+    try:
+        return badge_controller.proof_service.get_multiproof(addresses=req.addresses)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"{e}")
+    except Exception as e :
+        logger.error(e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@app.get("/api/proof-stats")
+async def get_proof_stats() -> dict:
+    return badge_controller.proof_service.stats()
+
+
+@app.get("/api/lifecycle")
+async def get_lifecycle_report(window_s : Optional[float] = Query(default=None, gt=0)) -> dict:
+    return badge_controller.lifecycle.report(window_s=window_s)
+
+
+@app.get("/metrics")
+async def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/verifier-stats")
+async def get_verifier_stats() -> dict:
+    return badge_controller.mempool.validator.queue_delay.summary()
+
+
+@app.get("/api/prover-status")
+async def get_prover_status() -> dict:
+    return badge_controller.prover_coordinator.status()
+
+
+@app.post("/api/admin/prover/retry/{batch_id}", dependencies=[Depends(require_admin)])
+async def retry_proof(batch_id : int) -> dict:
+    if not badge_controller.prover_coordinator.retry(batch_id):
+        raise HTTPException(status_code=404, detail=f"no failed proof job for batch {batch_id}")
+    return badge_controller.prover_coordinator.status()
+
+
+@app.post("/api/admin/profile", dependencies=[Depends(require_admin)])
+async def start_profile(req : ProfileRequest) -> dict:
+    if req.blocks is None and req.seconds is None:
+        raise HTTPException(status_code=400, detail="either blocks or seconds is required")
+    try:
+        badge_controller.profiler.start(blocks=req.blocks, seconds=req.seconds)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=f"{e}")
+    return badge_controller.profiler.status()
+
+
+@app.get("/api/admin/profile", dependencies=[Depends(require_admin)])
+async def get_profile_status() -> dict:
+    return badge_controller.profiler.status()
+
+
+@app.post("/api/admin/profile/stop", dependencies=[Depends(require_admin)])
+async def stop_profile() -> dict:
+    badge_controller.profiler.stop()
+    if badge_controller.profiler.finishing is not None:
+        await badge_controller.profiler.finishing
+    return badge_controller.profiler.status()
+
+
+@app.get("/api/admin/scheduler", dependencies=[Depends(require_admin)])
+async def get_scheduler_status() -> SchedulerStatus:
+    return badge_controller.scheduler.status()
+
+
+@app.post("/api/admin/scheduler", dependencies=[Depends(require_admin)])
+async def update_scheduler_settings(update : SchedulerSettingsUpdate) -> SchedulerSettings:
+    try:
+        return badge_controller.scheduler.update_settings(update)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"{e}")
        
 
 if __name__ == "__main__":
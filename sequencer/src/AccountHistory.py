@@ -0,0 +1,137 @@
+from src.AsyncMongoClient import get_mongo_client
+from src.Types import AccountHistoryPage, AccountUpdates
+from pymongo import UpdateOne, InsertOne, DESCENDING
+from typing import Optional
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+"""
+    Account history in the bucket pattern: one ACCOUNT_HISTORY document holds the updates of
+    one account within one time window (ACCOUNT_HISTORY_BUCKET_S), at most
+    ACCOUNT_HISTORY_BUCKET_SIZE of them, a full bucket is continued in a new document.
+    An account has at most one update per block, so history is paged by blocknumber.
+"""
+
+ACCOUNT_HISTORY_BUCKET_S = int(os.environ.get("ACCOUNT_HISTORY_BUCKET_S", 3600))
+ACCOUNT_HISTORY_BUCKET_SIZE = int(os.environ.get("ACCOUNT_HISTORY_BUCKET_SIZE", 500))
+ACCOUNT_HISTORY_PAGE_LIMIT = 500
+
+
+def bucket_start(timestamp : int) -> int:
+    return timestamp - timestamp % ACCOUNT_HISTORY_BUCKET_S
+
+
+def history_operation(address : str, update : dict) -> UpdateOne:
+    """
+        Appends one update (AccountUpdates layout) to the open bucket of the account
+    """
+    return UpdateOne(
+        {"address": address, "bucket": bucket_start(update["timestamp"]), "count": {"$lt": ACCOUNT_HISTORY_BUCKET_SIZE}},
+        {
+            "$push": {"updates": update},
+            "$inc": {"count": 1},
+            "$min": {"first_block": update["blocknumber"]},
+            "$max": {"last_block": update["blocknumber"]}
+        },
+        upsert=True
+    )
+
+
+def history_buckets(address : str, updates : list[dict]) -> list[dict]:
+    """
+        Groups updates in block order into full bucket documents
+    """
+    buckets = []
+    for update in updates:
+        bucket = bucket_start(update["timestamp"])
+        if len(buckets) == 0 or buckets[-1]["bucket"] != bucket or buckets[-1]["count"] >= ACCOUNT_HISTORY_BUCKET_SIZE:
+            buckets.append({"address": address, "bucket": bucket, "count": 0, "first_block": update["blocknumber"],
+                            "last_block": update["blocknumber"], "updates": []})
+        buckets[-1]["updates"].append(update)
+        buckets[-1]["count"] += 1
+        buckets[-1]["last_block"] = update["blocknumber"]
+    return buckets
+
+
+class AccountHistory:
+
+    def __init__(self):
+        self.mongo_client = get_mongo_client()
+
+    def _collection(self):
+        return self.mongo_client[os.environ["DB_NAME"]][os.environ.get("ACCOUNT_HISTORY", "account_history")]
+
+    async def create_indexes(self) -> None:
+        # open bucket lookup of history_operation, and paging newest first
+        await self._collection().create_index([("address", 1), ("bucket", 1)])
+        await self._collection().create_index([("address", 1), ("first_block", DESCENDING)])
+        # blocks committed after the last tree checkpoint, replayed on start
+        await self._collection().create_index([("last_block", 1)])
+
+    async def get_history(self, address : str, before : Optional[int] = None, limit : int = 50) -> AccountHistoryPage:
+        """
+            Updates of the account newest first, only the ones of blocks before `before`
+        """
+        limit = max(1, min(limit, ACCOUNT_HISTORY_PAGE_LIMIT))
+        query = {"address": address}
+        if before is not None:
+            query["first_block"] = {"$lt": before}
+        cursor = self._collection().find(query, {"_id": 0, "updates": 1}).sort("first_block", DESCENDING)
+        updates = []
+        async for doc in cursor:
+            for update in reversed(doc["updates"]):
+                if before is not None and update["blocknumber"] >= before:
+                    continue
+                updates.append(AccountUpdates(**update))
+                if len(updates) == limit:
+                    break
+            if len(updates) == limit:
+                break
+        next_before = updates[-1].blocknumber if len(updates) == limit else None
+        return AccountHistoryPage(address=address, updates=updates, next_before=next_before)
+
+    async def migrate_users(self) -> int:
+        """
+            Moves the account_updates arrays of the USERS documents into history buckets and
+            keeps only the latest balance and nonce on the account. Every account is migrated
+            in its own transaction, an interrupted migration continues where it stopped.
+            The blocknumber and timestamp of an update come from its badge.
+            Returns the number of migrated accounts.
+        """
+        db = self.mongo_client[os.environ["DB_NAME"]]
+        users_col = db[os.environ["USERS"]]
+        badges_col = db[os.environ["BADGES"]]
+        migrated = 0
+        cursor = users_col.find({"account_updates": {"$exists": True}}, {"_id": 1, "address": 1, "account_updates": 1})
+        async for doc in cursor:
+            account_updates = doc["account_updates"]
+            badge_ids = list({u["badgeId"] for u in account_updates})
+            badges = {}
+            async for badge in badges_col.find({"badgeId": {"$in": badge_ids}}, {"_id": 0, "badgeId": 1, "blocknumber": 1, "timestamp": 1}):
+                badges[badge["badgeId"]] = badge
+            updates = []
+            for u in account_updates:
+                badge = badges.get(u["badgeId"], {"blocknumber": 0, "timestamp": 0})
+                updates.append({**u, "blocknumber": badge["blocknumber"], "timestamp": badge["timestamp"]})
+            updates.sort(key=lambda u: u["blocknumber"])
+            account_set = {}
+            if len(updates) > 0:
+                account_set = {"balance": updates[-1]["balance_after"], "nonce": updates[-1]["nonce_after"]}
+            buckets = history_buckets(doc["address"], updates)
+
+            async def migrate_account(session) -> None:
+                if len(buckets) > 0:
+                    await self._collection().bulk_write([InsertOne(b) for b in buckets], session=session)
+                update = {"$unset": {"account_updates": ""}}
+                if len(account_set) > 0:
+                    update["$set"] = account_set
+                await users_col.update_one({"_id": doc["_id"]}, update, session=session)
+
+            async with await self.mongo_client.start_session() as session:
+                await session.with_transaction(migrate_account)
+            migrated += 1
+        if migrated > 0:
+            logger.info(f"moved the account updates of {migrated} accounts into {os.environ.get('ACCOUNT_HISTORY', 'account_history')}")
+        return migrated
@@ -0,0 +1,166 @@
+from pymongo import UpdateOne
+import json
+import logging
+from typing import Callable, Optional
+from src.utils import hex_to_bytes
+from eth_utils import to_checksum_address
+from src.TxRecord import TxRecord
+from src.AccountHistory import history_operation
+
+logger = logging.getLogger(__name__)
+
+
+class AccountState:
+    """
+        Authoritative in-memory view of one rollup account.
+        balance_before / nonce_before / transactions describe the pending delta
+        of the badge that is currently being formed and get flushed with it.
+    """
+    __slots__ = ("address", "key", "balance", "nonce", "badge_id", "balance_before", "nonce_before", "transactions")
+
+    def __init__(self, address : str, balance : int, nonce : int):
+        self.address = address
+        self.key = hex_to_bytes(address)
+        self.balance = balance
+        self.nonce = nonce
+        self.badge_id = None
+        self.balance_before = balance
+        self.nonce_before = nonce
+        self.transactions = []
+
+    def leaf_bytes(self) -> bytes:
+        return int(self.balance).to_bytes(8, 'little') + int(self.nonce).to_bytes(8, 'little') + self.key
+
+
+class AccountStateStore:
+    """
+        In-process account state used for the tree invariants and leaf computation.
+        It is loaded once at startup (funded_accounts.json, then the USERS collection)
+        and only written back to mongo as a write-behind flush at the end of each badge.
+        Accounts are keyed by their 20 byte address.
+        With a leaf_loader (restart from a checkpointed tree) accounts are not loaded up front,
+        an account is read from its leaf value (AccountState.leaf_bytes) the first time it is used.
+    """
+
+    def __init__(self, leaf_loader : Optional[Callable[[bytes], Optional[bytes]]] = None):
+        self.accounts : dict[bytes, AccountState] = {}
+        self.touched : dict[bytes, AccountState] = {}
+        self.leaf_loader = leaf_loader
+
+    def get(self, address : str) -> Optional[AccountState]:
+        return self.get_by_key(hex_to_bytes(address))
+
+    def get_by_key(self, key : bytes) -> Optional[AccountState]:
+        state = self.accounts.get(key)
+        if state is None and self.leaf_loader is not None:
+            leaf = self.leaf_loader(key)
+            if leaf is not None:
+                state = self.put_from_leaf(leaf)
+        return state
+
+    def put(self, address : str, balance : int, nonce : int) -> AccountState:
+        state = AccountState(address=address, balance=int(balance), nonce=int(nonce))
+        self.accounts[state.key] = state
+        return state
+
+    def load_from_state_json(self, path : str) -> None:
+        with open(path, "r") as file:
+            users_data = json.load(file)
+        for acc in users_data:
+            self.put(address=acc["pub_key"], balance=acc["balance"], nonce=0)
+        logger.info(f"loaded {len(users_data)} genesis accounts into the account state")
+
+    def put_from_leaf(self, leaf : bytes) -> AccountState:
+        """
+            Restores an account from its leaf value in the state tree (AccountState.leaf_bytes).
+            Addresses come back checksummed, like the genesis and deposit addresses.
+        """
+        return self.put(address=to_checksum_address(leaf[16:]), balance=int.from_bytes(leaf[:8], 'little'), nonce=int.from_bytes(leaf[8:16], 'little'))
+
+    async def load_from_collection(self, users_col) -> list[AccountState]:
+        """
+            Overrides the genesis state with the latest persisted state of every account.
+            Like find_one, the first document of an address wins.
+            Returns the accounts whose state differs from what was loaded before.
+        """
+        changed = []
+        seen = set()
+        cursor = users_col.find({}, {"_id": 0, "address": 1, "balance": 1, "nonce": 1})
+        async for doc in cursor:
+            address = doc["address"]
+            if address.lower() in seen:
+                continue
+            seen.add(address.lower())
+            balance = doc["balance"]
+            nonce = doc["nonce"]
+            prev = self.get(address)
+            if prev is not None and prev.balance == balance and prev.nonce == nonce:
+                continue
+            changed.append(self.put(address=address, balance=balance, nonce=nonce))
+        logger.info(f"loaded {len(seen)} accounts from the users collection, {len(changed)} differ from genesis")
+        return changed
+
+    def _touch(self, state : AccountState, badge_id : str, transaction_id : Optional[str]) -> None:
+        if state.badge_id != badge_id:
+            state.badge_id = badge_id
+            state.balance_before = state.balance
+            state.nonce_before = state.nonce
+            state.transactions = []
+            self.touched[state.key] = state
+        state.transactions.append(transaction_id)
+
+    def check_transfer(self, transaction : TxRecord) -> bool:
+        sender = self.get_by_key(transaction.sender_key)
+        if sender is None:
+            logger.error(f"account data could not be found for sender {transaction.sender}")
+            return False
+        receiver = self.get_by_key(transaction.receiver_key)
+        balance_sufficient = sender.balance >= transaction.amount #+ fee
+        nonce_correct = sender.nonce == transaction.nonce
+        return balance_sufficient and nonce_correct and (receiver is not None)
+
+    def apply_transfer(self, badge_id : str, transaction : TxRecord) -> tuple[AccountState, AccountState]:
+        """
+            receiver nonces do not get updated
+        """
+        sender = self.get_by_key(transaction.sender_key)
+        receiver = self.get_by_key(transaction.receiver_key)
+        amount = transaction.amount
+        self._touch(sender, badge_id=badge_id, transaction_id=transaction.transaction_id)
+        sender.balance -= amount
+        sender.nonce += 1
+        if receiver is not sender:
+            self._touch(receiver, badge_id=badge_id, transaction_id=transaction.transaction_id)
+        receiver.balance += amount
+        return sender, receiver
+
+    def apply_deposit(self, badge_id : str, transaction : TxRecord) -> AccountState:
+        state = self.get_by_key(transaction.sender_key)
+        if state is None:
+            state = self.put(address=transaction.sender, balance=0, nonce=0)
+        self._touch(state, badge_id=badge_id, transaction_id=transaction.transaction_id)
+        state.balance += transaction.amount
+        return state
+
+    def drain_account_updates(self, badge_id : str, blocknumber : int, timestamp : int) -> tuple[list[UpdateOne], list[UpdateOne]]:
+        """
+            Turns the pending per-badge deltas into the new balance and nonce of every
+            touched account (USERS) and one entry in its history (ACCOUNT_HISTORY),
+            then resets the pending delta.
+        """
+        account_operations = []
+        history_operations = []
+        for state in self.touched.values():
+            account_operations.append(UpdateOne({"address": state.address}, {"$set": {"balance": state.balance, "nonce": state.nonce}}))
+            history_operations.append(history_operation(state.address, {
+                "balance_before": state.balance_before,
+                "balance_after": state.balance,
+                "nonce_before": state.nonce_before,
+                "nonce_after": state.nonce,
+                "transactions": state.transactions,
+                "badgeId": badge_id,
+                "blocknumber": blocknumber,
+                "timestamp": timestamp
+            }))
+        self.touched = {}
+        return account_operations, history_operations
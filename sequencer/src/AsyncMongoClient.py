@@ -4,6 +4,7 @@ import os
 
 import asyncio
 import motor.motor_asyncio
+from src.Metrics import MONGO_COMMAND_COUNTER
 
 load_dotenv()
 
@@ -11,9 +12,16 @@ load_dotenv()
 async_mongo_client = None
 
 def get_mongo_client():
+    """
+        MONGO_BACKEND=memory replaces mongo with the in-process stand-in of src/MemoryMongoClient.py
+    """
     global async_mongo_client
     if async_mongo_client is None:
-        client = motor.motor_asyncio.AsyncIOMotorClient(os.environ["MONGO_URI"])
+        if os.environ.get("MONGO_BACKEND", "mongo") == "memory":
+            from src.MemoryMongoClient import MemoryMongoClient
+            client = MemoryMongoClient()
+        else:
+            client = motor.motor_asyncio.AsyncIOMotorClient(os.environ["MONGO_URI"], event_listeners=[MONGO_COMMAND_COUNTER])
         async_mongo_client = client
         return client
     else :
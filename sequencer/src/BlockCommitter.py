@@ -0,0 +1,71 @@
+from src.AsyncMongoClient import get_mongo_client
+from src.Types import TransactionBadge, TransactionStatus, CurrentBadge
+from src.Metrics import MONGO_COMMAND_COUNTER, BLOCK_MONGO_ROUND_TRIPS
+from pymongo import UpdateOne, UpdateMany, InsertOne
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class BlockCommit:
+    """
+        Everything a sealed L2 block changes in mongo, collected in memory
+        while the block is formed.
+    """
+
+    def __init__(self, badge_id : str):
+        self.badge_id = badge_id
+        self.account_updates : list[UpdateOne] = []
+        self.history_updates : list[UpdateOne] = []
+        self.included_transactions : list[str] = []
+        self.failed_transactions : list[str] = []
+        self.badge : TransactionBadge = None
+
+    def transaction_operations(self) -> list[UpdateMany]:
+        operations = []
+        if len(self.included_transactions) > 0:
+            operations.append(UpdateMany(
+                {"transactionId": {"$in": self.included_transactions}},
+                {"$set": {"status": TransactionStatus.INCLUDED.value, "badgeId": self.badge_id}}
+            ))
+        if len(self.failed_transactions) > 0:
+            operations.append(UpdateMany(
+                {"transactionId": {"$in": self.failed_transactions}},
+                {"$set": {"status": TransactionStatus.FAILED.value, "badgeId": self.badge_id}}
+            ))
+        return operations
+
+
+class BlockCommitter:
+    """
+        Persists a whole block in one multi-document transaction,
+        so a crash can never leave a half applied block behind.
+    """
+
+    def __init__(self):
+        self.mongo_client = get_mongo_client()
+
+    async def _write_block(self, block_commit : BlockCommit, session) -> None:
+        db = self.mongo_client[os.environ["DB_NAME"]]
+        if len(block_commit.account_updates) > 0:
+            await db[os.environ["USERS"]].bulk_write(block_commit.account_updates, ordered=False, session=session)
+        if len(block_commit.history_updates) > 0:
+            await db[os.environ.get("ACCOUNT_HISTORY", "account_history")].bulk_write(block_commit.history_updates, ordered=False, session=session)
+        transaction_operations = block_commit.transaction_operations()
+        if len(transaction_operations) > 0:
+            await db[os.environ["TRANSACTIONS"]].bulk_write(transaction_operations, ordered=False, session=session)
+        await db[os.environ["BADGES"]].bulk_write([InsertOne(block_commit.badge.model_dump())], session=session)
+        pointer = CurrentBadge(currBadgeID=block_commit.badge_id)
+        await db[os.environ["CURR"]].bulk_write([UpdateOne({}, {"$set": pointer.model_dump()}, upsert=True)], session=session)
+
+    async def commit(self, block_commit : BlockCommit) -> None:
+        async with await self.mongo_client.start_session() as session:
+            try:
+                MONGO_COMMAND_COUNTER.track(session)
+                await session.with_transaction(lambda s: self._write_block(block_commit, s))
+                BLOCK_MONGO_ROUND_TRIPS.observe(MONGO_COMMAND_COUNTER.take(session))
+                logger.info(f"committed badge : {block_commit.badge_id} with {len(block_commit.included_transactions)} included and {len(block_commit.failed_transactions)} failed transactions")
+            except Exception as e:
+                logger.error(f"error when committing badge : {block_commit.badge_id} : {e}")
+                raise e
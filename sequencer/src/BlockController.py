@@ -1,129 +1,217 @@
 from src.utils import get_current_timestamp
 from src.MemPool import MemPool
-from src.Types import BadgeExecutionCause, TransactionBadge, TransactionStatus, BadgeStatus, Transaction, TransactionRequest, SubmissionResponse, SubmissionStatus, NonceResponse, AccountsCollection
+from src.Types import BadgeExecutionCause, TransactionBadge, BadgeStatus, TransactionStatus, TransactionRequest, SubmissionResponse, SubmissionStatus, NonceResponse, BatchSubmissionResponse, BatchSubmissionResult
+from src.TxRecord import TxRecord
 from src.AsyncMongoClient import get_mongo_client
 import logging
 from src.MerkleTreeController import MerkleTreeController
-from src.utils import generate_random_id, hex_to_bytes, bytes_to_hex, add_0x_prefix
+from src.BlockCommitter import BlockCommitter, BlockCommit
+from src.BlockScheduler import BlockScheduler
+from src.BlockPipeline import BlockPipeline, SealedBlock
+from src.WitnessExporter import WitnessExporter, build_batch_witness
+from src.CalldataCodec import encode_compact, calldata_gas
+from src.ProverCoordinator import ProverCoordinator
+from src.Prover import create_prover
+from src.BlockHeader import BlockHeaderBuilder
+from src.TransactionStatusCache import TransactionStatusCache
+from src.AccountHistory import AccountHistory
+from src.EventBus import EventBus
+from src.ProofService import ProofService
+from src.LifecycleTracker import LifecycleTracker
+from src.Profiler import Profiler
+from src.Metrics import SUBMIT_SECONDS, BLOCK_STAGE_SECONDS, BLOCK_TRANSACTIONS, TRANSACTIONS, MEMPOOL_TRANSACTIONS
+from src.utils import generate_random_id, generate_random_ids, hex_to_bytes
 import os
-import hashlib
+import time
 import asyncio
 
-BATCH_SIZE = 50
-
 logger = logging.getLogger(__name__)
 
 """
     Blocknumber increments monotonically
-    Blockhash is determined by the : H(bocknumber, _blocktimestamp, _prevL2BlockHash, _blockTxsRollingHash)
-    Tx rolling hash: H(H(0, t_1), t_2) ....
+    Blockhash and tx rolling hash : see BlockHeader
 """
 
-ZERO_ADDRESS = "0x" + "0" * 40
+# withdrawals go to the zero address
+ZERO_KEY = bytes(20)
 
 class BlockController:
 
-    def __init__(self, queue, with_account_setup: bool):
-        self.queue = queue
-        self.transaction_counter = 0
-        self.last_timestamp = get_current_timestamp()
-        self.mempool = MemPool()
+    def __init__(self, with_account_setup: bool):
         self.mongo_client = get_mongo_client()
         self.tree_controller = MerkleTreeController(with_account_setup=with_account_setup)
+        self.event_bus = EventBus()
+        self.lifecycle = LifecycleTracker()
+        self.proof_service = ProofService(tree_controller=self.tree_controller)
+        self.mempool = MemPool(account_state=self.tree_controller.account_state, event_bus=self.event_bus, lifecycle=self.lifecycle)
+        self.scheduler = BlockScheduler(pending_pool=self.mempool.pending_pool)
+        self.block_committer = BlockCommitter()
+        self.pipeline = BlockPipeline(block_controller=self)
+        self.status_cache = TransactionStatusCache()
+        self.account_history = AccountHistory()
+        self.witness_exporter = WitnessExporter(directory=os.environ.get("WITNESS_DIR", "witness"), tree_controller=self.tree_controller)
+        self.pipeline.add_exporter(self.witness_exporter.export)
+        self.prover_coordinator = ProverCoordinator(witness_exporter=self.witness_exporter, prover=create_prover(), status_cache=self.status_cache,
+            event_bus=self.event_bus, lifecycle=self.lifecycle)
+        self.pipeline.add_exporter(self.prover_coordinator.enqueue)
+        # last, the witness of the block has been taken from its old root by now
+        self.pipeline.add_exporter(self.release_block)
+        # holds the chain tip, it runs ahead of mongo
+        self.header_builder = BlockHeaderBuilder()
+        MEMPOOL_TRANSACTIONS.set_function(self._mempool_depth)
+        self.profiler = Profiler()
+        for scope in (self.form_new_L2_block, self.execute_block, self.persist_block, self.pipeline.export_block):
+            self.profiler.add_scope(scope)
+
+    def _mempool_depth(self) -> list[tuple[tuple, int]]:
+        pending_pool = self.mempool.pending_pool
+        deposits = len(pending_pool.deposits)
+        held = pending_pool.held()
+        return [(("ready",), len(pending_pool) - deposits - held), (("held",), held), (("deposit",), deposits)]
     
 
-    async def _get_transaction_for_badge(self, badge_execution_cause : BadgeExecutionCause) -> list[Transaction]:
-        transaction_for_badge = None
-        if badge_execution_cause == BadgeExecutionCause.FILLEDUP:
-            transaction_for_badge = await self.mempool.get_transaction_for_badge()
-        else:
-            transaction_for_badge = await self.mempool.get_transaction_for_badge(last_timestamp=self.last_timestamp)
-        return transaction_for_badge
-
-
-    async def _update_merkle_tree(self, badged_transaction : list[Transaction], badge_id : str) -> list[Transaction]:
-            db = self.mongo_client[os.environ["DB_NAME"]]
-            trans_col = db[os.environ["TRANSACTIONS"]]
+    async def _update_merkle_tree(self, badged_transaction : list[TxRecord], block_commit : BlockCommit) -> tuple[list[TxRecord], list[TxRecord]]:
+            """
+                Returns the included and the failed transactions, the failed ones with the
+                pending transactions the block left without a chance to execute
+            """
+            badge_id = block_commit.badge_id
+            included_transaction = []
             failed_transaction = []
             for t in badged_transaction:
+                self.header_builder.add(t)
                 try:
                     if t.receiver is None:
                         await self.tree_controller.handle_deposit_transaction(badge_id=badge_id, transaction=t)
-                    elif t.receiver == ZERO_ADDRESS:
+                    elif t.receiver_key == ZERO_KEY:
                         pass # here withdraw transaction should be processed
                     else:
                         await self.tree_controller.make_rollup_transaction_between_existing_users(badge_id=badge_id, transaction=t)
+                    included_transaction.append(t)
+                    block_commit.included_transactions.append(t.transaction_id)
                 except Exception as e:
-                    await trans_col.update_one(
-                        {"transactionId": t.transactionId},
-                        {"$set": {"status": TransactionStatus.FAILED.value}}
-                    )
                     logger.error(f"{e}")
-                    failed_transaction.append(t.transactionId)
-                    logger.info(f"transaction : {t.transactionId} could not be included in the badge : {badge_id}")
+                    block_commit.failed_transactions.append(t.transaction_id)
+                    failed_transaction.append(t)
+                    logger.info(f"transaction : {t.transaction_id} could not be included in the badge : {badge_id}")
             
-            return [t for t in badged_transaction if t.transactionId not in failed_transaction]
-    
-    async def increment_badge_pointer(self, next_badge_id : str) -> None:
-        try:
-            db = self.mongo_client[os.environ["DB_NAME"]]
-            badge_col = db[os.environ["CURR"]]
-            await badge_col.update_one(
-                {},
-                {"$set": {"currBadgeID": next_badge_id}}
-            )
-            logger.info("badge pointer got incremented")
-        except Exception as e:
-            logger.error(f"cannot increment the badgepointer: {e}")
-    
-    async def insert_new_badge(self , badge : TransactionBadge, next_badge_id : str) -> None:
-        try:
-            db = self.mongo_client[os.environ["DB_NAME"]]
-            badges_col = db[os.environ["BADGES"]]
-            await badges_col.insert_one(badge.model_dump())
-            await self.increment_badge_pointer(next_badge_id=next_badge_id)
-        except Exception as e:
-            logger.error(f"error when updating the badge pointer: {e}")
-    
+            stranded_transactions = self.mempool.after_block(transactions=badged_transaction, failed_transactions=failed_transaction)
+            for t in stranded_transactions:
+                block_commit.failed_transactions.append(t.transaction_id)
+            return included_transaction, failed_transaction + stranded_transactions
     
-    async def form_new_L2_block(self, execution_cause : BadgeExecutionCause) -> TransactionBadge:
-        logger.info("starting to form new L2 block ")
-        try:
-            badge_id = generate_random_id()
-        
-            badged_transaction = await self._get_transaction_for_badge(badge_execution_cause=execution_cause)
-            self.last_timestamp = get_current_timestamp()
-            logger.info(f"retrived : {len(badged_transaction)} transaction for badge : {badge_id}")
-            old_merkle_root = self.tree_controller.get_merkle_root()
-            transactions_for_delta = await self._update_merkle_tree(badged_transaction=badged_transaction, badge_id=badge_id)
-            new_merkle_root = self.tree_controller.get_merkle_root()
-            blockhash, blocknumber, prev_id =  await self.get_previous_block_information()
-            timestamp = get_current_timestamp()
-            curr_block_hash = await self.create_block_hash(blocknumber=blocknumber +1,
-            timestamp=timestamp, transactions=badged_transaction, previous_block_hash=blockhash)
-            transaction_ids = [t.transactionId for t in transactions_for_delta]
-            l2_badge_new = TransactionBadge(
-                badgeId=badge_id,
-                status=BadgeStatus.SEND_TO_VERIFY,
-                blockhash=add_0x_prefix(curr_block_hash),
-                state_root=new_merkle_root,
-                blocknumber=blocknumber + 1,
-                timestamp=timestamp,
-                executionCause=execution_cause,
-                transactions=transaction_ids,
-                prevBadge=prev_id
-            )
-            await self.insert_new_badge(badge=l2_badge_new, next_badge_id=badge_id)
-            logger.info({
-                "new_state_root": new_merkle_root,
-                "old_state_root" : old_merkle_root,
-                "blocknumber":  blocknumber + 1,
-                "transactions" : [x.model_dump() for x in transactions_for_delta],
-                "blockhash" : curr_block_hash
-            })
+    async def execute_block(self, execution_cause : BadgeExecutionCause, max_transactions : int, max_gas : int) -> SealedBlock:
+        """
+            Selects and executes the next block in memory, nothing is written to mongo yet.
+            Errors are not caught: once transactions are selected the in-memory state has moved,
+            the pipeline has to stop and the sequencer restarts from its checkpoint.
+        """
+        logger.info(f"starting to form new L2 block ({execution_cause.value}, up to {max_transactions} transactions)")
+        if self.header_builder.tip is None:
+            await self.load_tip()
+        badge_id = generate_random_id()
+        block_commit = BlockCommit(badge_id=badge_id)
+        self.header_builder.begin()
+
+        started_at = time.perf_counter()
+        badged_transaction = self.mempool.get_transaction_for_badge(limit=max_transactions, max_gas=max_gas)
+        selected_at = time.perf_counter()
+        BLOCK_STAGE_SECONDS.observe(selected_at - started_at, labels=("select",))
+        old_merkle_root = self.tree_controller.get_merkle_root()
+        transactions_for_delta, failed_transactions = await self._update_merkle_tree(badged_transaction=badged_transaction, block_commit=block_commit)
+        executed_at = time.perf_counter()
+        BLOCK_STAGE_SECONDS.observe(executed_at - selected_at, labels=("execute",))
+        touched_accounts = self.tree_controller.touched_accounts()
+        new_merkle_root = self.tree_controller.apply_pending_leaves()
+        changeset = self.tree_controller.take_changeset()
+        tree_updated_at = time.perf_counter()
+        BLOCK_STAGE_SECONDS.observe(tree_updated_at - executed_at, labels=("tree_update",))
+        header = self.header_builder.seal(timestamp=get_current_timestamp(), badge_id=badge_id)
+        self.tree_controller.state_blocknumber = header.blocknumber
+        block_commit.account_updates, block_commit.history_updates = self.tree_controller.drain_account_updates(badge_id=badge_id,
+            blocknumber=header.blocknumber, timestamp=header.timestamp)
+        transaction_ids = [t.transaction_id for t in transactions_for_delta]
+        l2_badge_new = TransactionBadge(
+            badgeId=badge_id,
+            status=BadgeStatus.SEND_TO_VERIFY,
+            blockhash=header.blockhash,
+            state_root=new_merkle_root,
+            blocknumber=header.blocknumber,
+            timestamp=header.timestamp,
+            executionCause=execution_cause,
+            transactions=transaction_ids,
+            prevBadge=header.prev_badge_id
+        )
+        block_commit.badge = l2_badge_new
+        # the proofs of the pre-state against the old root are added in the export stage, see WitnessExporter
+        witness = build_batch_witness(blocknumber=header.blocknumber, old_root=old_merkle_root, new_root=new_merkle_root,
+            touched_accounts=touched_accounts, transactions=transactions_for_delta)
+        calldata = encode_compact(witness["transactions"])
+        BLOCK_STAGE_SECONDS.observe(time.perf_counter() - tree_updated_at, labels=("seal",))
+        BLOCK_TRANSACTIONS.observe(len(transactions_for_delta), labels=("included",))
+        BLOCK_TRANSACTIONS.observe(len(failed_transactions), labels=("failed",))
+        logger.info({
+            "new_state_root": new_merkle_root,
+            "old_state_root" : old_merkle_root,
+            "blocknumber":  header.blocknumber,
+            "transactions" : len(transaction_ids),
+            "failed_transactions" : len(failed_transactions),
+            "blockhash" : header.blockhash,
+            "calldata_bytes" : len(calldata),
+            "calldata_gas" : calldata_gas(calldata)
+        })
+        logger.debug("transactions of block %s : %s", header.blocknumber, transaction_ids)
+        return SealedBlock(
+            block_commit=block_commit,
+            transactions=badged_transaction,
+            included_transactions=transactions_for_delta,
+            failed_transactions=failed_transactions,
+            old_root=old_merkle_root,
+            new_root=new_merkle_root,
+            changeset=changeset,
+            witness=witness,
+            calldata=calldata
+        )
 
-        except Exception as e:
-            logger.error(f"{e}")
+
+    async def persist_block(self, sealed_block : SealedBlock) -> None:
+        """
+            Commits an executed block to mongo, then checkpoints the tree at its root.
+            Blocks have to be persisted in the order they were executed. Both steps are
+            atomic and retried on their own, see BlockPipeline.retry.
+        """
+        started_at = time.perf_counter()
+        await self.pipeline.retry(lambda: self.block_committer.commit(sealed_block.block_commit), f"committing block {sealed_block.blocknumber}")
+        committed_at = time.perf_counter()
+        BLOCK_STAGE_SECONDS.observe(committed_at - started_at, labels=("persist",))
+        TRANSACTIONS.inc(len(sealed_block.block_commit.included_transactions), labels=(TransactionStatus.INCLUDED.value,))
+        TRANSACTIONS.inc(len(sealed_block.block_commit.failed_transactions), labels=(TransactionStatus.FAILED.value,))
+        self.status_cache.update(sealed_block.block_commit.included_transactions, TransactionStatus.INCLUDED.value)
+        self.status_cache.update(sealed_block.block_commit.failed_transactions, TransactionStatus.FAILED.value)
+        self.event_bus.publish_block(sealed_block)
+        self.lifecycle.included(badge_id=sealed_block.badge_id, blocknumber=sealed_block.blocknumber,
+            transactions=sealed_block.included_transactions, failed_transactions=sealed_block.failed_transactions)
+        await self.pipeline.retry(lambda: self.tree_controller.checkpoint(changeset=sealed_block.changeset, root=sealed_block.new_root,
+            blocknumber=sealed_block.blocknumber, badge_id=sealed_block.badge_id), f"checkpointing block {sealed_block.blocknumber}")
+        BLOCK_STAGE_SECONDS.observe(time.perf_counter() - committed_at, labels=("checkpoint",))
+        if self.profiler.active:
+            self.profiler.block_done()
+
+    async def release_block(self, sealed_block : SealedBlock) -> None:
+        """
+            Lets the tree prune the nodes the block orphaned once its export is done
+        """
+        self.tree_controller.release(sealed_block.changeset)
+
+    async def form_new_L2_block(self, execution_cause : BadgeExecutionCause, max_transactions : int, max_gas : int) -> list[TxRecord]:
+        """
+            Executes and persists one block without the pipeline.
+            Returns the transactions taken from the mempool for the block
+        """
+        sealed_block = await self.execute_block(execution_cause=execution_cause, max_transactions=max_transactions, max_gas=max_gas)
+        await self.persist_block(sealed_block)
+        await self.pipeline.export_block(sealed_block)
+        return sealed_block.transactions
     
 
     async def get_leaf_data_(self) -> list[dict]:
@@ -131,152 +219,108 @@ class BlockController:
         curr_col = db[os.environ["USERS"]]
         users = await curr_col.find({})
 
-    async def get_previous_block_information(self) -> tuple[str, int, str]:
+    async def load_tip(self) -> None:
         """
-            Gets prev blockhash and blocknumber to increment
+            Reads the chain tip before the first block is selected. It has to be the block
+            the state tree is at, otherwise the next block would not continue the chain.
         """
-        try:
-            db = self.mongo_client[os.environ["DB_NAME"]]
-            curr_col = db[os.environ["CURR"]]
-            first_doc = await curr_col.find_one({})
-            prev_badge_id = first_doc["currBadgeID"]
-            badges_col = db[os.environ["BADGES"]]
-            prev_badge = await badges_col.find_one({"badgeId": prev_badge_id})
-            a = [prev_badge["blockhash"], prev_badge["blocknumber"], prev_badge["badgeId"]]
-            return a
-
-        except Exception as e:
-            logger.error(f"failed to retriece previous block information : {e}")
-
-    async def create_block_hash(self, blocknumber: int, timestamp: int, transactions: list[Transaction], previous_block_hash: str) -> str:
-        try: 
-            rolling_tx_hash: bytes = await self.create_rolling_transaction_hash(transactions=transactions)
-            blocknumber_bytes = blocknumber.to_bytes(8, 'little')
-            timestamp_bytes = timestamp.to_bytes(8, 'little')
-            prev_block_hash_bytes = None
-            if previous_block_hash is None:
-                prev_block_hash_bytes = bytes.fromhex("0")
-            else:
-                prev_block_hash_bytes = hex_to_bytes(previous_block_hash)
-            data = blocknumber_bytes + timestamp_bytes + prev_block_hash_bytes + rolling_tx_hash
-            return hashlib.sha256(data).hexdigest()
-        except Exception as e:
-            logger.info(f"error in create blockhash : {e}")
-        
-
-    
-    async def create_rolling_transaction_hash(self, transactions : list[Transaction]) -> bytes:
-        if len(transactions) == 0:
-            zero = 0
-            return zero.to_bytes(8, 'little')
-
-        resulting_hash = None
-        for t in transactions:
-            if resulting_hash is None:
-                zero = 0
-                tx_hash = self.create_transaction_hash(t)
-                zero_bytes = zero.to_bytes(8, 'little')
-                resulting_hash = hashlib.sha256(zero_bytes + tx_hash).digest()
-            else:
-                tx_hash = self.create_transaction_hash(t)
-                resulting_hash = hashlib.sha256(resulting_hash + tx_hash).digest()
-        
-        return resulting_hash
-
+        tip = await self.get_previous_block_information()
+        if tip[1] != self.tree_controller.state_blocknumber:
+            raise Exception(f"the chain tip {tip[2]} is block {tip[1]}, the state tree is at block {self.tree_controller.state_blocknumber}")
+        self.header_builder.tip = tip
 
-    def create_transaction_hash(self, t: Transaction) -> bytes:
-        sender_bytes = hex_to_bytes(t.sender)
-        if t.receiver is not None:
-            receiver_bytes = hex_to_bytes(t.receiver)
-        else:
-            receiver_bytes = b"0"
-        nonce_bytes = t.nonce.to_bytes(8, 'little')
-        amount_bytes = int(t.amount).to_bytes(8, 'little')
-        received_bytes = t.receivedAt.to_bytes(8, 'little')
-        msg = sender_bytes + receiver_bytes + nonce_bytes + amount_bytes + received_bytes
-        return hashlib.sha256(msg).digest()
-    
-    def enrich_transaction(self, transaction_request: TransactionRequest, submission_id : str) -> Transaction:
-        return Transaction(
-            receivedAt= get_current_timestamp(),
-            submissionId=submission_id,
-            transactionId= generate_random_id(),
-            sender=transaction_request.sender,
-            receiver=transaction_request.receiver,
-            nonce=transaction_request.nonce,
-            signature=transaction_request.signature.signature,
-            amount=transaction_request.amount,
-            status=TransactionStatus.PENDING,
-            badgeId = None,
-            pubKey = transaction_request.signature.pubKey
-        )
+    async def get_previous_block_information(self) -> tuple[str, int, str]:
+        """
+            Blockhash, blocknumber and badge id of the last committed badge
+        """
+        db = self.mongo_client[os.environ["DB_NAME"]]
+        pointer = await db[os.environ["CURR"]].find_one({})
+        if pointer is None:
+            raise Exception("there is no current badge pointer, the genesis badge was not set up")
+        prev_badge = await db[os.environ["BADGES"]].find_one({"badgeId": pointer["currBadgeID"]})
+        if prev_badge is None:
+            raise Exception(f"the current badge {pointer['currBadgeID']} is not in {os.environ['BADGES']}")
+        return prev_badge["blockhash"], prev_badge["blocknumber"], prev_badge["badgeId"]
+
+    def enrich_transaction(self, transaction_request: TransactionRequest, submission_id : str) -> TxRecord:
+        return TxRecord.from_request(transaction_request, transaction_id=generate_random_id(), submission_id=submission_id,
+            received_at=get_current_timestamp())
 
     async def handel_transaction_submission(self, transaction_request : TransactionRequest) -> SubmissionResponse:
+        self.pipeline.check_running()
+        started_at = time.perf_counter()
         submission_id = generate_random_id()
         trans = self.enrich_transaction(transaction_request=transaction_request, submission_id=submission_id)
+        self.status_cache.reserve(submission_id, trans.transaction_id)
+        # accepted transactions reach the block scheduler through the mempool
         submission_response = await self.mempool.insert_into_queue(trans, submisson_id=submission_id)
-        self.transaction_counter += 1
-        if self.transaction_counter == BATCH_SIZE:
-            await self.queue.put({"cause" : BadgeExecutionCause.FILLEDUP})
-            self.transaction_counter = 0
+        self.status_cache.put(submission_id, trans.transaction_id, trans.status)
+        SUBMIT_SECONDS.observe(time.perf_counter() - started_at, labels=("submit",))
         return submission_response
+
+    async def handle_batch_submission(self, transaction_requests : list[TransactionRequest]) -> BatchSubmissionResponse:
+        """
+            Submissions of one batch request, in request order. Every transaction gets its own
+            submission id and status, an invalid one does not reject the others.
+        """
+        self.pipeline.check_running()
+        started_at = time.perf_counter()
+        received_at = get_current_timestamp()
+        ids = generate_random_ids(2 * len(transaction_requests))
+        transactions = [TxRecord.from_request(request, transaction_id=ids[2 * i], submission_id=ids[2 * i + 1], received_at=received_at)
+                        for i, request in enumerate(transaction_requests)]
+        for t in transactions:
+            self.status_cache.reserve(t.submission_id, t.transaction_id)
+        validity = await self.mempool.insert_batch_into_queue(transactions)
+        for t in transactions:
+            self.status_cache.put(t.submission_id, t.transaction_id, t.status)
+        SUBMIT_SECONDS.observe(time.perf_counter() - started_at, labels=("submit-batch",))
+        return BatchSubmissionResponse(submissions=[BatchSubmissionResult(submission_id=t.submission_id, valid=valid, status=t.status)
+                                                    for t, valid in zip(transactions, validity)])
         
-    async def batch_queue_consumer(self):
-        while True:
-            item = await self.queue.get()
-            await self.form_new_L2_block(execution_cause=item["cause"])
-            self.queue.task_done()
-    
-    async def batch_queue_producer(self):
-        await asyncio.sleep(5)
-        while True:
-            await self.queue.put({"cause" : BadgeExecutionCause.TIMEDOUT})
-            await asyncio.sleep(5)
+    async def block_production_loop(self):
+        await self.pipeline.run()
     
-    async def get_nonce_for_account(self, account : str) -> int:
+    async def get_nonce_for_account(self, account : str) -> NonceResponse:
+        """
+            Next nonce of the account from memory: the executed nonce, moved past the transfers
+            waiting in the mempool with consecutive nonces. Mongo is only read for accounts
+            that are not in the account state yet (deposited, not executed).
+        """
         try:
-            db = self.mongo_client[os.environ["DB_NAME"]]
-            curr_col = db[os.environ["USERS"]]
-            account = await curr_col.find_one({"address" : account})
-            acc = AccountsCollection(**account)
-            if len(acc.account_updates) > 0:
-                latest_nonce = acc.account_updates[-1].nonce_after
-            else:
-                    latest_nonce = acc.nonce
-            return NonceResponse( nonce = latest_nonce)
+            key = hex_to_bytes(account)
+            state = self.tree_controller.account_state.get_by_key(key)
+            pending_nonce = self.mempool.pending_pool.next_nonce(key)
+            if state is None and pending_nonce is None:
+                return NonceResponse(nonce=await self._stored_nonce(account))
+            nonce = state.nonce if state is not None else 0
+            if pending_nonce is not None:
+                nonce = max(nonce, pending_nonce)
+            return NonceResponse(nonce=nonce)
         except Exception as e:
             logger.error(f"Error when queriing for nonce: {e}")
             raise e
+
+    async def _stored_nonce(self, account : str) -> int:
+        db = self.mongo_client[os.environ["DB_NAME"]]
+        curr_col = db[os.environ["USERS"]]
+        doc = await curr_col.find_one({"address" : account}, {"_id": 0, "nonce": 1})
+        if doc is None:
+            raise Exception(f"account {account} does not exist")
+        return doc["nonce"]
     
-    async def get_status_for_transaction(self, submission_id: str) -> str:
+    async def get_status_for_transaction(self, submission_id: str) -> SubmissionStatus:
+        """
+            Recent submissions are answered from the status cache, older ones from mongo
+        """
         try:
-            db = self.mongo_client[os.environ["DB_NAME"]]
-            curr_col = db[os.environ["TRANSACTIONS"]]
-            doc = await curr_col.find_one({"submissionId" : submission_id})
-            return SubmissionStatus(submission_id= submission_id, status=doc["status"])
+            status = self.status_cache.get(submission_id)
+            if status is None:
+                db = self.mongo_client[os.environ["DB_NAME"]]
+                curr_col = db[os.environ["TRANSACTIONS"]]
+                doc = await curr_col.find_one({"submissionId" : submission_id}, {"_id": 0, "status": 1})
+                status = doc["status"]
+            return SubmissionStatus(submission_id= submission_id, status=status)
         except Exception as e:
             logger.error(f"Error when quering for status {e}")
             raise e
-
-
-
-    
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
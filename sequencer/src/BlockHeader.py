@@ -0,0 +1,64 @@
+from src.TxRecord import TxRecord
+from src.utils import hex_to_bytes, add_0x_prefix
+from typing import Optional
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+"""
+    Blockhash : H(blocknumber, timestamp, prevL2BlockHash, blockTxsRollingHash), integers as 8 byte little endian
+    Tx rolling hash : H(H(0, t_1), t_2) ..., 0 (8 bytes) for a block without transactions
+"""
+
+EMPTY_ROLLING_HASH = (0).to_bytes(8, 'little')
+
+
+class BlockHeader:
+    __slots__ = ("blocknumber", "blockhash", "timestamp", "prev_badge_id", "rolling_hash")
+
+    def __init__(self, blocknumber : int, blockhash : str, timestamp : int, prev_badge_id : str, rolling_hash : bytes):
+        self.blocknumber = blocknumber
+        self.blockhash = blockhash
+        self.timestamp = timestamp
+        self.prev_badge_id = prev_badge_id
+        self.rolling_hash = rolling_hash
+
+
+class BlockHeaderBuilder:
+    """
+        Builds the header of the block that is being formed.
+        Every transaction taken into the block is folded into the rolling hash right away
+        (its own hash is computed once, when it is admitted to the mempool), so sealing
+        hashes one header.
+        tip is the (blockhash, blocknumber, badgeId) of the latest executed block. It is read
+        from mongo once and runs ahead of it afterwards, it is persisted with the blocks
+        themselves (BADGES and the CURR pointer).
+    """
+
+    def __init__(self):
+        self.tip : Optional[tuple[str, int, str]] = None
+        self.rolling_hash = EMPTY_ROLLING_HASH
+        self.count = 0
+
+    def begin(self) -> None:
+        self.rolling_hash = EMPTY_ROLLING_HASH
+        self.count = 0
+
+    def add(self, transaction : TxRecord) -> None:
+        self.rolling_hash = hashlib.sha256(self.rolling_hash + transaction.hash()).digest()
+        self.count += 1
+
+    def seal(self, timestamp : int, badge_id : str) -> BlockHeader:
+        """
+            Hashes the header on top of the tip and makes the new block the tip
+        """
+        prev_blockhash, prev_blocknumber, prev_badge_id = self.tip
+        blocknumber = prev_blocknumber + 1
+        data = blocknumber.to_bytes(8, 'little') + timestamp.to_bytes(8, 'little') + hex_to_bytes(prev_blockhash) + self.rolling_hash
+        blockhash = add_0x_prefix(hashlib.sha256(data).hexdigest())
+        header = BlockHeader(blocknumber=blocknumber, blockhash=blockhash, timestamp=timestamp, prev_badge_id=prev_badge_id,
+            rolling_hash=self.rolling_hash)
+        self.tip = (blockhash, blocknumber, badge_id)
+        self.begin()
+        return header
@@ -0,0 +1,156 @@
+from src.Types import BadgeExecutionCause
+from src.TxRecord import TxRecord
+from src.BlockCommitter import BlockCommit
+from src.PersistentNodeStore import TreeChangeset
+from src.Metrics import BLOCK_STAGE_SECONDS
+from typing import Awaitable, Callable, Optional, TypeVar, TYPE_CHECKING
+import asyncio
+import logging
+import os
+import time
+
+if TYPE_CHECKING:
+    from src.BlockController import BlockController
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_DEPTH = int(os.environ.get("PIPELINE_DEPTH", 2))
+PERSIST_MAX_ATTEMPTS = int(os.environ.get("PERSIST_MAX_ATTEMPTS", 5))
+PERSIST_RETRY_BACKOFF_S = float(os.environ.get("PERSIST_RETRY_BACKOFF_S", 0.5))
+
+T = TypeVar("T")
+
+
+class PipelineStopped(Exception):
+    """
+        The pipeline stopped after a failure, no block is produced until the sequencer is restarted
+    """
+
+
+class SealedBlock:
+    """
+        A block that was executed in memory and is handed down the pipeline
+    """
+
+    def __init__(self, block_commit : BlockCommit, transactions : list[TxRecord], included_transactions : list[TxRecord],
+                 failed_transactions : list[TxRecord], old_root : str, new_root : str, changeset : TreeChangeset, witness : dict, calldata : bytes):
+        self.block_commit = block_commit
+        self.transactions = transactions
+        self.included_transactions = included_transactions
+        self.failed_transactions = failed_transactions
+        self.old_root = old_root
+        self.new_root = new_root
+        self.changeset = changeset
+        self.witness = witness
+        # compact txData of the block's transfers
+        self.calldata = calldata
+
+    @property
+    def blocknumber(self) -> int:
+        return self.block_commit.badge.blocknumber
+
+    @property
+    def badge_id(self) -> str:
+        return self.block_commit.badge_id
+
+
+class BlockPipeline:
+    """
+        selection + execution -> persistence -> export
+
+        Execution is in memory, so block N+1 is executed against the post-state of
+        block N while N is still being written to mongo. Every stage is a single task
+        that works through a bounded queue, which keeps the blocks in order and makes
+        execution wait once PIPELINE_DEPTH blocks are waiting to be persisted.
+        Exporters are called with every persisted block, in block order.
+
+        The persistence steps are retried PERSIST_MAX_ATTEMPTS times with a doubling
+        backoff. If a stage still fails the pipeline stops: the in-memory state is ahead
+        of mongo then, so `failure` is set, submissions are refused and /health fails
+        until the sequencer is restarted from its checkpoint.
+    """
+
+    def __init__(self, block_controller : "BlockController", depth : int = PIPELINE_DEPTH, max_attempts : int = PERSIST_MAX_ATTEMPTS,
+                 retry_backoff_s : float = PERSIST_RETRY_BACKOFF_S):
+        self.block_controller = block_controller
+        self.max_attempts = max_attempts
+        self.retry_backoff_s = retry_backoff_s
+        self.failure : Optional[BaseException] = None
+        self.persist_queue : asyncio.Queue[SealedBlock] = asyncio.Queue(maxsize=depth)
+        self.export_queue : asyncio.Queue[SealedBlock] = asyncio.Queue(maxsize=depth)
+        self.exporters : list[Callable[[SealedBlock], Awaitable[None]]] = []
+
+    def check_running(self) -> None:
+        if self.failure is not None:
+            raise PipelineStopped(f"block production stopped : {self.failure}")
+
+    async def retry(self, operation : Callable[[], Awaitable[T]], description : str) -> T:
+        """
+            Runs an atomic persistence step, retrying it with a doubling backoff
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return await operation()
+            except Exception as e:
+                if attempt >= self.max_attempts:
+                    raise e
+                delay = self.retry_backoff_s * 2 ** (attempt - 1)
+                logger.warning(f"{description} failed (attempt {attempt} of {self.max_attempts}), retrying in {delay}s : {e}")
+                await asyncio.sleep(delay)
+
+    def add_exporter(self, exporter : Callable[[SealedBlock], Awaitable[None]]) -> None:
+        self.exporters.append(exporter)
+
+    async def _execute(self, execution_cause : BadgeExecutionCause, max_transactions : int, max_gas : int) -> list[TxRecord]:
+        sealed_block = await self.block_controller.execute_block(execution_cause=execution_cause, max_transactions=max_transactions, max_gas=max_gas)
+        await self.persist_queue.put(sealed_block)
+        return sealed_block.transactions
+
+    async def _persist_loop(self) -> None:
+        while True:
+            sealed_block = await self.persist_queue.get()
+            await self.block_controller.persist_block(sealed_block)
+            if len(self.exporters) > 0:
+                await self.export_queue.put(sealed_block)
+            self.persist_queue.task_done()
+
+    async def export_block(self, sealed_block : SealedBlock) -> None:
+        started_at = time.perf_counter()
+        for exporter in self.exporters:
+            try:
+                await exporter(sealed_block)
+            except Exception as e:
+                logger.error(f"exporting block {sealed_block.blocknumber} failed : {e}")
+        BLOCK_STAGE_SECONDS.observe(time.perf_counter() - started_at, labels=("export",))
+
+    async def _export_loop(self) -> None:
+        while True:
+            sealed_block = await self.export_queue.get()
+            await self.export_block(sealed_block)
+            self.export_queue.task_done()
+
+    async def run(self) -> None:
+        tasks = [
+            asyncio.create_task(self._persist_loop()),
+            asyncio.create_task(self._export_loop()),
+            asyncio.create_task(self.block_controller.scheduler.run(self._execute)),
+        ]
+        try:
+            # a failing stage stops the whole pipeline, the in-memory state is ahead of mongo then
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        except Exception as e:
+            self.failure = e
+            logger.error(f"block pipeline stopped : {e}")
+            raise e
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def drain(self) -> None:
+        """
+            Waits until every executed block is persisted and exported
+        """
+        await self.persist_queue.join()
+        await self.export_queue.join()
@@ -0,0 +1,162 @@
+from src.Types import BadgeExecutionCause, SchedulerSettings, SchedulerSettingsUpdate, SchedulerStatus
+from src.TxRecord import TxRecord
+from src.PendingPool import PendingPool
+from src.utils import estimate_l1_gas
+from typing import Awaitable, Callable, Optional
+import asyncio
+import logging
+import math
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+SMOOTHING = 0.2
+
+
+def settings_from_env() -> SchedulerSettings:
+    return SchedulerSettings(
+        max_block_size=int(os.environ.get("BLOCK_MAX_SIZE", 50)),
+        min_block_size=int(os.environ.get("BLOCK_MIN_SIZE", 1)),
+        max_latency_ms=int(os.environ.get("BLOCK_MAX_LATENCY_MS", 5000)),
+        target_interval_ms=int(os.environ.get("BLOCK_TARGET_INTERVAL_MS", 1000)),
+        max_gas=int(os.environ.get("BLOCK_MAX_GAS", 15_000_000)),
+        adaptive=os.environ.get("BLOCK_ADAPTIVE", "true").lower() == "true",
+    )
+
+
+class BlockScheduler:
+    """
+        Decides when the next block is sealed: as soon as the pending transactions
+        reach the target block size or the gas limit, or when the oldest pending
+        transaction waited max_latency_ms, whichever comes first.
+
+        With adaptive sizing the target is what arrives within one target interval,
+        or within one block formation if forming a block takes longer, so slow
+        blocks grow instead of falling behind. It stays within min/max block size.
+
+        Triggers only set an event, any number of them before the next block is
+        formed collapse into a single block.
+    """
+
+    def __init__(self, pending_pool : PendingPool, settings : Optional[SchedulerSettings] = None):
+        self.pending_pool = pending_pool
+        self.pending_pool.on_insert = self.notify_arrival
+        self.settings = settings if settings is not None else settings_from_env()
+        self.wakeup = asyncio.Event()
+        self.pending = 0
+        self.pending_gas = 0
+        self.first_pending_at : Optional[float] = None
+        self.arrivals_since_block = 0
+        self.last_block_at = time.monotonic()
+        self.arrival_rate = 0.0
+        self.formation_time = 0.0
+        self.blocks_observed = 0
+        self.target_block_size = self.settings.max_block_size
+
+    def notify_arrival(self, transaction : TxRecord) -> None:
+        self.pending += 1
+        self.pending_gas += estimate_l1_gas(transaction)
+        self.arrivals_since_block += 1
+        if self.first_pending_at is None:
+            self.first_pending_at = time.monotonic()
+            self.wakeup.set()
+        elif not self.wakeup.is_set() and self._due() is not None:
+            self.wakeup.set()
+
+    def _due(self) -> Optional[BadgeExecutionCause]:
+        if self.pending == 0:
+            return None
+        if not self.pending_pool.has_ready():
+            # only transfers waiting for a nonce gap are left, there is nothing to seal
+            self.pending = 0
+            self.pending_gas = 0
+            self.first_pending_at = None
+            return None
+        if self.pending >= self.target_block_size:
+            return BadgeExecutionCause.FILLEDUP
+        if self.pending_gas >= self.settings.max_gas:
+            return BadgeExecutionCause.GASLIMIT
+        if time.monotonic() >= self.first_pending_at + self.settings.max_latency_ms / 1000:
+            return BadgeExecutionCause.TIMEDOUT
+        return None
+
+    async def next_trigger(self) -> BadgeExecutionCause:
+        while True:
+            self.wakeup.clear()
+            cause = self._due()
+            if cause is not None:
+                return cause
+            timeout = None
+            if self.first_pending_at is not None:
+                timeout = max(0.0, self.first_pending_at + self.settings.max_latency_ms / 1000 - time.monotonic())
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def block_formed(self, selected : list[TxRecord], started_at : float) -> None:
+        now = time.monotonic()
+        elapsed = max(now - self.last_block_at, 1e-6)
+        self.arrival_rate = SMOOTHING * (self.arrivals_since_block / elapsed) + (1 - SMOOTHING) * self.arrival_rate
+        self.formation_time = SMOOTHING * (now - started_at) + (1 - SMOOTHING) * self.formation_time
+        self.arrivals_since_block = 0
+        self.last_block_at = now
+        self.blocks_observed += 1
+
+        if self.pending_pool.has_ready():
+            # leftovers arrived before the block started, their deadline counts from there at the latest
+            self.pending = max(0, self.pending - len(selected))
+            self.pending_gas = max(0, self.pending_gas - sum(estimate_l1_gas(t) for t in selected))
+            self.first_pending_at = started_at
+        else:
+            self.pending = 0
+            self.pending_gas = 0
+            self.first_pending_at = None
+        self._adapt()
+
+    def _adapt(self) -> None:
+        settings = self.settings
+        if not settings.adaptive or self.blocks_observed == 0:
+            self.target_block_size = settings.max_block_size
+            return
+        window = max(settings.target_interval_ms / 1000, self.formation_time)
+        target = math.ceil(self.arrival_rate * window)
+        self.target_block_size = min(settings.max_block_size, max(settings.min_block_size, target))
+
+    def update_settings(self, update : SchedulerSettingsUpdate) -> SchedulerSettings:
+        values = self.settings.model_dump()
+        values.update({key: value for key, value in update.model_dump().items() if value is not None})
+        settings = SchedulerSettings(**values)
+        if settings.min_block_size < 1 or settings.min_block_size > settings.max_block_size:
+            raise ValueError("min_block_size has to be between 1 and max_block_size")
+        if settings.max_latency_ms <= 0 or settings.max_gas <= 0:
+            raise ValueError("max_latency_ms and max_gas have to be positive")
+        self.settings = settings
+        self._adapt()
+        logger.info(f"block scheduler settings updated : {settings.model_dump()}")
+        # the new limits might already be reached
+        self.wakeup.set()
+        return settings
+
+    def status(self) -> SchedulerStatus:
+        return SchedulerStatus(
+            settings=self.settings,
+            target_block_size=self.target_block_size,
+            arrival_rate=self.arrival_rate,
+            formation_time_ms=self.formation_time * 1000,
+            pending=self.pending,
+            pending_gas=self.pending_gas,
+        )
+
+    async def run(self, form_block : Callable[[BadgeExecutionCause, int, int], Awaitable[list[TxRecord]]]) -> None:
+        """
+            form_block(cause, max_transactions, max_gas) seals one block and
+            returns the transactions it took from the mempool
+        """
+        while True:
+            cause = await self.next_trigger()
+            started_at = time.monotonic()
+            selected = await form_block(cause, self.target_block_size, self.settings.max_gas)
+            self.block_formed(selected=selected, started_at=started_at)
+
@@ -0,0 +1,140 @@
+from src.utils import hex_to_bytes, bytes_to_hex
+import struct
+
+"""
+    txData of submitBatch, same encoding as executor/lib/calldata (see its README for the spec).
+    Transactions are the dicts of the batch witness:
+        {"from", "to", "amount", "nonce", "signature": {"pubKey", "signature"}}
+
+    legacy  : u32 count | per tx from(20) to(20) amount(u64) nonce(u64) signature(65) pubKey(20), big endian
+    compact : 0x01 | u32 count | varint A | A addresses(20) | per tx varint from_index, varint to_index,
+              varint amount, varint nonce, signature(65)
+
+    The address table holds every sender and receiver once, in order of first appearance.
+    The signer is the sender, so the pubKey is not sent.
+"""
+
+COMPACT_VERSION = 1
+LEGACY_TX_SIZE = 141
+SIGNATURE_SIZE = 65
+ADDRESS_SIZE = 20
+
+
+def encode_varint(value : int) -> bytes:
+    """
+        unsigned LEB128: 7 bits per byte, least significant group first
+    """
+    if value < 0:
+        raise ValueError(f"varint can not encode negative value {value}")
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def decode_varint(data : bytes, offset : int) -> tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        if offset >= len(data):
+            raise ValueError("truncated varint")
+        if shift > 63:
+            raise ValueError("varint does not fit into u64")
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80 == 0:
+            if value >= 1 << 64:
+                raise ValueError("varint does not fit into u64")
+            return value, offset
+        shift += 7
+
+
+def _address(value : str) -> bytes:
+    address = hex_to_bytes(value)
+    if len(address) != ADDRESS_SIZE:
+        raise ValueError(f"{value} is not a 20 byte address")
+    return address
+
+
+def _signature(value : str) -> bytes:
+    signature = hex_to_bytes(value)
+    if len(signature) != SIGNATURE_SIZE:
+        raise ValueError(f"signature has {len(signature)} bytes instead of {SIGNATURE_SIZE}")
+    return signature
+
+
+def encode_legacy(transactions : list[dict]) -> bytes:
+    parts = [struct.pack(">I", len(transactions))]
+    for t in transactions:
+        parts += [_address(t["from"]), _address(t["to"]), struct.pack(">QQ", t["amount"], t["nonce"]),
+                  _signature(t["signature"]["signature"]), _address(t["signature"]["pubKey"])]
+    return b"".join(parts)
+
+
+def address_table(transactions : list[dict]) -> list[bytes]:
+    indices : dict[bytes, int] = {}
+    for t in transactions:
+        for field in ("from", "to"):
+            address = _address(t[field])
+            if address not in indices:
+                indices[address] = len(indices)
+    return list(indices)
+
+
+def encode_compact(transactions : list[dict]) -> bytes:
+    addresses = address_table(transactions)
+    indices = {address: i for i, address in enumerate(addresses)}
+    parts = [bytes([COMPACT_VERSION]), struct.pack(">I", len(transactions)), encode_varint(len(addresses))]
+    parts += addresses
+    for t in transactions:
+        parts += [encode_varint(indices[_address(t["from"])]), encode_varint(indices[_address(t["to"])]),
+                  encode_varint(t["amount"]), encode_varint(t["nonce"]), _signature(t["signature"]["signature"])]
+    return b"".join(parts)
+
+
+def decode_compact(data : bytes) -> list[dict]:
+    if len(data) < 5 or data[0] != COMPACT_VERSION:
+        raise ValueError("not a compact txData")
+    count = struct.unpack(">I", data[1:5])[0]
+    address_count, offset = decode_varint(data, 5)
+    if offset + address_count * ADDRESS_SIZE > len(data):
+        raise ValueError("truncated address table")
+    addresses = [data[offset + i * ADDRESS_SIZE: offset + (i + 1) * ADDRESS_SIZE] for i in range(address_count)]
+    offset += address_count * ADDRESS_SIZE
+    transactions = []
+    for _ in range(count):
+        from_index, offset = decode_varint(data, offset)
+        to_index, offset = decode_varint(data, offset)
+        amount, offset = decode_varint(data, offset)
+        nonce, offset = decode_varint(data, offset)
+        if from_index >= address_count or to_index >= address_count:
+            raise ValueError("address index out of range")
+        if offset + SIGNATURE_SIZE > len(data):
+            raise ValueError("truncated signature")
+        signature = data[offset:offset + SIGNATURE_SIZE]
+        offset += SIGNATURE_SIZE
+        sender = bytes_to_hex(addresses[from_index])
+        transactions.append({
+            "from": sender,
+            "to": bytes_to_hex(addresses[to_index]),
+            "amount": amount,
+            "nonce": nonce,
+            "signature": {"pubKey": sender, "signature": bytes_to_hex(signature)}
+        })
+    if offset != len(data):
+        raise ValueError(f"{len(data) - offset} trailing bytes after the transactions")
+    return transactions
+
+
+def calldata_gas(data : bytes) -> int:
+    """
+        EIP-2028: 16 gas per non-zero byte, 4 per zero byte
+    """
+    zero_bytes = data.count(0)
+    return zero_bytes * 4 + (len(data) - zero_bytes) * 16
@@ -1,71 +1,204 @@
 from web3 import Web3
-import sys
 import logging
-import json
 import asyncio
-import logging
+import os
+import time
+from typing import Optional
 from web3 import AsyncWeb3, AsyncHTTPProvider
+from web3.exceptions import BlockNotFound
 from eth_abi.abi import decode
+from eth_utils import keccak
+from src.AsyncMongoClient import get_mongo_client
 from src.MemPool import MemPool
-from src.utils import get_current_timestamp
+from src.Types import TransactionStatus
+from src.TxRecord import TxRecord
+from src.Metrics import DEPOSIT_LAG_BLOCKS, DEPOSIT_INGEST_LAG_SECONDS
+from src.utils import get_current_timestamp, generate_random_id
 
 logger = logging.getLogger(__name__)
 
+# DepositManager (solidity/contracts/Deposit.sol)
+DEPOSIT_MADE_TOPIC = "0x" + keccak(text="DepositMade(uint64,address,uint256,uint256)").hex()
+
+CURSOR_ID = "deposits"
+# (blocknumber, blockhash) of the last chunk ends kept to find the fork point of a reorg
+CURSOR_HISTORY = 128
+
+DEPOSIT_CONFIRMATIONS = int(os.environ.get("DEPOSIT_CONFIRMATIONS", 2))
+DEPOSIT_LOG_CHUNK = int(os.environ.get("DEPOSIT_LOG_CHUNK", 2000))
+DEPOSIT_START_BLOCK = int(os.environ.get("DEPOSIT_START_BLOCK", 0))
+
+WEI_PER_ETHER = 10 ** 18
 
 
 class ChainListener:
+    """
+        Ingests the DepositMade logs of the deposit contract.
+
+        The last processed L1 block is persisted (CHAIN_CURSOR), on start the listener
+        backfills from there with eth_getLogs over ranges of DEPOSIT_LOG_CHUNK blocks,
+        then follows the head. Only blocks with DEPOSIT_CONFIRMATIONS confirmations are read.
+        The deposits of a range are written in one bulk write together with the cursor,
+        so a crash never loses or duplicates a deposit.
+        When the block at the cursor is no longer canonical the cursor goes back to the
+        last block that still is, the pending deposits after it are dropped and read again.
+    """
 
-    def __init__(self, polling_interval : int, mempool : MemPool, node_addres : str, contract_address : str):
+    def __init__(self, polling_interval : int, mempool : MemPool, node_addres : str, contract_address : str,
+                 confirmations : int = DEPOSIT_CONFIRMATIONS, chunk_size : int = DEPOSIT_LOG_CHUNK, start_block : int = DEPOSIT_START_BLOCK):
         try:
             self.NODE_ADDRESS = node_addres
-            self.contract_address = contract_address
-            self.contract = self._init_contract()
-            if self.contract is None:
-                raise RuntimeError("Contract initialization failed")
+            self.contract_address = Web3.to_checksum_address(contract_address)
+            self.w3 = AsyncWeb3(AsyncHTTPProvider(self.NODE_ADDRESS))
             self.polling_interval = polling_interval
             self.mempool = mempool
-            self.web3_instance = Web3()
+            self.mongo_client = get_mongo_client()
+            self.confirmations = confirmations
+            self.chunk_size = chunk_size
+            self.start_block = start_block
+            self.cursor : Optional[dict] = None
         except Exception as e:
-            print(e)
             logger.error(f"Error occured in the system using : {e}")
             raise
-    
-
-    def load_abi(self):
-        with open('Rollup.json') as f:
-            abi = json.load(f)['abi']
-        return abi
-    
-    def _init_contract(self):
-        contract_abi = self.load_abi()
-        w3 = AsyncWeb3(AsyncHTTPProvider(self.NODE_ADDRESS))
-        checksum_address = Web3.to_checksum_address(self.contract_address)
-        return w3.eth.contract(address=checksum_address, abi=contract_abi)
-        
-    async def _init_deposit_event_filter(self):
-        return await self.contract.events.Deposit.create_filter(from_block='latest')
-
-    async def _init_withdraw_event_filter(self):
-        return await self.contract.events.Withdraw.create_filter(from_block='latest')
-    
-    async def handle_deposit_entries(self, deposit_entries):
-        for dep in deposit_entries:
-            logger.info("handling deposit event")
-            deposit_args = dep['args']
-            curr_time_stamp = get_current_timestamp()
-            address = deposit_args["layer2Address"]
-            amount = deposit_args["amount"]
-            in_eth = self.web3_instance.from_wei(amount, "ether")
-            await self.mempool.insert_deposit_transaction(address=address, amount=int(in_eth), current_time_stamp=curr_time_stamp)
+
+    def _cursor_collection(self):
+        return self.mongo_client[os.environ["DB_NAME"]][os.environ.get("CHAIN_CURSOR", "chain_cursor")]
+
+    async def load_cursor(self) -> dict:
+        if self.cursor is None:
+            cursor = await self._cursor_collection().find_one({"_id": CURSOR_ID})
+            if cursor is None:
+                cursor = {"_id": CURSOR_ID, "blocknumber": self.start_block - 1, "blockhash": None, "history": []}
+            self.cursor = cursor
+        return self.cursor
+
+    def decode_deposit(self, log, received_at : int) -> Optional[TxRecord]:
+        """
+            Rollup balances are whole ether, a deposit with a fraction of an ether is not
+            credited (None) and stays withdrawable on L1 through forceWithdraw
+        """
+        deposit_id = int.from_bytes(bytes(log["topics"][1]), "big")
+        user = Web3.to_checksum_address(bytes(log["topics"][2])[-20:])
+        amount, _ = decode(["uint256", "uint256"], bytes(log["data"]))
+        ether, remainder = divmod(amount, WEI_PER_ETHER)
+        if remainder != 0:
+            logger.warning(f"deposit {deposit_id} of {user} is {amount} wei, not a whole ether, it is not credited")
+            return None
+        return TxRecord(
+            transaction_id=generate_random_id(),
+            submission_id=generate_random_id(),
+            received_at=received_at,
+            sender=user,
+            receiver=None,
+            amount=ether,
+            nonce=None,
+            status=TransactionStatus.PENDING.value,
+            deposit_id=deposit_id,
+            l1_block=log["blockNumber"],
+            l1_block_hash=Web3.to_hex(log["blockHash"])
+        )
+
+    async def _get_logs(self, from_block : int, to_block : int) -> list:
+        return await self.w3.eth.get_logs({
+            "fromBlock": from_block,
+            "toBlock": to_block,
+            "address": self.contract_address,
+            "topics": [DEPOSIT_MADE_TOPIC]
+        })
+
+    async def _block_hash(self, blocknumber : int) -> Optional[str]:
+        """
+            None only when the node does not have the block (the chain got shorter),
+            RPC errors propagate and the caller retries, they are no sign of a reorg
+        """
+        try:
+            block = await self.w3.eth.get_block(blocknumber)
+        except BlockNotFound:
+            return None
+        return block["hash"].to_0x_hex()
+
+    async def check_reorg(self) -> None:
+        """
+            Moves the cursor back to the newest recorded block that is still canonical
+        """
+        cursor = await self.load_cursor()
+        if cursor["blockhash"] is None or await self._block_hash(cursor["blocknumber"]) == cursor["blockhash"]:
+            return
+        fork_block, fork_hash = self.start_block - 1, None
+        history = cursor["history"]
+        while len(history) > 0:
+            blocknumber, blockhash = history[-1]
+            if await self._block_hash(blocknumber) == blockhash:
+                fork_block, fork_hash = blocknumber, blockhash
+                break
+            history.pop()
+        logger.warning(f"L1 reorg detected, block {cursor['blocknumber']} is no longer canonical, rewinding the deposit cursor to {fork_block}")
+        dropped = await self.mempool.drop_deposits_after(fork_block)
+        logger.warning(f"dropped {len(dropped)} pending deposits of orphaned L1 blocks")
+        cursor_update = {"blocknumber": fork_block, "blockhash": fork_hash, "history": history}
+        await self._cursor_collection().update_one({"_id": CURSOR_ID}, {"$set": cursor_update}, upsert=True)
+        cursor.update(cursor_update)
+
+    async def _process_range(self, from_block : int, to_block : int) -> int:
+        logs = await self._get_logs(from_block, to_block)
+        to_block_data = await self.w3.eth.get_block(to_block)
+        to_hash = to_block_data["hash"].to_0x_hex()
+        received_at = get_current_timestamp()
+        deposits = [self.decode_deposit(log, received_at) for log in logs if not log.get("removed", False)]
+        deposits = [deposit for deposit in deposits if deposit is not None]
+
+        cursor = await self.load_cursor()
+        history = (cursor["history"] + [[to_block, to_hash]])[-CURSOR_HISTORY:]
+        cursor_update = {"blocknumber": to_block, "blockhash": to_hash, "history": history}
+
+        async def write_range(session) -> tuple[list[TxRecord], list[str]]:
+            written = await self.mempool.write_deposit_transactions(deposits, session=session)
+            await self._cursor_collection().update_one({"_id": CURSOR_ID}, {"$set": cursor_update}, upsert=True, session=session)
+            return written
+
+        async with await self.mongo_client.start_session() as session:
+            new_deposits, replaced = await session.with_transaction(write_range)
+        cursor.update(cursor_update)
+        self.mempool.discard_deposits(replaced)
+        self.mempool.queue_deposits(new_deposits)
+        if to_block_data.get("timestamp") is not None:
+            # the deposits of the range are at least as old as its last block
+            lag = max(0.0, time.time() - to_block_data["timestamp"])
+            for _ in new_deposits:
+                DEPOSIT_INGEST_LAG_SECONDS.observe(lag)
+        return len(new_deposits)
+
+    async def catch_up(self) -> int:
+        """
+            Reads every confirmed block after the cursor, returns the number of new deposits
+        """
+        await self.check_reorg()
+        cursor = await self.load_cursor()
+        head = await self.w3.eth.block_number
+        safe_block = head - self.confirmations
+        inserted = 0
+        # ranges are halved when the node refuses them, for the rest of this catch up
+        chunk_size = self.chunk_size
+        while cursor["blocknumber"] < safe_block:
+            from_block = cursor["blocknumber"] + 1
+            to_block = min(safe_block, from_block + chunk_size - 1)
+            try:
+                inserted += await self._process_range(from_block, to_block)
+            except Exception as e:
+                if chunk_size == 1:
+                    raise e
+                chunk_size = max(1, chunk_size // 2)
+                logger.warning(f"eth_getLogs of blocks {from_block}-{to_block} failed, retrying with ranges of {chunk_size} blocks : {e}")
+            DEPOSIT_LAG_BLOCKS.set(head - cursor["blocknumber"])
+        DEPOSIT_LAG_BLOCKS.set(head - cursor["blocknumber"])
+        if inserted > 0:
+            logger.info(f"ingested {inserted} deposits up to L1 block {cursor['blocknumber']}")
+        return inserted
 
     async def deposit_chain_loop(self):
-        deposit_event = await self._init_deposit_event_filter()
         while True:
-            entries = await deposit_event.get_new_entries()
-            await self.handle_deposit_entries(entries)
+            try:
+                await self.catch_up()
+            except Exception as e:
+                logger.error(f"deposit ingestion failed, retrying in {self.polling_interval}s : {e}")
             await asyncio.sleep(self.polling_interval)
-
-
-# if __name__ == "__main__":
-#     listener = ChainListener(2, mempool=MemPool())
-#     asyncio.run(listener.chain_loop())
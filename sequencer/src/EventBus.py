@@ -0,0 +1,179 @@
+from src.TxRecord import TxRecord
+from src.Types import TransactionStatus, BadgeStatus
+from src.utils import hex_to_bytes
+from collections import OrderedDict
+from typing import Iterable, Optional, TYPE_CHECKING
+import asyncio
+import logging
+import orjson
+import os
+
+if TYPE_CHECKING:
+    from src.BlockPipeline import SealedBlock
+
+logger = logging.getLogger(__name__)
+
+EVENT_BUFFER_SIZE = int(os.environ.get("EVENT_BUFFER_SIZE", 1024))
+EVENT_UNVERIFIED_BADGES = int(os.environ.get("EVENT_UNVERIFIED_BADGES", 4096))
+
+
+class Subscription:
+    """
+        One connection of the event stream. Events are JSON, serialized once when they
+        are published, and wait in a buffer of at most EVENT_BUFFER_SIZE events.
+    """
+
+    def __init__(self, addresses : set[bytes], submission_ids : set[str], badges : bool, buffer_size : int = EVENT_BUFFER_SIZE):
+        self.addresses = addresses
+        self.submission_ids = submission_ids
+        self.badges = badges
+        self.queue : asyncio.Queue[Optional[bytes]] = asyncio.Queue(maxsize=max(2, buffer_size))
+        self.evicted = False
+
+    async def next(self, timeout : float) -> Optional[bytes]:
+        """
+            The next event, b"" when none arrived within timeout, None once the subscription is closed
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return b""
+
+
+class EventBus:
+    """
+        Pushes status transitions and new badges to the subscribed connections.
+
+        Transaction events go to the subscriptions of their submission id, sender or
+        receiver; badge events to the subscriptions that asked for badges. Events are
+        published after the state they describe is committed to mongo:
+            MemPool           pending / invalid / failed of a submission or deposit
+            BlockController   included / failed of the block's transactions, the badge header
+            ProverCoordinator verified of the badges of a proof and their transactions
+        Publishing never waits for a connection, a subscription whose buffer is full is
+        evicted: its buffer is replaced by an evicted event and the stream is closed.
+    """
+
+    def __init__(self, buffer_size : int = EVENT_BUFFER_SIZE, unverified_badges : int = EVENT_UNVERIFIED_BADGES):
+        self.buffer_size = buffer_size
+        self.unverified_badges = unverified_badges
+        self.subscriptions : set[Subscription] = set()
+        self.by_address : dict[bytes, set[Subscription]] = {}
+        self.by_submission : dict[str, set[Subscription]] = {}
+        self.badge_subscriptions : set[Subscription] = set()
+        # badgeId -> included transactions, to publish them again once the badge is verified
+        self.unverified : OrderedDict[str, list[TxRecord]] = OrderedDict()
+        self.published = 0
+        self.evictions = 0
+
+    def subscribe(self, addresses : Iterable[str] = (), submission_ids : Iterable[str] = (), badges : bool = False) -> Subscription:
+        subscription = Subscription(addresses={hex_to_bytes(a) for a in addresses}, submission_ids=set(submission_ids),
+            badges=badges, buffer_size=self.buffer_size)
+        self.subscriptions.add(subscription)
+        for address in subscription.addresses:
+            self.by_address.setdefault(address, set()).add(subscription)
+        for submission_id in subscription.submission_ids:
+            self.by_submission.setdefault(submission_id, set()).add(subscription)
+        if badges:
+            self.badge_subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription : Subscription) -> None:
+        if subscription not in self.subscriptions:
+            return
+        self.subscriptions.discard(subscription)
+        self.badge_subscriptions.discard(subscription)
+        for index, keys in ((self.by_address, subscription.addresses), (self.by_submission, subscription.submission_ids)):
+            for key in keys:
+                subscribers = index.get(key)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if len(subscribers) == 0:
+                        del index[key]
+
+    def _deliver(self, subscriptions : Iterable[Subscription], data : bytes) -> None:
+        for subscription in list(subscriptions):
+            try:
+                subscription.queue.put_nowait(data)
+            except asyncio.QueueFull:
+                self._evict(subscription)
+        self.published += 1
+
+    def _evict(self, subscription : Subscription) -> None:
+        logger.info(f"evicting a slow event subscriber ({subscription.queue.qsize()} events buffered)")
+        self.unsubscribe(subscription)
+        subscription.evicted = True
+        self.evictions += 1
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(orjson.dumps({"type": "evicted"}))
+        subscription.queue.put_nowait(None)
+
+    def _transaction_subscribers(self, transaction : TxRecord) -> set[Subscription]:
+        subscribers = set()
+        for index, key in ((self.by_submission, transaction.submission_id), (self.by_address, transaction.sender_key),
+                           (self.by_address, transaction.receiver_key)):
+            if key is not None and key in index:
+                subscribers |= index[key]
+        return subscribers
+
+    def publish_transactions(self, transactions : Iterable[TxRecord], status : Optional[str] = None, blocknumber : Optional[int] = None) -> None:
+        """
+            One event per transaction, with the status of the record unless one is given
+        """
+        if len(self.subscriptions) == 0:
+            return
+        for t in transactions:
+            subscribers = self._transaction_subscribers(t)
+            if len(subscribers) == 0:
+                continue
+            self._deliver(subscribers, orjson.dumps({
+                "type": "transaction",
+                "submission_id": t.submission_id,
+                "transaction_id": t.transaction_id,
+                "sender": t.sender,
+                "receiver": t.receiver,
+                "status": status or t.status,
+                "blocknumber": blocknumber
+            }))
+
+    def publish_block(self, sealed_block : "SealedBlock") -> None:
+        badge = sealed_block.block_commit.badge
+        self.unverified[badge.badgeId] = sealed_block.included_transactions
+        while len(self.unverified) > self.unverified_badges:
+            self.unverified.popitem(last=False)
+        self.publish_transactions(sealed_block.included_transactions, status=TransactionStatus.INCLUDED.value, blocknumber=badge.blocknumber)
+        self.publish_transactions(sealed_block.failed_transactions, status=TransactionStatus.FAILED.value, blocknumber=badge.blocknumber)
+        if len(self.badge_subscriptions) > 0:
+            self._deliver(self.badge_subscriptions, orjson.dumps({
+                "type": "badge",
+                "badge_id": badge.badgeId,
+                "blocknumber": badge.blocknumber,
+                "blockhash": badge.blockhash,
+                "state_root": badge.state_root,
+                "timestamp": badge.timestamp,
+                "prev_badge": badge.prevBadge,
+                "transactions": len(badge.transactions),
+                "status": badge.status
+            }))
+
+    def publish_verified(self, badge_ids : list[str], blocknumbers : list[int], batch_id : int) -> None:
+        for badge_id, blocknumber in zip(badge_ids, blocknumbers):
+            transactions = self.unverified.pop(badge_id, [])
+            self.publish_transactions(transactions, status=TransactionStatus.VERIFIED.value, blocknumber=blocknumber)
+            if len(self.badge_subscriptions) > 0:
+                self._deliver(self.badge_subscriptions, orjson.dumps({
+                    "type": "badge",
+                    "badge_id": badge_id,
+                    "blocknumber": blocknumber,
+                    "batch_id": batch_id,
+                    "status": BadgeStatus.VERIFIED.value
+                }))
+
+    def stats(self) -> dict:
+        return {
+            "subscriptions": len(self.subscriptions),
+            "published": self.published,
+            "evictions": self.evictions,
+            "unverified_badges": len(self.unverified)
+        }
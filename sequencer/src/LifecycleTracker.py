@@ -0,0 +1,200 @@
+from src.TxRecord import TxRecord
+from collections import OrderedDict, deque
+from typing import Iterable, Optional
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+LIFECYCLE_WINDOW_S = float(os.environ.get("LIFECYCLE_WINDOW_S", 900))
+LIFECYCLE_MAX_TRACKED = int(os.environ.get("LIFECYCLE_MAX_TRACKED", 200_000))
+LIFECYCLE_MAX_SAMPLES = int(os.environ.get("LIFECYCLE_MAX_SAMPLES", 100_000))
+
+# per transaction
+RECEIVED, VERIFIED, SELECTED = 0, 1, 2
+
+"""
+    stage           from               to
+    verify          received           signature verified, admitted to the mempool
+    queue           verified           selected for a block
+    execute         selected           block committed to mongo
+    inclusion       received           block committed to mongo
+    prove_wait      block committed    proof started            (once per badge)
+    prove           proof started      proof finished           (once per badge)
+    submit          proof finished     submitBatch mined        (once per badge)
+    settlement      received           submitBatch mined
+"""
+STAGES = ("verify", "queue", "execute", "inclusion", "prove_wait", "prove", "submit", "settlement")
+
+
+class BadgeLifecycle:
+    __slots__ = ("blocknumber", "included_at", "proof_started_at", "proof_finished_at", "received")
+
+    def __init__(self, blocknumber : int, included_at : int, received : list[int]):
+        self.blocknumber = blocknumber
+        self.included_at = included_at
+        self.proof_started_at : Optional[int] = None
+        self.proof_finished_at : Optional[int] = None
+        # received time of every transaction of the badge, for the settlement latency
+        self.received = received
+
+
+class LifecycleTracker:
+    """
+        Monotonic timestamps (time.monotonic_ns) of every transaction from the moment it is
+        received until the submitBatch covering its badge is mined, and the time spent in
+        each stage over a sliding window of LIFECYCLE_WINDOW_S.
+
+        A transaction is tracked from submission until its badge is committed, then only its
+        received time is kept with the badge until the badge is verified. Invalid and failed
+        transactions are dropped, so are deposits of orphaned L1 blocks (discard). Transactions
+        that are not included within the window (held behind a nonce gap) expire.
+        At most LIFECYCLE_MAX_TRACKED transactions are in flight, submissions beyond that
+        are not tracked. Every stage keeps at most
+        LIFECYCLE_MAX_SAMPLES samples, the report sorts them on request.
+    """
+
+    def __init__(self, window_s : float = LIFECYCLE_WINDOW_S, max_tracked : int = LIFECYCLE_MAX_TRACKED, max_samples : int = LIFECYCLE_MAX_SAMPLES):
+        self.window_ns = int(window_s * 1e9)
+        self.max_tracked = max_tracked
+        # transactionId -> [received, verified, selected]
+        self.transactions : dict[str, list[int]] = {}
+        # badgeId -> lifecycle, badges that were committed and are not verified yet
+        self.badges : OrderedDict[str, BadgeLifecycle] = OrderedDict()
+        # stage -> (observed at, duration in ns)
+        self.samples : dict[str, deque[tuple[int, int]]] = {stage: deque(maxlen=max_samples) for stage in STAGES}
+        self.untracked = 0
+        self.expired = 0
+
+    def _observe(self, stage : str, now : int, duration : int) -> None:
+        self.samples[stage].append((now, duration))
+
+    def received(self, transactions : Iterable[TxRecord], verified : bool = False) -> None:
+        """
+            verified for transactions without a signature (deposits), they skip the verify stage
+        """
+        now = time.monotonic_ns()
+        for t in transactions:
+            if len(self.transactions) >= self.max_tracked:
+                self._expire(now)
+            if len(self.transactions) >= self.max_tracked:
+                self.untracked += 1
+                continue
+            self.transactions[t.transaction_id] = [now, now if verified else 0, 0]
+
+    def _expire(self, now : int) -> None:
+        """
+            Drops the transactions received before the window, the dict is in received order
+        """
+        expired = []
+        for transaction_id, timestamps in self.transactions.items():
+            if timestamps[RECEIVED] >= now - self.window_ns:
+                break
+            expired.append(transaction_id)
+        for transaction_id in expired:
+            del self.transactions[transaction_id]
+        self.expired += len(expired)
+
+    def discard(self, transaction_ids : Iterable[str]) -> None:
+        for transaction_id in transaction_ids:
+            self.transactions.pop(transaction_id, None)
+
+    def verified(self, transaction : TxRecord, admitted : bool) -> None:
+        timestamps = self.transactions.get(transaction.transaction_id)
+        if timestamps is None:
+            return
+        if not admitted:
+            del self.transactions[transaction.transaction_id]
+            return
+        now = time.monotonic_ns()
+        timestamps[VERIFIED] = now
+        self._observe("verify", now, now - timestamps[RECEIVED])
+
+    def selected(self, transactions : Iterable[TxRecord]) -> None:
+        now = time.monotonic_ns()
+        for t in transactions:
+            timestamps = self.transactions.get(t.transaction_id)
+            if timestamps is not None:
+                timestamps[SELECTED] = now
+                self._observe("queue", now, now - timestamps[VERIFIED])
+
+    def included(self, badge_id : str, blocknumber : int, transactions : Iterable[TxRecord], failed_transactions : Iterable[TxRecord]) -> None:
+        now = time.monotonic_ns()
+        received = []
+        for t in transactions:
+            timestamps = self.transactions.pop(t.transaction_id, None)
+            if timestamps is None:
+                continue
+            received.append(timestamps[RECEIVED])
+            if timestamps[SELECTED] > 0:
+                self._observe("execute", now, now - timestamps[SELECTED])
+            self._observe("inclusion", now, now - timestamps[RECEIVED])
+        for t in failed_transactions:
+            self.transactions.pop(t.transaction_id, None)
+        self.badges[badge_id] = BadgeLifecycle(blocknumber=blocknumber, included_at=now, received=received)
+        # badges that are never verified (failed proofs) must not pile up
+        while len(self.badges) > self.max_tracked:
+            self.badges.popitem(last=False)
+
+    def proof_started(self, badge_ids : Iterable[str]) -> None:
+        now = time.monotonic_ns()
+        for badge_id in badge_ids:
+            badge = self.badges.get(badge_id)
+            # a retried proof keeps the start of its first attempt
+            if badge is not None and badge.proof_started_at is None:
+                badge.proof_started_at = now
+                self._observe("prove_wait", now, now - badge.included_at)
+
+    def proof_finished(self, badge_ids : Iterable[str]) -> None:
+        now = time.monotonic_ns()
+        for badge_id in badge_ids:
+            badge = self.badges.get(badge_id)
+            if badge is not None and badge.proof_started_at is not None:
+                badge.proof_finished_at = now
+                self._observe("prove", now, now - badge.proof_started_at)
+
+    def settled(self, badge_ids : Iterable[str]) -> None:
+        now = time.monotonic_ns()
+        for badge_id in badge_ids:
+            badge = self.badges.pop(badge_id, None)
+            if badge is None:
+                continue
+            if badge.proof_finished_at is not None:
+                self._observe("submit", now, now - badge.proof_finished_at)
+            for received_at in badge.received:
+                self._observe("settlement", now, now - received_at)
+
+    def discard_badges(self, badge_ids : Iterable[str]) -> None:
+        for badge_id in badge_ids:
+            self.badges.pop(badge_id, None)
+
+    def report(self, window_s : Optional[float] = None) -> dict:
+        """
+            Percentiles of every stage over the last window_s seconds (at most LIFECYCLE_WINDOW_S)
+        """
+        now = time.monotonic_ns()
+        self._expire(now)
+        window_ns = self.window_ns if window_s is None else min(self.window_ns, int(window_s * 1e9))
+        stages = {}
+        for stage, samples in self.samples.items():
+            while len(samples) > 0 and samples[0][0] < now - self.window_ns:
+                samples.popleft()
+            durations = sorted(duration for observed_at, duration in samples if observed_at >= now - window_ns)
+            if len(durations) == 0:
+                stages[stage] = {"count": 0}
+                continue
+            stages[stage] = {
+                "count": len(durations),
+                "mean_ms": sum(durations) / len(durations) / 1e6,
+                **{f"p{p}_ms": durations[min(len(durations) - 1, int(p / 100 * len(durations)))] / 1e6 for p in (50, 90, 99)},
+                "max_ms": durations[-1] / 1e6
+            }
+        return {
+            "window_s": window_ns / 1e9,
+            "in_flight_transactions": len(self.transactions),
+            "unverified_badges": len(self.badges),
+            "untracked": self.untracked,
+            "expired": self.expired,
+            "stages": stages
+        }
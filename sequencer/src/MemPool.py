@@ -1,118 +1,253 @@
 
 from src.AsyncMongoClient import get_mongo_client
-from src.Types import Transaction, TransactionStatus, SubmissionResponse
+from src.Types import TransactionStatus, SubmissionResponse, AccountsCollection
+from src.TxRecord import TxRecord
 import logging
 import os
-from pymongo import DESCENDING
+from pymongo import ASCENDING, UpdateOne
 import asyncio
+from typing import Optional
 from src.TransactionValidator import Transaction_Validator
+from src.PendingPool import PendingPool
+from src.AccountStateStore import AccountStateStore
+from src.EventBus import EventBus
+from src.Metrics import TRANSACTIONS
+from src.LifecycleTracker import LifecycleTracker
 from src.utils import generate_random_id
 
 logger = logging.getLogger(__name__)
 
-BADGE_SIZE = int(os.environ["BADGE_SIZE"])
-
 
 class MemPool:
     """
-        This class should also save invalid transaction as stated in the zkSync Protocol
+        This class should also save invalid transaction as stated in the zkSync Protocol.
+        Pending transactions are selected from the in-memory PendingPool,
+        mongo only mirrors them for durability.
     """
 
-    def __init__(self):
+    def __init__(self, account_state : AccountStateStore, event_bus : Optional[EventBus] = None, lifecycle : Optional[LifecycleTracker] = None):
         self.mongo_client = get_mongo_client()
         self.validator = Transaction_Validator()
+        self.pending_pool = PendingPool(account_state=account_state)
+        self.event_bus = event_bus
+        self.lifecycle = lifecycle
     
 
-    async def insert_into_queue(self, transaction : Transaction, submisson_id) -> SubmissionResponse:
+    def _admit(self, transaction : TxRecord, transaction_valid : bool) -> bool:
+        """
+            Hands a transaction that is mirrored in mongo to the pool.
+            Returns False when its stored status is stale: a transfer with a valid
+            signature is stored as pending, but its nonce can still turn out to be
+            stale or taken, it fails then.
+        """
+        if not transaction_valid:
+            transaction.status = TransactionStatus.INVALID.value
+        elif self.pending_pool.insert(transaction):
+            transaction.status = TransactionStatus.PENDING.value
+        else:
+            # stale or duplicate nonce, it could never be executed
+            transaction.status = TransactionStatus.FAILED.value
+        TRANSACTIONS.inc(labels=(transaction.status,))
+        if self.lifecycle is not None:
+            self.lifecycle.verified(transaction, admitted=transaction.status == TransactionStatus.PENDING.value)
+        return transaction.status != TransactionStatus.FAILED.value
+
+    async def insert_into_queue(self, transaction : TxRecord, submisson_id) -> SubmissionResponse:
         
+        if self.lifecycle is not None:
+            self.lifecycle.received([transaction])
+        # hashed once here, the block only folds the hash into its rolling hash
+        transaction.hash()
         transaction_valid = await self.validator.check_transaction_validity(transaction= transaction, submission_id=submisson_id)
-        logger.info(transaction_valid)
         #transaction_valid = True
 
         async with await self.mongo_client.start_session(causal_consistency=True) as session:
                 try:
-                    logger.info(f"starting to insert the transaction into the queue ")
                     db = self.mongo_client[os.environ["DB_NAME"]]
-                    if transaction_valid:
-                        transaction.status = TransactionStatus.PENDING.value
-                    else:
-                        transaction.status = TransactionStatus.INVALID.value
-                    transaction_dict = transaction.model_dump()
                     trans_col = db[os.environ["TRANSACTIONS"]]
-                    await trans_col.insert_one(transaction_dict, session=session)
-                    logger.info("transaction successfully inserted into the queue")
+                    # stored before it enters the pool, a block can only include (and update) a stored transaction
+                    transaction.status = TransactionStatus.PENDING.value if transaction_valid else TransactionStatus.INVALID.value
+                    await trans_col.insert_one(transaction.to_document(), session=session)
+                    if not self._admit(transaction, transaction_valid):
+                        await trans_col.update_one({"transactionId": transaction.transaction_id},
+                            {"$set": {"status": transaction.status}}, session=session)
+                    logger.debug("submission %s inserted into the queue, valid : %s", submisson_id, transaction_valid)
+                    if self.event_bus is not None:
+                        self.event_bus.publish_transactions([transaction])
                     return SubmissionResponse(submission_id = submisson_id, valid = transaction_valid)
                 except Exception as e:
                     logger.error(f"Failed to process transaction: {e}")
                     raise e
     
+    async def insert_batch_into_queue(self, transactions : list[TxRecord]) -> list[bool]:
+        """
+            insert_into_queue for a batch: the signatures are checked in parallel and all
+            transactions are mirrored with one insert_many. They enter the pool in request
+            order, so consecutive nonces of one sender can share a batch.
+            Returns the validity of every transaction, the status is set on the records.
+        """
+        if self.lifecycle is not None:
+            self.lifecycle.received(transactions)
+        for transaction in transactions:
+            transaction.hash()
+        validity = await self.validator.check_transactions_validity(transactions)
+        try:
+            db = self.mongo_client[os.environ["DB_NAME"]]
+            trans_col = db[os.environ["TRANSACTIONS"]]
+            # stored before they enter the pool, see insert_into_queue
+            for transaction, transaction_valid in zip(transactions, validity):
+                transaction.status = TransactionStatus.PENDING.value if transaction_valid else TransactionStatus.INVALID.value
+            await trans_col.insert_many([t.to_document() for t in transactions], ordered=False)
+            failed = [t.transaction_id for t, transaction_valid in zip(transactions, validity) if not self._admit(t, transaction_valid)]
+            if len(failed) > 0:
+                await trans_col.update_many({"transactionId": {"$in": failed}}, {"$set": {"status": TransactionStatus.FAILED.value}})
+            logger.info(f"inserted a batch of {len(transactions)} transactions, {sum(validity)} with a valid signature")
+            if self.event_bus is not None:
+                self.event_bus.publish_transactions(transactions)
+        except Exception as e:
+            logger.error(f"Failed to process transaction batch: {e}")
+            raise e
+        return validity
+
     async def insert_deposit_transaction(self, address : str, amount : int , current_time_stamp : int):
-        submission_id = generate_random_id()
-        async with await self.mongo_client.start_session(causal_consistency=True) as session:
-            try:
-                deposit_transaction = Transaction(
-                    sender = address,
-                    amount = amount,
-                    receivedAt = current_time_stamp,
-                    submissionId = submission_id,
-                    transactionId=None,
-                    receiver=None,
-                    nonce=None,
-                    signature=None,
-                    status=TransactionStatus.PENDING.value,
-                    badgeId=None,
-                    pubKey = None
-                )
-                db = self.mongo_client[os.environ["DB_NAME"]]
-                trans_col = db[os.environ["TRANSACTIONS"]]
-                users_col = db[os.environ["USERS"]]
-                users_col.insert_one({"address" : address, "balance": amount, "nonce" : 0, "account_updates" :[]})
-                logger.info("new account leaf inserted due to deposit transaction")
-                trans_col.insert_one(deposit_transaction.model_dump())
-                logger.info("deposit transaction successfully included into the mempool queue")
-            except Exception as e:
-                logger.error(f"Deposit event could not be processed : {e}")
-        
+        deposit_transaction = TxRecord(
+            transaction_id=generate_random_id(),
+            submission_id=generate_random_id(),
+            received_at=current_time_stamp,
+            sender=address,
+            receiver=None,
+            amount=amount,
+            nonce=None,
+            status=TransactionStatus.PENDING.value
+        )
+        try:
+            async with await self.mongo_client.start_session(causal_consistency=True) as session:
+                await self.write_deposit_transactions([deposit_transaction], session=session)
+            self.queue_deposits([deposit_transaction])
+        except Exception as e:
+            logger.error(f"Deposit event could not be processed : {e}")
+
+    async def write_deposit_transactions(self, deposits : list[TxRecord], session=None) -> tuple[list[TxRecord], list[str]]:
+        """
+            Mirrors a chunk of deposits to mongo with one bulk write per collection.
+            A deposit is known when its depositId is stored with the same L1 block hash. A pending
+            one stored with another block hash was read from a block that got reorged away: it is
+            replaced. One that was already included is only kept when sender and amount match.
+            Returns the deposits that were written and the transaction ids of the replaced ones.
+            Depositors without an account get an empty one, the deposit itself is
+            credited when its block is executed.
+        """
+        if len(deposits) == 0:
+            return [], []
+        db = self.mongo_client[os.environ["DB_NAME"]]
+        trans_col = db[os.environ["TRANSACTIONS"]]
+        users_col = db[os.environ["USERS"]]
+        deposit_ids = [d.deposit_id for d in deposits if d.deposit_id is not None]
+        known = {}
+        if len(deposit_ids) > 0:
+            projection = {"_id": 0, "transactionId": 1, "depositId": 1, "l1BlockHash": 1, "sender": 1, "amount": 1, "status": 1}
+            async for doc in trans_col.find({"depositId": {"$in": deposit_ids}}, projection, session=session):
+                known[doc["depositId"]] = doc
+        new_deposits = []
+        replaced = []
+        for deposit in deposits:
+            stored = known.get(deposit.deposit_id) if deposit.deposit_id is not None else None
+            if stored is None:
+                new_deposits.append(deposit)
+            elif stored.get("l1BlockHash") == deposit.l1_block_hash:
+                continue
+            elif stored["status"] == TransactionStatus.PENDING.value:
+                replaced.append(stored["transactionId"])
+                new_deposits.append(deposit)
+            elif (stored["sender"], stored["amount"]) != (deposit.sender, deposit.amount):
+                logger.error(f"deposit {deposit.deposit_id} was included from another L1 block with a different sender or amount")
+        if len(replaced) > 0:
+            await trans_col.delete_many({"transactionId": {"$in": replaced}}, session=session)
+        if len(new_deposits) == 0:
+            return [], replaced
+        await trans_col.insert_many([d.to_document() for d in new_deposits], ordered=False, session=session)
+        accounts = {d.sender: AccountsCollection(address=d.sender, balance=0, nonce=0) for d in new_deposits}
+        await users_col.bulk_write(
+            [UpdateOne({"address": address}, {"$setOnInsert": account.model_dump()}, upsert=True) for address, account in accounts.items()],
+            ordered=False, session=session
+        )
+        return new_deposits, replaced
+
+    def queue_deposits(self, deposits : list[TxRecord]) -> None:
+        if self.lifecycle is not None:
+            self.lifecycle.received(deposits, verified=True)
+        for deposit in deposits:
+            self.pending_pool.insert(deposit)
+        if self.event_bus is not None:
+            self.event_bus.publish_transactions(deposits)
+        if len(deposits) > 0:
+            TRANSACTIONS.inc(len(deposits), labels=(TransactionStatus.PENDING.value,))
+            logger.info(f"{len(deposits)} deposit transactions successfully included into the mempool queue")
+
+    async def drop_deposits_after(self, l1_block : int) -> list[str]:
+        """
+            Removes the pending deposits of orphaned L1 blocks after a reorg.
+            Returns their transaction ids.
+        """
+        db = self.mongo_client[os.environ["DB_NAME"]]
+        trans_col = db[os.environ["TRANSACTIONS"]]
+        orphaned = {"receiver": None, "l1Block": {"$gt": l1_block}}
+        dropped = await trans_col.distinct("transactionId", {**orphaned, "status": TransactionStatus.PENDING.value})
+        included = await trans_col.count_documents({**orphaned, "status": {"$ne": TransactionStatus.PENDING.value}})
+        if included > 0:
+            logger.error(f"{included} deposits of orphaned L1 blocks were already included in a badge")
+        if len(dropped) > 0:
+            await trans_col.delete_many({"transactionId": {"$in": dropped}})
+            self.discard_deposits(dropped)
+        return dropped
+
+    def discard_deposits(self, transaction_ids : list[str]) -> None:
+        """
+            Takes pending deposits that were removed from mongo out of the pool
+        """
+        if len(transaction_ids) > 0:
+            self.pending_pool.remove_deposits(set(transaction_ids))
+            if self.lifecycle is not None:
+                self.lifecycle.discard(transaction_ids)
+
     #async def insert_withdraw_transaction(self, )
 
-    async def get_transaction_for_badge(self, last_timestamp = None) -> list[Transaction]:
-        async with await self.mongo_client.start_session(causal_consistency=True) as session:
-                try:
-                    db = self.mongo_client[os.environ["DB_NAME"]]
-                    trans_col =  db[os.environ["TRANSACTIONS"]]
-
-                    cursor = None
-                    if last_timestamp:
-                        cursor = trans_col.find(
-                        {
-                            "status": TransactionStatus.PENDING.value,
-                            "receivedAt": {"$gt": last_timestamp}
-                        }
-                        ).sort("receivedAt", DESCENDING).limit(BADGE_SIZE)
-                    else: 
-                        cursor = trans_col.find(
-                            {"status": TransactionStatus.PENDING.value},
-                        ).sort("receivedAt", DESCENDING).limit(BADGE_SIZE)
-                    
-                    logger.info("retrieving the next badge of transactions")
-                    
-                    transactions = []
-                    async for doc in cursor:
-                        transaction = Transaction(**doc)
-                        transactions.append(transaction)
-
-                    transaction_ids = [trans.transactionId for trans in transactions]
-
-                    await trans_col.update_many(
-                        {'transactionId': {'$in': transaction_ids}}, 
-                        {'$set': {'status': TransactionStatus.INCLUDED.value}},
-                        session=session
-                    )
-                    
-                    logger.info("changed the status of the documents from pending to included")
-                    return transactions
-                
-                except Exception as e:
-                    logger.error(f"Failed to retrieve badge ids from queue: {e}")
-                    return []
-    
+    async def load_pending_transactions(self) -> None:
+        """
+            Rebuilds the in-memory pool from the pending transactions mirrored in mongo,
+            call it after the account state is loaded
+        """
+        try:
+            db = self.mongo_client[os.environ["DB_NAME"]]
+            trans_col = db[os.environ["TRANSACTIONS"]]
+            cursor = trans_col.find({"status": TransactionStatus.PENDING.value}, {"_id": 0}).sort("receivedAt", ASCENDING)
+            rejected = []
+            async for doc in cursor:
+                transaction = TxRecord.from_document(doc)
+                if not self.pending_pool.insert(transaction):
+                    rejected.append(transaction.transaction_id)
+            if len(rejected) > 0:
+                await trans_col.update_many({"transactionId": {"$in": rejected}}, {"$set": {"status": TransactionStatus.FAILED.value}})
+            logger.info(f"loaded {len(self.pending_pool)} pending transactions into the mempool, {len(rejected)} could never execute")
+        except Exception as e:
+            logger.error(f"Failed to load the pending transactions : {e}")
+            raise e
+
+    def get_transaction_for_badge(self, limit : int, max_gas : int) -> list[TxRecord]:
+        """
+            Deposits first, then transfers in arrival order where every sender's
+            transfers follow its nonces. The status changes are committed together with the block.
+        """
+        transactions = self.pending_pool.select(limit, max_gas=max_gas)
+        if self.lifecycle is not None:
+            self.lifecycle.selected(transactions)
+        logger.info(f"selected {len(transactions)} transactions for the next badge, {self.pending_pool.held()} wait for a nonce gap")
+        return transactions
+
+    def after_block(self, transactions : list[TxRecord], failed_transactions : list[TxRecord]) -> list[TxRecord]:
+        """
+            Returns the pending transactions that can no longer execute after the block
+        """
+        senders = {t.sender_key for t in transactions if t.receiver is not None}
+        failed_senders = {t.sender_key for t in failed_transactions if t.receiver is not None}
+        return self.pending_pool.after_block(senders=senders, failed_senders=failed_senders)
@@ -0,0 +1,374 @@
+from pymongo import InsertOne, UpdateOne, UpdateMany, DeleteOne, DeleteMany, ASCENDING
+from bson import ObjectId, encode, decode
+from typing import Any, Optional
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+"""
+    In-process stand-in for the motor client (MONGO_BACKEND=memory), for benchmarks and
+    local runs without a mongo server. It covers the operations and query / update
+    operators the sequencer uses. Documents are copied through BSON on every write and
+    read like they are on the wire, fields with a created index get a hash index for
+    equality and $in lookups. MEMORY_MONGO_LATENCY_MS adds a round trip to every call.
+    Transactions run one at a time and are not rolled back when they fail.
+"""
+
+MEMORY_MONGO_LATENCY_MS = float(os.environ.get("MEMORY_MONGO_LATENCY_MS", 0))
+
+_MISSING = object()
+
+
+def _copy(doc : dict) -> dict:
+    return decode(encode(doc))
+
+
+def _compare(value, operand) -> Optional[int]:
+    try:
+        return (value > operand) - (value < operand)
+    except TypeError:
+        return None
+
+
+def _matches_condition(value, condition) -> bool:
+    if isinstance(condition, dict) and len(condition) > 0 and next(iter(condition)).startswith("$"):
+        for op, operand in condition.items():
+            if op == "$in":
+                if (None if value is _MISSING else value) not in operand:
+                    return False
+            elif op == "$nin":
+                if (None if value is _MISSING else value) in operand:
+                    return False
+            elif op == "$ne":
+                if (None if value is _MISSING else value) == operand:
+                    return False
+            elif op == "$exists":
+                if (value is not _MISSING) != bool(operand):
+                    return False
+            elif op in ("$gt", "$gte", "$lt", "$lte"):
+                if value is _MISSING or value is None:
+                    return False
+                c = _compare(value, operand)
+                if c is None or not {"$gt": c > 0, "$gte": c >= 0, "$lt": c < 0, "$lte": c <= 0}[op]:
+                    return False
+            else:
+                raise NotImplementedError(f"query operator {op} is not supported by the memory stand-in")
+        return True
+    if value is _MISSING:
+        return condition is None
+    return value == condition
+
+
+def matches(doc : dict, query : dict) -> bool:
+    for field, condition in query.items():
+        if not _matches_condition(doc.get(field, _MISSING), condition):
+            return False
+    return True
+
+
+def _project(doc : dict, projection : Optional[dict]) -> dict:
+    if not projection:
+        return _copy(doc)
+    include_id = projection.get("_id", 1)
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if any(fields.values()):
+        projected = {k: doc[k] for k in fields if k in doc}
+        if include_id and "_id" in doc:
+            projected["_id"] = doc["_id"]
+    else:
+        projected = {k: v for k, v in doc.items() if k not in fields and (include_id or k != "_id")}
+    return _copy(projected)
+
+
+def _apply_update(doc : dict, update : dict, inserting : bool) -> None:
+    for op, fields in update.items():
+        for field, value in fields.items():
+            if op == "$set":
+                doc[field] = value
+            elif op == "$setOnInsert":
+                if inserting:
+                    doc[field] = value
+            elif op == "$unset":
+                doc.pop(field, None)
+            elif op == "$inc":
+                doc[field] = doc.get(field, 0) + value
+            elif op == "$push":
+                doc.setdefault(field, []).append(value)
+            elif op == "$min":
+                if field not in doc or value < doc[field]:
+                    doc[field] = value
+            elif op == "$max":
+                if field not in doc or value > doc[field]:
+                    doc[field] = value
+            else:
+                raise NotImplementedError(f"update operator {op} is not supported by the memory stand-in")
+
+
+class MemoryCursor:
+
+    def __init__(self, collection : "MemoryCollection", query : dict, projection : Optional[dict], session=None):
+        self.collection = collection
+        self.query = query
+        self.projection = projection
+        self.session = session
+        self.sort_keys : list[tuple[str, int]] = []
+        self.limit_count = 0
+
+    def sort(self, key, direction : int = ASCENDING) -> "MemoryCursor":
+        self.sort_keys = list(key) if isinstance(key, list) else [(key, direction)]
+        return self
+
+    def limit(self, count : int) -> "MemoryCursor":
+        self.limit_count = count
+        return self
+
+    def _documents(self) -> list[dict]:
+        docs = self.collection._select(self.query)
+        for key, direction in reversed(self.sort_keys):
+            docs.sort(key=lambda d: (d.get(key) is not None, d.get(key)), reverse=direction < 0)
+        if self.limit_count > 0:
+            docs = docs[:self.limit_count]
+        return [_project(d, self.projection) for d in docs]
+
+    async def to_list(self, length : Optional[int] = None) -> list[dict]:
+        await self.collection.client._round_trip(self.session)
+        docs = self._documents()
+        return docs if length is None else docs[:length]
+
+    async def __aiter__(self):
+        await self.collection.client._round_trip(self.session)
+        for doc in self._documents():
+            yield doc
+
+
+class MemoryResult:
+
+    def __init__(self, **fields):
+        self.acknowledged = True
+        self.__dict__.update(fields)
+
+
+class MemoryCollection:
+
+    def __init__(self, client : "MemoryMongoClient", name : str):
+        self.client = client
+        self.name = name
+        self.documents : dict[Any, dict] = {}
+        # _id -> insertion position, reads return documents in insertion order like a collection scan
+        self.positions : dict[Any, int] = {}
+        self.next_position = 0
+        # field -> value -> _ids, for the first field of every created index
+        self.indexes : dict[str, dict[Any, set]] = {}
+
+    def _index_add(self, doc : dict) -> None:
+        for field, index in self.indexes.items():
+            value = doc.get(field)
+            try:
+                index.setdefault(value, set()).add(doc["_id"])
+            except TypeError:
+                pass
+
+    def _index_remove(self, doc : dict) -> None:
+        for field, index in self.indexes.items():
+            value = doc.get(field)
+            try:
+                ids = index.get(value)
+            except TypeError:
+                continue
+            if ids is not None:
+                ids.discard(doc["_id"])
+                if len(ids) == 0:
+                    del index[value]
+
+    def _candidates(self, query : dict) -> Optional[set]:
+        _id = query.get("_id", _MISSING)
+        if _id is not _MISSING and not isinstance(_id, dict):
+            return {_id} if _id in self.documents else set()
+        for field, condition in query.items():
+            index = self.indexes.get(field)
+            if index is None:
+                continue
+            if isinstance(condition, dict) and "$in" in condition:
+                ids = set()
+                for value in condition["$in"]:
+                    ids |= index.get(value, set())
+                return ids
+            if not isinstance(condition, dict):
+                return set(index.get(condition, set()))
+        return None
+
+    def _select(self, query : dict) -> list[dict]:
+        ids = self._candidates(query)
+        if ids is None:
+            return [d for d in self.documents.values() if matches(d, query)]
+        docs = [self.documents[i] for i in ids]
+        docs.sort(key=lambda d: self.positions[d["_id"]])
+        return [d for d in docs if matches(d, query)]
+
+    def _insert(self, doc : dict) -> Any:
+        if "_id" not in doc:
+            doc["_id"] = ObjectId()
+        if doc["_id"] in self.documents:
+            raise ValueError(f"duplicate key _id {doc['_id']} in {self.name}")
+        stored = _copy(doc)
+        self.positions[stored["_id"]] = self.next_position
+        self.next_position += 1
+        self.documents[stored["_id"]] = stored
+        self._index_add(stored)
+        return doc["_id"]
+
+    def _update(self, query : dict, update : dict, upsert : bool, many : bool) -> MemoryResult:
+        docs = self._select(query)
+        if not many:
+            docs = docs[:1]
+        for doc in docs:
+            self._index_remove(doc)
+            _apply_update(doc, _copy(update), inserting=False)
+            self._index_add(doc)
+        upserted_id = None
+        if len(docs) == 0 and upsert:
+            doc = {k: v for k, v in query.items() if not (isinstance(v, dict) and len(v) > 0 and next(iter(v)).startswith("$"))}
+            _apply_update(doc, _copy(update), inserting=True)
+            upserted_id = self._insert(doc)
+        return MemoryResult(matched_count=len(docs), modified_count=len(docs), upserted_id=upserted_id)
+
+    def _delete(self, query : dict, many : bool) -> int:
+        docs = self._select(query)
+        if not many:
+            docs = docs[:1]
+        for doc in docs:
+            self._index_remove(doc)
+            del self.documents[doc["_id"]]
+            del self.positions[doc["_id"]]
+        return len(docs)
+
+    async def create_index(self, keys, **kwargs) -> str:
+        field = keys if isinstance(keys, str) else keys[0][0]
+        if field not in self.indexes:
+            self.indexes[field] = {}
+            for doc in self.documents.values():
+                self._index_add(doc)
+        return field
+
+    async def insert_one(self, document : dict, session=None) -> MemoryResult:
+        await self.client._round_trip(session)
+        return MemoryResult(inserted_id=self._insert(document))
+
+    async def insert_many(self, documents : list[dict], ordered : bool = True, session=None) -> MemoryResult:
+        await self.client._round_trip(session)
+        return MemoryResult(inserted_ids=[self._insert(d) for d in documents])
+
+    async def find_one(self, filter : Optional[dict] = None, projection : Optional[dict] = None, sort : Optional[list] = None, session=None) -> Optional[dict]:
+        cursor = self.find(filter, projection, session=session).limit(1)
+        if sort is not None:
+            cursor.sort(sort)
+        docs = await cursor.to_list()
+        return docs[0] if len(docs) > 0 else None
+
+    def find(self, filter : Optional[dict] = None, projection : Optional[dict] = None, session=None) -> MemoryCursor:
+        return MemoryCursor(self, filter or {}, projection, session=session)
+
+    async def update_one(self, filter : dict, update : dict, upsert : bool = False, session=None) -> MemoryResult:
+        await self.client._round_trip(session)
+        return self._update(filter, update, upsert=upsert, many=False)
+
+    async def update_many(self, filter : dict, update : dict, upsert : bool = False, session=None) -> MemoryResult:
+        await self.client._round_trip(session)
+        return self._update(filter, update, upsert=upsert, many=True)
+
+    async def delete_many(self, filter : dict, session=None) -> MemoryResult:
+        await self.client._round_trip(session)
+        return MemoryResult(deleted_count=self._delete(filter, many=True))
+
+    async def bulk_write(self, requests : list, ordered : bool = True, session=None) -> MemoryResult:
+        await self.client._round_trip(session)
+        inserted = matched = deleted = 0
+        for request in requests:
+            if isinstance(request, InsertOne):
+                self._insert(request._doc)
+                inserted += 1
+            elif isinstance(request, (UpdateOne, UpdateMany)):
+                result = self._update(request._filter, request._doc, upsert=bool(request._upsert), many=isinstance(request, UpdateMany))
+                matched += result.matched_count
+            elif isinstance(request, (DeleteOne, DeleteMany)):
+                deleted += self._delete(request._filter, many=isinstance(request, DeleteMany))
+            else:
+                raise NotImplementedError(f"{type(request).__name__} is not supported by the memory stand-in")
+        return MemoryResult(inserted_count=inserted, matched_count=matched, modified_count=matched, deleted_count=deleted)
+
+    async def distinct(self, key : str, filter : Optional[dict] = None, session=None) -> list:
+        await self.client._round_trip(session)
+        values = []
+        for doc in self._select(filter or {}):
+            value = doc.get(key)
+            if value is not None and value not in values:
+                values.append(value)
+        return values
+
+    async def count_documents(self, filter : dict, session=None) -> int:
+        await self.client._round_trip(session)
+        return len(self._select(filter))
+
+
+class MemoryDatabase:
+
+    def __init__(self, client : "MemoryMongoClient", name : str):
+        self.client = client
+        self.name = name
+        self.collections : dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name : str) -> MemoryCollection:
+        collection = self.collections.get(name)
+        if collection is None:
+            collection = MemoryCollection(self.client, name)
+            self.collections[name] = collection
+        return collection
+
+
+class MemorySession:
+
+    def __init__(self, client : "MemoryMongoClient"):
+        self.client = client
+        # calls made with this session, see Metrics.MongoCommandCounter
+        self.round_trips = 0
+
+    async def __aenter__(self) -> "MemorySession":
+        return self
+
+    async def __aexit__(self, *exc) -> bool:
+        return False
+
+    async def with_transaction(self, callback, *args, **kwargs):
+        async with self.client.transaction_lock:
+            return await callback(self)
+
+
+class MemoryMongoClient:
+
+    def __init__(self, latency_ms : float = MEMORY_MONGO_LATENCY_MS):
+        self.latency_ms = latency_ms
+        self.databases : dict[str, MemoryDatabase] = {}
+        self.transaction_lock = asyncio.Lock()
+        self.round_trips = 0
+
+    async def _round_trip(self, session : Optional[MemorySession] = None) -> None:
+        self.round_trips += 1
+        if session is not None:
+            session.round_trips += 1
+        if self.latency_ms > 0:
+            await asyncio.sleep(self.latency_ms / 1000)
+
+    def __getitem__(self, name : str) -> MemoryDatabase:
+        database = self.databases.get(name)
+        if database is None:
+            database = MemoryDatabase(self, name)
+            self.databases[name] = database
+        return database
+
+    async def start_session(self, **kwargs) -> MemorySession:
+        return MemorySession(self)
+
+    async def drop_database(self, name : str) -> None:
+        self.databases.pop(name, None)
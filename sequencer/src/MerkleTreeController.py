@@ -1,49 +1,58 @@
 
-from src.Types import Transaction, AccountsCollection
+from src.TxRecord import TxRecord
 import json
 import hashlib
-from smt.tree import SparseMerkleTree
+from src.StateTree import StateTree
+from src.PersistentNodeStore import PersistentNodeStore, TreeChangeset
 from  src.AsyncMongoClient import get_mongo_client
+from pymongo import UpdateOne
 import os
 import logging
+import asyncio
+from typing import Optional
 from src.utils import hex_to_bytes, bytes_to_hex
+from src.AccountStateStore import AccountStateStore, AccountState
+from src.Metrics import INVARIANT_FAILURES
 
 logger = logging.getLogger(__name__)
 
 class MerkleTreeController:
 
     def __init__(self, with_account_setup : bool):
+        self.account_state = AccountStateStore()
+        self.dirty_leaves = {}
+        self.node_store = PersistentNodeStore(os.environ["STATE_DB_PATH"])
+        # block whose execution produced the current root
+        self.state_blocknumber = 0
+        # the tree was restored from an earlier checkpoint instead of the genesis accounts
+        self.restored = False
         if with_account_setup:
-            self.sparse_merkle_tree = self.initilize_sparse_merkle_tree()
-        else:
-            self.sparse_merkle_tree = SparseMerkleTree()
+            self.account_state.load_from_state_json("funded_accounts.json")
+        self.sparse_merkle_tree = self.initilize_sparse_merkle_tree()
         self.mongo_client = get_mongo_client()
 
     
-    async def make_rollup_transaction_between_existing_users(self, badge_id : str, transaction : Transaction) -> None:
+    async def make_rollup_transaction_between_existing_users(self, badge_id : str, transaction : TxRecord) -> None:
         """
             Implements the rollup Operation: Transfer funds between Existing rollup accounts
         """
-        invariants_succeded = await self._check_tree_invariants_for_update(transaction=transaction)
+        invariants_succeded = self._check_tree_invariants_for_update(transaction=transaction)
         if not invariants_succeded:
-            logger.info(f"in badge : {badge_id} and transaction: {transaction.transactionId} did not pass the invariants")
-            logger.error("invariants problem: tree invariants failed")
+            INVARIANT_FAILURES.inc()
+            logger.info(f"in badge : {badge_id} and transaction: {transaction.transaction_id} did not pass the invariants")
             raise Exception("Tree invariants failed")
         try:
-            new_sender_leaf_data = await self.update_sender_leaf_return_bytes(badge_id=badge_id, transaction=transaction)
-            self.sparse_merkle_tree.update(hex_to_bytes(transaction.sender), new_sender_leaf_data)
-            new_receiver_leaf = await self.update_receiver_bytes_return_bytes(badge_id=badge_id, transaction=transaction)
-            self.sparse_merkle_tree.update(hex_to_bytes(transaction.receiver), new_receiver_leaf)
+            sender, receiver = self.account_state.apply_transfer(badge_id=badge_id, transaction=transaction)
+            self.dirty_leaves[sender.key] = sender
+            self.dirty_leaves[receiver.key] = receiver
         except Exception as e:
             logger.error(f"Error when updating leaf data : {e}")
             raise e
     
-    async def handle_deposit_transaction(self, badge_id : str, transaction : Transaction) -> None:
+    async def handle_deposit_transaction(self, badge_id : str, transaction : TxRecord) -> None:
         try:
-            new_leaf_data= await self.leaf_to_bytes(balance=transaction.amount, nonce=0, account=transaction.sender)
-            logger.info(new_leaf_data)
-            logger.info(type(new_leaf_data))
-            self.sparse_merkle_tree.update(hex_to_bytes(transaction.sender), new_leaf_data)
+            account = self.account_state.apply_deposit(badge_id=badge_id, transaction=transaction)
+            self.dirty_leaves[account.key] = account
         except Exception as e :
             logger.error(f"Error when inserting deposit into the tree: {e}")
             raise e
@@ -52,210 +61,124 @@ class MerkleTreeController:
     def get_merkle_root(self) -> str:
         return self.sparse_merkle_tree.root_as_hex()
 
-    
-    async def update_sender_leaf_return_bytes(self, badge_id : str, transaction : Transaction) -> bytes:
-        async with await self.mongo_client.start_session(causal_consistency=True) as session:
-                try:
-                    logger.info(f"updating sender leaf data for change log")
-                    db = self.mongo_client[os.environ["DB_NAME"]]
-                    users_col = db[os.environ["USERS"]]
-                    prev_sender = await users_col.find_one({
-                         "address": transaction.sender,
-                    })
-                    account_updates = prev_sender.get("account_updates", [])
-                    update_index = None
-                    for acc in range(0, len(account_updates)):
-                        if account_updates[acc].get(("badgeId") == badge_id):
-                            update_index = acc
-
-                    if update_index is not None:
-                        new_balance = prev_sender.account_updates[update_index] - transaction.amount
-                        new_nonce = prev_sender.account_updates[update_index]["nonce_before"] + 1
-                        await users_col.update_one(
-                                {
-                                    "address": transaction.sender,
-                                    "account_updates.badgeId": badge_id
-                                },
-                                {
-                                    "$set": {
-                                        "account_updates.$.balance_after": new_balance,
-                                        "account_updates.$.nonce_after": new_nonce
-                                    },
-                                    "$push": {
-                                        "account_updates.$.transactions": transaction.transactionId
-                                    }
-                                },
-                                session=session
-                            )
-                        new_leaf_bytes =  await self.leaf_to_bytes(new_balance, new_nonce, account=transaction.sender)
-                        return new_leaf_bytes
-                    else:
-                            balance_before = None
-                            nonce_before = None
-                            if len(account_updates) == 0:
-                                balance_before = prev_sender["balance"]
-                                nonce_before = prev_sender["nonce"]
-                            else :
-                                last_sub = prev_sender["account_updates"][len(account_updates) -2]
-                                balance_before = last_sub["balance_after"]
-                                nonce_before = last_sub["nonce_after"]
-                            
-                            new_balance = balance_before - transaction.amount #+ transaction.fee)
-                            new_nonce = nonce_before + 1
-
-                            await users_col.update_one(
-                                {"address": transaction.sender},
-                                {
-                                    "$push": {
-                                        "account_updates": {
-                                            "balance_before": balance_before,
-                                            "balance_after": new_balance,
-                                            "nonce_before": nonce_before,
-                                            "nonce_after": new_nonce,
-                                            "transactions": [transaction.transactionId],
-                                            "badgeId": badge_id
-                                        }
-                                    }
-                                },
-                                session=session
-                            )
-                            new_leaf_bytes = await self.leaf_to_bytes(new_balance, new_nonce, account= transaction.sender)
-                            return new_leaf_bytes
-                except Exception as e:
-                    logger.error(f"error in updating the chnagelog for transaction : {transaction.transactionId}")
-                    logger.error(f"{e}")
-                    raise e
-    
-    async def update_receiver_bytes_return_bytes(self, badge_id : str, transaction : Transaction) -> bytes:
-         """
-            receiver nonces do not get updated
-         """
-         async with await self.mongo_client.start_session(causal_consistency=True) as session:
-                try:
-                    logger.info(f"updating receiver leaf data for change log")
-                    db = self.mongo_client[os.environ["DB_NAME"]]
-                    users_col = db[os.environ["USERS"]]
-                    prev_receiver = await users_col.find_one({
-                         "address": transaction.receiver,
-                    })
-                    account_updates = prev_receiver.get("account_updates", [])
-                    update_index = None
-                    for acc in range(0, len(account_updates)):
-                        if account_updates[acc].get(("badgeId") == badge_id):
-                            update_index = acc
+    def apply_pending_leaves(self) -> str:
+        """
+            Writes every leaf touched since the last call into the tree in one batched update
+        """
+        if len(self.dirty_leaves) > 0:
+            accounts = list(self.dirty_leaves.values())
+            self.sparse_merkle_tree.update_many([acc.key for acc in accounts], [acc.leaf_bytes() for acc in accounts])
+            self.dirty_leaves = {}
+        return self.get_merkle_root()
 
-                    if update_index is not None:
-                        new_balance = prev_receiver.account_updates[update_index] + transaction.amount
-                        new_nonce = prev_receiver.account_updates[update_index]["nonce_after"]
-                        await users_col.update_one(
-                                {
-                                    "address": transaction.receiver,
-                                    "account_updates.badgeId": badge_id
-                                },
-                                {
-                                    "$set": {
-                                        "account_updates.$.balance_after": new_balance,
-                                        "account_updates.$.nonce_after": new_nonce
-                                    },
-                                    "$push": {
-                                        "account_updates.$.transactions": transaction.transactionId
-                                    }
-                                },
-                                session=session
-                            )
-                        new_leaf_bytes = await self.leaf_to_bytes(new_balance, new_nonce, account=transaction.receiver)
-                        return new_leaf_bytes
-                    else:
-                            balance_before = None
-                            nonce_before = None
-                            if len(account_updates) == 0:
-                                balance_before = prev_receiver["balance"]
-                                nonce_before = prev_receiver["nonce"]
-                            else :
-                                last_sub = prev_receiver["account_updates"][len(account_updates) -1]
-                                balance_before = last_sub["balance_after"]
-                                nonce_before = last_sub["nonce_after"]
-                            
-                            new_balance = balance_before + transaction.amount
-                            new_nonce = nonce_before
+    async def load_account_state(self) -> None:
+        """
+            Restores the account state at the checkpointed root: accounts are read lazily from
+            the leaves of the persisted tree, the blocks mongo committed after the checkpoint
+            are replayed.
+        """
+        if self.restored:
+            self.account_state.leaf_loader = self.account_leaf
+        await self.replay_blocks_after(self.state_blocknumber)
 
-                            await users_col.update_one(
-                                {"address": transaction.sender},
-                                {
-                                    "$push": {
-                                        "account_updates": {
-                                            "balance_before": balance_before,
-                                            "balance_after": new_balance,
-                                            "nonce_before": nonce_before,
-                                            "nonce_after": new_nonce,
-                                            "transactions": [transaction.transactionId],
-                                            "badgeId": badge_id
-                                        }
-                                    }
-                                },
-                                session=session
-                            )
+    def account_leaf(self, key : bytes) -> Optional[bytes]:
+        """
+            Leaf value of an address in the current tree, None if it has no account
+        """
+        return self.node_store.get_value(hashlib.sha256(key).digest())
 
-                            new_leaf_bytes =  await self.leaf_to_bytes(new_balance, new_nonce, account= transaction.receiver)
-                            return new_leaf_bytes
-                except Exception as e:
-                    logger.error(f"error in updating the chnagelog for transaction : {transaction.transactionId}")
-                    raise e
+    async def replay_blocks_after(self, blocknumber : int) -> int:
+        """
+            A block is committed to mongo before the tree is checkpointed at its root, a stop
+            in between leaves mongo ahead of the tree. The account updates of those blocks
+            are read back from ACCOUNT_HISTORY and applied in block order, the resulting root
+            has to match the state root of the last committed badge.
+            Returns the blocknumber the tree is at afterwards.
+        """
+        db = self.mongo_client[os.environ["DB_NAME"]]
+        pointer = await db[os.environ["CURR"]].find_one({})
+        if pointer is None:
+            return blocknumber
+        badge = await db[os.environ["BADGES"]].find_one({"badgeId": pointer["currBadgeID"]}, {"_id": 0, "badgeId": 1, "blocknumber": 1, "state_root": 1})
+        if badge is None or badge["blocknumber"] <= blocknumber:
+            return blocknumber
+
+        updates = []
+        history_col = db[os.environ.get("ACCOUNT_HISTORY", "account_history")]
+        async for doc in history_col.find({"last_block": {"$gt": blocknumber}}, {"_id": 0, "address": 1, "updates": 1}):
+            updates += [(doc["address"], update) for update in doc["updates"] if update["blocknumber"] > blocknumber]
+        updates.sort(key=lambda u: u[1]["blocknumber"])
+        replayed = {}
+        for address, update in updates:
+            state = self.account_state.put(address=address, balance=update["balance_after"], nonce=update["nonce_after"])
+            replayed[state.key] = state
+        accounts = list(replayed.values())
+        self.sparse_merkle_tree.update_many([acc.key for acc in accounts], [acc.leaf_bytes() for acc in accounts])
+        root = self.get_merkle_root()
+        if root != badge["state_root"]:
+            raise Exception(f"replaying blocks {blocknumber + 1}-{badge['blocknumber']} gave root {root}, badge {badge['badgeId']} has {badge['state_root']}")
+        changeset = self.take_changeset()
+        await self.checkpoint(changeset=changeset, root=root, blocknumber=badge["blocknumber"], badge_id=badge["badgeId"])
+        self.release(changeset)
+        self.state_blocknumber = badge["blocknumber"]
+        logger.info(f"replayed {len(accounts)} account updates of blocks {blocknumber + 1}-{badge['blocknumber']} into the state tree")
+        return self.state_blocknumber
+
+    def touched_accounts(self) -> list[AccountState]:
+        """
+            Accounts touched by the badge that is being formed, with their pre-badge state
+        """
+        return list(self.account_state.touched.values())
 
-    async def leaf_to_bytes(self, balance : int, nonce : int , account : str ) -> bytes:
+    def drain_account_updates(self, badge_id : str, blocknumber : int, timestamp : int) -> tuple[list[UpdateOne], list[UpdateOne]]:
+        """
+            Write-behind updates (account state, account history) of all accounts touched
+            by the badge, committed together with the block
+        """
+        return self.account_state.drain_account_updates(badge_id=badge_id, blocknumber=blocknumber, timestamp=timestamp)
 
-        nonce_bytes = int(nonce).to_bytes(8, 'little') 
-        balance_bytes = int(balance).to_bytes(8, 'little')
-        hashes_pub = hex_to_bytes(account)
-        msg = balance_bytes + nonce_bytes + hashes_pub
-        return msg
-        
+    def _check_tree_invariants_for_update(self, transaction : TxRecord) -> bool:
+        return self.account_state.check_transfer(transaction=transaction)
     
-    async def _check_tree_invariants_for_update(self, transaction : Transaction) -> bool:
-         async with await self.mongo_client.start_session(causal_consistency=True) as session:
-                try:
-                    db = self.mongo_client[os.environ["DB_NAME"]]
-                    users_col = db[os.environ["USERS"]]
-                    account  = await users_col.find_one({"address" : transaction.sender}, session=session)
-                    if account is None:
-                        logger.error(f"account data could not be found when quering for it")
-                        return False
-                    account_object = AccountsCollection(**account)
-                    balance_sufficient = account_object.balance >= transaction.amount #+ fee
-                    if len(account_object.account_updates) > 0:
-                        latest_nonce = account_object.account_updates[-1].nonce_after
-                        latest_balance = account_object.account_updates[-1].balance_after
-                    else:
-                        latest_nonce = account_object.nonce
-                        latest_balance = account_object.balance
-
-                    balance_sufficient = latest_balance >= transaction.amount
-                    nonce_correct = latest_nonce == transaction.nonce
-                    account_receiver  = await users_col.find_one({"address" : transaction.receiver}, session=session)
 
-                    endresult = (balance_sufficient and  nonce_correct and (account_receiver is not None))
-                    logger.info(f"endresult of the tree invariants : {endresult}")
-                    return endresult
-
-                except Exception as e:
-                    logger.info(f"{e}")
-                    return False
-    
+    def initilize_sparse_merkle_tree(self) -> StateTree:
+        """
+            Maps the persisted tree and continues from its last checkpointed root,
+            the genesis tree is only built when the node store is still empty
+        """
+        checkpoint = self.node_store.last_checkpoint()
+        if checkpoint is not None:
+            root, blocknumber, badge_id = checkpoint
+            logger.info(f"restored sparse merkle tree at block {blocknumber} with root 0x{root.hex()}")
+            self.state_blocknumber = blocknumber
+            self.restored = True
+            return StateTree(store=self.node_store, root=root)
 
-    def initilize_sparse_merkle_tree(self) -> SparseMerkleTree:
         logger.info("starting to initialize sparse merkle tree")
-        with open("funded_accounts.json", "r") as file:
-            users_data = json.load(file)
-        
-        tree = SparseMerkleTree()
-
-        for acc in users_data:
-            key = hex_to_bytes(acc["pub_key"])
-            value = self.hash_account_to_leaf_value(account_data= acc)
-            tree.update(key = key, value = value)
-        
+        tree = StateTree(store=self.node_store)
+        accounts = list(self.account_state.accounts.values())
+        tree.update_many(keys=[acc.key for acc in accounts], values=[acc.leaf_bytes() for acc in accounts])
+        self.node_store.commit(self.node_store.take_changeset(), root=tree.root, blocknumber=0, badge_id=None)
         logger.info("done inserting leaf values")
         return tree
+
+    def take_changeset(self) -> TreeChangeset:
+        """
+            Tree nodes written since the last call, taken right after a block is executed
+        """
+        return self.node_store.take_changeset()
+
+    def release(self, changeset : TreeChangeset) -> None:
+        """
+            Called once a block is exported, the nodes its execution orphaned can be pruned
+        """
+        self.node_store.release(changeset)
+
+    async def checkpoint(self, changeset : TreeChangeset, root : str, blocknumber : int, badge_id : str) -> None:
+        """
+            Persists the tree nodes written by a sealed block together with its root
+        """
+        await asyncio.to_thread(self.node_store.commit, changeset, hex_to_bytes(root), blocknumber, badge_id)
     
     def hash_account_to_leaf_value(self, account_data) -> bytes:
         balance = account_data["balance"]
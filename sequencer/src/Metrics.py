@@ -0,0 +1,217 @@
+from bisect import bisect_left
+from pymongo import monitoring
+from typing import Callable, Iterable, Optional
+import logging
+import math
+import threading
+
+logger = logging.getLogger(__name__)
+
+"""
+    Counters, gauges and histograms of the sequencer, exposed in the Prometheus text
+    format at /metrics. Recording is a dict lookup and an add on the event loop thread,
+    histograms keep cumulative bucket counts only (no samples), gauges that mirror
+    in-memory state are read when /metrics is scraped.
+"""
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+COUNT_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 50)
+
+
+def _format_value(value : float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(names : tuple[str, ...], values : tuple, extra : Optional[tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if len(pairs) > 0 else ""
+
+
+class Counter:
+
+    def __init__(self, name : str, documentation : str, labelnames : tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values : dict[tuple, float] = {}
+
+    def inc(self, amount : float = 1, labels : tuple = ()) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, labels : tuple = ()) -> float:
+        return self.values.get(labels, 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        # copied in one step, driver threads add labels (MongoCommandCounter) while a scrape renders
+        for labels, value in list(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """
+        Either set explicitly or, with a callback, read when it is rendered.
+        The callback returns the value, or (labels, value) pairs for a labelled gauge.
+    """
+
+    def __init__(self, name : str, documentation : str, labelnames : tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values : dict[tuple, float] = {}
+        self.callback : Optional[Callable[[], object]] = None
+
+    def set(self, value : float, labels : tuple = ()) -> None:
+        self.values[labels] = value
+
+    def set_function(self, callback : Callable[[], object]) -> None:
+        self.callback = callback
+
+    def _collect(self) -> Iterable[tuple[tuple, float]]:
+        if self.callback is None:
+            return list(self.values.items())
+        try:
+            result = self.callback()
+        except Exception as e:
+            logger.error(f"reading gauge {self.name} failed : {e}")
+            return []
+        return result if len(self.labelnames) > 0 else [((), result)]
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for labels, value in self._collect():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name : str, documentation : str, buckets : tuple[float, ...] = LATENCY_BUCKETS, labelnames : tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (the last one is +Inf), sum, count]
+        self.values : dict[tuple, list] = {}
+
+    def observe(self, value : float, labels : tuple = ()) -> None:
+        series = self.values.get(labels)
+        if series is None:
+            series = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            self.values[labels] = series
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (bucket_counts, total, count) in list(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, ('le', _format_value(float(bound))))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics : list = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+class MongoCommandCounter(monitoring.CommandListener):
+    """
+        Counts the commands sent to mongo by name. The commands of a session can be
+        counted separately (track / take), to get the round trips of one block commit.
+        The driver calls the listener from its own threads.
+    """
+
+    def __init__(self, commands : Counter):
+        self.commands = commands
+        self.lock = threading.Lock()
+        self.sessions : dict[bytes, int] = {}
+
+    def started(self, event : monitoring.CommandStartedEvent) -> None:
+        with self.lock:
+            self.commands.inc(labels=(event.command_name,))
+            lsid = event.command.get("lsid")
+            if lsid is not None:
+                key = bytes(lsid["id"])
+                if key in self.sessions:
+                    self.sessions[key] += 1
+
+    def succeeded(self, event : monitoring.CommandSucceededEvent) -> None:
+        pass
+
+    def failed(self, event : monitoring.CommandFailedEvent) -> None:
+        pass
+
+    def _session_key(self, session) -> Optional[bytes]:
+        session_id = getattr(session, "session_id", None)
+        return bytes(session_id["id"]) if session_id is not None else None
+
+    def track(self, session) -> None:
+        key = self._session_key(session)
+        if key is None:
+            return
+        with self.lock:
+            self.sessions[key] = 0
+
+    def take(self, session) -> int:
+        """
+            Commands sent with the session since track, the memory stand-in counts them itself
+        """
+        if hasattr(session, "round_trips"):
+            return session.round_trips
+        key = self._session_key(session)
+        if key is None:
+            return 0
+        with self.lock:
+            return self.sessions.pop(key, 0)
+
+
+REGISTRY = MetricsRegistry()
+
+SUBMIT_SECONDS = REGISTRY.register(Histogram("sequencer_submit_seconds",
+    "Time to accept a submission, signature check and mempool write included", labelnames=("endpoint",)))
+SIGNATURE_BATCH_SECONDS = REGISTRY.register(Histogram("sequencer_signature_batch_seconds",
+    "Time to verify one micro batch of signatures in the verifier pool"))
+SIGNATURE_QUEUE_SECONDS = REGISTRY.register(Histogram("sequencer_signature_queue_seconds",
+    "Time a signature waited for a verifier worker"))
+SIGNATURES = REGISTRY.register(Counter("sequencer_signatures_total", "Verified signatures", labelnames=("valid",)))
+TRANSACTIONS = REGISTRY.register(Counter("sequencer_transactions_total", "Transactions by the status they reached", labelnames=("status",)))
+MEMPOOL_TRANSACTIONS = REGISTRY.register(Gauge("sequencer_mempool_transactions",
+    "Transactions in the pending pool, ready or held back by a nonce gap", labelnames=("state",)))
+BLOCK_STAGE_SECONDS = REGISTRY.register(Histogram("sequencer_block_stage_seconds",
+    "Time of the stages of block formation", labelnames=("stage",)))
+BLOCK_TRANSACTIONS = REGISTRY.register(Histogram("sequencer_block_transactions",
+    "Transactions per block", buckets=SIZE_BUCKETS, labelnames=("outcome",)))
+INVARIANT_FAILURES = REGISTRY.register(Counter("sequencer_invariant_failures_total", "Transfers that failed the tree invariants"))
+BLOCK_MONGO_ROUND_TRIPS = REGISTRY.register(Histogram("sequencer_block_mongo_round_trips",
+    "Mongo commands of one block commit", buckets=COUNT_BUCKETS + (100,)))
+MONGO_COMMANDS = REGISTRY.register(Counter("sequencer_mongo_commands_total", "Commands sent to mongo", labelnames=("command",)))
+DEPOSIT_LAG_BLOCKS = REGISTRY.register(Gauge("sequencer_deposit_lag_blocks", "L1 blocks between the head and the deposit cursor"))
+DEPOSIT_INGEST_LAG_SECONDS = REGISTRY.register(Histogram("sequencer_deposit_ingest_lag_seconds",
+    "Time between the L1 block that ends a range of deposits and their ingestion", buckets=(1, 2, 5, 10, 15, 30, 60, 120, 300, 600, 1800, 3600)))
+
+MONGO_COMMAND_COUNTER = MongoCommandCounter(MONGO_COMMANDS)
@@ -0,0 +1,162 @@
+from src.TxRecord import TxRecord
+from src.AccountStateStore import AccountStateStore
+from src.utils import estimate_l1_gas
+from typing import Callable, Optional
+from collections import deque
+import heapq
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SenderQueue:
+    """
+        Pending transfers of one sender keyed by nonce.
+        next_nonce is the nonce the sender needs next, counting the transfers
+        that were already handed out to a block.
+    """
+    __slots__ = ("transactions", "next_nonce", "queued")
+
+    def __init__(self, next_nonce : int):
+        self.transactions : dict[int, tuple[int, TxRecord]] = {}
+        self.next_nonce = next_nonce
+        self.queued = False
+
+
+class PendingPool:
+    """
+        In-memory mempool. Every sender has a queue ordered by nonce and only the
+        head of a queue (the transfer with the sender's next nonce) sits in the
+        global ready heap, which is ordered by arrival. Picking k transfers is
+        O(k log n) and always yields nonce-executable sequences, transfers with a
+        future nonce wait in their queue until the gap is filled.
+        Deposits have no nonce and go first, in arrival order.
+        Senders are keyed by their 20 byte address (TxRecord.sender_key).
+    """
+
+    def __init__(self, account_state : AccountStateStore):
+        self.account_state = account_state
+        self.senders : dict[bytes, SenderQueue] = {}
+        self.ready : list[tuple[int, bytes]] = []
+        self.deposits : deque[TxRecord] = deque()
+        self.arrivals = 0
+        # called with every accepted transaction, the block scheduler hooks in here
+        self.on_insert : Optional[Callable[[TxRecord], None]] = None
+
+    def __len__(self) -> int:
+        return len(self.deposits) + sum(len(q.transactions) for q in self.senders.values())
+
+    def _account_nonce(self, sender : bytes) -> int:
+        account = self.account_state.get_by_key(sender)
+        return account.nonce if account is not None else 0
+
+    def _push_head(self, sender : bytes, queue : SenderQueue) -> None:
+        entry = queue.transactions.get(queue.next_nonce)
+        if entry is not None and not queue.queued:
+            heapq.heappush(self.ready, (entry[0], sender))
+            queue.queued = True
+
+    def insert(self, transaction : TxRecord) -> bool:
+        """
+            Returns False for transfers that can never execute:
+            a nonce below the sender's next nonce or one that is already pending
+        """
+        self.arrivals += 1
+        if transaction.receiver is None:
+            self.deposits.append(transaction)
+            self._notify(transaction)
+            return True
+        sender = transaction.sender_key
+        queue = self.senders.get(sender)
+        if queue is None:
+            queue = SenderQueue(next_nonce=self._account_nonce(sender))
+            self.senders[sender] = queue
+        if transaction.nonce < queue.next_nonce or transaction.nonce in queue.transactions:
+            return False
+        queue.transactions[transaction.nonce] = (self.arrivals, transaction)
+        if transaction.nonce == queue.next_nonce:
+            self._push_head(sender, queue)
+        self._notify(transaction)
+        return True
+
+    def _notify(self, transaction : TxRecord) -> None:
+        if self.on_insert is not None:
+            self.on_insert(transaction)
+
+    def has_ready(self) -> bool:
+        return len(self.deposits) > 0 or len(self.ready) > 0
+
+    def select(self, limit : int, max_gas : Optional[int] = None) -> list[TxRecord]:
+        selected = []
+        gas = 0
+        while len(selected) < limit and len(self.deposits) > 0:
+            if max_gas is not None and gas + estimate_l1_gas(self.deposits[0]) > max_gas:
+                return selected
+            gas += estimate_l1_gas(self.deposits[0])
+            selected.append(self.deposits.popleft())
+        while len(selected) < limit and len(self.ready) > 0:
+            arrival, sender = self.ready[0]
+            queue = self.senders.get(sender)
+            if queue is None:
+                heapq.heappop(self.ready)
+                continue
+            entry = queue.transactions.get(queue.next_nonce)
+            if entry is not None and max_gas is not None and gas + estimate_l1_gas(entry[1]) > max_gas:
+                break
+            heapq.heappop(self.ready)
+            queue.queued = False
+            if entry is None:
+                continue
+            del queue.transactions[queue.next_nonce]
+            gas += estimate_l1_gas(entry[1])
+            selected.append(entry[1])
+            queue.next_nonce += 1
+            self._push_head(sender, queue)
+        return selected
+
+    def after_block(self, senders : set[bytes], failed_senders : set[bytes]) -> list[TxRecord]:
+        """
+            Re-syncs the queues of the senders of an executed block with the account state.
+            A failed transfer leaves a nonce gap behind, so the next nonce of those senders
+            falls back to their account nonce; pending transfers below it can never
+            execute anymore and are returned to be marked failed.
+        """
+        dropped = []
+        for sender in failed_senders:
+            queue = self.senders.get(sender)
+            if queue is None:
+                continue
+            queue.next_nonce = self._account_nonce(sender)
+            for nonce in [n for n in queue.transactions if n < queue.next_nonce]:
+                dropped.append(queue.transactions.pop(nonce)[1])
+            self._push_head(sender, queue)
+        for sender in senders:
+            queue = self.senders.get(sender)
+            if queue is not None and len(queue.transactions) == 0:
+                del self.senders[sender]
+        return dropped
+
+    def remove_deposits(self, transaction_ids : set[str]) -> int:
+        remaining = deque(d for d in self.deposits if d.transaction_id not in transaction_ids)
+        removed = len(self.deposits) - len(remaining)
+        self.deposits = remaining
+        return removed
+
+    def next_nonce(self, sender : bytes) -> Optional[int]:
+        """
+            Nonce after the sender's transfers in the pool with consecutive nonces,
+            None when the sender has no pending transfers
+        """
+        queue = self.senders.get(sender)
+        if queue is None:
+            return None
+        nonce = queue.next_nonce
+        while nonce in queue.transactions:
+            nonce += 1
+        return nonce
+
+    def held(self) -> int:
+        """
+            Number of transfers waiting for a nonce gap to be filled
+        """
+        return sum(len(q.transactions) - (1 if q.queued else 0) for q in self.senders.values())
@@ -0,0 +1,198 @@
+import os
+import sqlite3
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+MMAP_SIZE = 1 << 34
+NODE_CACHE_SIZE = int(os.environ.get("NODE_CACHE_SIZE", 1_000_000))
+
+
+class TreeChangeset:
+    """
+        Node and leaf value writes of the state tree since the last checkpoint.
+        deleted_nodes are the nodes the block orphaned, they stay readable until the block
+        is released; pruned_nodes are orphans of earlier, released blocks that the checkpoint deletes.
+    """
+
+    def __init__(self, nodes : dict[bytes, bytes], deleted_nodes : set[bytes], values : dict[bytes, Optional[bytes]],
+                 pruned_nodes : set[bytes], generation : int):
+        self.nodes = nodes
+        self.deleted_nodes = deleted_nodes
+        self.values = values
+        self.pruned_nodes = pruned_nodes
+        self.generation = generation
+
+
+class PersistentNodeStore:
+    """
+        Disk backed node store for the StateTree (same interface as MemoryNodeStore).
+        Nodes live in a local SQLite file that is read through mmap; the cache_size most
+        recently used nodes and leaf values are cached. Writes are buffered until checkpoint(),
+        which stores them together with the root of the sealed block in one SQLite transaction,
+        until then they are read from the buffer and the changesets that are not committed yet.
+        A restart only reads that root back.
+
+        Nodes orphaned by a block stay in the store until the block is released, so the batch
+        witness can still prove its pre-state against the old root in the export stage. They
+        are deleted by the next checkpoint after that (a stop in between leaves them behind as
+        unreachable rows).
+    """
+
+    def __init__(self, path : str, cache_size : int = NODE_CACHE_SIZE):
+        self.path = path
+        self.cache_size = cache_size
+        self.connection = self._connect()
+        # checkpoints may run in a worker thread, they get their own connection
+        # (an in-memory database only exists for the connection that created it)
+        self.write_connection = self._connect() if path != ":memory:" else self.connection
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS nodes (hash BLOB PRIMARY KEY, data BLOB NOT NULL) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS leaf_values (path BLOB PRIMARY KEY, value BLOB NOT NULL) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS checkpoint (id INTEGER PRIMARY KEY CHECK (id = 0), root BLOB NOT NULL, blocknumber INTEGER NOT NULL, badge_id TEXT);
+        """)
+        self.nodes : OrderedDict[bytes, bytes] = OrderedDict()
+        self.values : OrderedDict[bytes, Optional[bytes]] = OrderedDict()
+        # taken changesets whose commit is still outstanding, oldest first
+        self._uncommitted : list[TreeChangeset] = []
+        self._dirty_nodes : dict[bytes, bytes] = {}
+        self._deleted_nodes : set[bytes] = set()
+        self._dirty_values : dict[bytes, Optional[bytes]] = {}
+        # orphaned node -> generation of the changeset that orphaned it, until it is released
+        self._retired : dict[bytes, int] = {}
+        self._pruned_nodes : set[bytes] = set()
+        self._generation = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        return connection
+
+    def _cache(self, cache : OrderedDict, key : bytes, value) -> None:
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def _unflushed(self, key : bytes, dirty : dict, attribute : str):
+        """
+            (found, value) of a write that is not in SQLite yet, the newest write wins
+        """
+        if key in dirty:
+            return True, dirty[key]
+        for changeset in reversed(self._uncommitted):
+            writes = getattr(changeset, attribute)
+            if key in writes:
+                return True, writes[key]
+        return False, None
+
+    def get_node(self, key : bytes) -> Optional[bytes]:
+        data = self.nodes.get(key)
+        if data is not None:
+            self.nodes.move_to_end(key)
+            return data
+        found, data = self._unflushed(key, self._dirty_nodes, "nodes")
+        if not found:
+            row = self.connection.execute("SELECT data FROM nodes WHERE hash = ?", (key,)).fetchone()
+            data = row[0] if row is not None else None
+        if data is not None:
+            self._cache(self.nodes, key, data)
+        return data
+
+    def set_node(self, key : bytes, value : bytes) -> bool:
+        self._cache(self.nodes, key, value)
+        self._dirty_nodes[key] = value
+        self._deleted_nodes.discard(key)
+        # a node that is created again is live, an older release must not delete it
+        self._retired.pop(key, None)
+        self._pruned_nodes.discard(key)
+        return True
+
+    def delete_node(self, key : bytes) -> bool:
+        self._dirty_nodes.pop(key, None)
+        self._deleted_nodes.add(key)
+        self._retired[key] = self._generation
+        return True
+
+    def delete_nodes(self, keys : list[bytes]) -> None:
+        for key in keys:
+            self.delete_node(key)
+
+    def get_value(self, key : bytes) -> Optional[bytes]:
+        if key in self.values:
+            self.values.move_to_end(key)
+            return self.values[key]
+        found, value = self._unflushed(key, self._dirty_values, "values")
+        if not found:
+            row = self.connection.execute("SELECT value FROM leaf_values WHERE path = ?", (key,)).fetchone()
+            value = row[0] if row is not None else None
+        self._cache(self.values, key, value)
+        return value
+
+    def set_value(self, key : bytes, value : bytes) -> bool:
+        self._cache(self.values, key, value)
+        self._dirty_values[key] = value
+        return True
+
+    def delete_value(self, key : bytes) -> bool:
+        self._cache(self.values, key, None)
+        self._dirty_values[key] = None
+        return True
+
+    def take_changeset(self) -> TreeChangeset:
+        changeset = TreeChangeset(nodes=self._dirty_nodes, deleted_nodes=self._deleted_nodes, values=self._dirty_values,
+                                  pruned_nodes=self._pruned_nodes, generation=self._generation)
+        self._dirty_nodes = {}
+        self._deleted_nodes = set()
+        self._dirty_values = {}
+        self._pruned_nodes = set()
+        self._generation += 1
+        self._uncommitted.append(changeset)
+        return changeset
+
+    def release(self, changeset : TreeChangeset) -> None:
+        """
+            The old root of the changeset's block is no longer needed: the nodes it orphaned,
+            unless a later block created them again, are deleted with the next checkpoint
+        """
+        for key in changeset.deleted_nodes:
+            if self._retired.get(key) == changeset.generation:
+                del self._retired[key]
+                self.nodes.pop(key, None)
+                self._pruned_nodes.add(key)
+
+    def commit(self, changeset : TreeChangeset, root : bytes, blocknumber : int, badge_id : Optional[str]) -> None:
+        """
+            Persists a changeset and moves the checkpoint to its root atomically
+        """
+        cursor = self.write_connection.cursor()
+        try:
+            cursor.execute("BEGIN")
+            cursor.executemany("DELETE FROM nodes WHERE hash = ?", ((key,) for key in changeset.pruned_nodes))
+            cursor.executemany("INSERT OR REPLACE INTO nodes (hash, data) VALUES (?, ?)", changeset.nodes.items())
+            cursor.executemany("DELETE FROM leaf_values WHERE path = ?", ((key,) for key, value in changeset.values.items() if value is None))
+            cursor.executemany("INSERT OR REPLACE INTO leaf_values (path, value) VALUES (?, ?)", ((key, value) for key, value in changeset.values.items() if value is not None))
+            cursor.execute("INSERT OR REPLACE INTO checkpoint (id, root, blocknumber, badge_id) VALUES (0, ?, ?, ?)", (root, blocknumber, badge_id))
+            cursor.execute("COMMIT")
+        except Exception as e:
+            cursor.execute("ROLLBACK")
+            logger.error(f"could not checkpoint the state tree at block {blocknumber} : {e}")
+            raise e
+        # checkpoints are taken in block order, everything up to this changeset is in SQLite now
+        while self._uncommitted and self._uncommitted[0].generation <= changeset.generation:
+            self._uncommitted.pop(0)
+
+    def last_checkpoint(self) -> Optional[tuple[bytes, int, Optional[str]]]:
+        row = self.connection.execute("SELECT root, blocknumber, badge_id FROM checkpoint WHERE id = 0").fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], row[2]
+
+    def close(self) -> None:
+        if self.write_connection is not self.connection:
+            self.write_connection.close()
+        self.connection.close()
@@ -0,0 +1,244 @@
+from collections import Counter
+from types import CodeType
+from typing import Callable, Optional
+import asyncio
+import logging
+import marshal
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", 2))
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", 600))
+PROFILE_TRACEMALLOC_FRAMES = int(os.environ.get("PROFILE_TRACEMALLOC_FRAMES", 25))
+
+
+def _frame_name(code : CodeType) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _pstats_key(code : CodeType) -> tuple[str, int, str]:
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+
+class ProfileSession:
+    """
+        One capture, from start until its block count or deadline is reached
+    """
+
+    def __init__(self, name : str, blocks : Optional[int], seconds : Optional[float]):
+        self.name = name
+        self.blocks = blocks
+        self.seconds = seconds
+        self.blocks_done = 0
+        self.started_at = time.time()
+        # stack, outermost scope frame first -> samples
+        self.stacks : Counter[tuple[CodeType, ...]] = Counter()
+        self.samples = 0
+        self.scoped_samples = 0
+        self.files : list[str] = []
+
+
+class Profiler:
+    """
+        On-demand sampling CPU profile and tracemalloc snapshot of the registered scopes
+        (block formation, submission endpoints), started from the admin API.
+
+        While a session runs, a thread samples the stack of the event loop thread every
+        PROFILE_INTERVAL_MS and keeps the samples that are inside a scope, cut at the
+        outermost scope frame. Coroutines only show up while they run, the time a scope
+        spends awaiting mongo or the verifier pool is not sampled. tracemalloc traces
+        every allocation during the session, the snapshot keeps the ones with a scope
+        file in their traceback. Nothing is installed while no session runs, the hooks
+        in the sequencer are a check of `active`.
+
+        A session ends after `blocks` blocks or `seconds` (at most PROFILE_MAX_SECONDS).
+        stop() only signals the sampler, joining it, taking and filtering the snapshot and
+        writing the files runs in a worker thread (`finishing`), block formation calls
+        stop() on the event loop. It writes to PROFILE_DIR:
+            <name>.collapsed    collapsed stacks, for flamegraph.pl / speedscope
+            <name>.prof         pstats format, pstats.Stats / snakeviz
+            <name>.txt          top functions by own and total samples, top allocations
+            <name>.tracemalloc  the snapshot, tracemalloc.Snapshot.load
+        A sampler has no call counts or exact times: in <name>.prof the times are samples
+        times the interval and the call counts are the number of samples.
+    """
+
+    def __init__(self, directory : str = PROFILE_DIR, interval_ms : float = PROFILE_INTERVAL_MS):
+        self.directory = directory
+        self.interval_ms = interval_ms
+        self.scopes : set[CodeType] = set()
+        self.scope_files : set[str] = set()
+        self.session : Optional[ProfileSession] = None
+        self.last_session : Optional[ProfileSession] = None
+        self.active = False
+        self.thread : Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+        self.deadline_handle : Optional[asyncio.TimerHandle] = None
+        self.stop_tracemalloc = False
+        self.finishing : Optional[asyncio.Task] = None
+
+    def add_scope(self, function : Callable) -> None:
+        function = getattr(function, "__func__", function)
+        self.scopes.add(function.__code__)
+        self.scope_files.add(function.__code__.co_filename)
+
+    def start(self, blocks : Optional[int] = None, seconds : Optional[float] = None) -> ProfileSession:
+        """
+            Has to be called on the event loop thread, raises ValueError when a session runs
+        """
+        if self.active:
+            raise ValueError(f"profile {self.session.name} is still running")
+        if self.finishing is not None and not self.finishing.done():
+            raise ValueError(f"profile {self.last_session.name} is still being written")
+        if blocks is None and seconds is None:
+            raise ValueError("either blocks or seconds is required")
+        seconds = min(seconds if seconds is not None else PROFILE_MAX_SECONDS, PROFILE_MAX_SECONDS)
+        self.session = ProfileSession(name=time.strftime("profile_%Y%m%d_%H%M%S"), blocks=blocks, seconds=seconds)
+        self.active = True
+        # tracing that was already on (PYTHONTRACEMALLOC) is left on afterwards
+        self.stop_tracemalloc = not tracemalloc.is_tracing()
+        if self.stop_tracemalloc:
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._sample, args=(threading.get_ident(), self.session), name="profiler", daemon=True)
+        self.thread.start()
+        self.deadline_handle = asyncio.get_running_loop().call_later(seconds, self.stop)
+        logger.info(f"started profile {self.session.name} for {blocks} blocks or {seconds}s")
+        return self.session
+
+    def _sample(self, thread_id : int, session : ProfileSession) -> None:
+        interval = self.interval_ms / 1000
+        scopes = self.scopes
+        while not self.stop_event.wait(interval):
+            frame = sys._current_frames().get(thread_id)
+            session.samples += 1
+            stack = []
+            scope_depth = -1
+            while frame is not None:
+                stack.append(frame.f_code)
+                if frame.f_code in scopes:
+                    scope_depth = len(stack)
+                frame = frame.f_back
+            if scope_depth < 0:
+                continue
+            session.scoped_samples += 1
+            session.stacks[tuple(reversed(stack[:scope_depth]))] += 1
+
+    def block_done(self) -> None:
+        session = self.session
+        session.blocks_done += 1
+        if session.blocks is not None and session.blocks_done >= session.blocks:
+            self.stop()
+
+    def stop(self) -> Optional[ProfileSession]:
+        """
+            Has to be called on the event loop thread, the files are written by `finishing`
+        """
+        if not self.active:
+            return None
+        session = self.session
+        self.active = False
+        if self.deadline_handle is not None:
+            self.deadline_handle.cancel()
+            self.deadline_handle = None
+        self.stop_event.set()
+        self.last_session = session
+        self.session = None
+        self.finishing = asyncio.get_running_loop().create_task(self._finish(session, self.thread, self.stop_tracemalloc))
+        return session
+
+    async def _finish(self, session : ProfileSession, thread : threading.Thread, stop_tracemalloc : bool) -> None:
+        try:
+            await asyncio.to_thread(self._collect, session, thread, stop_tracemalloc)
+        except Exception as e:
+            logger.error(f"writing profile {session.name} failed : {e}")
+        logger.info(f"finished profile {session.name} after {session.blocks_done} blocks, {session.scoped_samples} of {session.samples} samples in scope")
+
+    def _collect(self, session : ProfileSession, thread : threading.Thread, stop_tracemalloc : bool) -> None:
+        thread.join()
+        snapshot = tracemalloc.take_snapshot()
+        if stop_tracemalloc:
+            tracemalloc.stop()
+        self._write(session, snapshot)
+
+    def _write(self, session : ProfileSession, snapshot : tracemalloc.Snapshot) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, session.name)
+        with open(base + ".collapsed", "w") as file:
+            for stack, count in session.stacks.most_common():
+                file.write(f"{';'.join(_frame_name(code) for code in stack)} {count}\n")
+
+        with open(base + ".prof", "wb") as file:
+            marshal.dump(self._pstats(session), file)
+
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(True, filename, all_frames=True) for filename in self.scope_files])
+        snapshot.dump(base + ".tracemalloc")
+
+        own : Counter[str] = Counter()
+        total : Counter[str] = Counter()
+        for stack, count in session.stacks.items():
+            own[_frame_name(stack[-1])] += count
+            for frame in {_frame_name(code) for code in stack}:
+                total[frame] += count
+        lines = [
+            f"profile {session.name}, {session.blocks_done} blocks, {time.time() - session.started_at:.1f}s",
+            f"{session.scoped_samples} of {session.samples} samples every {self.interval_ms}ms in scope",
+            "",
+            f"{'own':>8} {'total':>8}  function"
+        ]
+        for frame, count in own.most_common(40):
+            lines.append(f"{count:>8} {total[frame]:>8}  {frame}")
+        lines += ["", "allocations in scope, by line"]
+        for stat in snapshot.statistics("lineno")[:40]:
+            lines.append(f"{stat.size / 1024:>10.1f} KiB {stat.count:>8}  {stat.traceback[0].filename}:{stat.traceback[0].lineno}")
+        with open(base + ".txt", "w") as file:
+            file.write("\n".join(lines) + "\n")
+        session.files = [base + ".collapsed", base + ".prof", base + ".txt", base + ".tracemalloc"]
+
+    def _pstats(self, session : ProfileSession) -> dict:
+        """
+            The samples in the layout pstats.Stats loads: function -> (primitive calls,
+            calls, own time, total time, callers), callers: caller -> the same four for
+            the calls from that caller
+        """
+        interval = self.interval_ms / 1000
+        stats : dict = {}
+        for stack, count in session.stacks.items():
+            keys = [_pstats_key(code) for code in stack]
+            seen = set()
+            for depth, key in enumerate(keys):
+                leaf = depth == len(keys) - 1
+                cc, nc, tt, ct, callers = stats.get(key, (0, 0, 0.0, 0.0, {}))
+                if leaf:
+                    tt += count * interval
+                # a recursive function is counted once per sample
+                if key not in seen:
+                    seen.add(key)
+                    cc += count
+                    nc += count
+                    ct += count * interval
+                if depth > 0:
+                    ccc, cnc, ctt, cct = callers.get(keys[depth - 1], (0, 0, 0.0, 0.0))
+                    callers[keys[depth - 1]] = (ccc + count, cnc + count, ctt + (count * interval if leaf else 0.0), cct + count * interval)
+                stats[key] = (cc, nc, tt, ct, callers)
+        return stats
+
+    def status(self) -> dict:
+        session = self.session or self.last_session
+        return {
+            "active": self.active,
+            "writing": self.finishing is not None and not self.finishing.done(),
+            "name": session.name if session is not None else None,
+            "blocks": session.blocks if session is not None else None,
+            "blocks_done": session.blocks_done if session is not None else 0,
+            "seconds": session.seconds if session is not None else None,
+            "samples": session.samples if session is not None else 0,
+            "scoped_samples": session.scoped_samples if session is not None else 0,
+            "files": session.files if session is not None else []
+        }
@@ -0,0 +1,194 @@
+from src.StateTree import StateTree, PLACEHOLDER, DEPTH
+from src.utils import hex_to_bytes, bytes_to_hex
+from collections import OrderedDict
+from hashlib import sha256
+from typing import Optional
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# a cached proof takes about 5 KB on a tree of 2^20 accounts
+PROOF_CACHE_SIZE = int(os.environ.get("PROOF_CACHE_SIZE", 20_000))
+
+
+def _node_indices(side_hex, nodes : list[str], node_index : dict[str, int]) -> list[int]:
+    """
+        Index of every side node in nodes, appending the ones that are not in it yet
+    """
+    indices = []
+    for node in side_hex:
+        index = node_index.get(node)
+        if index is None:
+            index = len(nodes)
+            node_index[node] = index
+            nodes.append(node)
+        indices.append(index)
+    return indices
+
+
+def multiproof_for_root(tree : StateTree, addresses : list[str], root : bytes) -> dict:
+    """
+        ProofService.get_multiproof of the accounts against a root of the tree whose nodes are
+        still in its store, from StateTree.prove_for_root, without the cache and the leaf values
+    """
+    nodes : list[str] = []
+    node_index : dict[str, int] = {}
+    proofs = []
+    for address in dict.fromkeys(addresses):
+        proof = tree.prove_for_root(hex_to_bytes(address), root)
+        leafdata = proof.non_membership_leafdata
+        proofs.append({
+            "address": address,
+            "non_membership_leafdata": leafdata.hex() if leafdata is not None else None,
+            "sidenodes": _node_indices((bytes_to_hex(node) for node in proof.sidenodes), nodes, node_index)
+        })
+    return {"root": bytes_to_hex(root), "nodes": nodes, "proofs": proofs}
+
+
+class CachedProof:
+    """
+        Proof of one account. path_nodes holds the hash of every node on the path of the
+        account from the root down, side_hex the hex encoded sibling next to each of them
+        (top first), leaf_data the node the path ends in (None for an empty subtree).
+    """
+    __slots__ = ("path_nodes", "side_hex", "leaf_data", "response")
+
+    def __init__(self, path_nodes : list[bytes], side_hex : list[str], leaf_data : Optional[bytes]):
+        self.path_nodes = path_nodes
+        self.side_hex = side_hex
+        self.leaf_data = leaf_data
+        self.response : Optional[dict] = None
+
+
+class ProofService:
+    """
+        Membership / non-membership proofs of accounts in the latest executed state tree,
+        in the smt.proof.SparseMerkleProof layout (sidenodes from the leaf up).
+
+        Proofs are cached per account. A cached proof is checked against the current root
+        lazily, when it is requested again: the path is walked down from the new root
+        until it meets a node hash the cached proof already has, everything below that node
+        is unchanged and reused. Only the part of a path above the paths touched by the
+        blocks since then is walked again, and block formation does no extra work.
+    """
+
+    def __init__(self, tree_controller, cache_size : int = PROOF_CACHE_SIZE):
+        self.tree_controller = tree_controller
+        self.cache_size = cache_size
+        self.cache : OrderedDict[bytes, CachedProof] = OrderedDict()
+        self.hits = 0
+        self.partial = 0
+        self.misses = 0
+
+    @property
+    def tree(self) -> StateTree:
+        return self.tree_controller.sparse_merkle_tree
+
+    def _prove(self, key : bytes) -> tuple[bytes, CachedProof]:
+        path = sha256(key).digest()
+        path_int = int.from_bytes(path, 'big')
+        root = self.tree.root
+        cached = self.cache.get(path)
+        if cached is not None and cached.path_nodes[0] == root:
+            self.hits += 1
+            self.cache.move_to_end(path)
+            return path, cached
+
+        get_node = self.tree.store.get_node
+        cached_nodes = cached.path_nodes if cached is not None else ()
+        reusable = len(cached_nodes)
+        path_nodes = []
+        side_hex = []
+        leaf_data = None
+        node_hash = root
+        depth = 0
+        shift = DEPTH - 1
+        while True:
+            if depth < reusable and cached_nodes[depth] == node_hash:
+                # same subtree as in the cached proof, the rest of the path did not change
+                path_nodes += cached_nodes[depth:]
+                side_hex += cached.side_hex[depth:]
+                leaf_data = cached.leaf_data
+                break
+            path_nodes.append(node_hash)
+            if node_hash == PLACEHOLDER:
+                break
+            data = get_node(node_hash)
+            if data is None:
+                raise KeyError(f"missing tree node {node_hash.hex()}")
+            if data[0] == 0:
+                leaf_data = data
+                break
+            if (path_int >> (shift - depth)) & 1:
+                side_hex.append("0x" + data[1:33].hex())
+                node_hash = data[33:]
+            else:
+                side_hex.append("0x" + data[33:].hex())
+                node_hash = data[1:33]
+            depth += 1
+        if cached is None:
+            self.misses += 1
+        else:
+            self.partial += 1
+        proof = CachedProof(path_nodes=path_nodes, side_hex=side_hex, leaf_data=leaf_data)
+        self.cache[path] = proof
+        self.cache.move_to_end(path)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return path, proof
+
+    def _account(self, address : str, path : bytes, proof : CachedProof) -> dict:
+        if proof.leaf_data is not None and proof.leaf_data[1:33] == path:
+            value = self.tree.store.get_value(path)
+            return {
+                "address": address,
+                "leaf": bytes_to_hex(value),
+                "balance": int.from_bytes(value[0:8], 'little'),
+                "nonce": int.from_bytes(value[8:16], 'little'),
+                "non_membership_leafdata": None
+            }
+        return {
+            "address": address,
+            "leaf": None,
+            "balance": None,
+            "nonce": None,
+            "non_membership_leafdata": proof.leaf_data.hex() if proof.leaf_data is not None else None
+        }
+
+    def get_proof(self, address : str) -> dict:
+        """
+            Proof of one account against the current root, verifiable with
+            smt.proof.verify_proof(proof, root, key=address bytes, value=leaf bytes)
+        """
+        path, proof = self._prove(hex_to_bytes(address))
+        if proof.response is None or proof.response["address"] != address:
+            proof.response = {
+                **self._account(address, path, proof),
+                "root": bytes_to_hex(proof.path_nodes[0]),
+                "sidenodes": proof.side_hex[::-1],
+                "sibling_data": None
+            }
+        return {**proof.response, "blocknumber": self.tree_controller.state_blocknumber}
+
+    def get_multiproof(self, addresses : list[str]) -> dict:
+        """
+            Proofs of many accounts against one root, every side node is sent once in
+            `nodes` and the proofs refer to it by index
+        """
+        nodes : list[str] = []
+        node_index : dict[str, int] = {}
+        proofs = []
+        for address in dict.fromkeys(addresses):
+            path, proof = self._prove(hex_to_bytes(address))
+            indices = _node_indices(reversed(proof.side_hex), nodes, node_index)
+            proofs.append({**self._account(address, path, proof), "sidenodes": indices})
+        return {
+            "root": self.tree.root_as_hex(),
+            "blocknumber": self.tree_controller.state_blocknumber,
+            "nodes": nodes,
+            "proofs": proofs
+        }
+
+    def stats(self) -> dict:
+        return {"cached": len(self.cache), "hits": self.hits, "partial": self.partial, "misses": self.misses}
@@ -0,0 +1,89 @@
+import asyncio
+import json
+import logging
+import os
+from src.Types import ProofJob
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutorHostProver:
+    """
+        Runs the executor host (executor/host) as a separate process per job:
+        --mode prove writes the proof of all badges of the job, --mode submit publishes it
+    """
+    # a submitted proof settles its badges on L1
+    settles = True
+
+    def __init__(self, binary : str, chain_id : str, rpc_url : str, contract : str):
+        self.binary = binary
+        self.chain_id = chain_id
+        self.rpc_url = rpc_url
+        self.contract = contract
+
+    async def _run(self, *args : str) -> None:
+        process = await asyncio.create_subprocess_exec(
+            self.binary, *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT
+        )
+        output, _ = await process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(f"{self.binary} {args[1]} exited with {process.returncode} : {output.decode(errors='replace')[-2000:]}")
+
+    async def prove(self, job : ProofJob) -> None:
+        batch_paths = [arg for path in job.batchPaths for arg in ("--batch-path", path)]
+        await self._run("--mode", "prove", *batch_paths, "--batch-id", str(job.batchId), "--proof-path", job.proofPath)
+
+    async def submit(self, job : ProofJob) -> None:
+        # the wallet key is read from ETH_WALLET_PRIVATE_KEY by the host itself
+        await self._run("--mode", "submit", "--proof-path", job.proofPath,
+            "--chain-id", self.chain_id, "--rpc-url", self.rpc_url, "--contract", self.contract)
+
+
+class FakeProver:
+    """
+        Stand-in for local runs and tests: takes prove_ms per job and writes a
+        proof file with an empty seal, submitting does nothing. Nothing is proven,
+        so its badges are left PROVED_FAKE and never reported as verified.
+    """
+    settles = False
+
+    def __init__(self, prove_ms : float = 100, fail_first_attempts : int = 0):
+        self.prove_ms = prove_ms
+        self.fail_first_attempts = fail_first_attempts
+
+    async def prove(self, job : ProofJob) -> None:
+        await asyncio.sleep(self.prove_ms / 1000)
+        if job.attempts <= self.fail_first_attempts:
+            raise RuntimeError(f"fake prover failure of batch {job.batchId}")
+        with open(job.proofPath, "w") as file:
+            json.dump({"badge_id": job.batchId, "seal": "0x", "journal_hash": "0x" + "0" * 64}, file)
+
+    async def submit(self, job : ProofJob) -> None:
+        await asyncio.sleep(0)
+
+
+def create_prover():
+    """
+        The executor host unless PROVER=fake. The sequencer does not start without a built
+        host and a rollup contract, badges would never settle otherwise.
+    """
+    prover = os.environ.get("PROVER", "host")
+    if prover == "fake":
+        logger.warning("PROVER=fake, badges are not proven and never settle")
+        return FakeProver(prove_ms=float(os.environ.get("FAKE_PROVER_MS", 100)))
+    if prover != "host":
+        raise ValueError(f"unknown PROVER {prover}, expected host or fake")
+    binary = os.environ.get("PROVER_HOST_BINARY", "../executor/target/release/host")
+    contract = os.environ.get("ROLLUP_CONTRACT", "")
+    if not os.path.isfile(binary):
+        raise RuntimeError(f"executor host {binary} not found, build it with cargo build --release in executor/ (PROVER_HOST_BINARY)")
+    if contract == "":
+        raise RuntimeError("ROLLUP_CONTRACT is not set")
+    return ExecutorHostProver(
+        binary=binary,
+        chain_id=os.environ.get("CHAIN_ID", "31337"),
+        rpc_url=os.environ.get("RPC_URL", "http://127.0.0.1:8545"),
+        contract=contract
+    )
@@ -0,0 +1,320 @@
+from src.AsyncMongoClient import get_mongo_client
+from src.Types import ProofJob, ProofJobStatus, BadgeStatus, TransactionStatus
+from src.WitnessExporter import WitnessExporter
+from src.TransactionStatusCache import TransactionStatusCache
+from src.EventBus import EventBus
+from src.Metrics import TRANSACTIONS
+from src.LifecycleTracker import LifecycleTracker
+from pymongo import UpdateOne, UpdateMany
+from typing import Optional, TYPE_CHECKING
+import asyncio
+import logging
+import os
+
+if TYPE_CHECKING:
+    from src.BlockPipeline import SealedBlock
+
+logger = logging.getLogger(__name__)
+
+PROVER_WORKERS = int(os.environ.get("PROVER_WORKERS", 1))
+PROVER_MAX_ATTEMPTS = int(os.environ.get("PROVER_MAX_ATTEMPTS", 3))
+PROVER_RETRY_BACKOFF_S = float(os.environ.get("PROVER_RETRY_BACKOFF_S", 5))
+PROVER_PARK_S = float(os.environ.get("PROVER_PARK_S", 300))
+PROVER_AGGREGATE = int(os.environ.get("PROVER_AGGREGATE", 1))
+PROVER_AGGREGATE_WAIT_MS = float(os.environ.get("PROVER_AGGREGATE_WAIT_MS", 2000))
+
+
+class ProverCoordinator:
+    """
+        Proves sealed badges and publishes the proofs.
+
+        Exported batch witnesses are grouped into proof jobs of `aggregate` consecutive
+        badges, one job is one L1 batch: the guest proves the group as one chained state
+        transition and it is published with a single submitBatch. A group that is not
+        full after PROVER_AGGREGATE_WAIT_MS is proved as it is.
+        PROVER_WORKERS jobs are proved at the same time, each in its own prover process,
+        failed attempts are retried with a growing backoff up to PROVER_MAX_ATTEMPTS.
+        The rollup contract only accepts batchId == batchCount + 1, so proved jobs are
+        submitted by a single task in batch order. After the submission the badges and
+        their transactions are VERIFIED. A prover that does not settle (FakeProver) leaves
+        the badges PROVED_FAKE and their transactions INCLUDED, nothing is reported as settled.
+        A job that failed all its attempts (proving or submitting) cannot be skipped, the
+        later batch ids would be rejected. It is parked as FAILED and queued again after
+        `park_s`, or earlier through retry().
+        Jobs are mirrored to mongo (PROOF_JOBS), unfinished ones are picked up again on start.
+        The jobs in memory are authoritative, a failed status write is logged and the
+        next write of the job brings mongo up to date.
+    """
+
+    def __init__(self, witness_exporter : WitnessExporter, prover, workers : int = PROVER_WORKERS, max_attempts : int = PROVER_MAX_ATTEMPTS,
+                 aggregate : int = PROVER_AGGREGATE, aggregate_wait_ms : float = PROVER_AGGREGATE_WAIT_MS,
+                 status_cache : Optional[TransactionStatusCache] = None, event_bus : Optional[EventBus] = None,
+                 lifecycle : Optional[LifecycleTracker] = None, park_s : float = PROVER_PARK_S):
+        self.mongo_client = get_mongo_client()
+        self.park_s = park_s
+        self.status_cache = status_cache
+        self.event_bus = event_bus
+        self.lifecycle = lifecycle
+        self.witness_exporter = witness_exporter
+        self.prover = prover
+        self.settles = getattr(prover, "settles", True)
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.aggregate = max(1, aggregate)
+        self.aggregate_wait_ms = aggregate_wait_ms
+        self.jobs : dict[int, ProofJob] = {}
+        self.queue : asyncio.Queue[int] = asyncio.Queue()
+        self.proved = asyncio.Event()
+        # (badgeId, blocknumber, transactions) of the badges waiting for their group to fill up
+        self.group : list[tuple[str, int, list[str]]] = []
+        self.group_timer : Optional[asyncio.TimerHandle] = None
+        self.next_batch_id = 1
+        self.next_submission : Optional[int] = None
+        self.last_blocknumber = 0
+
+    def _collection(self):
+        return self.mongo_client[os.environ["DB_NAME"]][os.environ.get("PROOF_JOBS", "proof_jobs")]
+
+    async def _save(self, job : ProofJob) -> None:
+        try:
+            await self._collection().update_one({"batchId": job.batchId}, {"$set": job.model_dump()}, upsert=True)
+        except Exception as e:
+            logger.error(f"could not store status {job.status} of batch {job.batchId} : {e}")
+
+    async def _set_status(self, job : ProofJob, status : ProofJobStatus, error : Optional[str] = None) -> None:
+        job.status = status.value
+        job.error = error
+        await self._save(job)
+
+    async def load_jobs(self) -> None:
+        """
+            Requeues the jobs that were not submitted before the last shutdown and
+            groups the persisted badges that never made it into a job
+        """
+        try:
+            last_job = await self._collection().find_one({}, sort=[("batchId", -1)])
+            if last_job is not None:
+                self.next_batch_id = last_job["batchId"] + 1
+                self.last_blocknumber = max(last_job["blocknumbers"], default=0)
+            cursor = self._collection().find({"status": {"$ne": ProofJobStatus.SUBMITTED.value}}).sort("batchId", 1)
+            async for doc in cursor:
+                doc.pop("_id", None)
+                job = ProofJob(**doc)
+                self.jobs[job.batchId] = job
+                if self.next_submission is None:
+                    self.next_submission = job.batchId
+                if job.status == ProofJobStatus.PROVED.value and os.path.exists(job.proofPath):
+                    continue
+                job.status = ProofJobStatus.QUEUED.value
+                job.attempts = 0
+                self.queue.put_nowait(job.batchId)
+            if self.next_submission is None:
+                self.next_submission = self.next_batch_id
+
+            badges = self.mongo_client[os.environ["DB_NAME"]][os.environ["BADGES"]]
+            cursor = badges.find({"status": BadgeStatus.SEND_TO_VERIFY.value, "blocknumber": {"$gt": self.last_blocknumber}}).sort("blocknumber", 1)
+            async for badge in cursor:
+                if os.path.exists(self.witness_exporter.batch_path(badge["blocknumber"], "bin")):
+                    await self._add_to_group(badge["badgeId"], badge["blocknumber"], badge["transactions"])
+            self.proved.set()
+            logger.info(f"loaded {len(self.jobs)} unfinished proof jobs and {len(self.group)} ungrouped badges, next submission : {self.next_submission}")
+        except Exception as e:
+            logger.error(f"failed to load the proof jobs : {e}")
+            raise e
+
+    async def enqueue(self, sealed_block : "SealedBlock") -> None:
+        """
+            Pipeline exporter, has to run after the witness exporter
+        """
+        await self._add_to_group(sealed_block.badge_id, sealed_block.blocknumber, sealed_block.block_commit.badge.transactions)
+
+    async def _add_to_group(self, badge_id : str, blocknumber : int, transactions : list[str]) -> None:
+        if blocknumber <= self.last_blocknumber:
+            return
+        self.last_blocknumber = blocknumber
+        self.group.append((badge_id, blocknumber, transactions))
+        if len(self.group) >= self.aggregate:
+            await self.flush_group()
+        elif self.group_timer is None:
+            loop = asyncio.get_running_loop()
+            self.group_timer = loop.call_later(self.aggregate_wait_ms / 1000, lambda: loop.create_task(self.flush_group()))
+
+    async def flush_group(self) -> None:
+        """
+            Turns the waiting badges into one proof job
+        """
+        if self.group_timer is not None:
+            self.group_timer.cancel()
+            self.group_timer = None
+        if len(self.group) == 0:
+            return
+        group = self.group
+        self.group = []
+        batch_id = self.next_batch_id
+        self.next_batch_id += 1
+        job = ProofJob(
+            batchId=batch_id,
+            badgeIds=[badge_id for badge_id, _, _ in group],
+            blocknumbers=[blocknumber for _, blocknumber, _ in group],
+            status=ProofJobStatus.QUEUED,
+            attempts=0,
+            batchPaths=[self.witness_exporter.batch_path(blocknumber, "bin") for _, blocknumber, _ in group],
+            proofPath=os.path.join(self.witness_exporter.directory, f"proof_{batch_id:010d}.json"),
+            transactions=[t for _, _, transactions in group for t in transactions]
+        )
+        self.jobs[batch_id] = job
+        if self.next_submission is None:
+            self.next_submission = batch_id
+        await self._save(job)
+        self.queue.put_nowait(batch_id)
+        logger.info(f"queued the proof of batch {batch_id} covering blocks {job.blocknumbers[0]}-{job.blocknumbers[-1]}, {self.queue.qsize()} jobs waiting")
+
+    async def _retry_later(self, batch_id : int, delay : float) -> None:
+        await asyncio.sleep(delay)
+        self.queue.put_nowait(batch_id)
+
+    async def _park(self, job : ProofJob, error : str) -> None:
+        await self._set_status(job, ProofJobStatus.FAILED, error=error)
+        await self._mark_badges_failed(job)
+        logger.error(f"batch {job.batchId} is parked, it is queued again in {self.park_s}s")
+        asyncio.get_running_loop().call_later(self.park_s, self.retry, job.batchId)
+
+    async def _worker(self, worker_id : int) -> None:
+        while True:
+            batch_id = await self.queue.get()
+            job = self.jobs[batch_id]
+            job.attempts += 1
+            await self._set_status(job, ProofJobStatus.PROVING)
+            logger.info(f"prover {worker_id} started batch {batch_id}, attempt {job.attempts}")
+            if self.lifecycle is not None:
+                self.lifecycle.proof_started(job.badgeIds)
+            try:
+                await self.prover.prove(job)
+                if self.lifecycle is not None:
+                    self.lifecycle.proof_finished(job.badgeIds)
+                await self._set_status(job, ProofJobStatus.PROVED)
+                logger.info(f"prover {worker_id} proved batch {batch_id}")
+                self.proved.set()
+            except Exception as e:
+                logger.error(f"proving batch {batch_id} failed (attempt {job.attempts} of {self.max_attempts}) : {e}")
+                if job.attempts < self.max_attempts:
+                    await self._set_status(job, ProofJobStatus.QUEUED, error=f"{e}")
+                    asyncio.get_running_loop().create_task(self._retry_later(batch_id, PROVER_RETRY_BACKOFF_S * 2 ** (job.attempts - 1)))
+                else:
+                    await self._park(job, error=f"{e}")
+                    if self.lifecycle is not None:
+                        self.lifecycle.discard_badges(job.badgeIds)
+                    self.proved.set()
+            finally:
+                self.queue.task_done()
+
+    async def _mark_badges_failed(self, job : ProofJob) -> None:
+        db = self.mongo_client[os.environ["DB_NAME"]]
+        try:
+            await db[os.environ["BADGES"]].update_many({"badgeId": {"$in": job.badgeIds}}, {"$set": {"status": BadgeStatus.FAILED.value}})
+        except Exception as e:
+            logger.error(f"could not mark the badges of batch {job.batchId} as failed : {e}")
+
+    async def _mark_verified(self, job : ProofJob, session) -> None:
+        db = self.mongo_client[os.environ["DB_NAME"]]
+        await db[os.environ["BADGES"]].bulk_write([UpdateMany(
+            {"badgeId": {"$in": job.badgeIds}},
+            {"$set": {"status": BadgeStatus.VERIFIED.value, "batchId": job.batchId}}
+        )], session=session)
+        if len(job.transactions) > 0:
+            await db[os.environ["TRANSACTIONS"]].bulk_write([UpdateMany(
+                {"transactionId": {"$in": job.transactions}},
+                {"$set": {"status": TransactionStatus.VERIFIED.value}}
+            )], session=session)
+        job.status = ProofJobStatus.SUBMITTED.value
+        job.error = None
+        await self._collection().bulk_write([UpdateOne({"batchId": job.batchId}, {"$set": job.model_dump()}, upsert=True)], session=session)
+
+    async def _mark_proved_fake(self, job : ProofJob) -> None:
+        db = self.mongo_client[os.environ["DB_NAME"]]
+        await db[os.environ["BADGES"]].update_many({"badgeId": {"$in": job.badgeIds}},
+            {"$set": {"status": BadgeStatus.PROVED_FAKE.value, "batchId": job.batchId}})
+        job.status = ProofJobStatus.SUBMITTED.value
+        job.error = None
+        await self._save(job)
+        if self.lifecycle is not None:
+            self.lifecycle.discard_badges(job.badgeIds)
+        logger.warning(f"batch {job.batchId} was proved by the fake prover, its {len(job.badgeIds)} badges are not settled")
+
+    async def _submit(self, job : ProofJob) -> None:
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await self.prover.submit(job)
+                break
+            except Exception as e:
+                logger.error(f"submitting the proof of batch {job.batchId} failed (attempt {attempt} of {self.max_attempts}) : {e}")
+                if attempt == self.max_attempts:
+                    raise e
+                await asyncio.sleep(PROVER_RETRY_BACKOFF_S * 2 ** (attempt - 1))
+        if not self.settles:
+            await self._mark_proved_fake(job)
+            return
+        async with await self.mongo_client.start_session() as session:
+            await session.with_transaction(lambda s: self._mark_verified(job, s))
+        TRANSACTIONS.inc(len(job.transactions), labels=(TransactionStatus.VERIFIED.value,))
+        if self.lifecycle is not None:
+            self.lifecycle.settled(job.badgeIds)
+        if self.status_cache is not None:
+            self.status_cache.update(job.transactions, TransactionStatus.VERIFIED.value)
+        if self.event_bus is not None:
+            self.event_bus.publish_verified(badge_ids=job.badgeIds, blocknumbers=job.blocknumbers, batch_id=job.batchId)
+        logger.info(f"batch {job.batchId} is verified, {len(job.badgeIds)} badges with {len(job.transactions)} transactions")
+
+    async def _submit_loop(self) -> None:
+        while True:
+            job = self.jobs.get(self.next_submission) if self.next_submission is not None else None
+            if job is None or job.status != ProofJobStatus.PROVED.value:
+                if job is not None and job.status == ProofJobStatus.FAILED.value:
+                    logger.error(f"the proof of batch {job.batchId} failed, submissions wait until it is proved again")
+                self.proved.clear()
+                await self.proved.wait()
+                continue
+            try:
+                await self._submit(job)
+                del self.jobs[job.batchId]
+                self.next_submission += 1
+            except Exception as e:
+                await self._park(job, error=f"{e}")
+
+    def retry(self, batch_id : int) -> bool:
+        """
+            Queues a failed job again, the submissions continue once it is proved
+        """
+        job = self.jobs.get(batch_id)
+        if job is None or job.status != ProofJobStatus.FAILED.value:
+            return False
+        job.attempts = 0
+        job.status = ProofJobStatus.QUEUED.value
+        self.queue.put_nowait(batch_id)
+        return True
+
+    def status(self) -> dict:
+        counts = {status.value: 0 for status in ProofJobStatus}
+        for job in self.jobs.values():
+            counts[job.status] += 1
+        return {
+            "workers": self.workers,
+            "aggregate": self.aggregate,
+            "grouping": len(self.group),
+            "next_submission": self.next_submission,
+            "parked": sorted(job.batchId for job in self.jobs.values() if job.status == ProofJobStatus.FAILED.value),
+            "waiting": self.queue.qsize(),
+            "jobs": counts,
+        }
+
+    async def run(self) -> None:
+        tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        tasks.append(asyncio.create_task(self._submit_loop()))
+        try:
+            await asyncio.gather(*tasks)
+        except Exception as e:
+            logger.error(f"prover coordinator stopped : {e}")
+            raise e
+        finally:
+            for task in tasks:
+                task.cancel()
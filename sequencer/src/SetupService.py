@@ -6,7 +6,9 @@ from src.Types import AccountsCollection, TransactionBadge, BadgeStatus, Current
 import sys
 import json
 from src.utils import generate_random_id, get_current_timestamp
+from src.AccountHistory import AccountHistory
 import asyncio
+from pymongo import ASCENDING, UpdateOne
 
 
 logger = logging.getLogger(__name__)
@@ -15,6 +17,7 @@ class SetupService:
     def __init__(self, start_users_needed : bool):
         self.start_users_needed = start_users_needed
         self.mongo_client = get_mongo_client()
+        self.account_history = AccountHistory()
 
     async def insert_start_users(self):
         db = self.mongo_client[os.environ["DB_NAME"]]
@@ -25,12 +28,12 @@ class SetupService:
                 AccountsCollection(
                     address=user["pub_key"],
                     balance=user["balance"],
-                    nonce=0,
-                    account_updates=[]
+                    nonce=0
                 ).model_dump()
                 for user in initial_state
             ]
-            await users_collection.insert_many(user_dicts)
+            # an interrupted seeding is run again, accounts that are already there are kept
+            await users_collection.bulk_write([UpdateOne({"address": user["address"]}, {"$setOnInsert": user}, upsert=True) for user in user_dicts])
             logger.info("Inserted users into the database.")
         except Exception as e:
             logger.info(e)
@@ -46,6 +49,10 @@ class SetupService:
             state_json = self.get_state_json()
             db = self.mongo_client[os.environ["DB_NAME"]]
             badges_col = db[os.environ["BADGES"]]
+            existing_genesis = await badges_col.find_one({"blocknumber": 0}, {"_id": 0, "badgeId": 1})
+            if existing_genesis is not None:
+                await self._set_genesis_pointer(db, existing_genesis["badgeId"])
+                return
             geneisis_badge_id = generate_random_id()
             genesis_badge = TransactionBadge(
                 badgeId=geneisis_badge_id,
@@ -64,17 +71,46 @@ class SetupService:
             except Exception as e:
                 logger.error(f"Error inserting genesis badge: {e}")
                 sys.exit(1)
-            
+            await self._set_genesis_pointer(db, geneisis_badge_id)
+
+    async def _set_genesis_pointer(self, db, genesis_badge_id : str) -> None:
             badges_pointer_col= db[os.environ["CURR"]]
-            badges_pointer = CurrentBadge(currBadgeID = geneisis_badge_id)
+            badges_pointer = CurrentBadge(currBadgeID = genesis_badge_id)
             try:
-                badges_pointer_col.insert_one(badges_pointer.model_dump())
+                await badges_pointer_col.insert_one(badges_pointer.model_dump())
                 logger.info("Inserted the genesis pointer")
             except Exception as e:
                 logger.error(f"Error inserting genesis badge: {e}")
                 sys.exit(1)
+
+    async def is_seeded(self) -> bool:
+        """
+            The current badge pointer is written last, once it exists the genesis state is complete
+        """
+        db = self.mongo_client[os.environ["DB_NAME"]]
+        return await db[os.environ["CURR"]].find_one({}) is not None
     
+    async def create_indexes(self) -> None:
+        db = self.mongo_client[os.environ["DB_NAME"]]
+        # get-nonce / get-status fall back to these when the in-memory state can not answer
+        await db[os.environ["USERS"]].create_index("address")
+        await db[os.environ["TRANSACTIONS"]].create_index("submissionId")
+        await db[os.environ["TRANSACTIONS"]].create_index("transactionId")
+        # pending transactions are reloaded in arrival order on start
+        await db[os.environ["TRANSACTIONS"]].create_index([("status", ASCENDING), ("receivedAt", ASCENDING)])
+        # deposits are deduplicated by their L1 deposit id and rewound by L1 block
+        await db[os.environ["TRANSACTIONS"]].create_index("depositId", sparse=True)
+        await db[os.environ["TRANSACTIONS"]].create_index("l1Block", sparse=True)
+        await self.account_history.create_indexes()
+
     async def on_start(self) -> None:
+        await self.create_indexes()
+        # databases written before the history buckets keep it in USERS.account_updates
+        await self.account_history.migrate_users()
+        # a restart continues the chain, only an empty database gets the genesis state
+        if await self.is_seeded():
+            logger.info("the genesis state is already set up")
+            return
         if self.start_users_needed:
             await self.insert_start_users()
         await self.setup_genesis_badge()
@@ -0,0 +1,275 @@
+from hashlib import sha256
+from bisect import bisect_left
+from typing import Optional
+from smt.proof import SparseMerkleProof
+import logging
+
+logger = logging.getLogger(__name__)
+
+"""
+    Drop-in replacement for smt.tree.SparseMerkleTree (same hashing, same compacted layout,
+    hence the same roots and proofs) that can apply a whole block of leaf updates at once.
+
+    leaf node:      0x00 || path || H(value)        path = H(key)
+    internal node:  0x01 || left || right
+    empty subtree:  32 zero bytes, at every height
+"""
+
+LEAF = b"\x00"
+NODE = b"\x01"
+DEPTH = 256
+PLACEHOLDER = bytes(32)
+DEFAULTVALUE = b""
+
+
+class MemoryNodeStore:
+    """
+        Nodes are kept as raw bytes keyed by their 32 byte hash,
+        leaf values are keyed by their 32 byte path.
+        Has the same interface as smt.store.TreeMapStore.
+    """
+
+    def __init__(self):
+        self.nodes : dict[bytes, bytes] = {}
+        self.values : dict[bytes, bytes] = {}
+        # the node accessors sit on the hot path of every update, bind them straight to the dict
+        self.get_node = self.nodes.get
+        self.set_node = self.nodes.__setitem__
+
+    def delete_node(self, key : bytes) -> bool:
+        return self.nodes.pop(key, None) is not None
+
+    def delete_nodes(self, keys : list[bytes]) -> None:
+        pop = self.nodes.pop
+        for key in keys:
+            pop(key, None)
+
+    def get_value(self, key : bytes) -> Optional[bytes]:
+        return self.values.get(key)
+
+    def set_value(self, key : bytes, value : bytes) -> bool:
+        self.values[key] = value
+        return True
+
+    def delete_value(self, key : bytes) -> bool:
+        return self.values.pop(key, None) is not None
+
+
+class StateTree:
+
+    def __init__(self, store = None, root : bytes = PLACEHOLDER):
+        self.store = store if store is not None else MemoryNodeStore()
+        self.root = root
+
+    def root_as_bytes(self) -> bytes:
+        return self.root
+
+    def root_as_hex(self) -> str:
+        return "0x" + self.root.hex()
+
+    def get(self, key : bytes) -> bytes:
+        if self.root == PLACEHOLDER:
+            return DEFAULTVALUE
+        value = self.store.get_value(sha256(key).digest())
+        return value if value else DEFAULTVALUE
+
+    def has(self, key : bytes) -> bool:
+        return self.get(key) != DEFAULTVALUE
+
+    def update(self, key : bytes, value : bytes) -> bytes:
+        return self.update_many([key], [value])
+
+    def delete(self, key : bytes) -> bytes:
+        return self.update_many([key], [DEFAULTVALUE])
+
+    def update_many(self, keys : list[bytes], values : list[bytes]) -> bytes:
+        """
+            Applies all updates in one pass: the dirty paths are sorted and the tree is
+            rewritten top down, so every internal node shared by several dirty leaves is
+            hashed once. The last value wins for duplicate keys, an empty value deletes.
+        """
+        updates = {}
+        for key, value in zip(keys, values):
+            updates[sha256(key).digest()] = value
+        items = []
+        for path, value in updates.items():
+            # no-op updates are dropped, so no node that gets orphaned can be recreated by this pass
+            current = self.store.get_value(path)
+            if value == (current or DEFAULTVALUE):
+                continue
+            if value == DEFAULTVALUE:
+                self.store.delete_value(path)
+                value_hash = None
+            else:
+                self.store.set_value(path, value)
+                value_hash = sha256(value).digest()
+            items.append((int.from_bytes(path, 'big'), path, value_hash))
+        items.sort()
+        self._orphans = []
+        self.root = self._update_subtree(self.root, 0, items, 0, len(items))
+        self.store.delete_nodes(self._orphans)
+        return self.root
+
+    def _create_leaf(self, path : bytes, value_hash : bytes) -> bytes:
+        data = LEAF + path + value_hash
+        node_hash = sha256(data).digest()
+        self.store.set_node(node_hash, data)
+        return node_hash
+
+    def _create_node(self, left : bytes, right : bytes) -> bytes:
+        data = NODE + left + right
+        node_hash = sha256(data).digest()
+        self.store.set_node(node_hash, data)
+        return node_hash
+
+    def _split(self, depth : int, items : list, lo : int, hi : int) -> int:
+        shift = DEPTH - depth
+        threshold = ((items[lo][0] >> shift) << shift) | (1 << (shift - 1))
+        return bisect_left(items, (threshold,), lo, hi)
+
+    def _build_subtree(self, depth : int, items : list, lo : int, hi : int) -> bytes:
+        """
+            Builds a subtree that holds nothing but the given leaves
+        """
+        if hi - lo == 1:
+            path_int, path, value_hash = items[lo]
+            return self._create_leaf(path, value_hash)
+        split = self._split(depth, items, lo, hi)
+        if split == lo:
+            return self._create_node(PLACEHOLDER, self._build_subtree(depth + 1, items, lo, hi))
+        if split == hi:
+            return self._create_node(self._build_subtree(depth + 1, items, lo, hi), PLACEHOLDER)
+        left = self._build_subtree(depth + 1, items, lo, split)
+        right = self._build_subtree(depth + 1, items, split, hi)
+        return self._create_node(left, right)
+
+    def _build_without_deletions(self, depth : int, items : list, lo : int, hi : int) -> bytes:
+        inserts = [item for item in items[lo:hi] if item[2] is not None]
+        if len(inserts) == 0:
+            return PLACEHOLDER
+        return self._build_subtree(depth, inserts, 0, len(inserts))
+
+    def _update_subtree(self, node_hash : bytes, depth : int, items : list, lo : int, hi : int) -> bytes:
+        if lo == hi:
+            return node_hash
+        if hi - lo == 1:
+            return self._update_path(node_hash, depth, items[lo])
+        if node_hash == PLACEHOLDER:
+            return self._build_without_deletions(depth, items, lo, hi)
+
+        store = self.store
+        data = store.get_node(node_hash)
+        if data is None:
+            raise KeyError(f"missing tree node {node_hash.hex()}")
+
+        if data[0] == 0:
+            # a single leaf lives in this subtree: merge it with the updates unless it gets replaced
+            leaf_path = data[1:33]
+            leaf_int = int.from_bytes(leaf_path, 'big')
+            i = bisect_left(items, (leaf_int,), lo, hi)
+            if i < hi and items[i][0] == leaf_int:
+                self._orphans.append(node_hash)
+                return self._build_without_deletions(depth, items, lo, hi)
+            merged = items[lo:i] + [(leaf_int, leaf_path, data[33:])] + items[i:hi]
+            return self._build_without_deletions(depth, merged, 0, len(merged))
+
+        self._orphans.append(node_hash)
+        shift = DEPTH - depth
+        split = bisect_left(items, ((((items[lo][0] >> shift) << shift) | (1 << (shift - 1))),), lo, hi)
+        new_left = self._update_subtree(data[1:33], depth + 1, items, lo, split)
+        new_right = self._update_subtree(data[33:], depth + 1, items, split, hi)
+        if new_left == PLACEHOLDER:
+            if new_right == PLACEHOLDER:
+                return PLACEHOLDER
+            # after deletions a lone leaf moves up to replace its parent
+            if store.get_node(new_right)[0] == 0:
+                return new_right
+        elif new_right == PLACEHOLDER and store.get_node(new_left)[0] == 0:
+            return new_left
+        data = NODE + new_left + new_right
+        node_hash = sha256(data).digest()
+        store.set_node(node_hash, data)
+        return node_hash
+
+    def _update_path(self, node_hash : bytes, depth : int, item : tuple) -> bytes:
+        """
+            Fast path for a subtree that receives a single update: walk down iteratively,
+            then hash back up along the collected side nodes
+        """
+        get_node = self.store.get_node
+        orphan = self._orphans.append
+        path_int, path, value_hash = item
+        bits = format(path_int, '0256b')
+        side_nodes = []
+        while node_hash != PLACEHOLDER:
+            data = get_node(node_hash)
+            if data is None:
+                raise KeyError(f"missing tree node {node_hash.hex()}")
+            if data[0] == 0:
+                if data[1:33] != path:
+                    leaf_int = int.from_bytes(data[1:33], 'big')
+                    pair = [item, (leaf_int, data[1:33], data[33:])] if path_int < leaf_int else [(leaf_int, data[1:33], data[33:]), item]
+                    new_hash = self._build_without_deletions(depth, pair, 0, 2)
+                    new_is_leaf = value_hash is None
+                    break
+                orphan(node_hash)
+                node_hash = PLACEHOLDER
+                break
+            orphan(node_hash)
+            if bits[depth] == "1":
+                side_nodes.append(data[1:33])
+                node_hash = data[33:]
+            else:
+                side_nodes.append(data[33:])
+                node_hash = data[1:33]
+            depth += 1
+        if node_hash == PLACEHOLDER:
+            new_is_leaf = value_hash is not None
+            new_hash = self._create_leaf(path, value_hash) if new_is_leaf else PLACEHOLDER
+
+        set_node = self.store.set_node
+        for side_node in reversed(side_nodes):
+            depth -= 1
+            # after deletions a lone leaf moves up to replace its parent
+            if new_hash == PLACEHOLDER:
+                if side_node == PLACEHOLDER:
+                    continue
+                if get_node(side_node)[0] == 0:
+                    new_hash = side_node
+                    new_is_leaf = True
+                    continue
+            elif new_is_leaf and side_node == PLACEHOLDER:
+                continue
+            data = NODE + side_node + new_hash if bits[depth] == "1" else NODE + new_hash + side_node
+            new_hash = sha256(data).digest()
+            set_node(new_hash, data)
+            new_is_leaf = False
+        return new_hash
+
+    def prove(self, key : bytes) -> SparseMerkleProof:
+        return self.prove_for_root(key, self.root)
+
+    def prove_for_root(self, key : bytes, root : bytes) -> SparseMerkleProof:
+        path = sha256(key).digest()
+        path_int = int.from_bytes(path, 'big')
+        side_nodes = []
+        if root == PLACEHOLDER:
+            return SparseMerkleProof(side_nodes, None, None)
+        node_hash = root
+        data = self.store.get_node(root)
+        depth = 0
+        while data[0] != 0:
+            if (path_int >> (DEPTH - 1 - depth)) & 1:
+                side_nodes.append(data[1:33])
+                node_hash = data[33:]
+            else:
+                side_nodes.append(data[33:])
+                node_hash = data[1:33]
+            depth += 1
+            if node_hash == PLACEHOLDER:
+                break
+            data = self.store.get_node(node_hash)
+        non_membership_leafdata = None
+        if node_hash != PLACEHOLDER and data[1:33] != path:
+            non_membership_leafdata = data
+        return SparseMerkleProof(side_nodes[::-1], non_membership_leafdata, None)
@@ -0,0 +1,73 @@
+from collections import OrderedDict
+from typing import Iterable, Optional
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+STATUS_CACHE_SIZE = int(os.environ.get("STATUS_CACHE_SIZE", 100_000))
+
+
+class TransactionStatusCache:
+    """
+        Status of the latest submissions, get-status answers from here without a mongo read.
+        A status is only set after it was committed to mongo, so a reader never sees a state
+        that could still be lost. Once max_size submissions are held the oldest are evicted,
+        get-status falls back to mongo for them.
+    """
+
+    def __init__(self, max_size : int = STATUS_CACHE_SIZE):
+        self.max_size = max_size
+        # submissionId -> [transactionId, status]
+        self.submissions : OrderedDict[str, list] = OrderedDict()
+        # transactionId -> submissionId
+        self.transactions : dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.submissions)
+
+    def reserve(self, submission_id : str, transaction_id : str) -> None:
+        """
+            Registers a submission before it is stored, without a status yet, so a block
+            that includes it before put is called still has an entry to update
+        """
+        self._set(submission_id, transaction_id, None)
+
+    def put(self, submission_id : str, transaction_id : str, status : str) -> None:
+        """
+            Submission status of a stored submission. A status a block already set is kept,
+            the submission status is never newer.
+        """
+        entry = self.submissions.get(submission_id)
+        if entry is not None and entry[1] is not None:
+            return
+        self._set(submission_id, transaction_id, status)
+
+    def _set(self, submission_id : str, transaction_id : str, status : Optional[str]) -> None:
+        if self.max_size <= 0:
+            return
+        if submission_id not in self.submissions:
+            while len(self.submissions) >= self.max_size:
+                _, (evicted_id, _) = self.submissions.popitem(last=False)
+                self.transactions.pop(evicted_id, None)
+        self.submissions[submission_id] = [transaction_id, status]
+        self.transactions[transaction_id] = submission_id
+
+    def update(self, transaction_ids : Iterable[str], status : str) -> None:
+        """
+            Transactions that are not held (deposits, evicted ones) are skipped
+        """
+        for transaction_id in transaction_ids:
+            submission_id = self.transactions.get(transaction_id)
+            if submission_id is not None:
+                self.submissions[submission_id][1] = status
+
+    def get(self, submission_id : str) -> Optional[str]:
+        entry = self.submissions.get(submission_id)
+        if entry is None or entry[1] is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
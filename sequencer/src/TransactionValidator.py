@@ -1,32 +1,180 @@
-
-from src.Types import Transaction
+from src.TxRecord import TxRecord
 import logging
-from src.utils import hex_to_bytes
-import json
-from eth_utils import keccak, to_bytes
+from src.utils import hex_to_bytes, transfer_message_hash
+import os
+import time
+import asyncio
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from eth_keys import keys
+from eth_keys.backends import get_backend
+from src.Metrics import SIGNATURE_BATCH_SECONDS, SIGNATURE_QUEUE_SECONDS, SIGNATURES
 
 logger = logging.getLogger(__name__)
 
+VERIFIER_POOL = os.environ.get("VERIFIER_POOL", "process")
+VERIFIER_WORKERS = int(os.environ.get("VERIFIER_WORKERS", os.cpu_count() or 1))
+VERIFY_BATCH_SIZE = int(os.environ.get("VERIFY_BATCH_SIZE", 64))
+VERIFY_BATCH_WINDOW_MS = float(os.environ.get("VERIFY_BATCH_WINDOW_MS", 2))
+
+QUEUE_DELAY_SAMPLES = 10000
+
+"""
+    (sender, receiver, amount, nonce, signature) of one transfer,
+    plain tuples so they are cheap to send to the worker processes
+"""
+SignatureJob = tuple[str, str, float, int, str]
+
+
+def verify_signature(job : SignatureJob) -> bool:
+    """
+        The scheme the guest checks: a personal_sign signature of utils.transfer_message whose
+        signer is the sender. v is 27/28 (wallets) or 0/1, the submitted pubKey is not used.
+    """
+    sender, receiver, amount, nonce, signature = job
+    try:
+        signature_bytes = hex_to_bytes(signature)
+        if len(signature_bytes) != 65:
+            return False
+        v = signature_bytes[64] - 27 if signature_bytes[64] >= 27 else signature_bytes[64]
+        signature = keys.Signature(signature_bytes[:64] + bytes([v]))
+        public_key = signature.recover_public_key_from_msg_hash(transfer_message_hash(sender, receiver, amount, nonce))
+        return public_key.to_canonical_address() == hex_to_bytes(sender)
+    except Exception as e:
+        logger.info(e)
+        return False
+
+
+def verify_signatures(jobs : list[SignatureJob]) -> tuple[float, list[bool]]:
+    """
+        Runs inside the pool, one call per micro batch.
+        Returns the wall clock time the worker picked the batch up.
+    """
+    started_at = time.time()
+    return started_at, [verify_signature(job) for job in jobs]
+
+
+class QueueDelayStats:
+    """
+        Time a signature waited between submission and a worker picking up its batch
+    """
+
+    def __init__(self):
+        self.samples = deque(maxlen=QUEUE_DELAY_SAMPLES)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, delay : float) -> None:
+        self.samples.append(delay)
+        self.count += 1
+        self.total += delay
+
+    def percentile(self, p : float) -> float:
+        if len(self.samples) == 0:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": (self.total / self.count) * 1000 if self.count > 0 else 0.0,
+            "p50_ms": self.percentile(0.50) * 1000,
+            "p99_ms": self.percentile(0.99) * 1000,
+            "max_ms": max(self.samples, default=0.0) * 1000,
+        }
+
+
 class Transaction_Validator(object):
-    
-    async def check_transaction_validity(self, transaction : Transaction, submission_id : str) -> bool:
-        logger.info("starting to check the transaction validity")
-        try:
-            tx_body = {
-                "sender" : transaction.sender,
-                "receiver" : transaction.receiver,
-                "amount": str(int(transaction.amount)),
-                "nonce": transaction.nonce
-            }
-            message_json = json.dumps(tx_body, separators=(",", ":"), sort_keys=True)
-            signature_bytes = hex_to_bytes(transaction.signature)
-            pubkey_bytes = hex_to_bytes(transaction.pubKey)
-            signature = keys.Signature(signature_bytes)
-            public_key = keys.PublicKey(pubkey_bytes)
-            message_bytes = message_json.encode("utf-8")
-            return public_key.verify_msg(message_bytes, signature)
+    """
+        Signature checks run in a worker pool instead of on the event loop.
+        Submissions that arrive within VERIFY_BATCH_WINDOW_MS of each other
+        (up to VERIFY_BATCH_SIZE) are sent to the pool as one batch.
+    """
+
+    def __init__(self):
+        self.executor : Executor = None
+        self.pending : list[tuple[SignatureJob, asyncio.Future, float]] = []
+        self.flush_handle : asyncio.TimerHandle = None
+        self.queue_delay = QueueDelayStats()
+
+    def start(self) -> None:
+        """
+            Creates the pool, call it early in the lifespan so the worker processes
+            are forked before the other background tasks start
+        """
+        if self.executor is not None:
+            return
+        if VERIFIER_POOL == "process":
+            self.executor = ProcessPoolExecutor(max_workers=VERIFIER_WORKERS)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=VERIFIER_WORKERS, thread_name_prefix="verifier")
+        logger.info(f"signature verification runs in a {VERIFIER_POOL} pool with {VERIFIER_WORKERS} workers, ecc backend : {type(get_backend()).__name__}")
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
 
+    def _queue(self, transaction : TxRecord, loop : asyncio.AbstractEventLoop) -> asyncio.Future:
+        future = loop.create_future()
+        if transaction.signature is None:
+            future.set_result(False)
+            return future
+        job = (transaction.sender, transaction.receiver, transaction.amount, transaction.nonce, transaction.signature)
+        self.pending.append((job, future, time.time()))
+        return future
+
+    async def check_transaction_validity(self, transaction : TxRecord, submission_id : str) -> bool:
+        loop = asyncio.get_running_loop()
+        future = self._queue(transaction, loop)
+        if len(self.pending) >= VERIFY_BATCH_SIZE:
+            self._flush()
+        elif self.flush_handle is None and len(self.pending) > 0:
+            self.flush_handle = loop.call_later(VERIFY_BATCH_WINDOW_MS / 1000, self._flush)
+        return await future
+
+    async def check_transactions_validity(self, transactions : list[TxRecord]) -> list[bool]:
+        """
+            Signature checks of a submitted batch, they are sent to the pool right away
+            together with whatever else is queued, spread over the workers
+        """
+        loop = asyncio.get_running_loop()
+        futures = [self._queue(transaction, loop) for transaction in transactions]
+        self._flush()
+        return list(await asyncio.gather(*futures))
+
+    def _flush(self) -> None:
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if len(self.pending) == 0:
+            return
+        batch = self.pending
+        self.pending = []
+        # spread the batch over the workers instead of letting one worker verify all of it
+        chunk_size = -(-len(batch) // VERIFIER_WORKERS)
+        loop = asyncio.get_running_loop()
+        for i in range(0, len(batch), chunk_size):
+            loop.create_task(self._verify_batch(batch[i:i + chunk_size]))
+
+    async def _verify_batch(self, batch : list[tuple[SignatureJob, asyncio.Future, float]]) -> None:
+        self.start()
+        try:
+            started_at, results = await asyncio.get_running_loop().run_in_executor(self.executor, verify_signatures, [job for job, future, enqueued_at in batch])
+            SIGNATURE_BATCH_SECONDS.observe(max(0.0, time.time() - started_at))
+            for job, future, enqueued_at in batch:
+                delay = max(0.0, started_at - enqueued_at)
+                self.queue_delay.observe(delay)
+                SIGNATURE_QUEUE_SECONDS.observe(delay)
+            valid = sum(results)
+            SIGNATURES.inc(valid, labels=("true",))
+            SIGNATURES.inc(len(results) - valid, labels=("false",))
         except Exception as e:
-            logger.info(e)
-            return False
+            logger.error(f"signature verification batch of {len(batch)} failed : {e}")
+            results = [False] * len(batch)
+        for (job, future, enqueued_at), valid in zip(batch, results):
+            if not future.done():
+                future.set_result(valid)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"verified a batch of {len(batch)} signatures, queue delay : {self.queue_delay.summary()}")
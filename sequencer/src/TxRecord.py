@@ -0,0 +1,108 @@
+from src.Types import TransactionRequest, TransactionStatus
+from src.utils import hex_to_bytes
+from typing import Optional
+import hashlib
+
+
+class TxRecord:
+    """
+        Internal transaction between the API edge and mongo. Pydantic validation
+        happens once on the request (TransactionRequest), everything after that
+        works on these records.
+        sender_key / receiver_key are the raw 20 byte addresses, parsed once here
+        and used for account lookups, hashing and encoding. sender / receiver keep
+        the hex strings as submitted, the signature was made over them.
+        to_document / from_document map to the TRANSACTIONS layout (Types.Transaction).
+        tx_hash is computed once (hash()) and folded into the rolling hash of its block.
+    """
+    __slots__ = ("transaction_id", "submission_id", "received_at", "sender", "receiver", "sender_key", "receiver_key",
+                 "amount", "nonce", "signature", "pub_key", "status", "badge_id", "deposit_id", "l1_block", "l1_block_hash", "tx_hash")
+
+    def __init__(self, transaction_id : str, submission_id : Optional[str], received_at : int, sender : str, receiver : Optional[str],
+                 amount : int, nonce : Optional[int], signature : Optional[str] = None, pub_key : Optional[str] = None,
+                 status : Optional[str] = None, badge_id : Optional[str] = None, deposit_id : Optional[int] = None, l1_block : Optional[int] = None,
+                 l1_block_hash : Optional[str] = None):
+        self.transaction_id = transaction_id
+        self.submission_id = submission_id
+        self.received_at = received_at
+        self.sender = sender
+        self.receiver = receiver
+        self.sender_key = hex_to_bytes(sender)
+        self.receiver_key = hex_to_bytes(receiver) if receiver is not None else None
+        self.amount = int(amount)
+        self.nonce = nonce
+        self.signature = signature
+        self.pub_key = pub_key
+        self.status = status
+        self.badge_id = badge_id
+        self.deposit_id = deposit_id
+        self.l1_block = l1_block
+        self.l1_block_hash = l1_block_hash
+        self.tx_hash : Optional[bytes] = None
+
+    @classmethod
+    def from_request(cls, request : TransactionRequest, transaction_id : str, submission_id : str, received_at : int) -> "TxRecord":
+        return cls(
+            transaction_id=transaction_id,
+            submission_id=submission_id,
+            received_at=received_at,
+            sender=request.sender,
+            receiver=request.receiver,
+            amount=request.amount,
+            nonce=request.nonce,
+            signature=request.signature.signature,
+            pub_key=request.signature.pubKey,
+            status=TransactionStatus.PENDING.value
+        )
+
+    @classmethod
+    def from_document(cls, doc : dict) -> "TxRecord":
+        return cls(
+            transaction_id=doc["transactionId"],
+            submission_id=doc.get("submissionId"),
+            received_at=doc["receivedAt"],
+            sender=doc["sender"],
+            receiver=doc.get("receiver"),
+            amount=doc["amount"],
+            nonce=doc.get("nonce"),
+            signature=doc.get("signature"),
+            pub_key=doc.get("pubKey"),
+            status=doc.get("status"),
+            badge_id=doc.get("badgeId"),
+            deposit_id=doc.get("depositId"),
+            l1_block=doc.get("l1Block"),
+            l1_block_hash=doc.get("l1BlockHash")
+        )
+
+    def to_document(self) -> dict:
+        return {
+            "receivedAt": self.received_at,
+            "submissionId": self.submission_id,
+            "transactionId": self.transaction_id,
+            "sender": self.sender,
+            "receiver": self.receiver,
+            "nonce": self.nonce,
+            "signature": self.signature,
+            "amount": self.amount,
+            "status": self.status,
+            "badgeId": self.badge_id,
+            "pubKey": self.pub_key,
+            "depositId": self.deposit_id,
+            "l1Block": self.l1_block,
+            "l1BlockHash": self.l1_block_hash
+        }
+
+    def hash(self) -> bytes:
+        """
+            H(sender, receiver, nonce, amount, receivedAt), integers as 8 byte little endian.
+            Deposits have no receiver (b"0") and no nonce (0).
+        """
+        if self.tx_hash is None:
+            receiver_bytes = self.receiver_key if self.receiver_key is not None else b"0"
+            msg = (self.sender_key + receiver_bytes + (self.nonce or 0).to_bytes(8, 'little')
+                   + self.amount.to_bytes(8, 'little') + self.received_at.to_bytes(8, 'little'))
+            self.tx_hash = hashlib.sha256(msg).digest()
+        return self.tx_hash
+
+    def is_deposit(self) -> bool:
+        return self.receiver is None
@@ -4,7 +4,8 @@ from typing import Optional
 
 
 class SignatureData(BaseModel):
-    pubKey: str
+    # the signer is recovered from the signature, a pubKey is accepted but not needed
+    pubKey: Optional[str] = None
     signature: str
 
 class TransactionRequest(BaseModel):
@@ -18,12 +19,23 @@ class TransactionRequest(BaseModel):
 class BadgeExecutionCause(Enum):
     TIMEDOUT = "timedout"
     FILLEDUP = "filledup"
+    GASLIMIT = "gaslimit"
 
 
 class BadgeStatus(Enum):
     SEND_TO_VERIFY = "send_to_verify"
     VERIFIED = "verified"
     FAILED = "failed"
+    # proved by the FakeProver, never submitted and never settled
+    PROVED_FAKE = "proved-fake"
+
+
+class ProofJobStatus(Enum):
+    QUEUED = "queued"
+    PROVING = "proving"
+    PROVED = "proved"
+    SUBMITTED = "submitted"
+    FAILED = "failed"
 
 
 class TransactionStatus(Enum):
@@ -46,6 +58,10 @@ class Transaction(BaseModel):
     status : Optional[TransactionStatus]
     badgeId :  Optional[str]
     pubKey : Optional[str]
+    depositId : Optional[int] = None
+    # L1 block of the deposit event
+    l1Block : Optional[int] = None
+    l1BlockHash : Optional[str] = None
 
     class Config:
         use_enum_values = True
@@ -58,14 +74,32 @@ class AccountUpdates(BaseModel):
     nonce_after : int
     transactions : list[str]
     badgeId : str
+    blocknumber : int
+    timestamp : int
 
 
-# collection
+# collection, the current state of an account
 class AccountsCollection(BaseModel):
     address : str
     balance : int
     nonce: int
-    account_updates : list[AccountUpdates]
+
+
+# collection, the updates of one account within one time bucket
+class AccountHistoryBucket(BaseModel):
+    address : str
+    bucket : int
+    count : int
+    first_block : int
+    last_block : int
+    updates : list[AccountUpdates]
+
+
+class AccountHistoryPage(BaseModel):
+    address : str
+    updates : list[AccountUpdates]
+    # pass as before to get the next (older) page
+    next_before : Optional[int]
 
 
 #collection
@@ -79,6 +113,23 @@ class TransactionBadge(BaseModel):
     executionCause: Optional[BadgeExecutionCause]
     transactions : list[str]
     prevBadge : Optional[str]
+    # L1 batch that published the badge, several badges share one with aggregation
+    batchId : Optional[int] = None
+
+    class Config:
+        use_enum_values = True
+
+# collection
+class ProofJob(BaseModel):
+    batchId : int
+    badgeIds : list[str]
+    blocknumbers : list[int]
+    status : ProofJobStatus
+    attempts : int
+    batchPaths : list[str]
+    proofPath : str
+    transactions : list[str]
+    error : Optional[str] = None
 
     class Config:
         use_enum_values = True
@@ -91,6 +142,24 @@ class SubmissionResponse(BaseModel):
     submission_id : str
     valid : bool
 
+class TransactionBatchRequest(BaseModel):
+    transactions : list[TransactionRequest]
+
+class BatchSubmissionResult(BaseModel):
+    submission_id : str
+    valid : bool
+    status : str
+
+class BatchSubmissionResponse(BaseModel):
+    submissions : list[BatchSubmissionResult]
+
+class ProofBatchRequest(BaseModel):
+    addresses : list[str]
+
+class ProfileRequest(BaseModel):
+    blocks : Optional[int] = Field(default=None, gt=0)
+    seconds : Optional[float] = Field(default=None, gt=0)
+
 class SubmissionStatus(BaseModel):
     submission_id : str
     status : str
@@ -106,3 +175,28 @@ class SubmissionStatusRequest(BaseModel):
 
 
 
+
+
+class SchedulerSettings(BaseModel):
+    max_block_size : int
+    min_block_size : int
+    max_latency_ms : int
+    target_interval_ms : int
+    max_gas : int
+    adaptive : bool
+
+class SchedulerSettingsUpdate(BaseModel):
+    max_block_size : Optional[int] = None
+    min_block_size : Optional[int] = None
+    max_latency_ms : Optional[int] = None
+    target_interval_ms : Optional[int] = None
+    max_gas : Optional[int] = None
+    adaptive : Optional[bool] = None
+
+class SchedulerStatus(BaseModel):
+    settings : SchedulerSettings
+    target_block_size : int
+    arrival_rate : float
+    formation_time_ms : float
+    pending : int
+    pending_gas : int
@@ -0,0 +1,164 @@
+from src.TxRecord import TxRecord
+from src.AccountStateStore import AccountState
+from src.ProofService import multiproof_for_root
+from src.utils import hex_to_bytes
+from typing import Optional, TYPE_CHECKING
+import asyncio
+import json
+import logging
+import os
+import struct
+
+if TYPE_CHECKING:
+    from src.BlockPipeline import SealedBlock
+    from src.MerkleTreeController import MerkleTreeController
+
+logger = logging.getLogger(__name__)
+
+ZERO_KEY = bytes(20)
+
+"""
+    Batch witness in the layout of the executor host (executor/host/src/main.rs):
+
+    Batch { old_merkle_root, new_merkle_root, leaf_data: [LeafData { balance, nonce }],
+            transactions: [Transaction { from, to, amount, nonce, signature: { pubKey, signature } }],
+            deposits: [DepositInfo { deposit_id, user, amount }], badge_id: u32, addresses: [String],
+            proof_nodes: [String], proofs: [AccountProof { sidenodes: [u32], non_membership_leafdata: Option<String> }] }
+
+    leaf_data[i] is the pre-state of addresses[i]. Only accounts touched by the block are included.
+    proofs[i] proves leaf_data[i] (or that addresses[i] is not in the tree yet) against
+    old_merkle_root, in the layout of ProofService.get_multiproof: side nodes from the leaf up,
+    as indices into proof_nodes. The guest checks them and hashes new_merkle_root from them.
+"""
+
+
+def build_batch_witness(blocknumber : int, old_root : str, new_root : str, touched_accounts : list[AccountState], transactions : list[TxRecord],
+                        multiproof : Optional[dict] = None) -> dict:
+    """
+        multiproof: ProofService.get_multiproof layout of the touched accounts, taken against old_root.
+        Without it the witness has no proofs yet, see add_multiproof.
+    """
+    accounts = sorted(touched_accounts, key=lambda acc: acc.address.lower())
+    batch_transactions = []
+    deposits = []
+    for t in transactions:
+        if t.receiver is None:
+            deposits.append({
+                "deposit_id": t.deposit_id if t.deposit_id is not None else 0,
+                "user": t.sender.lower(),
+                "amount": t.amount
+            })
+        elif t.receiver_key != ZERO_KEY:
+            batch_transactions.append({
+                "from": t.sender.lower(),
+                "to": t.receiver.lower(),
+                "amount": t.amount,
+                "nonce": t.nonce,
+                "signature": {
+                    "pubKey": t.sender.lower(),
+                    "signature": t.signature
+                }
+            })
+    witness = {
+        "old_merkle_root": old_root,
+        "new_merkle_root": new_root,
+        "leaf_data": [{"balance": acc.balance_before, "nonce": acc.nonce_before} for acc in accounts],
+        "transactions": batch_transactions,
+        "deposits": deposits,
+        "badge_id": blocknumber,
+        "addresses": [acc.address.lower() for acc in accounts]
+    }
+    if multiproof is not None:
+        add_multiproof(witness, multiproof)
+    return witness
+
+
+def add_multiproof(witness : dict, multiproof : dict) -> None:
+    """
+        Adds the proofs of witness["addresses"] from a multiproof that was taken for exactly those addresses
+    """
+    proofs = {proof["address"].lower(): proof for proof in multiproof["proofs"]}
+    witness["proof_nodes"] = multiproof["nodes"]
+    witness["proofs"] = [{
+        "sidenodes": proofs[address]["sidenodes"],
+        "non_membership_leafdata": _prefixed(proofs[address]["non_membership_leafdata"])
+    } for address in witness["addresses"]]
+
+
+def _prefixed(hex_str : Optional[str]) -> Optional[str]:
+    return "0x" + hex_str if hex_str is not None else None
+
+
+def _bincode_str(value : str) -> bytes:
+    data = value.encode("utf-8")
+    return struct.pack("<Q", len(data)) + data
+
+
+def encode_batch_bincode(batch : dict) -> bytes:
+    """
+        bincode 1.x with its default options (little endian, fixed size integers,
+        u64 length prefixes), fields in the order of the rust struct
+    """
+    parts = [_bincode_str(batch["old_merkle_root"]), _bincode_str(batch["new_merkle_root"])]
+    parts.append(struct.pack("<Q", len(batch["leaf_data"])))
+    for leaf in batch["leaf_data"]:
+        parts.append(struct.pack("<QQ", leaf["balance"], leaf["nonce"]))
+    parts.append(struct.pack("<Q", len(batch["transactions"])))
+    for t in batch["transactions"]:
+        parts += [_bincode_str(t["from"]), _bincode_str(t["to"]), struct.pack("<QQ", t["amount"], t["nonce"]),
+                  _bincode_str(t["signature"]["pubKey"]), _bincode_str(t["signature"]["signature"])]
+    parts.append(struct.pack("<Q", len(batch["deposits"])))
+    for d in batch["deposits"]:
+        parts += [struct.pack("<Q", d["deposit_id"]), _bincode_str(d["user"]), struct.pack("<Q", d["amount"])]
+    parts.append(struct.pack("<I", batch["badge_id"]))
+    parts.append(struct.pack("<Q", len(batch["addresses"])))
+    for address in batch["addresses"]:
+        parts.append(_bincode_str(address))
+    parts.append(struct.pack("<Q", len(batch["proof_nodes"])))
+    for node in batch["proof_nodes"]:
+        parts.append(_bincode_str(node))
+    parts.append(struct.pack("<Q", len(batch["proofs"])))
+    for proof in batch["proofs"]:
+        parts.append(struct.pack(f"<Q{len(proof['sidenodes'])}I", len(proof["sidenodes"]), *proof["sidenodes"]))
+        leafdata = proof["non_membership_leafdata"]
+        # Option: a 0 / 1 tag byte, then the value
+        parts.append(b"\x00" if leafdata is None else b"\x01" + _bincode_str(leafdata))
+    return b"".join(parts)
+
+
+class WitnessExporter:
+    """
+        Writes batch_<blocknumber>.json and batch_<blocknumber>.bin for every persisted block,
+        the executor host reads either (--batch-path).
+        Files are written under a temporary name and renamed, so a reader never sees a partial batch.
+        The multiproof of the touched accounts is taken here, from the tree itself against the
+        block's old root, so it costs block execution nothing and stays out of the ProofService cache.
+    """
+
+    def __init__(self, directory : str, tree_controller : Optional["MerkleTreeController"] = None):
+        self.directory = directory
+        self.tree_controller = tree_controller
+        os.makedirs(directory, exist_ok=True)
+
+    def batch_path(self, blocknumber : int, extension : str) -> str:
+        return os.path.join(self.directory, f"batch_{blocknumber:010d}.{extension}")
+
+    def _write(self, path : str, data : bytes) -> None:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+
+    def write_batch(self, batch : dict) -> None:
+        blocknumber = batch["badge_id"]
+        self._write(self.batch_path(blocknumber, "bin"), encode_batch_bincode(batch))
+        self._write(self.batch_path(blocknumber, "json"), json.dumps(batch, separators=(",", ":")).encode("utf-8"))
+
+    async def export(self, sealed_block : "SealedBlock") -> None:
+        witness = sealed_block.witness
+        if "proofs" not in witness:
+            # the nodes of the old root are kept until the block is released, see PersistentNodeStore
+            add_multiproof(witness, multiproof_for_root(self.tree_controller.sparse_merkle_tree, witness["addresses"],
+                                                        hex_to_bytes(witness["old_merkle_root"])))
+        await asyncio.to_thread(self.write_batch, witness)
+        logger.info(f"exported the batch witness of block {sealed_block.blocknumber} with {len(sealed_block.witness['addresses'])} accounts")
@@ -1,26 +1,50 @@
 import uuid
+import os
 import time
 import hashlib
-from src.Types import Transaction
-import json
 from eth_utils import keccak
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from src.TxRecord import TxRecord
+
+"""
+    L1 gas a transaction adds to its batch: transfers are 141 bytes of calldata
+    (16 gas per byte), deposits are marked processed in a fresh storage slot
+"""
+TRANSFER_GAS = 141 * 16
+DEPOSIT_GAS = 22100 + 8 * 16
+
+def estimate_l1_gas(transaction : "TxRecord") -> int:
+    return DEPOSIT_GAS if transaction.receiver is None else TRANSFER_GAS
 
 def generate_random_id() -> str:
     return str(uuid.uuid4())
+
+def generate_random_ids(count : int) -> list[str]:
+    """
+        uuid4 strings like generate_random_id, with one urandom call for all of them
+    """
+    data = os.urandom(16 * count)
+    return [str(uuid.UUID(bytes=data[i * 16:(i + 1) * 16], version=4)) for i in range(count)]
     
 def get_current_timestamp() -> int:
     return int(time.time())
 
 
-def create_message_from_transaction_body(body) -> bytes:
-    trans_body = {
-        "sender": body.sender,
-        "receiver": body.receiver,
-        "amount": str(body.amount),
-        "nonce": body.nonce
-    }
-    message_json = json.dumps(trans_body, separators=(",", ":"), sort_keys=True)
-    return keccak(text=message_json)
+def transfer_message(sender : str, receiver : str, amount : int, nonce : int) -> str:
+    """
+        The message a transfer is signed over, as the guest rebuilds it: lower case addresses,
+        amount and nonce as decimal strings
+    """
+    return f'{{"sender":"{sender.lower()}","receiver":"{receiver.lower()}","amount":"{int(amount)}","nonce":"{int(nonce)}"}}'
+
+def transfer_message_hash(sender : str, receiver : str, amount : int, nonce : int) -> bytes:
+    """
+        keccak of the transfer message with the personal_sign (EIP-191) prefix, what a wallet signs
+    """
+    message = transfer_message(sender, receiver, amount, nonce).encode("utf-8")
+    return keccak(b"\x19Ethereum Signed Message:\n" + str(len(message)).encode("utf-8") + message)
 
 def hex_to_bytes(hex_str: str) -> bytes:
     if hex_str.startswith("0x"):
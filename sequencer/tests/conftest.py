@@ -0,0 +1,14 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dotenv import load_dotenv
+
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+load_dotenv()
+# no mongo or state file needed, see src/MemoryMongoClient.py
+os.environ["MONGO_BACKEND"] = "memory"
+os.environ["MEMORY_MONGO_LATENCY_MS"] = "0"
+os.environ["STATE_DB_PATH"] = ":memory:"
+os.environ["VERIFIER_POOL"] = "thread"
+# badges of the tests are never settled
+os.environ["PROVER"] = "fake"
@@ -0,0 +1,87 @@
+import asyncio
+import os
+import random
+from eth_utils import to_checksum_address
+from src.BlockController import BlockController
+from src.MerkleTreeController import MerkleTreeController
+from src.TxRecord import TxRecord
+from src.Types import BadgeExecutionCause
+from src.utils import generate_random_id
+
+BALANCE = 1000
+
+
+def create_block_controller(accounts : list[str]) -> BlockController:
+    block_controller = BlockController(with_account_setup=False)
+    tree_controller = block_controller.tree_controller
+    for address in accounts:
+        tree_controller.account_state.put(address=address, balance=BALANCE, nonce=0)
+    states = list(tree_controller.account_state.accounts.values())
+    tree = tree_controller.sparse_merkle_tree
+    tree.update_many([s.key for s in states], [s.leaf_bytes() for s in states])
+    tree_controller.node_store.commit(tree_controller.take_changeset(), root=tree.root, blocknumber=0, badge_id=None)
+    block_controller.header_builder.tip = ("0x" + "0" * 64, 0, "genesis")
+
+    async def check_transactions_validity(transactions):
+        return [True] * len(transactions)
+
+    block_controller.mempool.validator.check_transactions_validity = check_transactions_validity
+    return block_controller
+
+
+async def form_block(block_controller : BlockController, transfers : list[tuple[str, str]], nonces : dict) -> None:
+    transactions = []
+    for sender, receiver in transfers:
+        transactions.append(TxRecord(transaction_id=generate_random_id(), submission_id=generate_random_id(), received_at=0, sender=sender,
+                                     receiver=receiver, amount=7, nonce=nonces[sender], signature="0x" + "11" * 65, pub_key="0x00"))
+        nonces[sender] += 1
+    await block_controller.mempool.insert_batch_into_queue(transactions)
+    await block_controller.form_new_L2_block(BadgeExecutionCause.FILLEDUP, len(transactions), 10**12)
+
+
+def test_restart_replays_the_blocks_after_the_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_NAME", "restore_test")
+    monkeypatch.setenv("STATE_DB_PATH", str(tmp_path / "state.sqlite"))
+    monkeypatch.setenv("WITNESS_DIR", str(tmp_path / "witness"))
+    rnd = random.Random(3)
+    accounts = [to_checksum_address(rnd.randbytes(20)) for _ in range(20)]
+    nonces = {address: 0 for address in accounts}
+
+    async def run():
+        block_controller = create_block_controller(accounts)
+        await form_block(block_controller, [(accounts[i], accounts[i + 1]) for i in range(0, 10, 2)], nonces)
+        await form_block(block_controller, [(accounts[i], accounts[0]) for i in range(1, 6)], nonces)
+
+        # stops after the mongo commit of block 3, before its checkpoint
+        async def checkpoint(**kwargs):
+            pass
+
+        block_controller.tree_controller.checkpoint = checkpoint
+        await form_block(block_controller, [(accounts[i], accounts[19]) for i in range(10, 15)], nonces)
+        block_controller.mempool.validator.shutdown()
+
+        restarted = MerkleTreeController(with_account_setup=False)
+        assert restarted.state_blocknumber == 2
+        await restarted.load_account_state()
+        assert restarted.state_blocknumber == 3
+        assert restarted.get_merkle_root() == block_controller.tree_controller.get_merkle_root()
+        for address in accounts:
+            before = block_controller.tree_controller.account_state.get(address)
+            after = restarted.account_state.get(address)
+            assert (after.address, after.balance, after.nonce) == (before.address, before.balance, before.nonce)
+
+        # the replay was checkpointed, the next start replays nothing
+        again = MerkleTreeController(with_account_setup=False)
+        assert again.state_blocknumber == 3
+        await again.load_account_state()
+        assert again.get_merkle_root() == block_controller.tree_controller.get_merkle_root()
+        # accounts are read from the tree leaves when they are first used, not on start
+        assert len(again.account_state.accounts) == 0
+        for address in accounts:
+            before = block_controller.tree_controller.account_state.get(address)
+            after = again.account_state.get(address)
+            assert (after.address, after.balance, after.nonce) == (before.address, before.balance, before.nonce)
+        assert again.account_state.get(to_checksum_address(rnd.randbytes(20))) is None
+        assert len(again.account_state.accounts) == len(accounts)
+
+    asyncio.run(run())
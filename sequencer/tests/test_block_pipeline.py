@@ -0,0 +1,127 @@
+import asyncio
+import pytest
+from src.BlockPipeline import BlockPipeline, PipelineStopped
+from src.TxRecord import TxRecord
+from src.Types import BadgeExecutionCause
+from src.utils import generate_random_id
+from test_witness import create_block_controller
+
+
+class FakeBlock:
+
+    def __init__(self, blocknumber : int):
+        self.blocknumber = blocknumber
+        self.transactions = []
+
+
+class FakeScheduler:
+
+    def __init__(self, blocks : int):
+        self.blocks = blocks
+
+    async def run(self, execute) -> None:
+        for _ in range(self.blocks):
+            await execute(BadgeExecutionCause.FILLEDUP, 10, 10)
+        await asyncio.Event().wait()
+
+
+class FakeController:
+    """
+        Persists through pipeline.retry like BlockController.persist_block,
+        the first `failures` commits fail
+    """
+
+    def __init__(self, blocks : int, failures : int, failing_block : int = 0):
+        self.scheduler = FakeScheduler(blocks)
+        self.failures = failures
+        self.failing_block = failing_block
+        self.attempts = 0
+        self.executed = 0
+        self.persisted = []
+        self.pipeline : BlockPipeline = None
+
+    async def execute_block(self, execution_cause, max_transactions, max_gas) -> FakeBlock:
+        self.executed += 1
+        if self.executed == self.failing_block:
+            raise KeyError("account state")
+        return FakeBlock(self.executed)
+
+    async def commit(self, sealed_block : FakeBlock) -> None:
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise ConnectionError("mongo unavailable")
+        self.persisted.append(sealed_block.blocknumber)
+
+    async def persist_block(self, sealed_block : FakeBlock) -> None:
+        await self.pipeline.retry(lambda: self.commit(sealed_block), f"committing block {sealed_block.blocknumber}")
+
+
+def create_pipeline(blocks : int, failures : int, max_attempts : int = 3, failing_block : int = 0) -> tuple[BlockPipeline, FakeController]:
+    controller = FakeController(blocks, failures, failing_block)
+    controller.pipeline = BlockPipeline(block_controller=controller, max_attempts=max_attempts, retry_backoff_s=0.001)
+    return controller.pipeline, controller
+
+
+def test_a_failed_persist_is_retried():
+    pipeline, controller = create_pipeline(blocks=3, failures=2)
+
+    async def run():
+        task = asyncio.create_task(pipeline.run())
+        while len(controller.persisted) < 3:
+            await asyncio.sleep(0.001)
+        task.cancel()
+
+    asyncio.run(run())
+    assert controller.persisted == [1, 2, 3]
+    assert controller.attempts == 5
+    pipeline.check_running()
+
+
+def test_submissions_are_refused_once_persisting_keeps_failing():
+    pipeline, controller = create_pipeline(blocks=3, failures=100)
+
+    async def run():
+        with pytest.raises(ConnectionError):
+            await pipeline.run()
+
+    asyncio.run(run())
+    assert controller.attempts == 3
+    assert controller.persisted == []
+    assert isinstance(pipeline.failure, ConnectionError)
+    with pytest.raises(PipelineStopped):
+        pipeline.check_running()
+
+
+def test_a_failed_execution_stops_the_pipeline():
+    pipeline, controller = create_pipeline(blocks=3, failures=0, failing_block=2)
+
+    async def run():
+        with pytest.raises(KeyError):
+            await pipeline.run()
+
+    asyncio.run(run())
+    assert controller.persisted == [1]
+    assert isinstance(pipeline.failure, KeyError)
+
+
+def test_the_tip_is_loaded_before_transactions_are_selected(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_NAME", f"pipeline_test_{tmp_path.name}")
+    monkeypatch.setenv("WITNESS_DIR", str(tmp_path / "witness"))
+    block_controller = create_block_controller()
+    # no genesis badge in mongo
+    block_controller.header_builder.tip = None
+    sender, receiver = "0x" + "a1" * 20, "0x" + "b1" * 20
+    block_controller.tree_controller.account_state.put(sender, balance=100, nonce=0)
+    block_controller.tree_controller.account_state.put(receiver, balance=0, nonce=0)
+    transfer = TxRecord(transaction_id=generate_random_id(), submission_id=generate_random_id(), received_at=0, sender=sender,
+                        receiver=receiver, amount=1, nonce=0, signature="0x00", pub_key="0x00")
+
+    async def run():
+        await block_controller.mempool.insert_batch_into_queue([transfer])
+        with pytest.raises(Exception, match="genesis badge"):
+            await block_controller.execute_block(BadgeExecutionCause.FILLEDUP, 10, 10**12)
+
+    asyncio.run(run())
+    block_controller.mempool.validator.shutdown()
+    assert len(block_controller.mempool.pending_pool) == 1
+    assert block_controller.tree_controller.account_state.touched == {}
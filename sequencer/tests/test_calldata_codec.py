@@ -0,0 +1,84 @@
+import json
+import os
+import random
+import pytest
+from src.CalldataCodec import (encode_compact, decode_compact, encode_legacy, encode_varint, decode_varint, address_table,
+                               LEGACY_TX_SIZE)
+from src.utils import hex_to_bytes
+
+# shared with the rust codec, see executor/lib/calldata/tests/vectors.rs
+VECTORS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "executor", "lib", "calldata", "vectors.json")
+
+with open(VECTORS_PATH) as file:
+    VECTORS = json.load(file)["vectors"]
+
+
+def batch_transactions(rng : random.Random, count : int, accounts : int) -> list[dict]:
+    addresses = ["0x" + rng.randbytes(20).hex() for _ in range(accounts)]
+    transactions = []
+    for _ in range(count):
+        sender, receiver = rng.sample(addresses, 2)
+        transactions.append({
+            "from": sender,
+            "to": receiver,
+            "amount": rng.choice([1, 127, 128, 300, 1 << 40, (1 << 64) - 1]),
+            "nonce": rng.randrange(1 << 20),
+            "signature": {"pubKey": sender, "signature": "0x" + rng.randbytes(65).hex()}
+        })
+    return transactions
+
+
+@pytest.mark.parametrize("vector", VECTORS, ids=[vector["name"] for vector in VECTORS])
+def test_golden_vectors(vector):
+    transactions = vector["transactions"]
+    assert encode_legacy(transactions) == hex_to_bytes(vector["legacy"])
+    assert encode_compact(transactions) == hex_to_bytes(vector["compact"])
+    assert decode_compact(hex_to_bytes(vector["compact"])) == transactions
+
+
+@pytest.mark.parametrize("value", [0, 1, 127, 128, 255, 300, 16383, 16384, (1 << 63), (1 << 64) - 1])
+def test_varint_round_trip(value):
+    data = encode_varint(value)
+    assert decode_varint(data, 0) == (value, len(data))
+
+
+def test_varint_rejects_values_beyond_u64():
+    with pytest.raises(ValueError):
+        decode_varint(encode_varint(1 << 64), 0)
+    with pytest.raises(ValueError):
+        decode_varint(b"\x80", 0)
+    with pytest.raises(ValueError):
+        encode_varint(-1)
+
+
+@pytest.mark.parametrize("count,accounts", [(0, 2), (1, 2), (50, 8), (500, 400)])
+def test_compact_round_trip(count, accounts):
+    transactions = batch_transactions(random.Random(count), count, accounts)
+    assert decode_compact(encode_compact(transactions)) == transactions
+
+
+def test_address_table_keeps_first_appearance_order():
+    transactions = batch_transactions(random.Random(1), 30, 5)
+    table = address_table(transactions)
+    first_seen = list(dict.fromkeys(bytes.fromhex(t[field][2:]) for t in transactions for field in ("from", "to")))
+    assert table == first_seen
+
+
+def test_compact_is_smaller_than_legacy():
+    transactions = batch_transactions(random.Random(2), 200, 20)
+    legacy = encode_legacy(transactions)
+    assert len(legacy) == 4 + LEGACY_TX_SIZE * len(transactions)
+    assert len(encode_compact(transactions)) < len(legacy)
+
+
+@pytest.mark.parametrize("cut", [1, 5, 30])
+def test_decode_rejects_truncated_data(cut):
+    data = encode_compact(batch_transactions(random.Random(3), 3, 3))
+    with pytest.raises(ValueError):
+        decode_compact(data[:-cut])
+
+
+def test_decode_rejects_trailing_bytes():
+    data = encode_compact(batch_transactions(random.Random(4), 3, 3))
+    with pytest.raises(ValueError):
+        decode_compact(data + b"\x00")
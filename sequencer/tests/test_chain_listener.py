@@ -0,0 +1,177 @@
+import asyncio
+import os
+import pytest
+from eth_abi import encode
+from hexbytes import HexBytes
+from web3.exceptions import BlockNotFound
+from src.AccountStateStore import AccountStateStore
+from src.ChainListener import ChainListener, DEPOSIT_MADE_TOPIC
+from src.MemPool import MemPool
+from src.TxRecord import TxRecord
+from src.Types import TransactionStatus
+from src.utils import generate_random_id
+
+CONTRACT = "0x" + "ab" * 20
+USER = "0x" + "0c" * 20
+
+
+class FakeChain:
+    """
+        Blocks with a DepositMade log in every other block, hashes derived from (number, fork)
+    """
+
+    def __init__(self):
+        self.hashes : list[HexBytes] = []
+        self.logs : dict[int, list] = {}
+        self.deposit_id = 0
+        self.failing = False
+
+    def mine(self, blocks : int, fork : int = 0) -> None:
+        for _ in range(blocks):
+            number = len(self.hashes)
+            self.hashes.append(HexBytes(number.to_bytes(16, "big") + fork.to_bytes(16, "big")))
+            self.logs[number] = []
+            if number % 2 == 0:
+                self.deposit_id += 1
+                self.logs[number].append({
+                    "blockNumber": number,
+                    "blockHash": self.hashes[number],
+                    "topics": [HexBytes(DEPOSIT_MADE_TOPIC), HexBytes(self.deposit_id.to_bytes(32, "big")), HexBytes(bytes(12) + bytes.fromhex(USER[2:]))],
+                    "data": HexBytes(encode(["uint256", "uint256"], [10 ** 18, number]))
+                })
+
+    def reorg(self, depth : int, blocks : int) -> None:
+        del self.hashes[len(self.hashes) - depth:]
+        self.logs = {n: logs for n, logs in self.logs.items() if n < len(self.hashes)}
+        self.mine(blocks, fork=1)
+
+
+class FakeEth:
+
+    def __init__(self, chain : FakeChain):
+        self.chain = chain
+
+    @property
+    async def block_number(self) -> int:
+        return len(self.chain.hashes) - 1
+
+    async def get_block(self, number : int) -> dict:
+        if self.chain.failing:
+            raise asyncio.TimeoutError("rpc timeout")
+        if number >= len(self.chain.hashes):
+            raise BlockNotFound(f"block {number} not found")
+        return {"hash": self.chain.hashes[number]}
+
+    async def get_logs(self, params : dict) -> list:
+        return [log for n in range(params["fromBlock"], params["toBlock"] + 1) for log in self.chain.logs.get(n, [])]
+
+
+class FakeWeb3:
+
+    def __init__(self, chain : FakeChain):
+        self.eth = FakeEth(chain)
+
+
+def create_listener(chain : FakeChain) -> ChainListener:
+    # every test gets its own database of the in-memory stand-in
+    os.environ["DB_NAME"] = f"test_{generate_random_id()}"
+    mempool = MemPool(account_state=AccountStateStore())
+    listener = ChainListener(polling_interval=1, mempool=mempool, node_addres="http://localhost:8545", contract_address=CONTRACT,
+                             confirmations=2, chunk_size=100, start_block=0)
+    listener.w3 = FakeWeb3(chain)
+    return listener
+
+
+def test_backfill_in_chunks():
+    chain = FakeChain()
+    chain.mine(500)
+    listener = create_listener(chain)
+    assert asyncio.run(listener.catch_up()) == 249
+    assert listener.cursor["blocknumber"] == 497
+    assert asyncio.run(listener.catch_up()) == 0
+    assert len(listener.mempool.pending_pool.deposits) == 249
+
+
+def test_an_rpc_error_is_not_a_reorg():
+    chain = FakeChain()
+    chain.mine(100)
+    listener = create_listener(chain)
+    asyncio.run(listener.catch_up())
+    cursor = dict(listener.cursor)
+    chain.failing = True
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(listener.catch_up())
+    assert listener.cursor["blocknumber"] == cursor["blocknumber"]
+    assert len(listener.mempool.pending_pool.deposits) == 49
+    chain.failing = False
+    chain.mine(10)
+    assert asyncio.run(listener.catch_up()) == 5
+
+
+def test_a_reorg_drops_the_orphaned_deposits_and_reads_the_new_ones():
+    chain = FakeChain()
+    chain.mine(100)
+    listener = create_listener(chain)
+    listener.chunk_size = 10
+    asyncio.run(listener.catch_up())
+    assert listener.cursor["blocknumber"] == 97
+    # blocks 92-99 are replaced by 92-101: the ingested deposits 47-49 (blocks 92-96) are orphaned,
+    # the new blocks 92-98 carry 51-54. The cursor goes back to the chunk end 89, deposit 46 of block 90 is read again.
+    chain.reorg(depth=8, blocks=10)
+    asyncio.run(listener.catch_up())
+    assert listener.cursor["blocknumber"] == 99
+    assert listener.cursor["blockhash"] == chain.hashes[99].to_0x_hex()
+    deposit_ids = [d.deposit_id for d in listener.mempool.pending_pool.deposits]
+    assert deposit_ids == list(range(1, 47)) + list(range(51, 55))
+
+
+def deposit_log(deposit_id : int, amount : int, block_hash : bytes, number : int = 1) -> dict:
+    return {
+        "blockNumber": number,
+        "blockHash": HexBytes(block_hash),
+        "topics": [HexBytes(DEPOSIT_MADE_TOPIC), HexBytes(deposit_id.to_bytes(32, "big")), HexBytes(bytes(12) + bytes.fromhex(USER[2:]))],
+        "data": HexBytes(encode(["uint256", "uint256"], [amount, number]))
+    }
+
+
+def test_only_whole_ether_deposits_are_credited():
+    listener = create_listener(FakeChain())
+    deposit = listener.decode_deposit(deposit_log(1, 3 * 10 ** 18, bytes(32)), received_at=0)
+    assert (deposit.amount, deposit.l1_block_hash) == (3, "0x" + "00" * 32)
+    # 0.5 ether used to be rounded down to a deposit of 0
+    assert listener.decode_deposit(deposit_log(2, 10 ** 18 // 2, bytes(32)), received_at=0) is None
+    assert listener.decode_deposit(deposit_log(3, 10 ** 18 + 1, bytes(32)), received_at=0) is None
+
+
+def test_deposits_are_known_by_id_and_block_hash():
+    listener = create_listener(FakeChain())
+    mempool = listener.mempool
+    first, other = b"\x01" * 32, b"\x02" * 32
+
+    async def write(logs : list) -> tuple[list[TxRecord], list[str]]:
+        deposits = [listener.decode_deposit(log, received_at=0) for log in logs]
+        new_deposits, replaced = await mempool.write_deposit_transactions(deposits)
+        mempool.discard_deposits(replaced)
+        mempool.queue_deposits(new_deposits)
+        return new_deposits, replaced
+
+    async def run():
+        new_deposits, _ = await write([deposit_log(1, 10 ** 18, first), deposit_log(2, 10 ** 18, first)])
+        assert [d.deposit_id for d in new_deposits] == [1, 2]
+        orphaned = new_deposits[0].transaction_id
+        # read again from the same block
+        assert await write([deposit_log(1, 10 ** 18, first)]) == ([], [])
+        # deposit 1 comes from another block with another amount, the pending one from the old block is replaced
+        new_deposits, replaced = await write([deposit_log(1, 2 * 10 ** 18, other)])
+        assert [(d.deposit_id, d.amount) for d in new_deposits] == [(1, 2)]
+        assert replaced == [orphaned]
+        assert sorted((d.deposit_id, d.amount) for d in mempool.pending_pool.deposits) == [(1, 2), (2, 1)]
+
+        # an included deposit is not credited again from another block
+        trans_col = mempool.mongo_client[os.environ["DB_NAME"]][os.environ["TRANSACTIONS"]]
+        await trans_col.update_many({"depositId": 2}, {"$set": {"status": TransactionStatus.INCLUDED.value}})
+        assert await write([deposit_log(2, 10 ** 18, other)]) == ([], [])
+        assert await write([deposit_log(2, 5 * 10 ** 18, other)]) == ([], [])
+        return await trans_col.count_documents({"depositId": {"$in": [1, 2]}})
+
+    assert asyncio.run(run()) == 2
@@ -0,0 +1,102 @@
+"""
+    ChainListener against a local anvil node and the DepositManager of solidity/contracts/Deposit.sol.
+    Needs anvil on the PATH and the contracts built (forge build in the root directory), skipped otherwise.
+"""
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import time
+import pytest
+from web3 import Web3
+from src.AccountStateStore import AccountStateStore
+from src.ChainListener import ChainListener
+from src.MemPool import MemPool
+from src.utils import generate_random_id
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ARTIFACT = os.path.join(ROOT, "out", "Deposit.sol", "DepositManager.json")
+ANVIL = shutil.which("anvil")
+
+pytestmark = pytest.mark.skipif(ANVIL is None or not os.path.exists(ARTIFACT), reason="needs anvil and the contracts built with forge build")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def anvil():
+    port = free_port()
+    process = subprocess.Popen([ANVIL, "--port", str(port), "--silent"])
+    url = f"http://127.0.0.1:{port}"
+    w3 = Web3(Web3.HTTPProvider(url))
+    try:
+        for _ in range(100):
+            if w3.is_connected():
+                break
+            time.sleep(0.1)
+        yield url, w3
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def deploy_deposit_manager(w3 : Web3):
+    with open(ARTIFACT) as file:
+        artifact = json.load(file)
+    account = w3.eth.accounts[0]
+    contract = w3.eth.contract(abi=artifact["abi"], bytecode=artifact["bytecode"]["object"])
+    receipt = w3.eth.wait_for_transaction_receipt(contract.constructor(account).transact({"from": account}))
+    return w3.eth.contract(address=receipt.contractAddress, abi=artifact["abi"])
+
+
+def deposit(w3 : Web3, contract, user_index : int, ether : int) -> None:
+    tx_hash = contract.functions.deposit().transact({"from": w3.eth.accounts[user_index], "value": Web3.to_wei(ether, "ether")})
+    w3.eth.wait_for_transaction_receipt(tx_hash)
+
+
+def mine(w3 : Web3, blocks : int) -> None:
+    for _ in range(blocks):
+        w3.provider.make_request("evm_mine", [])
+
+
+def test_deposits_and_a_reorg_on_anvil(anvil):
+    url, w3 = anvil
+    contract = deploy_deposit_manager(w3)
+    os.environ["DB_NAME"] = f"test_{generate_random_id()}"
+
+    async def run():
+        # one event loop for the whole test, the provider keeps its http session per loop
+        mempool = MemPool(account_state=AccountStateStore())
+        listener = ChainListener(polling_interval=1, mempool=mempool, node_addres=url, contract_address=contract.address,
+                                 confirmations=2, chunk_size=3, start_block=0)
+
+        for user_index, ether in ((1, 1), (2, 2), (1, 3)):
+            deposit(w3, contract, user_index, ether)
+        mine(w3, 2)
+        assert await listener.catch_up() == 3
+        assert [(d.sender, d.amount) for d in mempool.pending_pool.deposits] == [
+            (w3.eth.accounts[1], 1), (w3.eth.accounts[2], 2), (w3.eth.accounts[1], 3)]
+
+        snapshot = w3.provider.make_request("evm_snapshot", [])["result"]
+        deposit(w3, contract, 3, 4)
+        deposit(w3, contract, 3, 5)
+        mine(w3, 2)
+        assert await listener.catch_up() == 2
+        orphaned_head = w3.eth.block_number
+
+        # the two deposits are replaced by another one on a longer chain
+        w3.provider.make_request("evm_revert", [snapshot])
+        mine(w3, 1)
+        deposit(w3, contract, 4, 6)
+        mine(w3, orphaned_head + 2 - w3.eth.block_number)
+        assert await listener.catch_up() == 1
+        assert [(d.deposit_id, d.amount) for d in mempool.pending_pool.deposits] == [(1, 1), (2, 2), (3, 3), (4, 6)]
+        assert listener.cursor["blockhash"] == w3.eth.get_block(listener.cursor["blocknumber"])["hash"].to_0x_hex()
+
+    asyncio.run(run())
@@ -0,0 +1,43 @@
+import time
+from src.LifecycleTracker import LifecycleTracker
+from src.TxRecord import TxRecord
+
+
+def transaction(transaction_id : str) -> TxRecord:
+    return TxRecord(transaction_id=transaction_id, submission_id=None, received_at=0, sender="0x" + "aa" * 20,
+                    receiver="0x" + "bb" * 20, amount=1, nonce=0)
+
+
+def test_stages_of_an_included_and_settled_transaction():
+    tracker = LifecycleTracker()
+    t = transaction("t")
+    tracker.received([t])
+    tracker.verified(t, admitted=True)
+    tracker.selected([t])
+    tracker.included("badge", 1, [t], [])
+    tracker.proof_started(["badge"])
+    tracker.proof_finished(["badge"])
+    tracker.settled(["badge"])
+    report = tracker.report()
+    assert {stage: report["stages"][stage]["count"] for stage in report["stages"]} == {
+        "verify": 1, "queue": 1, "execute": 1, "inclusion": 1, "prove_wait": 1, "prove": 1, "submit": 1, "settlement": 1}
+    assert report["in_flight_transactions"] == 0
+    assert report["unverified_badges"] == 0
+
+
+def test_transactions_that_are_never_included_expire():
+    tracker = LifecycleTracker(window_s=0.05, max_tracked=3)
+    tracker.received([transaction(str(i)) for i in range(3)])
+    tracker.received([transaction("late")])
+    assert tracker.untracked == 1
+    time.sleep(0.06)
+    tracker.received([transaction("new")])
+    assert list(tracker.transactions) == ["new"]
+    assert tracker.report()["expired"] == 3
+
+
+def test_discarded_deposits_leave_the_tracker():
+    tracker = LifecycleTracker()
+    tracker.received([transaction("d1"), transaction("d2")], verified=True)
+    tracker.discard(["d1"])
+    assert list(tracker.transactions) == ["d2"]
@@ -0,0 +1,75 @@
+import asyncio
+import os
+from src.AccountStateStore import AccountStateStore
+from src.MemPool import MemPool
+from src.TxRecord import TxRecord
+from src.Types import TransactionStatus
+from src.utils import generate_random_id
+
+ALICE = "0x" + "a1" * 20
+BOB = "0x" + "b1" * 20
+
+
+def transfer(nonce : int) -> TxRecord:
+    return TxRecord(transaction_id=generate_random_id(), submission_id=generate_random_id(), received_at=0, sender=ALICE,
+                    receiver=BOB, amount=1, nonce=nonce, signature="0x00", pub_key="0x00")
+
+
+def create_mempool(valid : bool = True) -> MemPool:
+    account_state = AccountStateStore()
+    account_state.put(ALICE, balance=100, nonce=0)
+    account_state.put(BOB, balance=100, nonce=0)
+    mempool = MemPool(account_state=account_state)
+
+    async def check_transaction_validity(transaction, submission_id):
+        return valid
+
+    async def check_transactions_validity(transactions):
+        return [valid] * len(transactions)
+
+    mempool.validator.check_transaction_validity = check_transaction_validity
+    mempool.validator.check_transactions_validity = check_transactions_validity
+    return mempool
+
+
+def stored(mempool : MemPool, transaction_id : str) -> dict:
+    collection = mempool.mongo_client[os.environ["DB_NAME"]][os.environ["TRANSACTIONS"]]
+    return next((doc for doc in collection.documents.values() if doc["transactionId"] == transaction_id), None)
+
+
+def test_a_transaction_is_stored_before_it_can_be_selected():
+    mempool = create_mempool()
+    stored_on_insert = []
+    mempool.pending_pool.on_insert = lambda t: stored_on_insert.append(stored(mempool, t.transaction_id) is not None)
+
+    async def run():
+        await mempool.insert_into_queue(transfer(0), submisson_id="s")
+        await mempool.insert_batch_into_queue([transfer(1), transfer(2)])
+
+    asyncio.run(run())
+    assert stored_on_insert == [True, True, True]
+
+
+def test_a_duplicate_nonce_is_stored_as_failed():
+    mempool = create_mempool()
+    first, duplicate = transfer(0), transfer(0)
+    batch = [transfer(1), transfer(1)]
+
+    async def run():
+        await mempool.insert_into_queue(first, submisson_id="s1")
+        await mempool.insert_into_queue(duplicate, submisson_id="s2")
+        await mempool.insert_batch_into_queue(batch)
+
+    asyncio.run(run())
+    assert stored(mempool, first.transaction_id)["status"] == TransactionStatus.PENDING.value
+    assert stored(mempool, duplicate.transaction_id)["status"] == TransactionStatus.FAILED.value
+    assert [stored(mempool, t.transaction_id)["status"] for t in batch] == [TransactionStatus.PENDING.value, TransactionStatus.FAILED.value]
+    assert len(mempool.pending_pool) == 2
+
+
+def test_an_invalid_signature_is_stored_and_not_pooled():
+    mempool = create_mempool(valid=False)
+    transaction = transfer(0)
+    asyncio.run(mempool.insert_into_queue(transaction, submisson_id="s"))
+    assert stored(mempool, transaction.transaction_id)["status"] == TransactionStatus.INVALID.value
+    assert len(mempool.pending_pool) == 0
@@ -0,0 +1,44 @@
+import sys
+import threading
+from src.Metrics import Counter, Gauge, Histogram, MetricsRegistry
+
+
+def test_render_in_the_prometheus_text_format():
+    registry = MetricsRegistry()
+    counter = registry.register(Counter("c_total", "a counter", labelnames=("status",)))
+    gauge = registry.register(Gauge("g", "a gauge"))
+    histogram = registry.register(Histogram("h_seconds", "a histogram", buckets=(0.1, 1.0)))
+    counter.inc(labels=("ok",))
+    counter.inc(2, labels=("ok",))
+    gauge.set_function(lambda: 7)
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    lines = registry.render().splitlines()
+    assert 'c_total{status="ok"} 3' in lines
+    assert "g 7" in lines
+    assert 'h_seconds_bucket{le="0.1"} 1' in lines
+    assert 'h_seconds_bucket{le="1"} 2' in lines
+    assert 'h_seconds_bucket{le="+Inf"} 2' in lines
+    assert "h_seconds_count 2" in lines
+
+
+def test_render_while_another_thread_adds_labels():
+    counter = Counter("commands_total", "commands", labelnames=("command",))
+    done = threading.Event()
+
+    def record():
+        for i in range(50_000):
+            counter.inc(labels=(f"command{i}",))
+        done.set()
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    thread = threading.Thread(target=record)
+    thread.start()
+    try:
+        while not done.is_set():
+            counter.render()
+    finally:
+        thread.join()
+        sys.setswitchinterval(switch_interval)
+    assert len(counter.render()) == 2 + 50_000
@@ -0,0 +1,114 @@
+from src.AccountStateStore import AccountStateStore
+from src.PendingPool import PendingPool
+from src.TxRecord import TxRecord
+
+ALICE = "0x" + "aa" * 20
+BOB = "0x" + "bb" * 20
+CAROL = "0x" + "cc" * 20
+
+
+def transfer(sender : str, nonce : int, receiver : str = CAROL, amount : int = 1) -> TxRecord:
+    return TxRecord(transaction_id=f"{sender[-4:]}-{nonce}", submission_id=None, received_at=0, sender=sender,
+                    receiver=receiver, amount=amount, nonce=nonce)
+
+
+def deposit(user : str, transaction_id : str) -> TxRecord:
+    return TxRecord(transaction_id=transaction_id, submission_id=None, received_at=0, sender=user, receiver=None, amount=5, nonce=None)
+
+
+def create_pool(**nonces) -> PendingPool:
+    account_state = AccountStateStore()
+    for address in (ALICE, BOB, CAROL):
+        account_state.put(address, balance=100, nonce=0)
+    for name, nonce in nonces.items():
+        account_state.get(globals()[name.upper()]).nonce = nonce
+    return PendingPool(account_state=account_state)
+
+
+def ids(transactions : list[TxRecord]) -> list[str]:
+    return [t.transaction_id for t in transactions]
+
+
+def test_senders_interleave_in_arrival_order():
+    pool = create_pool()
+    for t in (transfer(ALICE, 0), transfer(BOB, 0), transfer(ALICE, 1), transfer(BOB, 1)):
+        assert pool.insert(t)
+    assert ids(pool.select(10)) == [f"{ALICE[-4:]}-0", f"{BOB[-4:]}-0", f"{ALICE[-4:]}-1", f"{BOB[-4:]}-1"]
+    assert len(pool) == 0
+
+
+def test_nonces_of_a_sender_come_out_in_order():
+    pool = create_pool()
+    for nonce in (2, 0, 1):
+        assert pool.insert(transfer(ALICE, nonce))
+    assert [t.nonce for t in pool.select(10)] == [0, 1, 2]
+
+
+def test_a_nonce_gap_holds_the_later_transfers_back():
+    pool = create_pool()
+    pool.insert(transfer(ALICE, 0))
+    pool.insert(transfer(ALICE, 2))
+    pool.insert(transfer(BOB, 0))
+    assert ids(pool.select(10)) == [f"{ALICE[-4:]}-0", f"{BOB[-4:]}-0"]
+    assert pool.held() == 1
+    assert pool.next_nonce(bytes.fromhex(ALICE[2:])) == 1
+    pool.insert(transfer(ALICE, 1))
+    assert [t.nonce for t in pool.select(10)] == [1, 2]
+
+
+def test_stale_and_duplicate_nonces_are_rejected():
+    pool = create_pool(alice=3)
+    assert not pool.insert(transfer(ALICE, 2))
+    assert pool.insert(transfer(ALICE, 3))
+    assert not pool.insert(transfer(ALICE, 3))
+    assert len(pool) == 1
+
+
+def test_deposits_go_first():
+    pool = create_pool()
+    pool.insert(transfer(ALICE, 0))
+    pool.insert(deposit(BOB, "d1"))
+    pool.insert(deposit(CAROL, "d2"))
+    assert ids(pool.select(10)) == ["d1", "d2", f"{ALICE[-4:]}-0"]
+
+
+def test_select_respects_the_limit_and_the_gas_budget():
+    pool = create_pool()
+    for nonce in range(5):
+        pool.insert(transfer(ALICE, nonce))
+    assert len(pool.select(2)) == 2
+    assert len(pool.select(10, max_gas=0)) == 0
+    assert [t.nonce for t in pool.select(10)] == [2, 3, 4]
+
+
+def test_a_failed_transfer_strands_the_later_nonces_of_its_sender():
+    pool = create_pool()
+    for nonce in range(3):
+        pool.insert(transfer(ALICE, nonce))
+    selected = pool.select(1)
+    # the transfer failed, the account nonce stays at 0
+    dropped = pool.after_block(senders={selected[0].sender_key}, failed_senders={selected[0].sender_key})
+    assert dropped == []
+    assert pool.select(10) == []
+    assert pool.held() == 2
+    # a transfer with nonce 0 fills the gap again
+    assert pool.insert(transfer(ALICE, 0, amount=2))
+    assert [t.nonce for t in pool.select(10)] == [0, 1, 2]
+
+
+def test_transfers_below_the_account_nonce_are_dropped_after_a_block():
+    pool = create_pool()
+    pool.insert(transfer(ALICE, 1))
+    # another block moved the account to nonce 2
+    pool.account_state.get(ALICE).nonce = 2
+    dropped = pool.after_block(senders=set(), failed_senders={bytes.fromhex(ALICE[2:])})
+    assert ids(dropped) == [f"{ALICE[-4:]}-1"]
+    assert len(pool) == 0
+
+
+def test_removed_deposits_are_not_selected():
+    pool = create_pool()
+    pool.insert(deposit(BOB, "d1"))
+    pool.insert(deposit(CAROL, "d2"))
+    assert pool.remove_deposits({"d1"}) == 1
+    assert ids(pool.select(10)) == ["d2"]
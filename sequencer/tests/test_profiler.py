@@ -0,0 +1,83 @@
+import asyncio
+import io
+import pstats
+import threading
+import time
+from src.Profiler import Profiler
+
+
+def busy(seconds : float) -> int:
+    total = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        total += sum(range(100))
+    return total
+
+
+def scoped_work() -> list:
+    busy(0.2)
+    return [bytes(64) for _ in range(1000)]
+
+
+def test_block_done_does_not_write_on_the_event_loop(tmp_path):
+    profiler = Profiler(directory=str(tmp_path), interval_ms=1)
+    profiler.add_scope(scoped_work)
+    writers = []
+    write = profiler._write
+    profiler._write = lambda session, snapshot: (writers.append(threading.get_ident()), write(session, snapshot))
+
+    async def main():
+        profiler.start(blocks=1)
+        scoped_work()
+        profiler.block_done()
+        assert not profiler.active
+        assert profiler.status()["writing"]
+        await profiler.finishing
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(main())
+    assert writers and writers[0] != loop_thread
+    status = profiler.status()
+    assert not status["writing"]
+    assert [name.rsplit(".", 1)[1] for name in status["files"]] == ["collapsed", "prof", "txt", "tracemalloc"]
+
+
+def test_prof_file_loads_with_pstats(tmp_path):
+    profiler = Profiler(directory=str(tmp_path), interval_ms=1)
+    profiler.add_scope(scoped_work)
+
+    async def main():
+        profiler.start(blocks=1)
+        scoped_work()
+        profiler.block_done()
+        await profiler.finishing
+
+    asyncio.run(main())
+    session = profiler.status()
+    stats = pstats.Stats(session["files"][1], stream=io.StringIO())
+    by_name = {function[2]: values for function, values in stats.stats.items()}
+    assert by_name["scoped_work"][1] == session["scoped_samples"]
+    # busy is called from scoped_work and does the sampled work
+    assert "scoped_work" in {caller[2] for caller in by_name["busy"][4]}
+    assert by_name["busy"][3] <= by_name["scoped_work"][3]
+    stats.sort_stats("cumulative").print_stats(5)
+
+
+def test_start_waits_for_the_previous_profile_to_be_written(tmp_path):
+    profiler = Profiler(directory=str(tmp_path), interval_ms=1)
+    profiler.add_scope(scoped_work)
+
+    async def main():
+        profiler.start(blocks=1)
+        profiler.block_done()
+        try:
+            profiler.start(blocks=1)
+            raise AssertionError("started while writing")
+        except ValueError:
+            pass
+        await profiler.finishing
+        profiler.start(blocks=1)
+        profiler.stop()
+        await profiler.finishing
+
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+import random
+from smt.proof import SparseMerkleProof, verify_proof
+from src.ProofService import ProofService, multiproof_for_root
+from src.StateTree import StateTree, DEFAULTVALUE
+from src.utils import hex_to_bytes
+
+
+class TreeHolder:
+
+    def __init__(self, tree : StateTree):
+        self.sparse_merkle_tree = tree
+        self.state_blocknumber = 0
+
+
+def leaf(address : str, balance : int, nonce : int) -> bytes:
+    return balance.to_bytes(8, 'little') + nonce.to_bytes(8, 'little') + hex_to_bytes(address)
+
+
+def create_service(accounts : int) -> tuple[ProofService, list[str], random.Random]:
+    rng = random.Random(accounts)
+    addresses = ["0x" + rng.randbytes(20).hex() for _ in range(accounts)]
+    tree = StateTree()
+    tree.update_many([hex_to_bytes(a) for a in addresses], [leaf(a, 100, 0) for a in addresses])
+    return ProofService(tree_controller=TreeHolder(tree)), addresses, rng
+
+
+def verify(response : dict, sidenodes : list[str], root : bytes) -> bool:
+    proof = SparseMerkleProof([hex_to_bytes(s) for s in sidenodes],
+                              bytes.fromhex(response["non_membership_leafdata"]) if response["non_membership_leafdata"] else None, None)
+    value = hex_to_bytes(response["leaf"]) if response["leaf"] is not None else DEFAULTVALUE
+    return verify_proof(proof, root, hex_to_bytes(response["address"]), value)
+
+
+def test_proofs_verify_cold_cached_and_after_a_block():
+    service, addresses, rng = create_service(500)
+    tree = service.tree
+    requested = rng.sample(addresses, 100)
+    for _ in range(2):
+        for address in requested:
+            response = service.get_proof(address)
+            assert response["balance"] == 100
+            assert verify(response, response["sidenodes"], tree.root)
+    assert service.hits == len(requested)
+    touched = rng.sample(addresses, 60)
+    tree.update_many([hex_to_bytes(a) for a in touched], [leaf(a, 99, 1) for a in touched])
+    for address in requested:
+        response = service.get_proof(address)
+        assert response["root"] == tree.root_as_hex()
+        assert response["nonce"] == (1 if address in touched else 0)
+        assert verify(response, response["sidenodes"], tree.root)
+
+
+def test_non_membership_proof():
+    service, _, rng = create_service(100)
+    missing = "0x" + rng.randbytes(20).hex()
+    response = service.get_proof(missing)
+    assert response["leaf"] is None
+    assert verify(response, response["sidenodes"], service.tree.root)
+
+
+def test_multiproof_deduplicates_side_nodes():
+    service, addresses, rng = create_service(300)
+    batch = rng.sample(addresses, 80)
+    multiproof = service.get_multiproof(batch + batch[:10])
+    assert len(multiproof["proofs"]) == len(batch)
+    assert len(multiproof["nodes"]) == len(set(multiproof["nodes"]))
+    root = hex_to_bytes(multiproof["root"])
+    for proof in multiproof["proofs"]:
+        assert verify(proof, [multiproof["nodes"][i] for i in proof["sidenodes"]], root)
+
+
+def test_multiproof_for_root_matches_get_multiproof():
+    service, addresses, rng = create_service(300)
+    tree = service.tree
+    batch = rng.sample(addresses, 40) + ["0x" + rng.randbytes(20).hex() for _ in range(5)]
+    for _ in range(2):
+        expected = service.get_multiproof(batch)
+        multiproof = multiproof_for_root(tree, batch, tree.root)
+        assert multiproof["root"] == expected["root"]
+        assert multiproof["nodes"] == expected["nodes"]
+        for proof, expected_proof in zip(multiproof["proofs"], expected["proofs"], strict=True):
+            assert proof == {key: expected_proof[key] for key in ("address", "non_membership_leafdata", "sidenodes")}
+        tree.update_many([hex_to_bytes(a) for a in batch[:20]], [leaf(a, 7, 1) for a in batch[:20]])
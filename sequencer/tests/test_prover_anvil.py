@@ -0,0 +1,93 @@
+"""
+    Sequencer witnesses -> executor host -> Rollup.sol on a local anvil node: three blocks are
+    proven as one aggregated batch and submitted. Needs anvil and forge on the PATH, the host
+    built (PROVER_HOST_BINARY) and the contracts built after it, skipped otherwise:
+
+        cd executor && cargo build --release    # regenerates solidity/contracts/risc0/ImageID.sol
+        cd .. && forge build
+
+    RISC0_DEV_MODE is set for the host and the deployment, the proof is a fake receipt that the
+    mock verifier of the deploy script accepts.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import pytest
+from eth_account import Account
+from web3 import Web3
+from src.Prover import ExecutorHostProver
+from src.Types import BadgeExecutionCause, ProofJob, ProofJobStatus
+from test_chain_listener_anvil import ROOT, anvil
+from test_transaction_validator import sign_transfer
+from test_witness import create_block_controller
+
+ARTIFACT = os.path.join(ROOT, "out", "Rollup.sol", "Rollup.json")
+HOST = os.path.abspath(os.environ.get("PROVER_HOST_BINARY", "../executor/target/release/host"))
+FORGE = shutil.which("forge")
+# first anvil account of the default mnemonic
+DEPLOYER_KEY = "0xac0974bec39a17e36ba4a6b4d238ff944bacb478cbed5efcae784d7bf4f2ff80"
+
+pytestmark = pytest.mark.skipif(shutil.which("anvil") is None or FORGE is None or not os.path.exists(HOST) or not os.path.exists(ARTIFACT),
+                                reason="needs anvil, forge, the executor host and the contracts built")
+
+
+async def form_blocks(block_controller, users : list) -> list[dict]:
+    witnesses = []
+
+    async def form_block() -> None:
+        sealed_block = await block_controller.execute_block(BadgeExecutionCause.FILLEDUP, 100, 10**12)
+        await block_controller.persist_block(sealed_block)
+        await block_controller.witness_exporter.export(sealed_block)
+        witnesses.append(sealed_block.witness)
+
+    for user in users[:-1]:
+        await block_controller.mempool.insert_deposit_transaction(user.address, 1000, 0)
+    await form_block()
+    await block_controller.mempool.insert_batch_into_queue([sign_transfer(users[0], users[1].address, 10, 0),
+                                                            sign_transfer(users[1], users[2].address, 20, 0)])
+    await form_block()
+    await block_controller.mempool.insert_deposit_transaction(users[-1].address, 5, 0)
+    await block_controller.mempool.insert_batch_into_queue([sign_transfer(users[2], users[-1].address, 3, 0)])
+    await form_block()
+    return witnesses
+
+
+def deploy_rollup(url : str) -> str:
+    result = subprocess.run([FORGE, "script", "solidity/deploy/Deploy.s.sol", "--rpc-url", url, "--private-key", DEPLOYER_KEY, "--broadcast"],
+                            cwd=ROOT, env={**os.environ, "RISC0_DEV_MODE": "true"}, capture_output=True, text=True, check=True)
+    return re.search(r"Deployed Rollup contract to (0x[0-9a-fA-F]{40})", result.stdout).group(1)
+
+
+def test_an_aggregated_batch_settles_on_anvil(anvil, tmp_path, monkeypatch):
+    url, w3 = anvil
+    monkeypatch.setenv("DB_NAME", f"prover_anvil_{tmp_path.name}")
+    monkeypatch.setenv("WITNESS_DIR", str(tmp_path / "witness"))
+    monkeypatch.setenv("RISC0_DEV_MODE", "1")
+    monkeypatch.setenv("ETH_WALLET_PRIVATE_KEY", DEPLOYER_KEY)
+    users = [Account.from_key(hashlib.sha256(f"anvil round trip {i}".encode()).digest()) for i in range(4)]
+
+    # the transfers go through the sequencer's signature check, the guest checks them again
+    block_controller = create_block_controller(check_signatures=True)
+    witnesses = asyncio.run(form_blocks(block_controller, users))
+    block_controller.mempool.validator.shutdown()
+    rollup = deploy_rollup(url)
+
+    job = ProofJob(batchId=1, badgeIds=[], blocknumbers=[1, 2, 3], status=ProofJobStatus.QUEUED, attempts=1,
+                   batchPaths=[block_controller.witness_exporter.batch_path(blocknumber, "bin") for blocknumber in (1, 2, 3)],
+                   proofPath=str(tmp_path / "proof.json"), transactions=[])
+    prover = ExecutorHostProver(binary=HOST, chain_id="31337", rpc_url=url, contract=rollup)
+    asyncio.run(prover.prove(job))
+    asyncio.run(prover.submit(job))
+
+    with open(job.proofPath) as file:
+        proof = json.load(file)
+    assert (proof["old_root"], proof["new_root"]) == (witnesses[0]["old_merkle_root"], witnesses[-1]["new_merkle_root"])
+    with open(ARTIFACT) as file:
+        contract = w3.eth.contract(address=rollup, abi=json.load(file)["abi"])
+    root, batch_count = contract.functions.getState().call()
+    assert batch_count == 1
+    assert root == Web3.solidity_keccak(["bytes32", "bytes32", "uint32"], [bytes(32), proof["journal_hash"], 1])
@@ -0,0 +1,140 @@
+import asyncio
+import os
+import pytest
+from src.Prover import FakeProver, create_prover
+from src.ProverCoordinator import ProverCoordinator
+from src.Types import ProofJob, ProofJobStatus, BadgeStatus, TransactionStatus
+from src.WitnessExporter import WitnessExporter
+
+
+class FlakyProver:
+    """
+        Fails the first `failures` proofs, counted over all jobs and retries
+    """
+
+    def __init__(self, failures : int):
+        self.failures = failures
+        self.submitted = []
+
+    async def prove(self, job : ProofJob) -> None:
+        if self.failures > 0:
+            self.failures -= 1
+            raise RuntimeError("prover crashed")
+
+    async def submit(self, job : ProofJob) -> None:
+        self.submitted.append(job.batchId)
+
+
+class RecordingFakeProver(FakeProver):
+
+    def __init__(self):
+        super().__init__(prove_ms=0)
+        self.submitted = []
+
+    async def submit(self, job : ProofJob) -> None:
+        self.submitted.append(job.batchId)
+
+
+class UnavailableJobs:
+    """
+        PROOF_JOBS whose single document writes fail, the submission transaction still works
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def update_one(self, *args, **kwargs):
+        raise ConnectionError("mongo unavailable")
+
+    async def bulk_write(self, *args, **kwargs):
+        return await self.collection.bulk_write(*args, **kwargs)
+
+
+def create_coordinator(tmp_path, monkeypatch, prover : FlakyProver) -> ProverCoordinator:
+    monkeypatch.setenv("DB_NAME", f"prover_test_{tmp_path.name}")
+    return ProverCoordinator(witness_exporter=WitnessExporter(directory=str(tmp_path)), prover=prover, workers=1, max_attempts=1,
+                             aggregate=1, park_s=0.01)
+
+
+async def run_until_submitted(coordinator : ProverCoordinator, prover : FlakyProver, batches : int) -> None:
+    for blocknumber in range(1, batches + 1):
+        await coordinator._add_to_group(f"badge{blocknumber}", blocknumber, [])
+    task = asyncio.create_task(coordinator.run())
+    try:
+        await asyncio.wait_for(_submitted(prover, batches), timeout=5)
+    finally:
+        task.cancel()
+
+
+async def _submitted(prover : FlakyProver, batches : int) -> None:
+    while len(prover.submitted) < batches:
+        await asyncio.sleep(0.001)
+
+
+def test_a_failed_batch_is_parked_and_proved_again(tmp_path, monkeypatch):
+    prover = FlakyProver(failures=2)
+    coordinator = create_coordinator(tmp_path, monkeypatch, prover)
+    parked = []
+
+    async def run():
+        retry = coordinator.retry
+        coordinator.retry = lambda batch_id: (parked.append(batch_id), retry(batch_id))[1]
+        await run_until_submitted(coordinator, prover, batches=2)
+
+    asyncio.run(run())
+    assert prover.submitted == [1, 2]
+    # both jobs were queued before the prover failed twice
+    assert parked == [1, 2]
+    assert coordinator.status()["parked"] == []
+
+
+def test_a_failed_status_write_does_not_stop_the_workers(tmp_path, monkeypatch):
+    prover = FlakyProver(failures=0)
+    coordinator = create_coordinator(tmp_path, monkeypatch, prover)
+    collection = coordinator._collection()
+
+    async def run():
+        await run_until_submitted(coordinator, prover, batches=1)
+        coordinator._collection = lambda: UnavailableJobs(collection)
+        await run_until_submitted(coordinator, prover, batches=2)
+
+    asyncio.run(run())
+    assert prover.submitted == [1, 2]
+    assert coordinator.jobs == {}
+    assert coordinator.status()["jobs"][ProofJobStatus.FAILED.value] == 0
+
+
+def test_badges_of_the_fake_prover_are_never_verified(tmp_path, monkeypatch):
+    prover = RecordingFakeProver()
+    coordinator = create_coordinator(tmp_path, monkeypatch, prover)
+    db = coordinator.mongo_client[os.environ["DB_NAME"]]
+
+    async def run():
+        await db[os.environ["BADGES"]].insert_one({"badgeId": "badge1", "status": BadgeStatus.SEND_TO_VERIFY.value})
+        await db[os.environ["TRANSACTIONS"]].insert_one({"transactionId": "t1", "status": TransactionStatus.INCLUDED.value})
+        await coordinator._add_to_group("badge1", 1, ["t1"])
+        task = asyncio.create_task(coordinator.run())
+        try:
+            await asyncio.wait_for(_submitted(prover, 1), timeout=5)
+            while len(coordinator.jobs) > 0 and coordinator.jobs[1].status != ProofJobStatus.SUBMITTED.value:
+                await asyncio.sleep(0.001)
+        finally:
+            task.cancel()
+        return await db[os.environ["BADGES"]].find_one({"badgeId": "badge1"}), await db[os.environ["TRANSACTIONS"]].find_one({"transactionId": "t1"})
+
+    badge, transaction = asyncio.run(run())
+    assert badge["status"] == BadgeStatus.PROVED_FAKE.value
+    assert transaction["status"] == TransactionStatus.INCLUDED.value
+
+
+def test_the_host_prover_is_the_default_and_has_to_be_built(tmp_path, monkeypatch):
+    monkeypatch.delenv("PROVER")
+    monkeypatch.setenv("PROVER_HOST_BINARY", str(tmp_path / "host"))
+    with pytest.raises(RuntimeError):
+        create_prover()
+    (tmp_path / "host").write_text("")
+    monkeypatch.setenv("ROLLUP_CONTRACT", "")
+    with pytest.raises(RuntimeError):
+        create_prover()
+    monkeypatch.setenv("ROLLUP_CONTRACT", "0x" + "11" * 20)
+    assert create_prover().settles
@@ -0,0 +1,37 @@
+import asyncio
+import os
+from src.SetupService import SetupService
+
+
+def test_a_restart_does_not_seed_the_genesis_state_again(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_NAME", f"setup_test_{tmp_path.name}")
+
+    async def boot_twice():
+        for _ in range(2):
+            await SetupService(start_users_needed=True).on_start()
+        db = SetupService(start_users_needed=False).mongo_client[os.environ["DB_NAME"]]
+        return [await db[os.environ[name]].count_documents({}) for name in ("USERS", "BADGES", "CURR")]
+
+    users, badges, pointers = asyncio.run(boot_twice())
+    assert users == len(SetupService(start_users_needed=True).get_state_json())
+    assert (badges, pointers) == (1, 1)
+
+
+def test_an_interrupted_seeding_is_completed_without_duplicates(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_NAME", f"setup_test_{tmp_path.name}")
+    setup_service = SetupService(start_users_needed=True)
+    db = setup_service.mongo_client[os.environ["DB_NAME"]]
+
+    async def boot_after_a_stop():
+        # stopped after the genesis badge, before the pointer
+        await setup_service.insert_start_users()
+        await setup_service.setup_genesis_badge()
+        await db[os.environ["CURR"]].delete_many({})
+        await setup_service.on_start()
+        pointer = await db[os.environ["CURR"]].find_one({})
+        genesis = await db[os.environ["BADGES"]].find_one({"blocknumber": 0})
+        return [await db[os.environ[name]].count_documents({}) for name in ("USERS", "BADGES", "CURR")], pointer, genesis
+
+    counts, pointer, genesis = asyncio.run(boot_after_a_stop())
+    assert counts == [len(setup_service.get_state_json()), 1, 1]
+    assert pointer["currBadgeID"] == genesis["badgeId"]
@@ -0,0 +1,122 @@
+import random
+from smt.proof import verify_proof
+from smt.tree import SparseMerkleTree
+from src.PersistentNodeStore import PersistentNodeStore
+from src.StateTree import StateTree, DEFAULTVALUE
+
+
+def leaf(rng : random.Random, address : bytes) -> bytes:
+    return rng.randrange(1 << 64).to_bytes(8, 'little') + rng.randrange(1 << 16).to_bytes(8, 'little') + address
+
+
+def test_update_many_matches_smt():
+    rng = random.Random(7)
+    addresses = [rng.randbytes(20) for _ in range(300)]
+    reference = SparseMerkleTree()
+    tree = StateTree()
+    for _ in range(6):
+        batch = rng.sample(addresses, 80)
+        keys, values = [], []
+        for address in batch:
+            value = leaf(rng, address)
+            reference.update(address, value)
+            keys.append(address)
+            values.append(value)
+        # a key updated twice in one batch, the last value wins
+        value = leaf(rng, batch[0])
+        reference.update(batch[0], value)
+        keys.append(batch[0])
+        values.append(value)
+        assert tree.update_many(keys, values) == reference.root_as_bytes()
+    for address in addresses:
+        assert tree.get(address) == reference.get(address)
+
+
+def test_single_updates_and_deletes_match_smt():
+    rng = random.Random(11)
+    addresses = [rng.randbytes(20) for _ in range(64)]
+    reference = SparseMerkleTree()
+    tree = StateTree()
+    for address in addresses:
+        value = leaf(rng, address)
+        reference.update(address, value)
+        tree.update(address, value)
+        assert tree.root == reference.root_as_bytes()
+    for address in rng.sample(addresses, 40):
+        reference.delete(address)
+        tree.delete(address)
+        assert tree.root == reference.root_as_bytes()
+        assert not tree.has(address)
+
+
+def test_deleting_everything_returns_to_the_empty_root():
+    rng = random.Random(3)
+    addresses = [rng.randbytes(20) for _ in range(20)]
+    tree = StateTree()
+    empty_root = tree.root
+    tree.update_many(addresses, [leaf(rng, a) for a in addresses])
+    tree.update_many(addresses, [DEFAULTVALUE] * len(addresses))
+    assert tree.root == empty_root
+
+
+def test_proofs_verify_with_smt():
+    rng = random.Random(5)
+    addresses = [rng.randbytes(20) for _ in range(200)]
+    values = [leaf(rng, a) for a in addresses]
+    tree = StateTree()
+    tree.update_many(addresses, values)
+    for address, value in zip(addresses[:50], values):
+        assert verify_proof(tree.prove(address), tree.root, address, value)
+    missing = rng.randbytes(20)
+    assert verify_proof(tree.prove(missing), tree.root, missing, DEFAULTVALUE)
+
+
+def test_released_orphans_are_pruned_unless_created_again():
+    rng = random.Random(9)
+    addresses = [rng.randbytes(20) for _ in range(50)]
+    values = [leaf(rng, a) for a in addresses]
+    store = PersistentNodeStore(":memory:")
+    tree = StateTree(store=store)
+    tree.update_many(addresses, values)
+    store.commit(store.take_changeset(), tree.root, 0, None)
+    first_root = tree.root
+    tree.update(addresses[0], leaf(rng, addresses[0]))
+    changed = store.take_changeset()
+    second_root = tree.root
+    # the orphans of the first update stay readable until it is released
+    assert verify_proof(tree.prove_for_root(addresses[1], first_root), first_root, addresses[1], values[1])
+    tree.update(addresses[0], values[0])
+    changed_back = store.take_changeset()
+    assert tree.root == first_root
+    store.release(changed)
+    store.release(changed_back)
+    pruned = store.take_changeset().pruned_nodes
+    # the nodes of the first root were created again, only the ones of the second root go
+    assert pruned == changed_back.deleted_nodes
+    assert pruned.isdisjoint(changed.deleted_nodes)
+    store.commit(changed, second_root, 1, None)
+    store.commit(changed_back, first_root, 2, None)
+    store.commit(store.take_changeset(), first_root, 2, None)
+    store.nodes.clear()
+    for address, value in zip(addresses, values):
+        assert verify_proof(tree.prove(address), tree.root, address, value)
+
+
+def test_a_small_node_cache_reads_uncommitted_and_committed_nodes():
+    rng = random.Random(13)
+    addresses = [rng.randbytes(20) for _ in range(300)]
+    values = [leaf(rng, a) for a in addresses]
+    store = PersistentNodeStore(":memory:", cache_size=16)
+    tree = StateTree(store=store)
+    tree.update_many(addresses[:200], values[:200])
+    taken = store.take_changeset()
+    # the first changeset is not committed yet, its evicted nodes come from the changeset
+    tree.update_many(addresses[200:], values[200:])
+    assert len(store.nodes) <= 16 and len(store.values) <= 16
+    for address, value in zip(addresses, values):
+        assert tree.get(address) == value
+    store.commit(taken, tree.root, 1, None)
+    store.commit(store.take_changeset(), tree.root, 2, None)
+    for address, value in zip(addresses, values):
+        assert verify_proof(tree.prove(address), tree.root, address, value)
+    assert len(store.nodes) <= 16
@@ -0,0 +1,34 @@
+from src.TransactionStatusCache import TransactionStatusCache
+
+
+def test_a_reserved_submission_falls_back_to_mongo():
+    cache = TransactionStatusCache()
+    cache.reserve("s", "t")
+    assert cache.get("s") is None
+
+
+def test_a_block_status_is_not_overwritten_by_the_submission_status():
+    cache = TransactionStatusCache()
+    cache.reserve("s", "t")
+    # the block is persisted before the submit handler caches its status
+    cache.update(["t"], "included")
+    cache.put("s", "t", "pending")
+    assert cache.get("s") == "included"
+
+
+def test_the_submission_status_fills_a_reservation():
+    cache = TransactionStatusCache()
+    cache.reserve("s", "t")
+    cache.put("s", "t", "pending")
+    cache.update(["t"], "failed")
+    assert cache.get("s") == "failed"
+
+
+def test_the_oldest_submissions_are_evicted():
+    cache = TransactionStatusCache(max_size=2)
+    for i in range(3):
+        cache.put(f"s{i}", f"t{i}", "pending")
+    assert cache.get("s0") is None
+    cache.update(["t0"], "included")
+    assert len(cache) == 2
+    assert cache.get("s2") == "pending"
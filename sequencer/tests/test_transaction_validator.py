@@ -0,0 +1,65 @@
+import asyncio
+import hashlib
+from eth_account import Account
+from eth_account.messages import encode_defunct
+from eth_keys import keys
+from src.TransactionValidator import Transaction_Validator, verify_signature
+from src.TxRecord import TxRecord
+from src.utils import generate_random_id, transfer_message, transfer_message_hash
+
+ALICE = Account.from_key(hashlib.sha256(b"validator alice").digest())
+BOB = Account.from_key(hashlib.sha256(b"validator bob").digest())
+
+
+def sign_transfer(account, receiver : str, amount : int, nonce : int) -> TxRecord:
+    """
+        personal_sign of the message the guest checks, with the lower case addresses of the witness
+    """
+    sender = account.address.lower()
+    message = f'{{"sender":"{sender}","receiver":"{receiver.lower()}","amount":"{amount}","nonce":"{nonce}"}}'
+    signature = Account.sign_message(encode_defunct(text=message), account.key).signature.to_0x_hex()
+    return TxRecord(transaction_id=generate_random_id(), submission_id=generate_random_id(), received_at=0, sender=account.address,
+                    receiver=receiver, amount=amount, nonce=nonce, signature=signature, pub_key=sender)
+
+
+def job(transaction : TxRecord) -> tuple:
+    return (transaction.sender, transaction.receiver, transaction.amount, transaction.nonce, transaction.signature)
+
+
+def test_the_message_is_the_one_the_guest_rebuilds():
+    # create_transaction_message of executor/methods/guest
+    assert transfer_message(ALICE.address, BOB.address, 10, 3) == \
+        '{"sender":"%s","receiver":"%s","amount":"10","nonce":"3"}' % (ALICE.address.lower(), BOB.address.lower())
+
+
+def test_a_wallet_signature_of_the_sender_is_valid():
+    transaction = sign_transfer(ALICE, BOB.address, 10, 3)
+    assert verify_signature(job(transaction))
+    # v as 0/1 instead of 27/28
+    signature = keys.PrivateKey(ALICE.key).sign_msg_hash(transfer_message_hash(ALICE.address, BOB.address, 10, 3))
+    assert verify_signature((ALICE.address, BOB.address, 10, 3, signature.to_hex()))
+
+
+def test_other_signers_and_changed_transfers_are_rejected():
+    transaction = sign_transfer(ALICE, BOB.address, 10, 3)
+    assert not verify_signature((BOB.address, BOB.address, 10, 3, transaction.signature))
+    assert not verify_signature((ALICE.address, BOB.address, 11, 3, transaction.signature))
+    assert not verify_signature((ALICE.address, BOB.address, 10, 4, transaction.signature))
+    assert not verify_signature((ALICE.address, ALICE.address, 10, 3, transaction.signature))
+    assert not verify_signature((ALICE.address, BOB.address, 10, 3, "0x" + "11" * 65))
+    assert not verify_signature((ALICE.address, BOB.address, 10, 3, transaction.signature[:-2]))
+
+
+def test_the_pool_checks_a_batch():
+    transactions = [sign_transfer(ALICE, BOB.address, 10, 0), sign_transfer(BOB, ALICE.address, 5, 0)]
+    transactions.append(TxRecord(transaction_id=generate_random_id(), submission_id=None, received_at=0, sender=ALICE.address,
+                                 receiver=BOB.address, amount=10, nonce=1, signature=transactions[1].signature))
+    validator = Transaction_Validator()
+
+    async def check():
+        return await validator.check_transactions_validity(transactions)
+
+    try:
+        assert asyncio.run(check()) == [True, True, False]
+    finally:
+        validator.shutdown()
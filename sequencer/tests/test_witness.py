@@ -0,0 +1,137 @@
+import asyncio
+import json
+import random
+import struct
+from eth_utils import to_checksum_address
+from smt.proof import SparseMerkleProof, verify_proof
+from src.BlockController import BlockController
+from src.TxRecord import TxRecord
+from src.Types import BadgeExecutionCause
+from src.WitnessExporter import encode_batch_bincode
+from src.utils import generate_random_id, hex_to_bytes
+
+
+def create_block_controller(check_signatures : bool = False) -> BlockController:
+    block_controller = BlockController(with_account_setup=False)
+    block_controller.header_builder.tip = ("0x" + "0" * 64, 0, "genesis")
+    if check_signatures:
+        return block_controller
+
+    async def check_transactions_validity(transactions):
+        return [True] * len(transactions)
+
+    block_controller.mempool.validator.check_transactions_validity = check_transactions_validity
+    return block_controller
+
+
+async def form_blocks(block_controller : BlockController, accounts : list[str]) -> list[dict]:
+    """
+        Deposits into an empty tree, transfers between the accounts, then a deposit
+        that creates one more account next to transfers. Returns the witnesses.
+        Like the pipeline, every block is executed before the ones before it are exported.
+    """
+    sealed_blocks = []
+
+    async def form_block() -> None:
+        sealed_blocks.append(await block_controller.execute_block(BadgeExecutionCause.FILLEDUP, 100, 10**12))
+
+    for address in accounts[:-1]:
+        await block_controller.mempool.insert_deposit_transaction(address, 1000, 0)
+    await form_block()
+
+    nonces = {address: 0 for address in accounts}
+    transactions = []
+    for sender, receiver in [(accounts[0], accounts[1]), (accounts[1], accounts[2]), (accounts[0], accounts[3]), (accounts[4], accounts[4])]:
+        transactions.append(TxRecord(transaction_id=generate_random_id(), submission_id=generate_random_id(), received_at=0, sender=sender,
+                                     receiver=receiver, amount=10, nonce=nonces[sender], signature="0x" + "11" * 65, pub_key="0x00"))
+        nonces[sender] += 1
+    await block_controller.mempool.insert_batch_into_queue(transactions)
+    await form_block()
+
+    await block_controller.mempool.insert_deposit_transaction(accounts[-1], 5, 0)
+    transfer = TxRecord(transaction_id=generate_random_id(), submission_id=generate_random_id(), received_at=0, sender=accounts[2],
+                        receiver=accounts[0], amount=3, nonce=0, signature="0x" + "11" * 65, pub_key="0x00")
+    await block_controller.mempool.insert_batch_into_queue([transfer])
+    await form_block()
+    for sealed_block in sealed_blocks:
+        await block_controller.persist_block(sealed_block)
+        await block_controller.witness_exporter.export(sealed_block)
+        await block_controller.release_block(sealed_block)
+    return [sealed_block.witness for sealed_block in sealed_blocks]
+
+
+def run_blocks(tmp_path, monkeypatch, seed : int = 5) -> tuple[list[dict], BlockController]:
+    monkeypatch.setenv("DB_NAME", f"witness_test_{tmp_path.name}")
+    monkeypatch.setenv("WITNESS_DIR", str(tmp_path / "witness"))
+    rnd = random.Random(seed)
+    accounts = [to_checksum_address(rnd.randbytes(20)) for _ in range(8)]
+    block_controller = create_block_controller()
+    witnesses = asyncio.run(form_blocks(block_controller, accounts))
+    block_controller.mempool.validator.shutdown()
+    return witnesses, block_controller
+
+
+def leaf(address : str, balance : int, nonce : int) -> bytes:
+    return balance.to_bytes(8, 'little') + nonce.to_bytes(8, 'little') + hex_to_bytes(address)
+
+
+def test_every_touched_account_is_proven_against_the_old_root(tmp_path, monkeypatch):
+    witnesses, _ = run_blocks(tmp_path, monkeypatch)
+    assert [len(w["addresses"]) for w in witnesses] == [7, 5, 3]
+    new_accounts = 0
+    for witness in witnesses:
+        root = hex_to_bytes(witness["old_merkle_root"])
+        assert len(witness["proofs"]) == len(witness["addresses"])
+        for address, leaf_data, proof in zip(witness["addresses"], witness["leaf_data"], witness["proofs"]):
+            leafdata = proof["non_membership_leafdata"]
+            smt_proof = SparseMerkleProof([hex_to_bytes(witness["proof_nodes"][i]) for i in proof["sidenodes"]],
+                                          hex_to_bytes(leafdata) if leafdata is not None else None, None)
+            key = hex_to_bytes(address)
+            if verify_proof(smt_proof, root, key, leaf(address, leaf_data["balance"], leaf_data["nonce"])):
+                continue
+            # accounts created by a deposit of this block
+            assert (leaf_data["balance"], leaf_data["nonce"]) == (0, 0)
+            assert verify_proof(smt_proof, root, key, b"")
+            new_accounts += 1
+    assert new_accounts == 8
+
+
+def test_witness_proofs_stay_out_of_the_proof_cache(tmp_path, monkeypatch):
+    _, block_controller = run_blocks(tmp_path, monkeypatch)
+    assert block_controller.proof_service.stats()["cached"] == 0
+
+
+def test_orphaned_nodes_are_pruned_once_the_block_is_released(tmp_path, monkeypatch):
+    _, block_controller = run_blocks(tmp_path, monkeypatch)
+    node_store = block_controller.tree_controller.node_store
+    # released orphans are deleted by the next checkpoint
+    changeset = node_store.take_changeset()
+    assert len(changeset.pruned_nodes) > 0
+    asyncio.run(block_controller.tree_controller.checkpoint(changeset, block_controller.tree_controller.get_merkle_root(), 3, None))
+    assert all(node_store.get_node(key) is None for key in changeset.pruned_nodes)
+    assert node_store._retired == {}
+
+
+def test_proofs_are_appended_to_the_bincode_batch(tmp_path, monkeypatch):
+    witnesses, _ = run_blocks(tmp_path, monkeypatch)
+    witness = witnesses[-1]
+    encoded = encode_batch_bincode(witness)
+    without_proofs = encode_batch_bincode({**witness, "proof_nodes": [], "proofs": []})
+    assert encoded.startswith(without_proofs[:-16])
+    tail = encoded[len(without_proofs) - 16:]
+    offset = 8 + sum(8 + len(node) for node in witness["proof_nodes"])
+    assert struct.unpack_from("<Q", tail, 0)[0] == len(witness["proof_nodes"])
+    assert struct.unpack_from("<Q", tail, offset)[0] == len(witness["proofs"])
+    offset += 8
+    for proof in witness["proofs"]:
+        count = struct.unpack_from("<Q", tail, offset)[0]
+        assert list(struct.unpack_from(f"<{count}I", tail, offset + 8)) == proof["sidenodes"]
+        offset += 8 + 4 * count
+        if proof["non_membership_leafdata"] is None:
+            assert tail[offset] == 0
+            offset += 1
+        else:
+            assert tail[offset] == 1
+            offset += 1 + 8 + len(proof["non_membership_leafdata"])
+    assert offset == len(tail)
+    json.dumps(witness)
@@ -18,6 +18,13 @@ contract Rollup {
     
     /// @notice Batch counter
     uint32 public batchCount;
+
+    /// @notice First byte of a compact txData (executor/lib/calldata)
+    /// @dev Legacy txData starts with a big endian uint32 count, its first byte is 0 for any realistic batch
+    uint8 public constant COMPACT_TX_DATA = 0x01;
+
+    /// @notice Smallest compact transaction: four 1 byte varints and the 65 byte signature
+    uint256 public constant MIN_COMPACT_TX_SIZE = 69;
     
     /// @notice Mapping from batch ID to state root after that batch
     mapping(uint32 => bytes32) public roots;
@@ -50,7 +57,7 @@ contract Rollup {
 
     /// @notice Submit a batch of MetaMask transactions with deposits
     /// @param batchId Batch identifier (must be batchCount + 1)
-    /// @param txData Serialized transaction data
+    /// @param txData Serialized transaction data, legacy or compact encoding
     /// @param journalHash SHA-256 hash of the raw journal bytes from the proof
     /// @param seal RISC Zero proof seal
     function submitBatch(
@@ -67,10 +74,18 @@ contract Rollup {
         
         // Decode and validate transaction count from txData
         require(txData.length >= 4, "Invalid txData length");
-        uint32 transactionCount = uint32(bytes4(txData[0:4]));
-        
-        // Verify expected txData length: 4 bytes (count) + transactionCount * 141 bytes per transaction
-        require(txData.length == 4 + transactionCount * 141, "Invalid txData length");
+        uint32 transactionCount;
+        if (uint8(txData[0]) == COMPACT_TX_DATA) {
+            // 1 byte version + 4 bytes count, then the address table and variable size transactions
+            require(txData.length >= 5, "Invalid txData length");
+            transactionCount = uint32(bytes4(txData[1:5]));
+            require(txData.length >= 5 + uint256(transactionCount) * MIN_COMPACT_TX_SIZE, "Invalid txData length");
+        } else {
+            transactionCount = uint32(bytes4(txData[0:4]));
+
+            // Verify expected txData length: 4 bytes (count) + transactionCount * 141 bytes per transaction
+            require(txData.length == 4 + transactionCount * 141, "Invalid txData length");
+        }
         
         console2.log("ImageID:", uint256(imageId));
         console2.log("Journal Hash:", uint256(journalHash));